@@ -1,23 +1,238 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException, Depends
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from datetime import datetime, UTC
+from contextlib import aclosing
+from bson import ObjectId
+from mongoengine.errors import ValidationError
+import asyncio
 
+from app.api.dependencies import upload_slot
+from app.core.config import settings
+from app.core.executors import parse_parallelism, run_cpu_bound
+from app.core.metrics import stage_timer
+from app.core.responses import ModelResponse
+from app.db.readings import ReadingRepository, ReadingWriter, get_reading_repository
+from app.db.repository import AnalysisRepository, DuplicateAnalysisError, get_analysis_repository
+from app.services.batch_service import BatchService
 from app.services.csv_service import CSVService
-from app.services.recommendation_service import RecommendationService
+from app.services.rule_table import get_rule_table
 from app.models.water_sample import WaterAnalysis
-from app.models.analysis_result import AnalysisResponse, AnalysisSummary, TreatmentRecommendation
+from app.models.analysis_result import AnalysisResponse, BatchUploadResponse, BatchUploadResult
 
 router = APIRouter(prefix="/api/v1/analysis", tags=["analysis"])
 
 
-@router.post("/upload", response_model=AnalysisResponse)
+def analysis_fields(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    WaterAnalysis fields derived from the statistics of a set of readings.
+    
+    The statistics carry the recommendation of their rule table. Shared by
+    uploads and re-analysis, so both store the same fields.
+    """
+    return {
+        'avg_ph': stats['avg_ph'],
+        'ph_category': stats['ph_category'],
+        'avg_tds': stats['avg_tds'],
+        'tds_category': stats['tds_category'],
+        'treatment_train': stats['treatment_train'],
+        'explanation': stats['explanation'],
+        'row_count': stats['row_count'],
+        'min_ph': stats.get('min_ph'),
+        'max_ph': stats.get('max_ph'),
+        'min_tds': stats.get('min_tds'),
+        'max_tds': stats.get('max_tds'),
+        'var_ph': stats.get('var_ph'),
+        'var_tds': stats.get('var_tds'),
+        'ph_percentiles': stats.get('ph_percentiles'),
+        'tds_percentiles': stats.get('tds_percentiles'),
+        'rule_counts': stats.get('rule_counts'),
+        'out_of_range_fraction': stats.get('out_of_range_fraction'),
+        'dominant_rule': stats.get('dominant_rule'),
+        'timeseries': stats.get('timeseries')
+    }
+
+
+def analysis_response(document: Dict[str, Any]) -> AnalysisResponse:
+    """
+    Response for a stored analysis.
+    
+    The dominant rule's treatment is read from the rule table profile of
+    the analysis's site, so it follows the current rule text.
+    """
+    treatment = None
+    if document.get('dominant_rule'):
+        treatment = get_rule_table(document.get('site_name')).recommendation(document['dominant_rule'])[0]
+    return AnalysisResponse.from_document(document, treatment)
+
+
+async def find_previous_upload(repository: AnalysisRepository, content_hash: str,
+                               site_name: Optional[str],
+                               idempotency_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Find the stored analysis a retried upload refers to.
+    
+    An Idempotency-Key names one upload, so it is checked first; otherwise
+    an identical file for the same site counts as the same upload.
+    
+    Raises:
+        HTTPException: 422 if the key was used for a different file or site
+    """
+    if idempotency_key is not None:
+        document = await repository.get_by_idempotency_key(idempotency_key)
+        if document is not None:
+            if (document.get('content_hash'), document.get('site_name')) != (content_hash, site_name):
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used for a different upload"
+                )
+            return document
+    return await repository.get_by_content(content_hash, site_name)
+
+
+async def analyze_upload(file: UploadFile, site_name: Optional[str], content_hash: str,
+                         idempotency_key: Optional[str], store_readings: bool,
+                         readings: ReadingRepository,
+                         progress: Optional[Callable[[int], Awaitable[None]]] = None
+                         ) -> Tuple[Dict[str, Any], Optional[ReadingWriter]]:
+    """
+    Analyze one CSV into a validated WaterAnalysis document, ready to insert.
+    
+    Raw readings, if kept, are written during parsing and discarded again
+    if the file turns out to be invalid.
+    
+    Returns:
+        Tuple of (document with its '_id' set, the reading writer or None)
+        
+    Raises:
+        HTTPException: If the CSV is invalid
+        ValidationError: If the analysis does not fit WaterAnalysis
+    """
+    # Resolve the rule table once, so the whole upload uses the same one
+    rules = get_rule_table(site_name)
+    
+    # The id is chosen up front so stored readings can refer to it
+    analysis_id = ObjectId()
+    # Naive UTC, the form MongoDB stores and returns datetimes in
+    uploaded_at = datetime.now(UTC).replace(tzinfo=None)
+    writer = None
+    if store_readings:
+        writer = ReadingWriter(readings, analysis_id, site_name, uploaded_at, settings.READINGS_CHUNK_SIZE)
+    
+    try:
+        # Parse, validate and calculate statistics chunk by chunk
+        stats = await CSVService.analyze_csv_stream(file, rules, writer, progress)
+        fields = analysis_fields(stats)
+        
+        analysis = WaterAnalysis(
+            id=analysis_id,
+            upload_timestamp=uploaded_at,
+            original_filename=file.filename,
+            site_name=site_name,
+            content_hash=content_hash,
+            idempotency_key=idempotency_key,
+            readings_stored=writer is not None,
+            **fields
+        )
+        analysis.validate()
+    except Exception:
+        if writer is not None:
+            await writer.discard()
+        raise
+    return analysis.to_mongo().to_dict(), writer
+
+
+async def store_upload(file: UploadFile, site_name: Optional[str], store_readings: Optional[bool],
+                       idempotency_key: Optional[str], repository: AnalysisRepository,
+                       readings: ReadingRepository,
+                       progress: Optional[Callable[[int], Awaitable[None]]] = None
+                       ) -> Tuple[Dict[str, Any], bool]:
+    """
+    Analyze and store one CSV upload, or find the analysis of its first try.
+    
+    Shared by /upload and upload jobs, so both treat retries the same way.
+    
+    Returns:
+        Tuple of (stored analysis document, whether it was stored by an
+        earlier upload)
+        
+    Raises:
+        HTTPException: If the CSV is invalid, or the upload conflicts with
+            a stored analysis
+        ValidationError: If the analysis does not fit WaterAnalysis
+    """
+    # Recognise retries before spending any time on parsing
+    content_hash = await CSVService.hash_upload(file)
+    previous = await find_previous_upload(repository, content_hash, site_name, idempotency_key)
+    if previous is not None:
+        return previous, True
+    
+    if store_readings is None:
+        store_readings = settings.STORE_RAW_READINGS
+    document, writer = await analyze_upload(
+        file, site_name, content_hash, idempotency_key, store_readings, readings, progress
+    )
+    
+    try:
+        # Save to database
+        with stage_timer('save'):
+            document = await repository.insert(document)
+    except DuplicateAnalysisError:
+        # A concurrent retry of the same upload was stored first
+        if writer is not None:
+            await writer.discard()
+        previous = await find_previous_upload(repository, content_hash, site_name, idempotency_key)
+        if previous is None:
+            raise HTTPException(
+                status_code=409,
+                detail="Upload conflicts with a stored analysis"
+            )
+        return previous, True
+    except Exception:
+        if writer is not None:
+            await writer.discard()
+        raise
+    
+    return document, False
+
+
+def replay(document: Dict[str, Any]) -> ModelResponse:
+    """Answer a retried upload with the analysis stored for it."""
+    return ModelResponse(analysis_response(document), headers={"Idempotent-Replayed": "true"})
+
+
+@router.post("/upload", response_model=AnalysisResponse, dependencies=[Depends(upload_slot)])
 async def upload_and_analyze(
     file: UploadFile = File(..., description="CSV file with water quality data"),
-    site_name: Optional[str] = Form(None, description="Optional site identifier")
+    site_name: Optional[str] = Form(None, description="Optional site identifier"),
+    store_readings: Optional[bool] = Form(
+        None, description="Keep the raw readings for re-analysis; STORE_RAW_READINGS if omitted"
+    ),
+    idempotency_key: Optional[str] = Header(
+        None, alias="Idempotency-Key", max_length=255,
+        description="Client-chosen key; retries with the same key return the first result"
+    ),
+    repository: AnalysisRepository = Depends(get_analysis_repository),
+    readings: ReadingRepository = Depends(get_reading_repository)
 ):
     """
     Upload CSV file and perform water quality analysis.
     
+    Parsing runs in the parse pool and the database write goes through the
+    async repository, so the event loop keeps serving other requests. Returns 503 when the worker is
+    already handling MAX_CONCURRENT_UPLOADS uploads. Readings are classified
+    with the site's rule table profile when it has one.
+    
+    When raw readings are kept, they are written to the readings time-series
+    collection block by block during parsing, and removed again if the
+    upload fails.
+    
+    Retries are answered from storage without parsing: an upload with a
+    known Idempotency-Key, or the same bytes as a stored upload for the
+    same site, returns that analysis with an Idempotent-Replayed header.
+    
+    Files that take longer to analyze than the client can wait should be
+    queued with /api/v1/jobs/upload instead.
+    
     Returns analysis results with treatment recommendation.
     """
     # Validate file type
@@ -27,52 +242,200 @@ async def upload_and_analyze(
             detail="Invalid file type. Only CSV files are accepted."
         )
     
-    # Parse and validate CSV
-    df = await CSVService.validate_and_parse_csv(file)
+    document, replayed = await store_upload(
+        file, site_name, store_readings, idempotency_key, repository, readings
+    )
+    if replayed:
+        return replay(document)
+    
+    # Return response
+    return ModelResponse(analysis_response(document))
+
+
+def failed_result(filename: str, error: HTTPException) -> BatchUploadResult:
+    """Batch result for a file /upload would have rejected with this error."""
+    return BatchUploadResult(filename=filename, status="failed", status_code=error.status_code, error=error.detail)
+
+
+def duplicate_result(filename: str, document: Dict[str, Any]) -> BatchUploadResult:
+    """Batch result for a file identical to a stored upload."""
+    return BatchUploadResult(filename=filename, status="duplicate", analysis=analysis_response(document))
+
+
+@router.post("/upload/batch", response_model=BatchUploadResponse, dependencies=[Depends(upload_slot)])
+async def upload_batch(
+    files: List[UploadFile] = File(..., description="CSV files, or zip/tar.gz archives of CSV files"),
+    site_name: Optional[str] = Form(None, description="Optional site identifier for every file"),
+    store_readings: Optional[bool] = Form(
+        None, description="Keep the raw readings for re-analysis; STORE_RAW_READINGS if omitted"
+    ),
+    repository: AnalysisRepository = Depends(get_analysis_repository),
+    readings: ReadingRepository = Depends(get_reading_repository)
+):
+    """
+    Upload many CSV files, or archives of them, in one request.
     
-    # Calculate statistics
-    stats = CSVService.calculate_statistics(df)
+    Archive members are read straight from the upload without extracting
+    to disk. Up to PARSE_WORKERS files are analyzed at once, each through
+    the same parse pool path as /upload, and all new analyses are stored
+    with one bulk write. The batch takes a single upload slot.
     
-    # Get treatment recommendation
-    treatment_train, explanation = RecommendationService.get_recommendation(
-        stats['avg_ph'],
-        stats['avg_tds']
-    )
+    Files identical to a stored upload for the site, or to an earlier file
+    of the batch, are not parsed and are reported as duplicates. A file
+    that fails gets the error /upload would have returned, and the rest of
+    the batch still goes ahead. A batch over MAX_BATCH_FILES files or
+    MAX_BATCH_SIZE bytes of CSV is rejected with 413 and nothing is stored.
     
-    # Save to database
-    analysis = WaterAnalysis(
-        upload_timestamp=datetime.now(UTC),
-        original_filename=file.filename,
-        site_name=site_name,
-        avg_ph=stats['avg_ph'],
-        ph_category=stats['ph_category'],
-        avg_tds=stats['avg_tds'],
-        tds_category=stats['tds_category'],
-        treatment_train=treatment_train,
-        explanation=explanation,
-        row_count=stats['row_count'],
-        min_ph=stats.get('min_ph'),
-        max_ph=stats.get('max_ph'),
-        min_tds=stats.get('min_tds'),
-        max_tds=stats.get('max_tds')
-    )
-    analysis.save()
+    Returns one result per CSV, in upload order, with the totals.
+    """
+    if store_readings is None:
+        store_readings = settings.STORE_RAW_READINGS
     
-    # Return response
-    return AnalysisResponse(
-        analysis_id=str(analysis.id),
-        upload_timestamp=analysis.upload_timestamp,
-        original_filename=analysis.original_filename,
-        site_name=analysis.site_name,
-        summary=AnalysisSummary(
-            avg_ph=stats['avg_ph'],
-            ph_category=stats['ph_category'],
-            avg_tds=stats['avg_tds'],
-            tds_category=stats['tds_category'],
-            row_count=stats['row_count']
-        ),
-        recommendation=TreatmentRecommendation(
-            treatment_train=treatment_train,
-            explanation=explanation
+    names: List[str] = []
+    results: List[Optional[BatchUploadResult]] = []
+    # Result index -> (document to insert, reading writer)
+    analyzed: Dict[int, Tuple[Dict[str, Any], Optional[ReadingWriter]]] = {}
+    # Content hash -> index of its first file; result index -> that index
+    first_copy: Dict[str, int] = {}
+    copies: Dict[int, int] = {}
+    # Bounds the files held in memory and analyzed at once
+    slots = asyncio.Semaphore(parse_parallelism())
+    
+    async def process(index: int, file: UploadFile) -> None:
+        try:
+            content_hash = await CSVService.hash_upload(file)
+            if content_hash in first_copy:
+                copies[index] = first_copy[content_hash]
+                return
+            first_copy[content_hash] = index
+            previous = await repository.get_by_content(content_hash, site_name)
+            if previous is not None:
+                results[index] = duplicate_result(names[index], previous)
+                return
+            analyzed[index] = await analyze_upload(
+                file, site_name, content_hash, None, store_readings, readings
+            )
+        except HTTPException as e:
+            results[index] = failed_result(names[index], e)
+        except ValidationError as e:
+            results[index] = failed_result(names[index], HTTPException(status_code=422, detail=str(e)))
+        finally:
+            slots.release()
+    
+    tasks = []
+    try:
+        async with aclosing(BatchService.iter_members(files)) as members:
+            async for name, member in members:
+                names.append(name)
+                results.append(None)
+                if isinstance(member, HTTPException):
+                    results[-1] = failed_result(name, member)
+                    continue
+                await slots.acquire()
+                tasks.append(asyncio.create_task(process(len(results) - 1, member)))
+        await asyncio.gather(*tasks)
+        
+        stored = await repository.insert_many([document for document, _ in analyzed.values()])
+    except BaseException:
+        # Let running files finish, then drop every reading written so far
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for _, writer in analyzed.values():
+            if writer is not None:
+                await writer.discard()
+        raise
+    
+    stored_ids = {document['_id'] for document in stored}
+    for index, (document, writer) in analyzed.items():
+        if document['_id'] in stored_ids:
+            results[index] = BatchUploadResult(
+                filename=names[index], status="created", analysis=analysis_response(document)
+            )
+            continue
+        # A concurrent upload of the same file was stored first
+        if writer is not None:
+            await writer.discard()
+        previous = await repository.get_by_content(document['content_hash'], site_name)
+        if previous is not None:
+            results[index] = duplicate_result(names[index], previous)
+        else:
+            results[index] = failed_result(names[index], HTTPException(
+                status_code=409,
+                detail="Upload conflicts with a stored analysis"
+            ))
+    for index, first in copies.items():
+        if results[first].status == "failed":
+            results[index] = results[first].model_copy(update={'filename': names[index]})
+        else:
+            results[index] = BatchUploadResult(filename=names[index], status="duplicate",
+                                               analysis=results[first].analysis)
+    
+    return ModelResponse(BatchUploadResponse(
+        created=sum(result.status == "created" for result in results),
+        duplicates=sum(result.status == "duplicate" for result in results),
+        failed=sum(result.status == "failed" for result in results),
+        results=results
+    ))
+
+
+@router.post("/{analysis_id}/reanalyze", response_model=AnalysisResponse)
+async def reanalyze(
+    analysis_id: str,
+    repository: AnalysisRepository = Depends(get_analysis_repository),
+    readings: ReadingRepository = Depends(get_reading_repository)
+):
+    """
+    Recompute an analysis from its stored raw readings.
+    
+    The readings are read back in bulk and classified with the site's
+    current rule table, so an analysis picks up rule changes without the
+    file being uploaded again. Statistics, recommendation, rule counts and
+    time-series summary are replaced; notes and upload details are kept.
+    
+    Returns the updated analysis.
+    """
+    # Validate ObjectId format
+    if not ObjectId.is_valid(analysis_id):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid analysis ID format"
         )
-    )
+    
+    document = await repository.get(analysis_id)
+    if document is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Analysis not found",
+                "analysis_id": analysis_id
+            }
+        )
+    
+    stored = await readings.load(analysis_id) if document.get('readings_stored') else None
+    if stored is None:
+        raise HTTPException(
+            status_code=409,
+            detail="No raw readings were stored for this analysis"
+        )
+    
+    rules = get_rule_table(document.get('site_name'))
+    stats = await run_cpu_bound(CSVService.analyze_readings, *stored, rules)
+    fields = analysis_fields(stats)
+    fields['reanalyzed_at'] = datetime.now(UTC).replace(tzinfo=None)
+    
+    # Validate the merged document before writing only the changed fields
+    analysis = WaterAnalysis._from_son(document)
+    for name, value in fields.items():
+        setattr(analysis, name, value)
+    analysis.validate()
+    son = analysis.to_mongo()
+    updated = await repository.update(analysis_id, {name: son.get(name) for name in fields})
+    if updated is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Analysis not found",
+                "analysis_id": analysis_id
+            }
+        )
+    
+    return ModelResponse(analysis_response(updated))
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+from fastapi import HTTPException, Query
+
+from app.core.executors import upload_limiter
+from app.models.analysis_result import HistoryFilters
+from app.services.rule_table import get_rule_config
+
+
+async def upload_slot():
+    """
+    Reserve one of the worker's upload slots for the duration of a request.
+
+    Raises:
+        HTTPException: 503 if MAX_CONCURRENT_UPLOADS uploads are already running
+    """
+    if not upload_limiter.try_acquire():
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing other uploads. Please retry shortly.",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        yield
+    finally:
+        upload_limiter.release()
+
+
+def check_category(name: str, value: Optional[str], bands: Tuple[str, ...]) -> None:
+    """
+    Check a category filter names a band of the rule table.
+
+    Raises:
+        HTTPException: 422 if it does not
+    """
+    if value is not None and value not in bands:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "error": f"Unknown {name}",
+                name: value,
+                "allowed_values": list(bands)
+            }
+        )
+
+
+def to_stored_time(value: Optional[datetime]) -> Optional[datetime]:
+    """Convert a query timestamp to the naive UTC form upload_timestamp is stored in."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def history_filters(
+    site_name: Optional[str] = Query(None, description="Only analyses for this site"),
+    start: Optional[datetime] = Query(
+        None, alias="from", description="Only analyses uploaded at or after this time (UTC if no offset)"
+    ),
+    end: Optional[datetime] = Query(
+        None, alias="to", description="Only analyses uploaded before this time (UTC if no offset)"
+    ),
+    ph_category: Optional[str] = Query(None, description="Only analyses in this pH band of the rule table"),
+    tds_category: Optional[str] = Query(None, description="Only analyses in this TDS band of the rule table"),
+    treatment_train: Optional[str] = Query(None, description="Only analyses with this recommendation")
+) -> HistoryFilters:
+    """
+    Collect the history filter query parameters shared by listing and export.
+
+    Categories are checked against the band names of the loaded rule
+    table, which every site profile shares.
+
+    Raises:
+        HTTPException: 400 if the time window is empty, 422 if a category
+            is not a band of the rule table
+    """
+    rules = get_rule_config().default
+    check_category('ph_category', ph_category, rules.ph_bands)
+    check_category('tds_category', tds_category, rules.tds_bands)
+    filters = HistoryFilters(
+        site_name=site_name,
+        start=to_stored_time(start),
+        end=to_stored_time(end),
+        ph_category=ph_category,
+        tds_category=tds_category,
+        treatment_train=treatment_train
+    )
+    if filters.start is not None and filters.end is not None and filters.start >= filters.end:
+        raise HTTPException(
+            status_code=400,
+            detail="'from' must be earlier than 'to'"
+        )
+    return filters
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import StreamingResponse
+from typing import Literal
+
+from app.api.dependencies import history_filters
+from app.core.config import settings
+from app.db.repository import AnalysisRepository, get_analysis_repository
+from app.models.analysis_result import HistoryFilters
+from app.services.export_service import EXPORT_FORMATS, ExportService
+
+router = APIRouter(prefix="/api/v1/analysis", tags=["export"])
+
+ExportFormat = Literal["ndjson", "csv", "parquet"]
+
+
+@router.get("/export")
+async def export_analyses(
+    format: ExportFormat = Query("ndjson", description="Output format: ndjson, csv or parquet"),
+    filters: HistoryFilters = Depends(history_filters),
+    repository: AnalysisRepository = Depends(get_analysis_repository)
+):
+    """
+    Export every matching analysis, most recent first.
+    
+    Accepts the same filters as /history. Records are read from a database
+    cursor in batches of EXPORT_BATCH_SIZE and written to the response as
+    each batch arrives, so memory use does not grow with the export size.
+    """
+    if format == "parquet" and not ExportService.parquet_available():
+        raise HTTPException(
+            status_code=501,
+            detail="Parquet export requires pyarrow to be installed on the server"
+        )
+    
+    batches = repository.iter_batches(
+        settings.EXPORT_BATCH_SIZE,
+        filters=filters,
+        fields=ExportService.stored_fields()
+    )
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        ExportService.stream(format, batches),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="water_analyses.{extension}"'}
+    )
@@ -1,7 +1,23 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+
+from app.db.repository import AnalysisRepository, get_analysis_repository
 
 router = APIRouter()
 
 @router.get("/health")
 def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+
+@router.get("/health/cache")
+def cache_stats(repository: AnalysisRepository = Depends(get_analysis_repository)):
+    """
+    Counters of this worker's analysis cache.
+    
+    Hits and misses count lookups by this worker, also when entries are
+    shared through Redis; the in-process cache adds its size, evictions
+    and expirations.
+    """
+    if repository.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **repository.cache.stats()}
@@ -1,68 +1,178 @@
-from fastapi import APIRouter, HTTPException, Query
-from typing import List
+from fastapi import APIRouter, HTTPException, Header, Query, Depends
+from typing import List, Literal, Optional, Tuple
 from bson import ObjectId
 from pydantic import BaseModel, Field
 
-from app.models.water_sample import WaterAnalysis
+from app.api.analysis import analysis_response
+from app.api.dependencies import history_filters
+from app.core.config import settings
+from app.core.responses import (
+    FastJSONResponse,
+    ModelResponse,
+    cache_headers,
+    etag_matches,
+    make_etag,
+    not_modified
+)
+from app.db.repository import (
+    AnalysisRepository,
+    decode_cursor,
+    encode_cursor,
+    get_analysis_repository,
+    history_key
+)
 from app.models.analysis_result import (
     AnalysisHistoryResponse,
     AnalysisHistoryItem,
     AnalysisResponse,
-    AnalysisSummary,
-    TreatmentRecommendation
+    HistoryFilters
 )
+from app.services.rule_table import get_rule_config
 
 router = APIRouter(prefix="/api/v1/analysis", tags=["history"])
 
+CountMode = Literal["exact", "cached", "estimated", "none"]
+
+
+async def count_analyses(repository: AnalysisRepository, mode: CountMode,
+                         filters: HistoryFilters) -> Optional[int]:
+    """Total number of matching analyses, computed as cheaply as the count mode allows."""
+    if mode == "exact":
+        return await repository.count(filters)
+    if mode == "cached":
+        return await repository.cached_count(settings.HISTORY_COUNT_CACHE_TTL, filters)
+    if mode == "estimated":
+        return await repository.estimated_count(filters)
+    return None
+
+
+def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """
+    Parse the comma-separated optional fields requested for a history page.
+    
+    Raises:
+        HTTPException: If an unknown field is requested
+    """
+    if fields is None:
+        return AnalysisHistoryItem.OPTIONAL_FIELDS
+    requested = tuple(name.strip() for name in fields.split(',') if name.strip())
+    unknown = [name for name in requested if name not in AnalysisHistoryItem.OPTIONAL_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Unknown fields requested",
+                "unknown_fields": unknown,
+                "allowed_fields": list(AnalysisHistoryItem.OPTIONAL_FIELDS)
+            }
+        )
+    return requested
+
 
 @router.get("/history", response_model=AnalysisHistoryResponse)
-def get_analysis_history(
+async def get_analysis_history(
     limit: int = Query(20, ge=1, le=100, description="Maximum number of records"),
-    offset: int = Query(0, ge=0, description="Number of records to skip")
+    offset: int = Query(0, ge=0, description="Number of records to skip"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    count_mode: CountMode = Query(
+        "cached",
+        description="How total is computed: exact, cached (exact, reused briefly), estimated or none"
+    ),
+    fields: Optional[str] = Query(
+        None,
+        description="Comma-separated optional fields to include "
+                    "(site_name, treatment_train, explanation, user_notes); defaults to all"
+    ),
+    filters: HistoryFilters = Depends(history_filters),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    repository: AnalysisRepository = Depends(get_analysis_repository)
 ):
     """
     Get history of water quality analyses.
     
-    Returns paginated list of past analyses, most recent first.
+    Returns paginated list of past analyses, most recent first. Pass the
+    returned next_cursor back as cursor to fetch the following page; unlike
+    offset, every cursor page costs the same however deep it is.
+    
+    The total defaults to a briefly cached exact count so polling dashboards
+    do not count the collection on every request. Only the fields the page
+    returns are read from the database; optional fields left out of fields
+    come back as null.
+    
+    Filters combine with AND and are evaluated by the database using the
+    compound indexes declared on WaterAnalysis.
+    
+    Pages carry an ETag tied to the query and the collection's change
+    counter. A poll sending it back in If-None-Match gets 304 Not
+    Modified, without the page being read or encoded, until an analysis
+    is added or changed.
     """
+    include = parse_fields(fields)
+    
+    after = None
+    if cursor is not None:
+        if offset:
+            raise HTTPException(
+                status_code=400,
+                detail="Use either cursor or offset, not both"
+            )
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid pagination cursor"
+            )
+    
+    # Read the version before the page, so a write in between makes the
+    # tag older than the page rather than the page older than the tag
+    version = await repository.change_version(settings.ETAG_VERSION_TTL)
+    etag = make_etag('history', version, limit, offset, after, count_mode, include, filters)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
     # Get total count
-    total = WaterAnalysis.objects.count()
-    
-    # Get paginated results
-    analyses = WaterAnalysis.objects.skip(offset).limit(limit)
-    
-    # Convert to response format
-    items = [
-        AnalysisHistoryItem(
-            id=str(analysis.id),
-            upload_timestamp=analysis.upload_timestamp,
-            original_filename=analysis.original_filename,
-            site_name=analysis.site_name,
-            avg_ph=analysis.avg_ph,
-            ph_category=analysis.ph_category,
-            avg_tds=analysis.avg_tds,
-            tds_category=analysis.tds_category,
-            treatment_train=getattr(analysis, 'treatment_train', None),
-            explanation=getattr(analysis, 'explanation', None),
-            user_notes=getattr(analysis, 'user_notes', None)
-        )
-        for analysis in analyses
-    ]
-    
-    return AnalysisHistoryResponse(
-        analyses=items,
-        total=total,
-        limit=limit,
-        offset=offset
+    total = await count_analyses(repository, count_mode, filters)
+    
+    # Fetch one extra record to learn whether another page follows
+    analyses = await repository.list(
+        limit=limit + 1,
+        offset=offset,
+        after=after,
+        fields=AnalysisHistoryItem.stored_fields(include),
+        filters=filters
     )
+    next_cursor = None
+    if len(analyses) > limit:
+        analyses = analyses[:limit]
+        next_cursor = encode_cursor(history_key(analyses[-1]))
+    
+    # Encode the projected rows as they are; fields_from_document gives
+    # each item the types AnalysisHistoryItem would serialize
+    items = [AnalysisHistoryItem.fields_from_document(analysis) for analysis in analyses]
+    
+    return FastJSONResponse({
+        "analyses": items,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "next_cursor": next_cursor
+    }, headers=cache_headers(etag))
 
 
 @router.get("/{analysis_id}", response_model=AnalysisResponse)
-def get_analysis_by_id(analysis_id: str):
+async def get_analysis_by_id(
+    analysis_id: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    repository: AnalysisRepository = Depends(get_analysis_repository)
+):
     """
     Get specific analysis by ID.
     
-    Returns full analysis details including recommendation.
+    Returns full analysis details including recommendation. Like history
+    pages, the response carries an ETag, and a matching If-None-Match gets
+    304 Not Modified without the analysis being read. Otherwise it is read
+    through the analysis cache, which notes changes and re-analyses reset.
     """
     # Validate ObjectId format
     if not ObjectId.is_valid(analysis_id):
@@ -71,10 +181,16 @@ def get_analysis_by_id(analysis_id: str):
             detail="Invalid analysis ID format"
         )
     
-    # Query database
-    try:
-        analysis = WaterAnalysis.objects.get(id=analysis_id)
-    except WaterAnalysis.DoesNotExist:
+    # The dominant rule's treatment text comes from the rule table
+    rules = get_rule_config()
+    version = await repository.change_version(settings.ETAG_VERSION_TTL)
+    etag = make_etag('analysis', analysis_id, version, rules.version, rules.mtime_ns)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    # Recently read analyses are served from the analysis cache
+    analysis = await repository.cached_get(analysis_id, settings.ETAG_VERSION_TTL)
+    if analysis is None:
         raise HTTPException(
             status_code=404,
             detail={
@@ -84,23 +200,7 @@ def get_analysis_by_id(analysis_id: str):
         )
     
     # Return response
-    return AnalysisResponse(
-        analysis_id=str(analysis.id),
-        upload_timestamp=analysis.upload_timestamp,
-        original_filename=analysis.original_filename,
-        site_name=analysis.site_name,
-        summary=AnalysisSummary(
-            avg_ph=analysis.avg_ph,
-            ph_category=analysis.ph_category,
-            avg_tds=analysis.avg_tds,
-            tds_category=analysis.tds_category,
-            row_count=analysis.row_count
-        ),
-        recommendation=TreatmentRecommendation(
-            treatment_train=analysis.treatment_train,
-            explanation=analysis.explanation
-        )
-    )
+    return ModelResponse(analysis_response(analysis), headers=cache_headers(etag))
 
 
 class UpdateNotesRequest(BaseModel):
@@ -109,7 +209,11 @@ class UpdateNotesRequest(BaseModel):
 
 
 @router.patch("/{analysis_id}/notes")
-def update_analysis_notes(analysis_id: str, request: UpdateNotesRequest):
+async def update_analysis_notes(
+    analysis_id: str,
+    request: UpdateNotesRequest,
+    repository: AnalysisRepository = Depends(get_analysis_repository)
+):
     """
     Update user notes for a specific analysis.
     
@@ -122,10 +226,9 @@ def update_analysis_notes(analysis_id: str, request: UpdateNotesRequest):
             detail="Invalid analysis ID format"
         )
     
-    # Query database
-    try:
-        analysis = WaterAnalysis.objects.get(id=analysis_id)
-    except WaterAnalysis.DoesNotExist:
+    # Update notes
+    analysis = await repository.update_notes(analysis_id, request.user_notes)
+    if analysis is None:
         raise HTTPException(
             status_code=404,
             detail={
@@ -134,12 +237,8 @@ def update_analysis_notes(analysis_id: str, request: UpdateNotesRequest):
             }
         )
     
-    # Update notes
-    analysis.user_notes = request.user_notes
-    analysis.save()
-    
     return {
         "success": True,
-        "analysis_id": str(analysis.id),
-        "user_notes": analysis.user_notes
+        "analysis_id": str(analysis['_id']),
+        "user_notes": analysis.get('user_notes')
     }
@@ -0,0 +1,146 @@
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException, Depends
+from typing import Optional
+from mongoengine.errors import ValidationError
+
+from app.api.analysis import store_upload
+from app.core.config import settings
+from app.core.responses import ModelResponse
+from app.db.readings import ReadingRepository, get_reading_repository
+from app.db.repository import AnalysisRepository, get_analysis_repository
+from app.services.csv_service import CSVService
+from app.services.job_queue import Job, JobQueue, JobQueueFull, get_job_queue
+from app.models.analysis_result import JobResponse
+
+router = APIRouter(prefix="/api/v1/jobs", tags=["jobs"])
+
+
+def queue_full() -> HTTPException:
+    """The 503 for a job submitted while JOB_QUEUE_SIZE jobs are waiting."""
+    return HTTPException(
+        status_code=503,
+        detail="Upload job queue is full. Please retry shortly.",
+        headers={"Retry-After": "5"}
+    )
+
+
+def job_response(job: Job) -> JobResponse:
+    """Report a job, with links to itself and to its analysis."""
+    return JobResponse(
+        job_id=job.id,
+        status=job.status,
+        filename=job.filename,
+        site_name=job.site_name,
+        file_size=job.file_size,
+        submitted_at=job.submitted_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        rows_processed=job.rows_processed,
+        status_url=f"/api/v1/jobs/{job.id}",
+        analysis_id=job.analysis_id,
+        result_url=f"/api/v1/analysis/{job.analysis_id}" if job.analysis_id else None,
+        replayed=job.replayed,
+        status_code=job.error_status,
+        error=job.error
+    )
+
+
+async def run_upload_job(job: Job, queue: JobQueue) -> None:
+    """
+    Analyze and store the spooled upload of a job.
+
+    Goes through the same path as /upload, reporting the rows parsed after
+    every block. Errors /upload would have returned are recorded on the job
+    with their status code.
+    """
+    repository, readings = job.context
+
+    async def progress(rows: int) -> None:
+        job.rows_processed = rows
+        await queue.update(job)
+
+    try:
+        with open(job.path, 'rb') as spooled:
+            file = UploadFile(spooled, size=job.file_size, filename=job.filename)
+            document, replayed = await store_upload(
+                file, job.site_name, job.store_readings, job.idempotency_key,
+                repository, readings, progress
+            )
+    except HTTPException as e:
+        job.fail(e.status_code, e.detail)
+    except ValidationError as e:
+        job.fail(422, str(e))
+    else:
+        job.rows_processed = document['row_count']
+        job.succeed(str(document['_id']), replayed)
+
+
+@router.post("/upload", response_model=JobResponse, status_code=202)
+async def submit_upload_job(
+    file: UploadFile = File(..., description="CSV file with water quality data"),
+    site_name: Optional[str] = Form(None, description="Optional site identifier"),
+    store_readings: Optional[bool] = Form(
+        None, description="Keep the raw readings for re-analysis; STORE_RAW_READINGS if omitted"
+    ),
+    idempotency_key: Optional[str] = Header(
+        None, alias="Idempotency-Key", max_length=255,
+        description="Client-chosen key; retries with the same key return the first result"
+    ),
+    queue: JobQueue = Depends(get_job_queue),
+    repository: AnalysisRepository = Depends(get_analysis_repository),
+    readings: ReadingRepository = Depends(get_reading_repository)
+):
+    """
+    Queue a CSV upload for analysis and return at once.
+
+    For files that take longer to analyze than a client or load balancer
+    will wait. The upload is spooled to disk, queued for the job workers
+    and answered with 202 and the job's status URL (also in the Location
+    header); poll it for progress and the link to the stored analysis.
+
+    The analysis is the one /upload would store, retries included: a job
+    for a known Idempotency-Key or an identical file succeeds with the
+    stored analysis and replayed set. Returns 503 when JOB_QUEUE_SIZE jobs
+    are already waiting.
+    """
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Only CSV files are accepted."
+        )
+
+    # Refuse before spooling, rather than after copying the whole file
+    if await queue.full():
+        raise queue_full()
+
+    path, size = await CSVService.spool_upload(file, settings.JOB_SPOOL_DIR or None)
+    job = Job(path, file.filename, size, site_name, store_readings, idempotency_key,
+              context=(repository, readings))
+    try:
+        await queue.submit(job)
+    except JobQueueFull:
+        job.remove_spool()
+        raise queue_full()
+
+    response = job_response(job)
+    return ModelResponse(response, status_code=202, headers={"Location": response.status_url})
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, queue: JobQueue = Depends(get_job_queue)):
+    """
+    Get the status and progress of an upload job.
+
+    Finished jobs are kept for JOB_RETENTION seconds. A job that succeeded
+    links to its analysis; a failed job carries the status code and error
+    /upload would have returned.
+    """
+    job = await queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Job not found",
+                "job_id": job_id
+            }
+        )
+    return ModelResponse(job_response(job))
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+
+from app.core.metrics import metrics_enabled, render_metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus scrape endpoint.
+    
+    Reports request latency per route, requests in progress, upload stage
+    timings, readings and bytes uploaded, and MongoDB pool connections.
+    With PROMETHEUS_MULTIPROC_DIR set, totals cover every worker.
+    """
+    if not metrics_enabled():
+        raise HTTPException(
+            status_code=501,
+            detail="Metrics require prometheus_client to be installed on the server"
+        )
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
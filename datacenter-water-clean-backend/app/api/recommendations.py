@@ -0,0 +1,206 @@
+import io
+import numpy as np
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.responses import ModelResponse
+from app.models.recommendation import (
+    RecommendationBatchRequest,
+    RecommendationBatchResponse,
+    RecommendationCacheInfo,
+    RuleTableInfo
+)
+from app.services.recommendation_service import RecommendationService
+from app.services.rule_table import (
+    RuleConfig,
+    RuleTable,
+    RuleTableError,
+    get_rule_config,
+    get_rule_table,
+    reload_rule_config
+)
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional; only Arrow requests need it
+    pa = None
+
+router = APIRouter(prefix="/api/v1/recommendations", tags=["recommendations"])
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+def _check_batch(ph: np.ndarray, tds: np.ndarray) -> None:
+    """
+    Validate the shape and size of a batch.
+    
+    Raises:
+        HTTPException: 400 for mismatched columns, 413 for oversized batches
+    """
+    if len(ph) != len(tds):
+        raise HTTPException(
+            status_code=400,
+            detail="ph and tds must contain the same number of values"
+        )
+    if len(ph) > settings.MAX_BATCH_RECOMMENDATIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large. Maximum is {settings.MAX_BATCH_RECOMMENDATIONS} pairs"
+        )
+
+
+def score_json(body: bytes, table: RuleTable) -> ModelResponse:
+    """
+    Classify a JSON batch and list the text of each rule that occurs.
+    
+    The response is serialized here too, so a large batch is encoded in
+    the worker thread rather than on the event loop.
+    """
+    try:
+        batch = RecommendationBatchRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    
+    ph = np.array(batch.ph, dtype=np.float64)
+    tds = np.array(batch.tds, dtype=np.float64)
+    _check_batch(ph, tds)
+    codes = table.codes[RecommendationService.get_rule_indices(ph, tds, table)]
+    rules = {code: table.recommendation(code) for code in np.unique(codes).tolist()}
+    return ModelResponse(RecommendationBatchResponse(
+        count=len(codes),
+        rule_codes=codes.tolist(),
+        rules={
+            code: {'treatment_train': treatment_train, 'explanation': explanation}
+            for code, (treatment_train, explanation) in rules.items()
+        }
+    ))
+
+
+def score_arrow(body: bytes, table: RuleTable) -> bytes:
+    """
+    Classify an Arrow IPC stream with float 'ph' and 'tds' columns.
+    
+    The response is an Arrow IPC stream of dictionary-encoded rule_code,
+    treatment_train and explanation columns: one int8 index per pair plus
+    each rule's text once.
+    """
+    try:
+        batch = pa.ipc.open_stream(body).read_all()
+        ph = batch.column('ph').cast(pa.float64()).to_numpy()
+        tds = batch.column('tds').cast(pa.float64()).to_numpy()
+    except (pa.ArrowException, KeyError) as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid Arrow batch; expected 'ph' and 'tds' columns: {e}"
+        )
+    
+    _check_batch(ph, tds)
+    indices = pa.array(RecommendationService.get_rule_indices(ph, tds, table), type=pa.int8())
+    result = pa.table({
+        'rule_code': pa.DictionaryArray.from_arrays(indices, pa.array(table.codes.tolist())),
+        'treatment_train': pa.DictionaryArray.from_arrays(indices, pa.array(table.treatments.tolist())),
+        'explanation': pa.DictionaryArray.from_arrays(indices, pa.array(table.explanations.tolist())),
+    })
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, result.schema) as writer:
+        writer.write_table(result)
+    return sink.getvalue()
+
+
+@router.post(
+    "/batch",
+    response_model=RecommendationBatchResponse,
+    responses={200: {"content": {ARROW_STREAM: {}}}},
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": RecommendationBatchRequest.model_json_schema()
+                },
+                ARROW_STREAM: {
+                    "schema": {"type": "string", "format": "binary"}
+                }
+            }
+        }
+    }
+)
+async def recommend_batch(
+    request: Request,
+    site_name: Optional[str] = Query(None, description="Classify with this site's threshold profile")
+):
+    """
+    Classify many pH/TDS pairs in one call.
+    
+    Send JSON ({"ph": [...], "tds": [...]}) for a JSON reply, or an Arrow IPC
+    stream (Content-Type: application/vnd.apache.arrow.stream) with 'ph' and
+    'tds' columns for an Arrow reply. Rules are the same as for uploads from
+    the same site.
+    """
+    table = get_rule_table(site_name)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    body = await request.body()
+    
+    if content_type == ARROW_STREAM:
+        if pa is None:
+            raise HTTPException(
+                status_code=501,
+                detail="Arrow input requires pyarrow to be installed on the server"
+            )
+        payload = await run_in_threadpool(score_arrow, body, table)
+        return Response(content=payload, media_type=ARROW_STREAM)
+    
+    if content_type not in ("application/json", ""):
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported content type. Use application/json or {ARROW_STREAM}"
+        )
+    return await run_in_threadpool(score_json, body, table)
+
+
+def describe_rules(config: RuleConfig) -> RuleTableInfo:
+    """Summarise a loaded rule table."""
+    return RuleTableInfo(
+        version=config.version,
+        source=str(config.path) if config.path else None,
+        loaded_at=config.loaded_at,
+        ph_bands=list(config.default.ph_bands),
+        tds_bands=list(config.default.tds_bands),
+        sites=sorted(config.sites)
+    )
+
+
+@router.get("/rules", response_model=RuleTableInfo)
+def get_rules():
+    """Show which rule table version this worker is classifying with."""
+    return describe_rules(get_rule_config())
+
+
+@router.get("/cache", response_model=RecommendationCacheInfo)
+def get_cache_info():
+    """
+    Show how often upload recommendations come from the per-cell memo.
+    
+    Counts are for the worker serving the request; re-analyses, which run
+    in the CSV parse pool, are looked up and counted in its processes.
+    """
+    return RecommendationService.cache_info()
+
+
+@router.post("/rules/reload", response_model=RuleTableInfo)
+def reload_rules():
+    """
+    Compile the rule table file now instead of waiting for the next change check.
+    
+    Only the worker serving the request reloads immediately; the others pick
+    the file up within RULE_TABLE_RELOAD_INTERVAL. An invalid file is
+    rejected with 422 and the current table stays active.
+    """
+    try:
+        return describe_rules(reload_rule_config())
+    except RuleTableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Header, Query, Depends
+from typing import Optional
+
+from app.api.dependencies import history_filters
+from app.core.config import settings
+from app.core.responses import ModelResponse, cache_headers, etag_matches, make_etag, not_modified
+from app.db.repository import AnalysisRepository, get_analysis_repository
+from app.models.analysis_result import AnalysisStatsResponse, HistoryFilters, StatsBucket
+
+router = APIRouter(prefix="/api/v1/analysis", tags=["stats"])
+
+
+@router.get("/stats", response_model=AnalysisStatsResponse)
+async def get_analysis_stats(
+    bucket: StatsBucket = Query("day", description="Width of the time buckets: hour, day, week or month"),
+    filters: HistoryFilters = Depends(history_filters),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    repository: AnalysisRepository = Depends(get_analysis_repository)
+):
+    """
+    Get aggregate statistics of the analyses matching the history filters.
+    
+    Reports readings-weighted mean pH and TDS with their ranges, and the
+    share of readings out of range, over all matching analyses, per site
+    and per time bucket, along with how often each treatment and dominant
+    rule was recommended.
+    
+    With STATS_FROM_ROLLUPS set, reports by day, week or month filtered
+    at most by site, treatment and a window on day boundaries are composed
+    from the site_daily_rollups cells, at a cost that grows with days and
+    sites rather than analyses. Other reports are computed by a single
+    aggregation in the database; with no filters, or only site and time
+    filters, it reads nothing but the covering stats index on
+    WaterAnalysis. Like history pages, the response carries an ETag for
+    conditional polling.
+    """
+    version = await repository.change_version(settings.ETAG_VERSION_TTL)
+    etag = make_etag('stats', version, bucket, filters)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    report = await repository.stats(bucket, filters, allow_disk_use=settings.STATS_ALLOW_DISK_USE)
+    return ModelResponse(AnalysisStatsResponse(bucket=bucket, **report), headers=cache_headers(etag))
@@ -0,0 +1,153 @@
+import zlib
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.responses import encoded_etag
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only gzip is offered without it
+    brotli = None
+
+# Responses of these types are sent as they are, as by Starlette's GZipMiddleware
+EXCLUDED_CONTENT_TYPES = ("text/event-stream",)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the content coding for a response from an Accept-Encoding header.
+
+    Brotli is preferred over gzip at equal quality, when it is installed.
+
+    Returns:
+        'br', 'gzip', or None to send the response as it is
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        name, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in (('br',) if brotli is not None else ()) + ('gzip',):
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class StreamCompressor:
+    """Incremental brotli or gzip encoder of one response body."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int) -> None:
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31: deflate in a gzip container
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, body: bytes, more_body: bool) -> bytes:
+        """Encode the next part of the body; the last part ends the stream."""
+        # Flush each streamed chunk so clients see rows as they are sent
+        if self.encoding == "br":
+            data = self.compressor.process(body)
+            return data + (self.compressor.flush() if more_body else self.compressor.finish())
+        data = self.compressor.compress(body)
+        return data + self.compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses of at least minimum_size bytes with brotli or gzip.
+
+    As with Starlette's GZipMiddleware, responses that are already encoded
+    or are event streams pass through, and streamed responses are
+    compressed chunk by chunk. A strong ETag on a compressed
+    response is marked with the coding (see encoded_etag), so each
+    representation has its own validator, and a 304 echoes the form the
+    client asked about.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6,
+                 brotli_quality: int = 4) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = choose_encoding(headers.get("Accept-Encoding", ""))
+        if_none_match = headers.get("If-None-Match", "")
+        compressor = None
+        # The start message is held back until the first body part shows
+        # whether, and how, the response is encoded
+        start: Optional[Message] = None
+        passthrough = False
+
+        def mark_etag(response_headers: MutableHeaders, status: int) -> None:
+            etag = response_headers.get("etag")
+            if etag is None or etag.startswith("W/"):
+                return
+            coding = response_headers.get("content-encoding")
+            if coding is None and status == 304 and encoding is not None \
+                    and encoded_etag(etag, encoding) in if_none_match:
+                coding = encoding
+            if coding is not None:
+                response_headers["ETag"] = encoded_etag(etag, coding)
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                response_headers = Headers(raw=message["headers"])
+                passthrough = ("content-encoding" in response_headers
+                               or response_headers.get("content-type", "").startswith(EXCLUDED_CONTENT_TYPES))
+                return
+            if message["type"] != "http.response.body":
+                # e.g. http.response.pathsend, sent as it is
+                if start is not None:
+                    mark_etag(MutableHeaders(raw=start["headers"]), start["status"])
+                    await send(start)
+                    start = None
+                await send(message)
+                return
+            if start is None:
+                # Later part of a streamed body
+                if compressor is not None:
+                    message["body"] = compressor.compress(message.get("body", b""), message.get("more_body", False))
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            response_headers = MutableHeaders(raw=start["headers"])
+            if not passthrough and (more_body or len(body) >= self.minimum_size):
+                response_headers.add_vary_header("Accept-Encoding")
+                if encoding is not None:
+                    compressor = StreamCompressor(encoding, self.gzip_level, self.brotli_quality)
+                    message["body"] = compressor.compress(body, more_body)
+                    response_headers["Content-Encoding"] = encoding
+                    if more_body:
+                        del response_headers["Content-Length"]
+                    else:
+                        response_headers["Content-Length"] = str(len(message["body"]))
+            mark_etag(response_headers, start["status"])
+            await send(start)
+            start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
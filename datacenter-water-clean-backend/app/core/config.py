@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import ConfigDict
-from typing import List
+from typing import List, Union
 
 
 class Settings(BaseSettings):
@@ -14,6 +14,16 @@ class Settings(BaseSettings):
     # MongoDB Configuration
     MONGODB_URL: str
     MONGODB_DB_NAME: str = "water_quality"
+    MONGODB_MAX_POOL_SIZE: int = 100
+    MONGODB_MIN_POOL_SIZE: int = 0
+    MONGODB_CONNECT_TIMEOUT_MS: int = 5000
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    MONGODB_SOCKET_TIMEOUT_MS: int = 30000
+    MONGODB_WRITE_CONCERN: str = "majority"  # "majority" or a node count such as "1"
+    MONGODB_WRITE_TIMEOUT_MS: int = 10000
+    
+    # Storage backend for analyses: "mongo" or "memory" (tests/benchmarks)
+    ANALYSIS_REPOSITORY_BACKEND: str = "mongo"
     
     # API Configuration
     API_HOST: str = "0.0.0.0"
@@ -21,12 +31,59 @@ class Settings(BaseSettings):
     API_TITLE: str = "DataCenter Water Clean API"
     API_VERSION: str = "1.0.0"
     
+    # Upload Configuration
+    MAX_FILE_SIZE: int = 10 * 1024 * 1024  # bytes
+    CSV_CHUNK_SIZE: int = 1024 * 1024  # bytes read from the upload per step
+    PARSE_WORKERS: int = 2  # CSV parse processes; 0 uses the thread pool
+    MAX_CONCURRENT_UPLOADS: int = 4  # per worker; extra uploads get a 503
+    MAX_BATCH_FILES: int = 500  # CSVs per batch upload, counting archive members
+    MAX_BATCH_SIZE: int = 200 * 1024 * 1024  # CSV bytes per batch upload, archive members decompressed
+    TIMESERIES_ROLLING_WINDOW: int = 15  # minutes averaged for excursion detection
+    TIMESERIES_MAX_EXCURSIONS: int = 50  # longest excursions kept per analysis
+    STORE_RAW_READINGS: bool = False  # keep parsed readings for re-analysis unless the upload says otherwise
+    READINGS_CHUNK_SIZE: int = 16384  # readings per stored chunk document (~400 KB)
+    
+    # Upload Job Configuration
+    JOB_WORKERS: int = 2  # upload jobs analyzed at once per worker
+    JOB_QUEUE_SIZE: int = 32  # jobs waiting to run; further submissions get a 503
+    JOB_RETENTION: float = 3600.0  # seconds a finished job's status stays available
+    JOB_SPOOL_DIR: str = ""  # where queued uploads are spooled; empty uses the system temp dir
+    
+    # History Configuration
+    HISTORY_COUNT_CACHE_TTL: float = 5.0  # seconds a cached total stays fresh
+    ETAG_VERSION_TTL: float = 1.0  # seconds before a worker re-reads the shared change counter
+    STATS_ALLOW_DISK_USE: bool = True  # let /stats aggregations spill to disk on large collections
+    STATS_FROM_ROLLUPS: bool = False  # serve whole-day /stats from site_daily_rollups; enable after a rebuild
+    EXPORT_BATCH_SIZE: int = 1000  # analyses per cursor batch when exporting
+    MAX_BATCH_RECOMMENDATIONS: int = 1_000_000  # pH/TDS pairs per batch request
+    
+    # Analysis Cache Configuration
+    ANALYSIS_CACHE_SIZE: int = 1024  # analyses cached by id per worker; 0 disables the cache
+    ANALYSIS_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # BSON bytes cached per worker
+    ANALYSIS_CACHE_TTL: float = 300.0  # seconds a cached analysis is served before it is read again
+    ANALYSIS_CACHE_URL: str = ""  # redis:// URL of a cache shared by all workers; needs the redis package
+    
+    # Treatment Rules Configuration
+    RULE_TABLE_PATH: str = ""  # rule table JSON; empty uses app/core/rule_table.json
+    RULE_TABLE_RELOAD_INTERVAL: float = 5.0  # seconds between file change checks; 0 disables
+    
+    # Response Compression Configuration
+    COMPRESSION_MIN_SIZE: int = 1024  # bytes; smaller responses are sent as they are
+    GZIP_LEVEL: int = 6
+    BROTLI_QUALITY: int = 4  # 0-11; used when the brotli package is installed
+    
     # CORS Configuration
     CORS_ORIGINS: str = "http://localhost:3000,http://localhost:5173,http://localhost:5174,https://datacenter-water-clean-frontend.vercel.app"
     
     # Environment
     ENVIRONMENT: str = "development"
     
+    @property
+    def mongodb_write_concern(self) -> Union[int, str]:
+        """Convert MONGODB_WRITE_CONCERN to the form PyMongo expects for w."""
+        value = self.MONGODB_WRITE_CONCERN.strip()
+        return int(value) if value.isdigit() else value
+    
     @property
     def cors_origins_list(self) -> List[str]:
         """Convert CORS_ORIGINS string to list."""
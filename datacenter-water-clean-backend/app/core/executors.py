@@ -0,0 +1,79 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_parse_executor() -> Optional[Executor]:
+    """
+    Return the process pool used for CPU-bound CSV work.
+
+    The pool is created on first use with PARSE_WORKERS processes. When
+    PARSE_WORKERS is 0, None is returned and work runs in the event loop's
+    default thread pool instead.
+    """
+    global _parse_pool
+    if settings.PARSE_WORKERS <= 0:
+        return None
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=settings.PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"Started CSV parse pool with {settings.PARSE_WORKERS} workers")
+    return _parse_pool
+
+
+def parse_parallelism() -> int:
+    """Number of blocks a single upload may have in flight at once."""
+    return max(settings.PARSE_WORKERS, 1)
+
+
+async def run_cpu_bound(func: Callable, *args: Any) -> Any:
+    """Run a picklable function in the parse pool without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_parse_executor(), func, *args)
+
+
+def shutdown_executors() -> None:
+    """Stop the parse pool, if one was started."""
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=True, cancel_futures=True)
+        _parse_pool = None
+        logger.info("CSV parse pool stopped")
+
+
+class ConcurrencyLimiter:
+    """
+    Non-blocking cap on concurrent operations.
+
+    Callers that find the limit reached are turned away immediately instead
+    of queueing, so a saturated worker sheds load rather than building up a
+    backlog. All access happens on the event loop thread.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+
+    def try_acquire(self) -> bool:
+        """Take a slot if one is free."""
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        """Give a slot back."""
+        self.in_flight -= 1
+
+
+upload_limiter = ConcurrencyLimiter(settings.MAX_CONCURRENT_UPLOADS)
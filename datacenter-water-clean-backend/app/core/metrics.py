@@ -0,0 +1,202 @@
+"""
+Prometheus metrics: request latency, upload stages and the MongoDB pool.
+
+Each uvicorn worker counts in its own process, so nothing is shared or
+locked between workers. To serve one total from any of them, start the
+server with PROMETHEUS_MULTIPROC_DIR naming an empty directory: every
+process, parse pool workers included, then writes its samples to
+memory-mapped files there, and /metrics adds them up.
+
+Without prometheus_client installed nothing is recorded and /metrics
+answers 501.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:  # prometheus_client is optional; metrics are off without it
+    prometheus_client = None
+
+# Upload stages timed by stage_timer, in upload order
+UPLOAD_STAGES = ('read', 'parse', 'statistics', 'recommendation', 'save')
+
+# Route label of requests no route matched, so unknown paths share one series
+UNMATCHED_ROUTE = "unmatched"
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = Histogram(
+        'http_request_duration_seconds', "Time to answer a request, by route template",
+        ['method', 'route', 'status'],
+        buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+    )
+    REQUESTS_IN_PROGRESS = Gauge(
+        'http_requests_in_progress', "Requests being answered",
+        ['method'], multiprocess_mode='livesum'
+    )
+    UPLOAD_STAGE_SECONDS = Histogram(
+        'upload_stage_duration_seconds', "Time one upload spent in each stage; parse is summed over blocks",
+        ['stage'],
+        buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+    )
+    UPLOAD_ROWS = Counter('upload_rows', "Readings parsed from uploads")
+    UPLOAD_BYTES = Counter('upload_bytes', "CSV bytes read from uploads")
+    MONGO_CONNECTIONS = Gauge(
+        'mongodb_pool_connections', "Connections in the MongoDB pools, by state",
+        ['state'], multiprocess_mode='livesum'
+    )
+    MONGO_CHECKOUT_SECONDS = Histogram(
+        'mongodb_pool_checkout_duration_seconds', "Time waited for a pooled MongoDB connection",
+        buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5)
+    )
+    MONGO_CHECKOUT_FAILURES = Counter(
+        'mongodb_pool_checkout_failures', "Connection checkouts that failed, by reason", ['reason']
+    )
+
+
+def metrics_enabled() -> bool:
+    """Whether metrics are recorded, i.e. prometheus_client is installed."""
+    return prometheus_client is not None
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record the time one upload spent in a stage (see UPLOAD_STAGES)."""
+    if prometheus_client is not None:
+        UPLOAD_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Time the enclosed block as one upload stage, unless it raises."""
+    start = time.perf_counter()
+    yield
+    observe_stage(stage, time.perf_counter() - start)
+
+
+def count_upload_bytes(size: int) -> None:
+    """Record CSV bytes read from an upload."""
+    if prometheus_client is not None:
+        UPLOAD_BYTES.inc(size)
+
+
+def count_upload_rows(rows: int) -> None:
+    """Record the readings parsed from an upload."""
+    if prometheus_client is not None:
+        UPLOAD_ROWS.inc(rows)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Current metrics in the Prometheus text format.
+
+    Returns:
+        Tuple of (body, content type)
+
+    Raises:
+        RuntimeError: If prometheus_client is not installed
+    """
+    if prometheus_client is None:
+        raise RuntimeError("Metrics require prometheus_client to be installed")
+    registry = prometheus_client.REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def shutdown_metrics() -> None:
+    """Drop this process's live gauges from the shared totals as it exits."""
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    Time every HTTP request and count those in progress.
+
+    Latency is labelled with the matched route's path template rather than
+    the request path, so /api/v1/analysis/{analysis_id} is one series
+    however many analyses are fetched.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or prometheus_client is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress.dec()
+            # The router records the matched route in the shared scope
+            route = scope.get("route")
+            route = getattr(route, "path", None) or UNMATCHED_ROUTE
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(time.perf_counter() - start)
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool events of a MongoDB client, as pool gauges.
+
+    Pass an instance in the client's event_listeners. Counts cover every
+    server the client connects to.
+    """
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        pass
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        pass
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        MONGO_CONNECTIONS.labels('open').inc()
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        MONGO_CONNECTIONS.labels('open').dec()
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        pass
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        MONGO_CHECKOUT_FAILURES.labels(event.reason).inc()
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        MONGO_CONNECTIONS.labels('checked_out').inc()
+        MONGO_CHECKOUT_SECONDS.observe(event.duration)
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        MONGO_CONNECTIONS.labels('checked_out').dec()
+
+
+def mongo_event_listeners() -> Optional[list]:
+    """event_listeners for a MongoDB client: pool metrics when metrics are on."""
+    return [MongoPoolMetrics()] if prometheus_client is not None else None
@@ -0,0 +1,121 @@
+from typing import Any, Mapping, Optional
+import hashlib
+import numpy as np
+import pydantic_core
+from bson import ObjectId
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; pydantic-core's serializer is the fallback
+    orjson = None
+
+if orjson is not None:
+    # UTC datetimes end in Z, as pydantic writes them
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z
+
+
+def _encode_extra(value: Any) -> Any:
+    """Encode values neither serializer knows: ObjectIds, numpy scalars, models."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize plain data (dicts, lists, strings, numbers, datetimes) to JSON.
+
+    Uses orjson when it is installed and pydantic-core otherwise. Both
+    write datetimes, NaN (as null) and floats the way pydantic serializes
+    a model, so a response built from plain data reads the same as one
+    built from its response model.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_encode_extra, option=ORJSON_OPTIONS)
+    return pydantic_core.to_json(content, fallback=_encode_extra, inf_nan_mode='null')
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Default response class of the app: JSONResponse rendered by dumps.
+
+    Routes returning dicts or models still go through FastAPI's response
+    model validation; only the final encoding is faster.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class ModelResponse(Response):
+    """
+    JSON response serialized straight from a pydantic model.
+
+    For routes that build their response model themselves: returning it
+    wrapped in a ModelResponse skips FastAPI re-validating the model and
+    converting it to a dict before encoding. Routes keep response_model
+    for the OpenAPI schema, and pass the status code and any headers here.
+    """
+    media_type = "application/json"
+
+    def __init__(self, model: BaseModel, status_code: int = 200,
+                 headers: Optional[Mapping[str, str]] = None):
+        super().__init__(model.model_dump_json(), status_code, headers)
+
+
+# Content codings the compression middleware marks on a strong ETag
+ETAG_ENCODINGS = ('gzip', 'br')
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Strong ETag for a representation determined entirely by parts.
+
+    The API version is mixed in, so a deployment that changes how
+    responses are built never matches tags handed out before it.
+    """
+    digest = hashlib.blake2b(repr((settings.API_VERSION,) + parts).encode(), digest_size=12)
+    return f'"{digest.hexdigest()}"'
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """The ETag of a representation after content coding, distinct from the identity one."""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header names this ETag.
+
+    Uses the weak comparison RFC 9110 asks for with If-None-Match, and
+    also accepts the tag as marked by content coding, since the client
+    holds whichever encoded form it was sent.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        candidate = candidate.removeprefix('W/')
+        if candidate == etag or any(candidate == encoded_etag(etag, encoding) for encoding in ETAG_ENCODINGS):
+            return True
+    return False
+
+
+def cache_headers(etag: str) -> dict:
+    """Headers letting clients keep a response but revalidate it on every use."""
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def not_modified(etag: str) -> Response:
+    """304 for a conditional GET whose copy is still current."""
+    return Response(status_code=304, headers=cache_headers(etag))
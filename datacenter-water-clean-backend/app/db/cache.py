@@ -0,0 +1,233 @@
+"""
+Cache of whole analyses by id, in front of AnalysisRepository.get.
+
+Documents are kept BSON-encoded: the encoded size is what the in-process
+backend bounds its memory by, a hit hands out a fresh copy callers may
+change freely, and the same bytes can be stored in a backend shared by
+several workers.
+"""
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import bson
+from bson.errors import BSONError
+
+from app.core.config import settings
+
+try:
+    from redis import asyncio as redis
+    from redis.exceptions import RedisError
+except ImportError:  # redis is optional; without it the cache is per worker
+    redis = None
+    RedisError = None
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    """Store of encoded documents by key, each kept for a limited time."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """The value stored under key, or None if it is missing or expired."""
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Store value under key for ttl seconds."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Drop the value stored under key, if any."""
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters the backend keeps itself, such as evictions."""
+        return {}
+
+    async def close(self) -> None:
+        """Release any connection held by the backend."""
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    CacheBackend in this process, bounded by entry count and by bytes.
+
+    Least recently used entries are evicted first once either bound is
+    exceeded. Expired entries are dropped when next looked up, or evicted
+    in their turn. All access happens on the event loop thread.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (value, monotonic expiry time), least recently used first
+        self.entries: OrderedDict[str, Tuple[bytes, float]] = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._remove(key)
+        if len(value) > self.max_bytes or self.max_entries <= 0:
+            return
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.size += len(value)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    CacheBackend in Redis, shared by every worker pointing at it.
+
+    Redis expires entries itself and evicts under its own maxmemory
+    policy, so evictions are not counted here. A Redis error is logged
+    and treated as a miss: the cache never fails a read.
+    """
+
+    def __init__(self, client, prefix: str = "analysis:"):
+        """
+        Args:
+            client: redis.asyncio.Redis client
+            prefix: Prepended to keys, to share a Redis database
+        """
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            return await self.client.get(self.prefix + key)
+        except RedisError as e:
+            self._failed("read", e)
+            return None
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        try:
+            await self.client.set(self.prefix + key, value, px=max(int(ttl * 1000), 1))
+        except RedisError as e:
+            self._failed("write", e)
+
+    async def delete(self, key: str) -> None:
+        try:
+            await self.client.delete(self.prefix + key)
+        except RedisError as e:
+            self._failed("delete", e)
+
+    def _failed(self, action: str, error: Exception) -> None:
+        self.errors += 1
+        logger.warning(f"Analysis cache {action} failed: {str(error)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"errors": self.errors}
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class DocumentCache:
+    """
+    Analyses by key, encoded into a CacheBackend, with hit and miss counters.
+
+    Counters are per process, also with a shared backend.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float):
+        """
+        Args:
+            backend: Where encoded documents are stored
+            ttl: Seconds an entry is served before it is read again
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """A fresh copy of the document cached under key, or None."""
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bson.decode(value)
+
+    async def put(self, key: str, document: Dict[str, Any]) -> None:
+        """Cache document under key; documents BSON cannot encode are not cached."""
+        try:
+            value = bson.encode(document)
+        except (BSONError, TypeError) as e:
+            logger.debug(f"Not caching analysis {key}: {str(e)}")
+            return
+        await self.backend.set(key, value, self.ttl)
+
+    async def delete(self, key: str) -> None:
+        """Forget the document cached under key."""
+        await self.backend.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hits, misses and hit ratio of this process, plus the backend's counters."""
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            **self.backend.stats()
+        }
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def create_document_cache() -> Optional[DocumentCache]:
+    """
+    DocumentCache as configured by the ANALYSIS_CACHE_* settings.
+
+    Returns None when ANALYSIS_CACHE_SIZE is 0. With ANALYSIS_CACHE_URL set
+    the entries live in Redis, shared by all workers; otherwise each worker
+    keeps its own LRU.
+
+    Raises:
+        RuntimeError: If ANALYSIS_CACHE_URL is set but redis is not installed
+    """
+    if settings.ANALYSIS_CACHE_SIZE <= 0:
+        return None
+    if settings.ANALYSIS_CACHE_URL:
+        if redis is None:
+            raise RuntimeError("ANALYSIS_CACHE_URL needs the redis package")
+        backend = RedisCacheBackend(redis.from_url(settings.ANALYSIS_CACHE_URL))
+    else:
+        backend = LRUCacheBackend(settings.ANALYSIS_CACHE_SIZE, settings.ANALYSIS_CACHE_MAX_BYTES)
+    return DocumentCache(backend, settings.ANALYSIS_CACHE_TTL)
@@ -1,28 +1,118 @@
-from mongoengine import connect, disconnect
-from app.core.config import settings
+from pymongo import AsyncMongoClient
+from pymongo.write_concern import WriteConcern
+from typing import Optional
+import asyncio
 import logging
 
+from app.core.config import settings
+from app.core.metrics import mongo_event_listeners
+from app.db.cache import DocumentCache, create_document_cache
+from app.db.readings import (
+    InMemoryReadingRepository,
+    MongoReadingRepository,
+    set_reading_repository
+)
+from app.db.rollups import ROLLUPS_COLLECTION
+from app.db.repository import (
+    VERSIONS_COLLECTION,
+    AnalysisRepository,
+    InMemoryAnalysisRepository,
+    MongoAnalysisRepository,
+    set_analysis_repository
+)
+from app.models.water_sample import WaterAnalysis
+
 logger = logging.getLogger(__name__)
 
+_async_client: Optional[AsyncMongoClient] = None
+_index_task: Optional[asyncio.Task] = None
+_document_cache: Optional[DocumentCache] = None
 
-def connect_to_mongo():
-    """Establish connection to MongoDB."""
-    try:
-        connect(
-            db=settings.MONGODB_DB_NAME,
-            host=settings.MONGODB_URL,
-            alias='default'
+
+def create_async_client() -> AsyncMongoClient:
+    """Create an asyncio MongoDB client with pool and timeout settings applied."""
+    return AsyncMongoClient(
+        settings.MONGODB_URL,
+        maxPoolSize=settings.MONGODB_MAX_POOL_SIZE,
+        minPoolSize=settings.MONGODB_MIN_POOL_SIZE,
+        connectTimeoutMS=settings.MONGODB_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=settings.MONGODB_SOCKET_TIMEOUT_MS,
+        event_listeners=mongo_event_listeners()
+    )
+
+
+def get_async_database():
+    """Return the application database on the shared async client."""
+    if _async_client is None:
+        raise RuntimeError("Async MongoDB client has not been opened")
+    return _async_client.get_database(
+        settings.MONGODB_DB_NAME,
+        write_concern=WriteConcern(
+            w=settings.mongodb_write_concern,
+            wtimeout=settings.MONGODB_WRITE_TIMEOUT_MS
         )
-        logger.info(f"Successfully connected to MongoDB: {settings.MONGODB_DB_NAME}")
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {str(e)}")
-        raise
+    )
 
 
-def close_mongo_connection():
-    """Close MongoDB connection."""
+async def _ensure_indexes(repository: AnalysisRepository) -> None:
+    """Build indexes in the background so startup never waits on MongoDB."""
     try:
-        disconnect(alias='default')
-        logger.info("MongoDB connection closed")
+        await repository.ensure_indexes()
+        logger.info("MongoDB indexes are up to date")
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        logger.error(f"Error closing MongoDB connection: {str(e)}")
+        logger.error(f"Failed to create MongoDB indexes: {str(e)}")
+
+
+async def open_analysis_repository() -> AnalysisRepository:
+    """
+    Create the configured AnalysisRepository and install it for the routes.
+    
+    The matching ReadingRepository for raw readings is installed alongside it.
+    """
+    global _async_client, _index_task, _document_cache
+    
+    _document_cache = create_document_cache()
+    if settings.ANALYSIS_REPOSITORY_BACKEND == "memory":
+        repository = InMemoryAnalysisRepository(cache=_document_cache)
+        set_reading_repository(InMemoryReadingRepository())
+        logger.info("Using in-memory analysis repository")
+    else:
+        _async_client = create_async_client()
+        database = get_async_database()
+        repository = MongoAnalysisRepository(
+            database.get_collection(WaterAnalysis._meta['collection']),
+            versions=database.get_collection(VERSIONS_COLLECTION),
+            rollups=database.get_collection(ROLLUPS_COLLECTION),
+            use_rollups=settings.STATS_FROM_ROLLUPS,
+            cache=_document_cache
+        )
+        _index_task = asyncio.create_task(_ensure_indexes(repository))
+        # The readings collection is created on first write
+        set_reading_repository(MongoReadingRepository(database))
+    
+    set_analysis_repository(repository)
+    return repository
+
+
+async def close_analysis_repository() -> None:
+    """Stop background work and close the async client and analysis cache."""
+    global _async_client, _index_task, _document_cache
+    
+    if _index_task is not None:
+        _index_task.cancel()
+        _index_task = None
+    set_analysis_repository(None)
+    set_reading_repository(None)
+    if _document_cache is not None:
+        await _document_cache.close()
+        _document_cache = None
+    if _async_client is not None:
+        try:
+            await _async_client.close()
+            logger.info("Async MongoDB client closed")
+        except Exception as e:
+            logger.error(f"Error closing async MongoDB client: {str(e)}")
+        _async_client = None
@@ -0,0 +1,257 @@
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+from pymongo import IndexModel
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from app.services.timeseries import EPOCH, NAT
+
+
+# Time-series collection holding the raw readings of analyses that kept them
+READINGS_COLLECTION = 'water_readings'
+
+# Chunks are measurements of a time-series collection: 'timestamp' is the
+# time field and 'meta' (site_name, analysis_id) the meta field, so the
+# chunks of one analysis share buckets. Chunks of a typical log span hours
+READINGS_TIMESERIES = {'timeField': 'timestamp', 'metaField': 'meta', 'granularity': 'hours'}
+
+# Raw readings as read back: (2, n) pH/TDS values, n timestamps or None
+Readings = Tuple[np.ndarray, Optional[np.ndarray]]
+
+# MongoDB error code for a collection created concurrently by another worker
+NAMESPACE_EXISTS = 48
+
+
+def encode_readings(values: np.ndarray, timestamps: Optional[np.ndarray], analysis_id: ObjectId,
+                    site_name: Optional[str], fallback_time: datetime, start_seq: int,
+                    chunk_size: int) -> List[Dict[str, Any]]:
+    """
+    Pack parsed readings into columnar chunk documents.
+
+    Each chunk stores up to chunk_size readings as little-endian float64
+    (pH, TDS) and int64 nanosecond (timestamps) byte strings, so 1M readings
+    are a few dozen documents of raw column bytes instead of a million small
+    documents. Rows are stored exactly as parsed, NaN and NAT included, so a
+    re-analysis sees the same rows as the upload did.
+
+    Args:
+        values: (2, n) pH and TDS readings
+        timestamps: n int64 nanosecond timestamps, or None for untimed files
+        analysis_id: Analysis the readings belong to
+        site_name: Site of the analysis, stored in the meta field
+        fallback_time: Chunk time for chunks without a usable timestamp
+        start_seq: Sequence number of the first chunk
+        chunk_size: Most readings per chunk
+
+    Returns:
+        Chunk documents in sequence order
+    """
+    meta = {'site_name': site_name, 'analysis_id': analysis_id}
+    chunks = []
+    total = values.shape[1]
+    for seq, start in enumerate(range(0, total, chunk_size), start_seq):
+        stop = min(start + chunk_size, total)
+        chunk = {
+            'timestamp': fallback_time,
+            'meta': meta,
+            'seq': seq,
+            'count': stop - start,
+            'ph': values[0, start:stop].astype('<f8').tobytes(),
+            'tds': values[1, start:stop].astype('<f8').tobytes(),
+        }
+        if timestamps is not None:
+            stamps = timestamps[start:stop]
+            chunk['timestamps'] = stamps.astype('<i8').tobytes()
+            stamped = stamps[stamps != NAT]
+            if len(stamped):
+                chunk['timestamp'] = EPOCH + timedelta(microseconds=int(stamped.min()) // 1000)
+        chunks.append(chunk)
+    return chunks
+
+
+def decode_readings(chunks: List[Dict[str, Any]]) -> Readings:
+    """
+    Reassemble the readings of one analysis from its chunk documents.
+
+    Chunks may arrive in any order; they are put back in sequence order.
+
+    Returns:
+        Tuple of ((2, n) values, n timestamps or None)
+    """
+    chunks = sorted(chunks, key=lambda chunk: chunk['seq'])
+    values = np.empty((2, sum(chunk['count'] for chunk in chunks)), dtype=np.float64)
+    timestamps = None
+    if chunks and 'timestamps' in chunks[0]:
+        timestamps = np.empty(values.shape[1], dtype=np.int64)
+    start = 0
+    for chunk in chunks:
+        stop = start + chunk['count']
+        values[0, start:stop] = np.frombuffer(chunk['ph'], dtype='<f8')
+        values[1, start:stop] = np.frombuffer(chunk['tds'], dtype='<f8')
+        if timestamps is not None:
+            timestamps[start:stop] = np.frombuffer(chunk['timestamps'], dtype='<i8')
+        start = stop
+    return values, timestamps
+
+
+class ReadingRepository(ABC):
+    """
+    Async storage interface for the raw readings of an analysis.
+
+    Readings are stored as the chunk documents built by encode_readings.
+    """
+
+    @abstractmethod
+    async def insert_chunks(self, chunks: List[Dict[str, Any]]) -> None:
+        """Store chunk documents; their order does not matter."""
+
+    @abstractmethod
+    async def load(self, analysis_id: str) -> Optional[Readings]:
+        """Read back all readings of an analysis, or None if none are stored."""
+
+    @abstractmethod
+    async def delete(self, analysis_id: str) -> int:
+        """Remove the readings of an analysis and return the chunks removed."""
+
+    async def close(self) -> None:
+        """Release any resources held by the backend."""
+
+
+class MongoReadingRepository(ReadingRepository):
+    """ReadingRepository backed by a MongoDB time-series collection."""
+
+    def __init__(self, database, name: str = READINGS_COLLECTION):
+        """
+        Args:
+            database: AsyncDatabase holding the readings collection
+            name: Collection name
+        """
+        self.database = database
+        self.collection = database.get_collection(name)
+        self._ready: Optional[asyncio.Future] = None
+
+    async def ensure_collection(self) -> None:
+        """
+        Create the time-series collection and its index, once per process.
+
+        Runs before the first write, because inserting into a missing
+        collection would create an ordinary one instead.
+        """
+        if self._ready is None:
+            self._ready = asyncio.ensure_future(self._create_collection())
+        try:
+            await asyncio.shield(self._ready)
+        except Exception:
+            # Let the next write try again
+            self._ready = None
+            raise
+
+    async def _create_collection(self) -> None:
+        try:
+            await self.database.create_collection(self.collection.name, timeseries=READINGS_TIMESERIES)
+        except CollectionInvalid:
+            pass
+        except OperationFailure as e:
+            if e.code != NAMESPACE_EXISTS:
+                raise
+        await self.collection.create_indexes([IndexModel([('meta.analysis_id', 1)])])
+
+    async def insert_chunks(self, chunks: List[Dict[str, Any]]) -> None:
+        if not chunks:
+            return
+        await self.ensure_collection()
+        # Unordered, so the server may apply the batch in parallel
+        await self.collection.insert_many(chunks, ordered=False)
+
+    async def load(self, analysis_id: str) -> Optional[Readings]:
+        cursor = self.collection.find({'meta.analysis_id': ObjectId(analysis_id)}, {'_id': 0, 'meta': 0})
+        # Sorted client-side: a server sort would have to buffer every chunk
+        chunks = await cursor.to_list()
+        return decode_readings(chunks) if chunks else None
+
+    async def delete(self, analysis_id: str) -> int:
+        result = await self.collection.delete_many({'meta.analysis_id': ObjectId(analysis_id)})
+        return result.deleted_count
+
+
+class InMemoryReadingRepository(ReadingRepository):
+    """ReadingRepository kept in a dict, for tests, benchmarks and local runs."""
+
+    def __init__(self):
+        self.chunks: Dict[ObjectId, List[Dict[str, Any]]] = {}
+
+    async def insert_chunks(self, chunks: List[Dict[str, Any]]) -> None:
+        for chunk in chunks:
+            self.chunks.setdefault(chunk['meta']['analysis_id'], []).append(dict(chunk))
+
+    async def load(self, analysis_id: str) -> Optional[Readings]:
+        chunks = self.chunks.get(ObjectId(analysis_id))
+        return decode_readings(chunks) if chunks else None
+
+    async def delete(self, analysis_id: str) -> int:
+        return len(self.chunks.pop(ObjectId(analysis_id), []))
+
+
+class ReadingWriter:
+    """
+    Stores the readings of one upload as its blocks are parsed.
+
+    Blocks are written as they arrive, so an upload never holds more than
+    the blocks in flight, and the chunk sequence follows file order.
+    """
+
+    def __init__(self, repository: ReadingRepository, analysis_id: ObjectId,
+                 site_name: Optional[str], uploaded_at: datetime, chunk_size: int):
+        """
+        Args:
+            repository: Where the chunks go
+            analysis_id: _id the analysis will be stored under
+            site_name: Site of the analysis
+            uploaded_at: Chunk time for readings without a timestamp
+            chunk_size: Most readings per chunk document
+        """
+        self.repository = repository
+        self.analysis_id = analysis_id
+        self.site_name = site_name
+        # Time-series fields are stored as naive UTC, like upload_timestamp
+        self.uploaded_at = uploaded_at.replace(tzinfo=None)
+        self.chunk_size = chunk_size
+        self.chunks = 0
+        self.count = 0
+
+    async def write(self, values: np.ndarray, timestamps: Optional[np.ndarray]) -> None:
+        """Store the next block of readings, in file order."""
+        chunks = encode_readings(values, timestamps, self.analysis_id, self.site_name,
+                                 self.uploaded_at, self.chunks, self.chunk_size)
+        await self.repository.insert_chunks(chunks)
+        self.chunks += len(chunks)
+        self.count += values.shape[1]
+
+    async def discard(self) -> None:
+        """Remove whatever was written, after a failed upload."""
+        if self.chunks:
+            await self.repository.delete(str(self.analysis_id))
+            self.chunks = self.count = 0
+
+
+_repository: Optional[ReadingRepository] = None
+
+
+def set_reading_repository(repository: Optional[ReadingRepository]) -> None:
+    """Install the repository used by the API routes."""
+    global _repository
+    _repository = repository
+
+
+def get_reading_repository() -> ReadingRepository:
+    """
+    FastAPI dependency returning the active ReadingRepository.
+
+    Tests can replace it with app.dependency_overrides.
+    """
+    if _repository is None:
+        raise RuntimeError("Reading repository has not been initialised")
+    return _repository
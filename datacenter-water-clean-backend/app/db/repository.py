@@ -0,0 +1,861 @@
+import base64
+import bisect
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import IndexModel, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+
+from app.db.cache import DocumentCache
+from app.db.rollups import (
+    ROLLED_UP_FIELDS,
+    ROLLUP_INDEXES,
+    cell_matches,
+    empty_totals,
+    read_rollup,
+    report_from_cells,
+    RollupKey,
+    document_totals,
+    extremes_updates,
+    merge_totals,
+    rollup_cells,
+    rollup_key,
+    rollup_pipeline,
+    rollup_query,
+    rollup_removals,
+    rollup_updates,
+    rollups_cover,
+    shape_totals,
+    stats_of_documents,
+    totals_group,
+    truncate_time
+)
+from app.models.analysis_result import HistoryFilters
+from app.models.water_sample import STATS_FIELDS, STATS_INDEX, WaterAnalysis
+
+logger = logging.getLogger(__name__)
+
+# Most recent first, matching WaterAnalysis.meta['ordering']; _id makes the
+# order total so a keyset cursor never skips or repeats a document
+HISTORY_SORT = [('upload_timestamp', -1), ('_id', -1)]
+
+# Position in HISTORY_SORT order: (upload_timestamp, _id) of the last item seen
+HistoryKey = Tuple[datetime, ObjectId]
+
+# Distinct filter combinations whose counts are cached before the cache resets
+COUNT_CACHE_SIZE = 256
+
+# MongoDB error code for a unique index violation
+DUPLICATE_KEY = 11000
+
+# MongoDB error code for, among others, a hint naming a missing index
+BAD_VALUE = 2
+
+# Query fields the covering stats index can serve
+STATS_COVERED_FILTERS = frozenset({'site_name', 'upload_timestamp'})
+
+# Collection holding the change counters of other collections, by name
+VERSIONS_COLLECTION = 'collection_versions'
+
+
+class DuplicateAnalysisError(Exception):
+    """An analysis with the same content hash and site, or idempotency key, is already stored."""
+
+
+def _upload_identity(document: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """Unique keys of a stored analysis, as declared on WaterAnalysis."""
+    keys = []
+    if document.get('content_hash') is not None:
+        keys.append(('content', (document['content_hash'], document.get('site_name'))))
+    if document.get('idempotency_key') is not None:
+        keys.append(('idempotency_key', document['idempotency_key']))
+    return keys
+
+
+def _as_stored(value: Any) -> Any:
+    """Copy of a value with datetimes in the naive UTC form MongoDB returns them in."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    if isinstance(value, dict):
+        return {key: _as_stored(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_as_stored(item) for item in value]
+    return value
+
+
+def history_key(document: Dict[str, Any]) -> HistoryKey:
+    """Sort key of a stored analysis in history order."""
+    return document['upload_timestamp'], document['_id']
+
+
+def encode_cursor(key: HistoryKey) -> str:
+    """Encode a history position as an opaque, URL-safe cursor."""
+    timestamp, analysis_id = key
+    payload = json.dumps([timestamp.isoformat(), str(analysis_id)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> HistoryKey:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, analysis_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), ObjectId(analysis_id)
+    except (ValueError, TypeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def filter_query(filters: Optional[HistoryFilters]) -> Dict[str, Any]:
+    """MongoDB query selecting the analyses that match the filters."""
+    if filters is None:
+        return {}
+    query = {}
+    for field in HistoryFilters.EQUALITY_FIELDS:
+        value = getattr(filters, field)
+        if value is not None:
+            query[field] = value
+    window = {}
+    if filters.start is not None:
+        window['$gte'] = filters.start
+    if filters.end is not None:
+        window['$lt'] = filters.end
+    if window:
+        query['upload_timestamp'] = window
+    return query
+
+
+def matches_filters(document: Dict[str, Any], filters: Optional[HistoryFilters]) -> bool:
+    """Evaluate filter_query(filters) against one stored document."""
+    if filters is None:
+        return True
+    for field in HistoryFilters.EQUALITY_FIELDS:
+        value = getattr(filters, field)
+        if value is not None and document.get(field) != value:
+            return False
+    timestamp = document['upload_timestamp']
+    if filters.start is not None and timestamp < filters.start:
+        return False
+    if filters.end is not None and timestamp >= filters.end:
+        return False
+    return True
+
+
+def _stats_shape(key_field: Optional[str]) -> Dict[str, Any]:
+    """$project stage turning the totals of totals_group into GroupStats fields, like shape_totals."""
+    shape = {
+        '_id': 0,
+        'analyses': 1,
+        'readings': 1,
+        'out_of_range_ratio': {'$cond': [
+            {'$gt': ['$classified', 0]}, {'$divide': ['$out_of_range', '$classified']}, None
+        ]}
+    }
+    for column in ('ph', 'tds'):
+        shape[column] = {
+            'mean': {'$divide': [f'${column}_total', '$readings']},
+            'min': f'${column}_min',
+            'max': f'${column}_max'
+        }
+    if key_field is not None:
+        shape[key_field] = '$_id'
+    return {'$project': shape}
+
+
+def _count_by(field: str) -> List[Dict[str, Any]]:
+    """Stages counting analyses per value of a field, most common first."""
+    return [
+        {'$match': {field: {'$ne': None}}},
+        {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+        {'$sort': {'count': -1, '_id': 1}}
+    ]
+
+
+def stats_pipeline(bucket: str, filters: Optional[HistoryFilters] = None) -> List[Dict[str, Any]]:
+    """
+    Aggregation pipeline reporting statistics of the matching analyses.
+
+    The analyses are narrowed to STATS_FIELDS straight after the match, so
+    the covering stats index can answer without fetching documents. A
+    single $facet then groups them overall, per site and per time bucket,
+    and counts treatments and dominant rules.
+
+    Args:
+        bucket: $dateTrunc unit of the time buckets: hour, day, week or month
+        filters: Only report analyses matching these filters
+    """
+    truncate = {'date': '$upload_timestamp', 'unit': bucket}
+    if bucket == 'week':
+        truncate['startOfWeek'] = 'monday'
+    return [
+        {'$match': filter_query(filters)},
+        {'$project': {'_id': 0, **{field: 1 for field in STATS_FIELDS}}},
+        {'$facet': {
+            'overall': [totals_group(None), _stats_shape(None)],
+            'sites': [totals_group('$site_name'), {'$sort': {'_id': 1}}, _stats_shape('site_name')],
+            'buckets': [totals_group({'$dateTrunc': truncate}), {'$sort': {'_id': 1}}, _stats_shape('start')],
+            'treatments': _count_by('treatment_train'),
+            'dominant_rules': _count_by('dominant_rule')
+        }}
+    ]
+
+
+def _normalise_filters(filters: Optional[HistoryFilters]) -> Optional[HistoryFilters]:
+    """Treat filters with nothing set as no filters."""
+    if filters is None or filters.is_empty():
+        return None
+    return filters
+
+
+class AnalysisRepository(ABC):
+    """
+    Async storage interface for water analyses.
+
+    Documents are plain dictionaries in their stored (BSON) shape, with the
+    ObjectId under '_id'. Use WaterAnalysis(...).to_mongo() to build one.
+    """
+
+    def __init__(self, cache: Optional[DocumentCache] = None):
+        """
+        Args:
+            cache: Cache of analyses by id for cached_get(); None reads
+                every analysis from the backend
+        """
+        self.cache = cache
+        # filters -> (total, monotonic time it was counted) for cached_count()
+        self._cached_counts: Dict[Optional[HistoryFilters], Tuple[int, float]] = {}
+        # (change counter, monotonic time it was read) for change_version();
+        # a local counter starts from the clock so restarts never reuse one
+        self._version: Tuple[int, float] = (time.time_ns(), float('-inf'))
+        # Whether stats() may compose reports from the rollup cells
+        self.use_rollups = False
+
+    @abstractmethod
+    async def insert(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Store a new analysis and return it with its '_id' set.
+
+        Raises:
+            DuplicateAnalysisError: If its content hash and site, or its
+                idempotency key, belong to a stored analysis
+        """
+
+    @abstractmethod
+    async def insert_many(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Store new analyses, which must have their '_id' set, in one bulk write.
+
+        Documents that would raise DuplicateAnalysisError in insert() are
+        skipped rather than failing the others.
+
+        Returns:
+            The documents that were stored, in the order given
+        """
+
+    @abstractmethod
+    async def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch one analysis, or None if it does not exist."""
+
+    async def cached_get(self, analysis_id: str, ttl: float) -> Optional[Dict[str, Any]]:
+        """
+        Fetch one analysis like get(), served from the cache when there is one.
+
+        Entries are keyed by analysis id, and update() drops the entry of
+        the analysis it changes, so with a cache shared by all workers an
+        update is seen by every worker at once. A per-worker cache only
+        learns of another worker's update when the entry expires. Missing
+        analyses are not cached.
+        """
+        if self.cache is None:
+            return await self.get(analysis_id)
+        document = await self.cache.get(analysis_id)
+        if document is None:
+            document = await self.get(analysis_id)
+            if document is not None:
+                await self.cache.put(analysis_id, document)
+        return document
+
+    @abstractmethod
+    async def get_by_content(self, content_hash: str, site_name: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Fetch the analysis of an identical file uploaded for the same site, if any."""
+
+    @abstractmethod
+    async def get_by_idempotency_key(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        """Fetch the analysis stored under an Idempotency-Key, if any."""
+
+    @abstractmethod
+    async def list(self, limit: int, offset: int = 0,
+                   after: Optional[HistoryKey] = None,
+                   fields: Optional[Sequence[str]] = None,
+                   filters: Optional[HistoryFilters] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch a page of analyses, most recent first.
+
+        Args:
+            limit: Maximum number of analyses
+            offset: Number of analyses to skip; cost grows with the offset
+            after: Keyset position; only analyses after it in history order
+                are returned, at the same cost for every page
+            fields: Stored fields to return besides '_id'; None returns all
+            filters: Only return analyses matching these filters
+        """
+
+    @abstractmethod
+    def iter_batches(self, batch_size: int,
+                     filters: Optional[HistoryFilters] = None,
+                     fields: Optional[Sequence[str]] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream every matching analysis, most recent first, in batches.
+
+        Only one batch is held at a time, so memory stays bounded however
+        many analyses match.
+
+        Args:
+            batch_size: Analyses per yielded list, and per database round trip
+            filters: Only return analyses matching these filters
+            fields: Stored fields to return besides '_id'; None returns all
+        """
+
+    @abstractmethod
+    async def update(self, analysis_id: str, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Set stored fields and return the updated analysis, or None if missing."""
+
+    async def update_notes(self, analysis_id: str, user_notes: str) -> Optional[Dict[str, Any]]:
+        """Set user_notes and return the updated analysis, or None if missing."""
+        return await self.update(analysis_id, {'user_notes': user_notes})
+
+    @abstractmethod
+    async def count(self, filters: Optional[HistoryFilters] = None) -> int:
+        """Count analyses matching the filters exactly."""
+
+    async def stats(self, bucket: str, filters: Optional[HistoryFilters] = None,
+                    allow_disk_use: bool = True) -> Dict[str, Any]:
+        """
+        Aggregate statistics of the matching analyses.
+
+        Composed from the site and day rollup cells when the repository
+        serves reports from them and the bucket and filters fall on whole
+        cells (see rollups_cover); aggregated from the analyses otherwise.
+
+        Args:
+            bucket: Width of the time buckets: hour, day, week or month
+            filters: Only report analyses matching these filters
+            allow_disk_use: Let the database spill grouping state to disk
+                rather than fail on a very large collection
+
+        Returns:
+            AnalysisStatsResponse fields other than bucket: overall, sites
+            and buckets statistics (see shape_totals), and treatments and
+            dominant_rules counts, most common first
+        """
+        filters = _normalise_filters(filters)
+        if self.use_rollups and rollups_cover(bucket, filters):
+            return report_from_cells(await self.read_rollups(filters), bucket)
+        return await self.aggregate_stats(bucket, filters, allow_disk_use)
+
+    @abstractmethod
+    async def aggregate_stats(self, bucket: str, filters: Optional[HistoryFilters] = None,
+                              allow_disk_use: bool = True) -> Dict[str, Any]:
+        """Statistics as stats() reports them, always aggregated from the analyses."""
+
+    @abstractmethod
+    async def read_rollups(self, filters: Optional[HistoryFilters] = None) -> List[Tuple[RollupKey, Dict[str, Any]]]:
+        """Keys and totals of the rollup cells matching filters that rollups_cover."""
+
+    @abstractmethod
+    async def rebuild_rollups(self) -> int:
+        """
+        Recompute every rollup cell from the analyses.
+
+        For backfills, and after analyses were written without maintaining
+        the rollups. Analyses stored while a rebuild runs may be missed.
+
+        Returns:
+            Number of cells
+        """
+
+    async def estimated_count(self, filters: Optional[HistoryFilters] = None) -> int:
+        """
+        Approximate number of analyses, from metadata where the backend has it.
+
+        Metadata only covers the whole collection, so filtered counts are exact.
+        """
+        return await self.count(filters)
+
+    async def cached_count(self, ttl: float, filters: Optional[HistoryFilters] = None) -> int:
+        """
+        Exact count, reused for up to ttl seconds per filter combination.
+
+        The cache is dropped whenever this repository inserts an analysis, so
+        a worker always sees its own uploads; uploads handled by other workers
+        show up once the entry expires.
+        """
+        filters = _normalise_filters(filters)
+        now = time.monotonic()
+        cached = self._cached_counts.get(filters)
+        if cached is not None and now - cached[1] < ttl:
+            return cached[0]
+        total = await self.count(filters)
+        if len(self._cached_counts) >= COUNT_CACHE_SIZE:
+            self._cached_counts.clear()
+        self._cached_counts[filters] = (total, now)
+        return total
+
+    def invalidate_count(self) -> None:
+        """Forget cached counts after the collection changed."""
+        self._cached_counts.clear()
+
+    async def change_version(self, ttl: float) -> int:
+        """
+        Counter that moves forward with every write to the analyses.
+
+        Cheap enough to check before every read, to tell whether anything
+        may have changed. This instance's own writes show at once; the
+        shared counter of other workers' writes is re-read at most every
+        ttl seconds, so their changes show within ttl.
+        """
+        version, read_at = self._version
+        now = time.monotonic()
+        if now - read_at >= ttl:
+            version = await self.read_version()
+            self._version = (version, now)
+        return version
+
+    async def read_version(self) -> int:
+        """Current change counter of the backend; this instance's own by default."""
+        return self._version[0]
+
+    async def record_change(self) -> None:
+        """Note a write: forget cached counts and move the change counter on."""
+        self.invalidate_count()
+        self._version = (self._version[0] + 1, time.monotonic())
+
+    async def record_update(self, analysis_id: str) -> None:
+        """Note an update to one analysis: drop its cache entry and record the change."""
+        if self.cache is not None:
+            await self.cache.delete(analysis_id)
+        await self.record_change()
+
+    async def ensure_indexes(self) -> None:
+        """Create the indexes declared on WaterAnalysis, where applicable."""
+
+    async def close(self) -> None:
+        """Release any resources held by the backend."""
+
+
+class MongoAnalysisRepository(AnalysisRepository):
+    """AnalysisRepository backed by PyMongo's native asyncio driver."""
+
+    def __init__(self, collection, versions=None, rollups=None, use_rollups: bool = False,
+                 cache: Optional[DocumentCache] = None):
+        """
+        Args:
+            collection: AsyncCollection for WaterAnalysis documents
+            versions: AsyncCollection of change counters shared by all
+                workers; without it the change counter is per process
+            rollups: AsyncCollection of site and day rollup cells, kept up
+                to date as analyses are written; None maintains none
+            use_rollups: Compose stats reports from the rollup cells; only
+                once they were rebuilt to cover analyses stored before them
+            cache: Cache of analyses by id for cached_get()
+        """
+        super().__init__(cache)
+        self.collection = collection
+        self.versions = versions
+        self.rollups = rollups
+        self.use_rollups = use_rollups and rollups is not None
+
+    async def insert(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            result = await self.collection.insert_one(document)
+        except DuplicateKeyError as e:
+            raise DuplicateAnalysisError(str(e)) from e
+        document['_id'] = result.inserted_id
+        await self.roll_up([document])
+        await self.record_change()
+        return document
+
+    async def insert_many(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not documents:
+            return []
+        stored = []
+        try:
+            # Unordered, so one duplicate does not stop the rest of the batch
+            await self.collection.insert_many(documents, ordered=False)
+            stored = documents
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            skipped = {error['index'] for error in errors}
+            stored = [document for index, document in enumerate(documents) if index not in skipped]
+            if any(error['code'] != DUPLICATE_KEY for error in errors):
+                raise
+        finally:
+            await self.roll_up(stored)
+            await self.record_change()
+        return stored
+
+    async def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({'_id': ObjectId(analysis_id)})
+
+    async def get_by_content(self, content_hash: str, site_name: Optional[str]) -> Optional[Dict[str, Any]]:
+        # site_name None matches analyses without a site, like the unique index
+        return await self.collection.find_one({'content_hash': content_hash, 'site_name': site_name})
+
+    async def get_by_idempotency_key(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({'idempotency_key': idempotency_key})
+
+    async def list(self, limit: int, offset: int = 0,
+                   after: Optional[HistoryKey] = None,
+                   fields: Optional[Sequence[str]] = None,
+                   filters: Optional[HistoryFilters] = None) -> List[Dict[str, Any]]:
+        query = filter_query(filters)
+        if after is not None:
+            timestamp, analysis_id = after
+            query['$or'] = [
+                {'upload_timestamp': {'$lt': timestamp}},
+                {'upload_timestamp': timestamp, '_id': {'$lt': analysis_id}}
+            ]
+        projection = dict.fromkeys(fields, 1) if fields is not None else None
+        cursor = self.collection.find(query, projection).sort(HISTORY_SORT)
+        if offset:
+            cursor = cursor.skip(offset)
+        return await cursor.limit(limit).to_list(length=limit)
+
+    async def iter_batches(self, batch_size: int,
+                           filters: Optional[HistoryFilters] = None,
+                           fields: Optional[Sequence[str]] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        projection = dict.fromkeys(fields, 1) if fields is not None else None
+        cursor = self.collection.find(filter_query(filters), projection)
+        cursor = cursor.sort(HISTORY_SORT).batch_size(batch_size)
+        try:
+            batch = []
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            # Release the server-side cursor if the client stops reading early
+            await cursor.close()
+
+    async def update(self, analysis_id: str, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Changed figures are moved out of the cell of the analysis as it was
+        rolled_up = self.rollups is not None and bool(ROLLED_UP_FIELDS.intersection(changes))
+        document = await self.collection.find_one_and_update(
+            {'_id': ObjectId(analysis_id)},
+            {'$set': changes},
+            return_document=ReturnDocument.BEFORE if rolled_up else ReturnDocument.AFTER
+        )
+        if document is None:
+            return None
+        if rolled_up:
+            before, document = document, {**document, **changes}
+            await self.move_rollups(before, document)
+        await self.record_update(analysis_id)
+        return document
+
+    async def roll_up(self, documents: List[Dict[str, Any]]) -> None:
+        """
+        Add newly stored analyses into their rollup cells.
+
+        One $inc/$min/$max upsert per cell, so concurrent workers never
+        overwrite each other's totals. A failure is logged rather than
+        raised, as the analyses are stored; rebuild_rollups repairs it.
+        """
+        if self.rollups is None or not documents:
+            return
+        try:
+            await self.rollups.bulk_write(rollup_updates(rollup_cells(documents)), ordered=False)
+        except PyMongoError as e:
+            logger.error(f"Failed to update {self.rollups.name}, rebuild it to repair: {str(e)}")
+
+    async def move_rollups(self, before: Dict[str, Any], after: Dict[str, Any]) -> None:
+        """
+        Move an analysis whose figures changed from its cell as it was to its cell as it is.
+
+        Totals are subtracted and added with $inc, so inserts into the same
+        cells by other workers are never lost, and cells left without
+        analyses are dropped. Extremes cannot be subtracted: those of the
+        site and day are recomputed and set on the cells still counting
+        the analyses they were computed from. A failure is logged rather
+        than raised, as the analysis is updated; rebuild_rollups repairs it.
+        """
+        day = truncate_time(before['upload_timestamp'], 'day')
+        site = {'site_name': before.get('site_name')}
+        try:
+            # Ordered, so a cell the analysis stays in is taken out before it is added back
+            await self.rollups.bulk_write(
+                rollup_removals(rollup_cells([before])) + rollup_updates(rollup_cells([after]))
+            )
+            await self.rollups.delete_many({**site, 'day': day, 'analyses': {'$lte': 0}})
+            match = {**site, 'upload_timestamp': {'$gte': day, '$lt': day + timedelta(days=1)}}
+            cursor = await self._aggregate_covered(rollup_pipeline(match), allowDiskUse=True)
+            cells = dict(read_rollup(cell) for cell in await cursor.to_list())
+            if cells:
+                await self.rollups.bulk_write(extremes_updates(cells), ordered=False)
+        except PyMongoError as e:
+            logger.error(f"Failed to update {self.rollups.name}, rebuild it to repair: {str(e)}")
+
+    async def read_rollups(self, filters: Optional[HistoryFilters] = None) -> List[Tuple[RollupKey, Dict[str, Any]]]:
+        cursor = self.rollups.find(rollup_query(filters), {'_id': 0})
+        return [read_rollup(document) for document in await cursor.to_list()]
+
+    async def rebuild_rollups(self) -> int:
+        # $out swaps the rebuilt cells in at once and keeps the unique index
+        pipeline = rollup_pipeline() + [{'$out': self.rollups.name}]
+        cursor = await self._aggregate_covered(pipeline, allowDiskUse=True)
+        await cursor.to_list()
+        return await self.rollups.count_documents({})
+
+    async def _aggregate_covered(self, pipeline: List[Dict[str, Any]], **options):
+        """
+        Run an aggregation reading only STATS_FIELDS on the covering stats index.
+
+        Without the hint the planner scans the collection for an empty
+        match and prefers the history indexes for site or time filters.
+        """
+        try:
+            return await self.collection.aggregate(pipeline, hint=STATS_INDEX, **options)
+        except OperationFailure as e:
+            if e.code != BAD_VALUE:
+                raise
+            # The covering index is still being built
+            return await self.collection.aggregate(pipeline, **options)
+
+    async def read_version(self) -> int:
+        if self.versions is None:
+            return await super().read_version()
+        counter = await self.versions.find_one({'_id': self.collection.name})
+        if counter is None:
+            return 0
+        return counter['version']
+
+    async def record_change(self) -> None:
+        if self.versions is None:
+            return await super().record_change()
+        self.invalidate_count()
+        counter = await self.versions.find_one_and_update(
+            {'_id': self.collection.name},
+            {'$inc': {'version': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._version = (counter['version'], time.monotonic())
+
+    async def count(self, filters: Optional[HistoryFilters] = None) -> int:
+        return await self.collection.count_documents(filter_query(filters))
+
+    async def aggregate_stats(self, bucket: str, filters: Optional[HistoryFilters] = None,
+                              allow_disk_use: bool = True) -> Dict[str, Any]:
+        pipeline = stats_pipeline(bucket, filters)
+        if set(pipeline[0]['$match']) <= STATS_COVERED_FILTERS:
+            cursor = await self._aggregate_covered(pipeline, allowDiskUse=allow_disk_use)
+        else:
+            cursor = await self.collection.aggregate(pipeline, allowDiskUse=allow_disk_use)
+        [facets] = await cursor.to_list()
+        return {
+            'overall': facets['overall'][0] if facets['overall'] else shape_totals(empty_totals()),
+            'sites': facets['sites'],
+            'buckets': facets['buckets'],
+            'treatments': {count['_id']: count['count'] for count in facets['treatments']},
+            'dominant_rules': {count['_id']: count['count'] for count in facets['dominant_rules']}
+        }
+
+    async def estimated_count(self, filters: Optional[HistoryFilters] = None) -> int:
+        if _normalise_filters(filters) is not None:
+            return await self.count(filters)
+        # Reads the collection metadata instead of scanning an index
+        return await self.collection.estimated_document_count()
+
+    async def ensure_indexes(self) -> None:
+        """Create the indexes declared in WaterAnalysis.meta."""
+        indexes = []
+        for spec in WaterAnalysis._meta['index_specs']:
+            options = {key: value for key, value in spec.items() if key != 'fields'}
+            indexes.append(IndexModel(spec['fields'], **options))
+        if indexes:
+            await self.collection.create_indexes(indexes)
+        if self.rollups is not None:
+            await self.rollups.create_indexes(ROLLUP_INDEXES)
+
+
+class InMemoryAnalysisRepository(AnalysisRepository):
+    """AnalysisRepository kept in a dict, for tests, benchmarks and local runs."""
+
+    def __init__(self, cache: Optional[DocumentCache] = None):
+        super().__init__(cache)
+        self.documents: Dict[ObjectId, Dict[str, Any]] = {}
+        # History keys in ascending order; history is read from the end
+        self.order: List[HistoryKey] = []
+        # Unique upload keys (see _upload_identity) -> _id
+        self.identities: Dict[Tuple[str, Any], ObjectId] = {}
+        # Rollup cells, maintained from the first insert so always complete
+        self.rollups: Dict[RollupKey, Dict[str, Any]] = {}
+        self.use_rollups = True
+
+    async def insert(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        identity = _upload_identity(document)
+        if any(key in self.identities for key in identity):
+            raise DuplicateAnalysisError("An identical upload is already stored")
+        document.setdefault('_id', ObjectId())
+        # Stored as MongoDB would, so filters and exports compare naive UTC times
+        stored = _as_stored(document)
+        self.documents[document['_id']] = stored
+        bisect.insort(self.order, history_key(stored))
+        self.identities.update((key, document['_id']) for key in identity)
+        key = rollup_key(stored)
+        if key in self.rollups:
+            merge_totals(self.rollups[key], document_totals(stored))
+        else:
+            self.rollups[key] = document_totals(stored)
+        await self.record_change()
+        return document
+
+    async def insert_many(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        stored = []
+        for document in documents:
+            try:
+                stored.append(await self.insert(document))
+            except DuplicateAnalysisError:
+                continue
+        return stored
+
+    async def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        document = self.documents.get(ObjectId(analysis_id))
+        return dict(document) if document is not None else None
+
+    def _get_by_identity(self, key: Tuple[str, Any]) -> Optional[Dict[str, Any]]:
+        analysis_id = self.identities.get(key)
+        return dict(self.documents[analysis_id]) if analysis_id is not None else None
+
+    async def get_by_content(self, content_hash: str, site_name: Optional[str]) -> Optional[Dict[str, Any]]:
+        return self._get_by_identity(('content', (content_hash, site_name)))
+
+    async def get_by_idempotency_key(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        return self._get_by_identity(('idempotency_key', idempotency_key))
+
+    async def list(self, limit: int, offset: int = 0,
+                   after: Optional[HistoryKey] = None,
+                   fields: Optional[Sequence[str]] = None,
+                   filters: Optional[HistoryFilters] = None) -> List[Dict[str, Any]]:
+        end = len(self.order) if after is None else bisect.bisect_left(self.order, after)
+        filters = _normalise_filters(filters)
+        if filters is None:
+            end = max(end - offset, 0)
+            keys = self.order[max(end - limit, 0):end]
+            documents = [self.documents[analysis_id] for _, analysis_id in reversed(keys)]
+        else:
+            documents = self._scan(end, offset, limit, filters)
+        return [self._project(doc, fields) for doc in documents]
+
+    async def iter_batches(self, batch_size: int,
+                           filters: Optional[HistoryFilters] = None,
+                           fields: Optional[Sequence[str]] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        filters = _normalise_filters(filters)
+        batch = []
+        # Snapshot the order so inserts made while the caller is suspended are safe
+        for _, analysis_id in reversed(self.order[:]):
+            document = self.documents[analysis_id]
+            if not matches_filters(document, filters):
+                continue
+            batch.append(self._project(document, fields))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _project(document: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+        """Copy of a stored document limited to '_id' and the given fields."""
+        if fields is None:
+            return dict(document)
+        return {key: document[key] for key in ('_id', *fields) if key in document}
+
+    def _scan(self, end: int, offset: int, limit: int,
+              filters: HistoryFilters) -> List[Dict[str, Any]]:
+        """Walk history backwards from position end, collecting matching documents."""
+        documents = []
+        for position in range(end - 1, -1, -1):
+            document = self.documents[self.order[position][1]]
+            if not matches_filters(document, filters):
+                continue
+            if offset:
+                offset -= 1
+                continue
+            documents.append(document)
+            if len(documents) == limit:
+                break
+        return documents
+
+    async def update(self, analysis_id: str, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        document = self.documents.get(ObjectId(analysis_id))
+        if document is None:
+            return None
+        document.update(_as_stored(changes))
+        if ROLLED_UP_FIELDS.intersection(changes):
+            self._refresh_rollups(document)
+        await self.record_update(analysis_id)
+        return dict(document)
+
+    def _refresh_rollups(self, changed: Dict[str, Any]) -> None:
+        """Recompute the cells of the site and day of a changed analysis."""
+        site_name, day = changed.get('site_name'), truncate_time(changed['upload_timestamp'], 'day')
+        for key in [key for key in self.rollups if key[:2] == (site_name, day)]:
+            del self.rollups[key]
+        self.rollups.update(rollup_cells(
+            doc for doc in self.documents.values() if rollup_key(doc)[:2] == (site_name, day)
+        ))
+
+    async def count(self, filters: Optional[HistoryFilters] = None) -> int:
+        filters = _normalise_filters(filters)
+        if filters is None:
+            return len(self.documents)
+        return sum(matches_filters(doc, filters) for doc in self.documents.values())
+
+    async def aggregate_stats(self, bucket: str, filters: Optional[HistoryFilters] = None,
+                              allow_disk_use: bool = True) -> Dict[str, Any]:
+        filters = _normalise_filters(filters)
+        return stats_of_documents(
+            [doc for doc in self.documents.values() if matches_filters(doc, filters)], bucket
+        )
+
+    async def read_rollups(self, filters: Optional[HistoryFilters] = None) -> List[Tuple[RollupKey, Dict[str, Any]]]:
+        return [(key, totals) for key, totals in self.rollups.items() if cell_matches(key, filters)]
+
+    async def rebuild_rollups(self) -> int:
+        self.rollups = rollup_cells(self.documents.values())
+        return len(self.rollups)
+
+
+_repository: Optional[AnalysisRepository] = None
+
+
+def set_analysis_repository(repository: Optional[AnalysisRepository]) -> None:
+    """Install the repository used by the API routes."""
+    global _repository
+    _repository = repository
+
+
+def get_analysis_repository() -> AnalysisRepository:
+    """
+    FastAPI dependency returning the active AnalysisRepository.
+
+    Tests can replace it with app.dependency_overrides.
+    """
+    if _repository is None:
+        raise RuntimeError("Analysis repository has not been initialised")
+    return _repository
@@ -0,0 +1,345 @@
+"""
+Per site and day totals of the stored analyses, kept for the /stats report.
+
+A rollup cell holds the sums, minima and maxima the stats aggregation
+groups analyses into, for the analyses of one site and UTC day that share a
+treatment and dominant rule. Keeping the treatment and rule in the key
+rather than counting them in a sub-document means user-visible strings
+never become field names, and a cell is exactly one $group result, so the
+whole collection can be rebuilt by a single aggregation.
+
+The repository upserts cells as analyses are stored, and a report over
+whole days is then composed from O(days x sites) cells rather than the
+analyses themselves.
+
+Rebuild the collection from the analyses (for a backfill, or after writes
+made while rollups were not maintained) with:
+    python -m app.db.rollups
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pymongo import AsyncMongoClient, IndexModel, UpdateOne
+
+from app.core.config import settings
+from app.models.analysis_result import HistoryFilters
+from app.models.water_sample import STATS_FIELDS, WaterAnalysis
+
+
+ROLLUPS_COLLECTION = 'site_daily_rollups'
+
+# Fields identifying a cell; null for analyses without a site or dominant rule
+ROLLUP_KEY = ('site_name', 'day', 'treatment_train', 'dominant_rule')
+
+RollupKey = Tuple[Optional[str], datetime, Optional[str], Optional[str]]
+
+# Totals added up across analyses, and extremes kept with $min/$max
+SUMMED_TOTALS = ('analyses', 'readings', 'classified', 'out_of_range', 'ph_total', 'tds_total')
+EXTREME_TOTALS = {'ph_min': min, 'ph_max': max, 'tds_min': min, 'tds_max': max}
+
+# Stored fields that change a cell; the rest of STATS_FIELDS place it
+ROLLED_UP_FIELDS = frozenset(STATS_FIELDS) - {'site_name', 'upload_timestamp'}
+
+# Filters a report composed from cells can apply: fields in the key, and
+# time windows that start and end on a day boundary
+ROLLUP_FILTERS = frozenset({'site_name', 'treatment_train', 'start', 'end'})
+ROLLUP_BUCKETS = frozenset({'day', 'week', 'month'})
+
+ROLLUP_INDEXES = [IndexModel([(field, 1) for field in ROLLUP_KEY], unique=True)]
+
+
+def truncate_time(timestamp: datetime, unit: str) -> datetime:
+    """Start of the hour, day, week (from Monday) or month containing timestamp, as $dateTrunc computes it."""
+    if unit == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if unit == 'week':
+        return day - timedelta(days=day.weekday())
+    if unit == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def totals_group(key: Any) -> Dict[str, Any]:
+    """$group stage summing up the analyses that share a key into cell totals."""
+    group = {
+        '_id': key,
+        'analyses': {'$sum': 1},
+        'readings': {'$sum': '$row_count'},
+        # Analyses stored before readings were classified have no fraction
+        'classified': {'$sum': {'$cond': [{'$isNumber': '$out_of_range_fraction'}, '$row_count', 0]}},
+        'out_of_range': {'$sum': {'$multiply': [{'$ifNull': ['$out_of_range_fraction', 0]}, '$row_count']}}
+    }
+    for column in ('ph', 'tds'):
+        group[f'{column}_total'] = {'$sum': {'$multiply': [f'$avg_{column}', '$row_count']}}
+        group[f'{column}_min'] = {'$min': {'$ifNull': [f'$min_{column}', f'$avg_{column}']}}
+        group[f'{column}_max'] = {'$max': {'$ifNull': [f'$max_{column}', f'$avg_{column}']}}
+    return {'$group': group}
+
+
+def empty_totals() -> Dict[str, Any]:
+    """Totals of no analyses."""
+    return {**{field: 0 for field in SUMMED_TOTALS}, **{field: None for field in EXTREME_TOTALS}}
+
+
+def _coalesce(*values: Any) -> Any:
+    """First value that is not None, like $ifNull."""
+    return next((value for value in values if value is not None), None)
+
+
+def document_totals(document: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Totals of one stored analysis, as totals_group computes them.
+
+    Missing fields count as MongoDB counts them: not at all.
+    """
+    rows = document.get('row_count', 0)
+    fraction = document.get('out_of_range_fraction')
+    totals = {
+        'analyses': 1,
+        'readings': rows,
+        'classified': rows if fraction is not None else 0,
+        'out_of_range': (fraction or 0) * rows
+    }
+    for column in ('ph', 'tds'):
+        average = document.get(f'avg_{column}')
+        totals[f'{column}_total'] = average * rows if average is not None else 0
+        totals[f'{column}_min'] = _coalesce(document.get(f'min_{column}'), average)
+        totals[f'{column}_max'] = _coalesce(document.get(f'max_{column}'), average)
+    return totals
+
+
+def merge_totals(totals: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    """Add other's totals into totals, in place, and return it."""
+    for field in SUMMED_TOTALS:
+        totals[field] += other[field]
+    for field, pick in EXTREME_TOTALS.items():
+        values = [value for value in (totals[field], other[field]) if value is not None]
+        totals[field] = pick(values) if values else None
+    return totals
+
+
+def shape_totals(totals: Dict[str, Any]) -> Dict[str, Any]:
+    """GroupStats fields of some totals."""
+    readings, classified = totals['readings'], totals['classified']
+    stats = {
+        'analyses': totals['analyses'],
+        'readings': readings,
+        'out_of_range_ratio': totals['out_of_range'] / classified if classified else None
+    }
+    for column in ('ph', 'tds'):
+        stats[column] = {
+            'mean': totals[f'{column}_total'] / readings if readings else None,
+            'min': totals[f'{column}_min'],
+            'max': totals[f'{column}_max']
+        }
+    return stats
+
+
+def rollup_key(document: Dict[str, Any], unit: str = 'day') -> RollupKey:
+    """Cell of a stored analysis; unit narrows cells to hours for reports by the hour."""
+    return (
+        document.get('site_name'),
+        truncate_time(document['upload_timestamp'], unit),
+        document.get('treatment_train'),
+        document.get('dominant_rule')
+    )
+
+
+def rollup_cells(documents: Iterable[Dict[str, Any]], unit: str = 'day') -> Dict[RollupKey, Dict[str, Any]]:
+    """Cells of some stored analyses."""
+    cells: Dict[RollupKey, Dict[str, Any]] = {}
+    for document in documents:
+        key = rollup_key(document, unit)
+        totals = document_totals(document)
+        if key in cells:
+            merge_totals(cells[key], totals)
+        else:
+            cells[key] = totals
+    return cells
+
+
+def rollup_updates(cells: Dict[RollupKey, Dict[str, Any]]) -> List[UpdateOne]:
+    """Upserts adding cells into the rollup collection."""
+    return [
+        UpdateOne(
+            dict(zip(ROLLUP_KEY, key)),
+            {
+                '$inc': {field: totals[field] for field in SUMMED_TOTALS},
+                '$min': {field: totals[field] for field, pick in EXTREME_TOTALS.items() if pick is min},
+                '$max': {field: totals[field] for field, pick in EXTREME_TOTALS.items() if pick is max}
+            },
+            upsert=True
+        )
+        for key, totals in cells.items()
+    ]
+
+
+def rollup_removals(cells: Dict[RollupKey, Dict[str, Any]]) -> List[UpdateOne]:
+    """Updates taking cells back out of the rollup collection; extremes cannot be, and are left."""
+    return [
+        UpdateOne(dict(zip(ROLLUP_KEY, key)), {'$inc': {field: -totals[field] for field in SUMMED_TOTALS}})
+        for key, totals in cells.items()
+    ]
+
+
+def extremes_updates(cells: Dict[RollupKey, Dict[str, Any]]) -> List[UpdateOne]:
+    """
+    Updates setting the extremes of recomputed cells.
+
+    Each applies only while the stored cell counts as many analyses as it
+    was recomputed from, so extremes an insert added meanwhile are kept.
+    """
+    return [
+        UpdateOne(
+            {**dict(zip(ROLLUP_KEY, key)), 'analyses': totals['analyses']},
+            {'$set': {field: totals[field] for field in EXTREME_TOTALS}}
+        )
+        for key, totals in cells.items()
+    ]
+
+
+def read_rollup(document: Dict[str, Any]) -> Tuple[RollupKey, Dict[str, Any]]:
+    """Key and totals of a stored cell."""
+    key = tuple(document.get(field) for field in ROLLUP_KEY)
+    totals = {field: document[field] for field in SUMMED_TOTALS}
+    totals.update((field, document.get(field)) for field in EXTREME_TOTALS)
+    return key, totals
+
+
+def rollup_pipeline(match: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Aggregation grouping analyses into cells in their stored form.
+
+    Reads only STATS_FIELDS, so the covering stats index can serve it.
+
+    Args:
+        match: Only group the analyses matching this query
+    """
+    key = {
+        'site_name': {'$ifNull': ['$site_name', None]},
+        'day': {'$dateTrunc': {'date': '$upload_timestamp', 'unit': 'day'}},
+        'treatment_train': '$treatment_train',
+        'dominant_rule': {'$ifNull': ['$dominant_rule', None]}
+    }
+    return [
+        {'$match': match or {}},
+        {'$project': {'_id': 0, **{field: 1 for field in STATS_FIELDS}}},
+        totals_group(key),
+        {'$project': {
+            '_id': 0,
+            **{field: f'$_id.{field}' for field in ROLLUP_KEY},
+            **{field: 1 for field in (*SUMMED_TOTALS, *EXTREME_TOTALS)}
+        }}
+    ]
+
+
+def rollups_cover(bucket: str, filters: Optional[HistoryFilters]) -> bool:
+    """Whether a report can be composed from cells rather than the analyses."""
+    if bucket not in ROLLUP_BUCKETS:
+        return False
+    if filters is None:
+        return True
+    fields = {field for field, value in filters.model_dump().items() if value is not None}
+    if not fields <= ROLLUP_FILTERS:
+        return False
+    return all(bound is None or bound == truncate_time(bound, 'day') for bound in (filters.start, filters.end))
+
+
+def rollup_query(filters: Optional[HistoryFilters]) -> Dict[str, Any]:
+    """Query selecting the cells of the analyses matching filters that rollups_cover."""
+    if filters is None:
+        return {}
+    query = {field: getattr(filters, field) for field in ('site_name', 'treatment_train')
+             if getattr(filters, field) is not None}
+    window = {}
+    if filters.start is not None:
+        window['$gte'] = filters.start
+    if filters.end is not None:
+        window['$lt'] = filters.end
+    if window:
+        query['day'] = window
+    return query
+
+
+def cell_matches(key: RollupKey, filters: Optional[HistoryFilters]) -> bool:
+    """Evaluate rollup_query(filters) against one cell key."""
+    if filters is None:
+        return True
+    site_name, day, treatment_train, _ = key
+    return ((filters.site_name is None or site_name == filters.site_name)
+            and (filters.treatment_train is None or treatment_train == filters.treatment_train)
+            and (filters.start is None or day >= filters.start)
+            and (filters.end is None or day < filters.end))
+
+
+def report_from_cells(cells: Iterable[Tuple[RollupKey, Dict[str, Any]]], bucket: str) -> Dict[str, Any]:
+    """
+    AnalysisRepository.stats report composed from cells.
+
+    Each cell falls wholly into one site and one time bucket, as long as
+    the bucket is no narrower than the cells.
+    """
+    overall = empty_totals()
+    sites: Dict[Optional[str], Dict[str, Any]] = {}
+    buckets: Dict[datetime, Dict[str, Any]] = {}
+    treatments: Dict[str, int] = {}
+    rules: Dict[str, int] = {}
+    for (site_name, start, treatment_train, dominant_rule), totals in cells:
+        merge_totals(overall, totals)
+        merge_totals(sites.setdefault(site_name, empty_totals()), totals)
+        merge_totals(buckets.setdefault(truncate_time(start, bucket), empty_totals()), totals)
+        if treatment_train is not None:
+            treatments[treatment_train] = treatments.get(treatment_train, 0) + totals['analyses']
+        if dominant_rule is not None:
+            rules[dominant_rule] = rules.get(dominant_rule, 0) + totals['analyses']
+
+    def by_count(counts: Dict[str, int]) -> Dict[str, int]:
+        return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+
+    # Sites without a name first, as MongoDB sorts null
+    return {
+        'overall': shape_totals(overall),
+        'sites': [{'site_name': site, **shape_totals(totals)}
+                  for site, totals in sorted(sites.items(), key=lambda item: (item[0] is not None, item[0] or ''))],
+        'buckets': [{'start': start, **shape_totals(totals)} for start, totals in sorted(buckets.items())],
+        'treatments': by_count(treatments),
+        'dominant_rules': by_count(rules)
+    }
+
+
+def stats_of_documents(documents: Iterable[Dict[str, Any]], bucket: str) -> Dict[str, Any]:
+    """AnalysisRepository.stats report of some stored analyses, computed as stats_pipeline does."""
+    return report_from_cells(rollup_cells(documents, unit=bucket).items(), bucket)
+
+
+async def rebuild(url: str, database_name: str) -> int:
+    """Rebuild the rollup collection of a database from its analyses; returns the cells written."""
+    # Imported here, as the repository builds on this module
+    from app.db.repository import MongoAnalysisRepository
+
+    client = AsyncMongoClient(url)
+    try:
+        database = client.get_database(database_name)
+        repository = MongoAnalysisRepository(
+            database.get_collection(WaterAnalysis._meta['collection']),
+            rollups=database.get_collection(ROLLUPS_COLLECTION)
+        )
+        await repository.ensure_indexes()
+        return await repository.rebuild_rollups()
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-url', default=settings.MONGODB_URL)
+    parser.add_argument('--database', default=settings.MONGODB_DB_NAME)
+    args = parser.parse_args()
+    cells = asyncio.run(rebuild(args.mongo_url, args.database))
+    print(f"Rebuilt {ROLLUPS_COLLECTION}: {cells:,} cells")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,21 @@ from contextlib import asynccontextmanager
 import logging
 
 from app.core.config import settings
-from app.db.mongo import connect_to_mongo, close_mongo_connection
+from app.db.mongo import open_analysis_repository, close_analysis_repository
+from app.core.compression import CompressionMiddleware
+from app.core.executors import shutdown_executors
+from app.core.metrics import MetricsMiddleware, shutdown_metrics
+from app.core.responses import FastJSONResponse
+from app.services.job_queue import start_job_workers, stop_job_workers
+from app.services.rule_table import get_rule_config
 from app.api.health import router as health_router
+from app.api.metrics import router as metrics_router
 from app.api.analysis import router as analysis_router
+from app.api.export import router as export_router
 from app.api.history import router as history_router
+from app.api.stats import router as stats_router
+from app.api.recommendations import router as recommendations_router
+from app.api.jobs import router as jobs_router, run_upload_job
 
 # Configure logging
 logging.basicConfig(
@@ -22,17 +33,25 @@ async def lifespan(app: FastAPI):
     """Handle startup and shutdown events."""
     # Startup
     logger.info("Starting application...")
-    connect_to_mongo()
+    # Compile the rule table up front so a broken file fails the startup
+    rules = get_rule_config()
+    logger.info(f"Loaded rule table version {rules.version} from {rules.path}")
+    await open_analysis_repository()
+    start_job_workers(run_upload_job)
     yield
     # Shutdown
     logger.info("Shutting down application...")
-    close_mongo_connection()
+    await stop_job_workers()
+    shutdown_executors()
+    await close_analysis_repository()
+    shutdown_metrics()
 
 
 # Create FastAPI application
 app = FastAPI(
     title=settings.API_TITLE,
     version=settings.API_VERSION,
+    default_response_class=FastJSONResponse,
     lifespan=lifespan
 )
 
@@ -43,12 +62,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets dashboards read the validator they send back in If-None-Match
+    expose_headers=["ETag"],
 )
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MIN_SIZE,
+    gzip_level=settings.GZIP_LEVEL,
+    brotli_quality=settings.BROTLI_QUALITY
+)
+# Outermost, so latency includes compression and CORS handling
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(health_router)
+app.include_router(metrics_router)
 app.include_router(analysis_router)
+# Before history, whose /{analysis_id} route would otherwise match /export and /stats
+app.include_router(export_router)
+app.include_router(stats_router)
 app.include_router(history_router)
+app.include_router(recommendations_router)
+app.include_router(jobs_router)
 
 
 @app.get("/")
@@ -1,8 +1,9 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, Dict, Any, ClassVar, List, Literal, Tuple
 from datetime import datetime
 
 
+
 class AnalysisSummary(BaseModel):
     """Summary statistics from water analysis."""
     avg_ph: float = Field(..., description="Average pH value")
@@ -10,6 +11,14 @@ class AnalysisSummary(BaseModel):
     avg_tds: float = Field(..., description="Average TDS in mg/L")
     tds_category: str = Field(..., description="TDS category")
     row_count: int = Field(..., description="Number of samples analyzed")
+    var_ph: Optional[float] = Field(None, description="Variance of the pH readings")
+    var_tds: Optional[float] = Field(None, description="Variance of the TDS readings")
+    ph_percentiles: Optional[Dict[str, float]] = Field(
+        None, description="pH percentiles by name (p5 to p95), estimated to 0.01 pH"
+    )
+    tds_percentiles: Optional[Dict[str, float]] = Field(
+        None, description="TDS percentiles by name (p5 to p95), estimated to 1 mg/L"
+    )
 
 
 class TreatmentRecommendation(BaseModel):
@@ -18,6 +27,52 @@ class TreatmentRecommendation(BaseModel):
     explanation: str = Field(..., description="Explanation of recommendation")
 
 
+class RuleDistribution(BaseModel):
+    """How the individual readings of an upload classify against the rules."""
+    rule_counts: Dict[str, int] = Field(..., description="Number of readings per rule code")
+    out_of_range_fraction: float = Field(..., description="Fraction of readings that alone would need treatment")
+    dominant_rule: str = Field(..., description="Rule covering the most readings")
+    dominant_treatment_train: str = Field(..., description="Treatment recommended by the dominant rule")
+
+
+class WindowStatistics(BaseModel):
+    """Columnar pH/TDS statistics for the fixed windows that contain readings."""
+    origin: datetime = Field(..., description="Start of the first window (UTC)")
+    step_minutes: int = Field(..., description="Window width in minutes")
+    offset: List[int] = Field(..., description="Window i starts at origin + offset[i] * step_minutes")
+    count: List[int]
+    ph_mean: List[float]
+    ph_min: List[float]
+    ph_max: List[float]
+    tds_mean: List[float]
+    tds_min: List[float]
+    tds_max: List[float]
+
+
+class Excursion(BaseModel):
+    """A period where the rolling mean of one parameter left its target band."""
+    parameter: str = Field(..., description="'ph' or 'tds'")
+    direction: str = Field(..., description="'low' or 'high'")
+    start: datetime = Field(..., description="First minute outside the band (UTC)")
+    end: datetime = Field(..., description="End of the last minute outside the band (UTC)")
+    duration_minutes: int
+    peak_rolling_mean: float = Field(..., description="Most extreme rolling mean during the excursion")
+
+
+class TimeSeriesSummary(BaseModel):
+    """Windowed statistics of an upload with a Timestamp column."""
+    start: datetime = Field(..., description="Earliest reading (UTC)")
+    end: datetime = Field(..., description="Latest reading (UTC)")
+    rows: int = Field(..., description="Readings with a valid timestamp, pH and TDS")
+    unparsed_timestamps: int = Field(..., description="Rows whose timestamp was missing or unreadable")
+    out_of_order_rows: int = Field(..., description="Rows earlier than the row before them")
+    hourly: WindowStatistics
+    daily: WindowStatistics
+    rolling_window_minutes: int
+    excursion_count: int = Field(..., description="Excursions found, including any not listed")
+    excursions: List[Excursion] = Field(..., description="Longest excursions, in time order")
+
+
 class AnalysisResponse(BaseModel):
     """API response for water analysis."""
     analysis_id: str = Field(..., description="Unique analysis ID")
@@ -26,6 +81,99 @@ class AnalysisResponse(BaseModel):
     site_name: Optional[str] = Field(None, description="Optional site identifier")
     summary: AnalysisSummary
     recommendation: TreatmentRecommendation
+    rule_distribution: Optional[RuleDistribution] = Field(
+        None, description="Per-reading classification; absent for analyses stored before it existed"
+    )
+    timeseries: Optional[TimeSeriesSummary] = Field(
+        None, description="Windowed statistics; only for files with a Timestamp column"
+    )
+    readings_stored: bool = Field(False, description="Whether raw readings were kept for re-analysis")
+    reanalyzed_at: Optional[datetime] = Field(None, description="When stored readings were last re-analyzed")
+    
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any],
+                      dominant_treatment_train: Optional[str] = None) -> "AnalysisResponse":
+        """
+        Build a response from a stored WaterAnalysis document.
+        
+        Args:
+            doc: Stored analysis
+            dominant_treatment_train: Treatment of the document's dominant
+                rule; the rule distribution is left out without it
+        """
+        rule_distribution = None
+        if doc.get('dominant_rule') and dominant_treatment_train is not None:
+            rule_distribution = RuleDistribution(
+                rule_counts=doc['rule_counts'],
+                out_of_range_fraction=doc['out_of_range_fraction'],
+                dominant_rule=doc['dominant_rule'],
+                dominant_treatment_train=dominant_treatment_train
+            )
+        return cls(
+            analysis_id=str(doc['_id']),
+            upload_timestamp=doc['upload_timestamp'],
+            original_filename=doc['original_filename'],
+            site_name=doc.get('site_name'),
+            summary=AnalysisSummary(
+                avg_ph=doc['avg_ph'],
+                ph_category=doc['ph_category'],
+                avg_tds=doc['avg_tds'],
+                tds_category=doc['tds_category'],
+                row_count=doc['row_count'],
+                var_ph=doc.get('var_ph'),
+                var_tds=doc.get('var_tds'),
+                ph_percentiles=doc.get('ph_percentiles') or None,
+                tds_percentiles=doc.get('tds_percentiles') or None
+            ),
+            recommendation=TreatmentRecommendation(
+                treatment_train=doc['treatment_train'],
+                explanation=doc['explanation']
+            ),
+            rule_distribution=rule_distribution,
+            timeseries=doc.get('timeseries') or None,
+            readings_stored=doc.get('readings_stored', False),
+            reanalyzed_at=doc.get('reanalyzed_at')
+        )
+
+
+class BatchUploadResult(BaseModel):
+    """Outcome for one CSV of a batch upload."""
+    filename: str = Field(..., description="Uploaded file name, or member path inside an archive")
+    status: Literal["created", "duplicate", "failed"] = Field(
+        ..., description="New analysis, existing analysis of an identical file, or not analyzed"
+    )
+    analysis: Optional[AnalysisResponse] = Field(None, description="Analysis unless the file failed")
+    status_code: Optional[int] = Field(None, description="HTTP status /upload would have returned for a failure")
+    error: Optional[Any] = Field(None, description="Error detail for a failed file")
+
+
+class BatchUploadResponse(BaseModel):
+    """API response for a batch upload."""
+    created: int = Field(..., description="Files stored as new analyses")
+    duplicates: int = Field(..., description="Files matching an analysis already stored")
+    failed: int = Field(..., description="Files that could not be analyzed")
+    results: List[BatchUploadResult] = Field(..., description="One result per CSV, in upload order")
+
+
+class JobResponse(BaseModel):
+    """Status and progress of an upload job."""
+    job_id: str = Field(..., description="Unique job ID")
+    status: Literal["queued", "running", "succeeded", "failed"] = Field(
+        ..., description="queued, running, succeeded or failed"
+    )
+    filename: str = Field(..., description="Original CSV filename")
+    site_name: Optional[str] = Field(None, description="Optional site identifier")
+    file_size: int = Field(..., description="Size of the uploaded file in bytes")
+    submitted_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    rows_processed: int = Field(..., description="Rows parsed so far")
+    status_url: str = Field(..., description="Where to poll for this job")
+    analysis_id: Optional[str] = Field(None, description="Stored analysis once the job succeeded")
+    result_url: Optional[str] = Field(None, description="Where to fetch the analysis once the job succeeded")
+    replayed: bool = Field(False, description="The analysis was stored by an earlier upload of the file")
+    status_code: Optional[int] = Field(None, description="HTTP status /upload would have returned for a failure")
+    error: Optional[Any] = Field(None, description="Error detail for a failed job")
 
 
 class AnalysisHistoryItem(BaseModel):
@@ -41,11 +189,117 @@ class AnalysisHistoryItem(BaseModel):
     treatment_train: Optional[str] = None
     explanation: Optional[str] = None
     user_notes: Optional[str] = None
+    
+    # Fields clients may leave out of a history page with fields=
+    OPTIONAL_FIELDS: ClassVar[Tuple[str, ...]] = (
+        'site_name', 'treatment_train', 'explanation', 'user_notes'
+    )
+    
+    @classmethod
+    def stored_fields(cls, include: Tuple[str, ...] = OPTIONAL_FIELDS) -> Tuple[str, ...]:
+        """Stored document fields needed to build an item with the given optional fields."""
+        required = tuple(
+            name for name in cls.model_fields
+            if name != 'id' and name not in cls.OPTIONAL_FIELDS
+        )
+        return required + tuple(include)
+    
+    @classmethod
+    def fields_from_document(cls, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Response fields of a stored WaterAnalysis document, as a plain dict.
+        
+        The history route encodes these directly instead of validating a
+        model per item, so values get the types the model would give them.
+        """
+        return {
+            'id': str(doc['_id']),
+            'upload_timestamp': doc['upload_timestamp'],
+            'original_filename': doc['original_filename'],
+            'site_name': doc.get('site_name'),
+            'avg_ph': float(doc['avg_ph']),
+            'ph_category': doc['ph_category'],
+            'avg_tds': float(doc['avg_tds']),
+            'tds_category': doc['tds_category'],
+            'treatment_train': doc.get('treatment_train'),
+            'explanation': doc.get('explanation'),
+            'user_notes': doc.get('user_notes')
+        }
+    
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "AnalysisHistoryItem":
+        """Build a history item from a stored WaterAnalysis document."""
+        return cls(**cls.fields_from_document(doc))
+
+
+class HistoryFilters(BaseModel):
+    """Optional filters for listing analysis history; unset fields match everything."""
+    model_config = ConfigDict(frozen=True)
+    
+    site_name: Optional[str] = None
+    start: Optional[datetime] = Field(None, description="Earliest upload_timestamp, inclusive (UTC)")
+    end: Optional[datetime] = Field(None, description="Latest upload_timestamp, exclusive (UTC)")
+    ph_category: Optional[str] = None
+    tds_category: Optional[str] = None
+    treatment_train: Optional[str] = None
+    
+    # Fields matched by equality, in the order their indexes are declared
+    EQUALITY_FIELDS: ClassVar[Tuple[str, ...]] = (
+        'site_name', 'ph_category', 'tds_category', 'treatment_train'
+    )
+    
+    def is_empty(self) -> bool:
+        """True when no filter is set."""
+        return all(value is None for value in self.model_dump().values())
 
 
 class AnalysisHistoryResponse(BaseModel):
     """API response for analysis history."""
     analyses: list[AnalysisHistoryItem]
-    total: int
+    total: Optional[int] = Field(None, description="Total analyses; null when count_mode is none")
     limit: int
     offset: int
+    next_cursor: Optional[str] = Field(None, description="Cursor for the next page; null on the last page")
+
+
+StatsBucket = Literal["hour", "day", "week", "month"]
+
+
+class MeasureStats(BaseModel):
+    """Mean and range of one parameter over a group of analyses."""
+    mean: Optional[float] = Field(None, description="Mean of the readings, each analysis weighted by its row count")
+    min: Optional[float] = Field(None, description="Lowest reading (the average, for analyses stored without one)")
+    max: Optional[float] = Field(None, description="Highest reading (the average, for analyses stored without one)")
+
+
+class GroupStats(BaseModel):
+    """Aggregate statistics of a group of analyses."""
+    analyses: int = Field(..., description="Number of analyses")
+    readings: int = Field(..., description="Readings across the analyses")
+    ph: MeasureStats
+    tds: MeasureStats
+    out_of_range_ratio: Optional[float] = Field(
+        None, description="Share of classified readings that alone would need treatment"
+    )
+
+
+class SiteStats(GroupStats):
+    """Statistics of the analyses of one site."""
+    site_name: Optional[str] = Field(None, description="Site identifier; null for analyses without one")
+
+
+class BucketStats(GroupStats):
+    """Statistics of the analyses uploaded in one time bucket."""
+    start: datetime = Field(..., description="Start of the bucket (UTC)")
+
+
+class AnalysisStatsResponse(BaseModel):
+    """API response for aggregate analysis statistics."""
+    bucket: StatsBucket = Field(..., description="Width of the time buckets")
+    overall: GroupStats
+    sites: List[SiteStats] = Field(..., description="Per site, by site name")
+    buckets: List[BucketStats] = Field(..., description="Per time bucket containing analyses, oldest first")
+    treatments: Dict[str, int] = Field(..., description="Analyses per recommended treatment, most common first")
+    dominant_rules: Dict[str, int] = Field(
+        ..., description="Analyses per dominant rule, most common first; older analyses without one are left out"
+    )
@@ -0,0 +1,40 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+from datetime import datetime
+
+
+class RecommendationBatchRequest(BaseModel):
+    """pH/TDS pairs to classify, as two equal-length columns."""
+    ph: List[Optional[float]] = Field(..., description="pH values; null marks a missing reading")
+    tds: List[Optional[float]] = Field(..., description="TDS values in mg/L; null marks a missing reading")
+
+
+class RuleDetail(BaseModel):
+    """Treatment recommended by one rule."""
+    treatment_train: str
+    explanation: str
+
+
+class RecommendationBatchResponse(BaseModel):
+    """Rule code per input pair, with each distinct rule's text listed once."""
+    count: int = Field(..., description="Number of pairs classified")
+    rule_codes: List[str] = Field(..., description="Rule code per pair; the fallback code for missing readings")
+    rules: Dict[str, RuleDetail] = Field(..., description="Treatment text for each rule code that occurs")
+
+
+class RuleTableInfo(BaseModel):
+    """The rule table currently used to classify readings."""
+    version: str = Field(..., description="Version string from the rule table file")
+    source: Optional[str] = Field(None, description="File the table was loaded from")
+    loaded_at: datetime = Field(..., description="When this process compiled the table")
+    ph_bands: List[str] = Field(..., description="pH band names, lowest first")
+    tds_bands: List[str] = Field(..., description="TDS band names, lowest first")
+    sites: List[str] = Field(..., description="Sites with their own threshold profile")
+
+
+class RecommendationCacheInfo(BaseModel):
+    """Counters of this worker's memoized per-cell recommendations."""
+    hits: int = Field(..., description="Lookups answered from the memo since the worker started")
+    misses: int = Field(..., description="Lookups that built a cell's recommendation")
+    hit_ratio: Optional[float] = Field(None, description="hits / (hits + misses); null before any lookup")
+    cells: int = Field(..., description="Cells memoized for the current rule table")
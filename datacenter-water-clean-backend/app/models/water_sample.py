@@ -1,7 +1,17 @@
-from mongoengine import Document, StringField, FloatField, DateTimeField, IntField
+from mongoengine import Document, StringField, FloatField, DateTimeField, IntField, DictField, BooleanField
 from datetime import datetime
 from typing import Optional
 
+# Fields read by the /stats aggregation. Its covering index starts with the
+# site and time filters and holds the rest, so the aggregation reads index
+# keys only and never fetches the documents.
+STATS_FIELDS = (
+    'site_name', 'upload_timestamp',
+    'avg_ph', 'min_ph', 'max_ph', 'avg_tds', 'min_tds', 'max_tds',
+    'row_count', 'out_of_range_fraction', 'dominant_rule', 'treatment_train'
+)
+STATS_INDEX = 'stats_covering'
+
 
 class WaterAnalysis(Document):
     """MongoDB document for water quality analysis results."""
@@ -11,19 +21,17 @@ class WaterAnalysis(Document):
     original_filename = StringField(required=True, max_length=255)
     site_name = StringField(max_length=255)
     
+    # Upload identity, for recognising retried uploads: SHA-256 of the raw
+    # file bytes and the client's Idempotency-Key header, if it sent one
+    content_hash = StringField(max_length=64)
+    idempotency_key = StringField(max_length=255)
+    
     # Calculated statistics
+    # Category names are the band names of the rule table in use
     avg_ph = FloatField(required=True)
-    ph_category = StringField(required=True, choices=[
-        "Low pH",
-        "In target range",
-        "High pH"
-    ])
+    ph_category = StringField(required=True, max_length=100)
     avg_tds = FloatField(required=True)
-    tds_category = StringField(required=True, choices=[
-        "Low",
-        "Moderate",
-        "High"
-    ])
+    tds_category = StringField(required=True, max_length=100)
     
     # Recommendation
     treatment_train = StringField(required=True, max_length=500)
@@ -41,15 +49,53 @@ class WaterAnalysis(Document):
     max_ph = FloatField()
     min_tds = FloatField()
     max_tds = FloatField()
+    var_ph = FloatField(min_value=0)
+    var_tds = FloatField(min_value=0)
+    ph_percentiles = DictField()  # 'p<q>' -> estimated percentile
+    tds_percentiles = DictField()
+    
+    # Optional: Per-reading rule classification
+    rule_counts = DictField()  # rule code -> number of readings
+    out_of_range_fraction = FloatField(min_value=0, max_value=1)
+    dominant_rule = StringField(max_length=20)
+    
+    # Optional: Windowed statistics and excursions of timestamped uploads,
+    # stored columnar (see TimeSeriesAccumulator.summary)
+    timeseries = DictField()
+    
+    # Optional: Raw readings kept in the water_readings time-series
+    # collection, and when they were last re-analyzed
+    readings_stored = BooleanField(default=False)
+    reanalyzed_at = DateTimeField()
     
     meta = {
         'collection': 'water_analyses',
         'indexes': [
-            '-upload_timestamp',  # Descending index for recent first
-            'site_name',
-            'created_at'
+            # Recent first; _id breaks timestamp ties for keyset pagination
+            {'fields': ['-upload_timestamp', '-id']},
+            # History filters: equality field first, then the history sort,
+            # so a filtered page (with or without a time window) is an index
+            # range scan that needs no in-memory sort
+            {'fields': ['site_name', '-upload_timestamp', '-id']},
+            {'fields': ['ph_category', '-upload_timestamp', '-id']},
+            {'fields': ['tds_category', '-upload_timestamp', '-id']},
+            {'fields': ['treatment_train', '-upload_timestamp', '-id']},
+            'created_at',
+            {'fields': list(STATS_FIELDS), 'name': STATS_INDEX},
+            # One analysis per file and site, and per idempotency key;
+            # analyses stored before uploads were hashed are left out
+            {
+                'fields': ['content_hash', 'site_name'],
+                'unique': True,
+                'partialFilterExpression': {'content_hash': {'$exists': True}}
+            },
+            {
+                'fields': ['idempotency_key'],
+                'unique': True,
+                'partialFilterExpression': {'idempotency_key': {'$exists': True}}
+            }
         ],
-        'ordering': ['-upload_timestamp']
+        'ordering': ['-upload_timestamp', '-id']
     }
     
     def to_dict(self) -> dict:
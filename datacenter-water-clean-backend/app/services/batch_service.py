@@ -0,0 +1,161 @@
+import asyncio
+import posixpath
+import tarfile
+import zipfile
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, Iterator, List, Tuple, Union
+from fastapi import HTTPException, UploadFile
+
+from app.core.config import settings
+from app.services.csv_service import CSVService
+
+
+# A batch member: the CSV to analyze, or why it cannot be analyzed
+Member = Tuple[str, Union[UploadFile, HTTPException]]
+
+ZIP_SUFFIXES = ('.zip',)
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+
+
+class BatchService:
+    """Service for splitting batch uploads into the CSV files they contain."""
+
+    @staticmethod
+    def is_archive(filename: str) -> bool:
+        """Whether an uploaded file is a zip or tar archive of CSVs."""
+        return filename.lower().endswith(ZIP_SUFFIXES + TAR_SUFFIXES)
+
+    @staticmethod
+    async def iter_members(files: List[UploadFile]) -> AsyncIterator[Member]:
+        """
+        Yield every CSV of a batch, with archives opened in place.
+
+        Plain CSV uploads are yielded as they are. Archive members are read
+        straight from the uploaded archive one at a time, each into memory
+        and never to disk, in a worker thread so decompression does not
+        block the event loop. The caller controls how many members are held
+        at once by how fast it consumes them.
+
+        Problems with one file (wrong type, too large, corrupt archive) are
+        yielded as an HTTPException in place of the file, so the rest of
+        the batch still goes ahead.
+
+        Yields:
+            Tuples of (file name, UploadFile or HTTPException)
+
+        Raises:
+            HTTPException: 413 as soon as the batch passes MAX_BATCH_FILES
+                files or MAX_BATCH_SIZE CSV bytes, archive members counted
+                as decompressed
+        """
+        count = size = 0
+
+        def check_limits(member: Union[UploadFile, HTTPException]) -> None:
+            nonlocal count, size
+            count += 1
+            if count > settings.MAX_BATCH_FILES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Batch has more than {settings.MAX_BATCH_FILES} CSV files"
+                )
+            if isinstance(member, UploadFile):
+                size += member.size or 0
+                if size > settings.MAX_BATCH_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Batch is larger than {settings.MAX_BATCH_SIZE / 1024 / 1024}MB of CSV data"
+                    )
+
+        for file in files:
+            filename = file.filename or ""
+            if not BatchService.is_archive(filename):
+                if filename.endswith('.csv'):
+                    member = file
+                else:
+                    member = HTTPException(
+                        status_code=400,
+                        detail="Invalid file type. Only CSV files and zip/tar.gz archives are accepted."
+                    )
+                check_limits(member)
+                yield filename, member
+                continue
+
+            entries = BatchService._archive_entries(file)
+            try:
+                while True:
+                    entry = await asyncio.to_thread(next, entries, None)
+                    if entry is None:
+                        break
+                    name, content = entry
+                    if isinstance(content, bytes):
+                        content = BatchService._as_upload(name, content)
+                    # Checked per member, so a compressed archive is never
+                    # expanded much beyond the limits
+                    check_limits(content)
+                    yield name, content
+            finally:
+                entries.close()
+
+    @staticmethod
+    def _as_upload(name: str, data: bytes) -> UploadFile:
+        """Wrap member bytes as an UploadFile that reads without a thread hop."""
+        # max_size=0 never rolls to disk, and UploadFile reads an unrolled
+        # spooled file directly on the event loop
+        buffer = SpooledTemporaryFile(max_size=0)
+        buffer.write(data)
+        buffer.seek(0)
+        return UploadFile(buffer, size=len(data), filename=name)
+
+    @staticmethod
+    def _archive_entries(file: UploadFile) -> Iterator[Tuple[str, Union[bytes, HTTPException]]]:
+        """
+        Read the CSV members of an archive in order, without extracting it.
+
+        Runs in a worker thread, one member per step. Tar archives are read
+        as a stream, so each member is decompressed exactly once.
+
+        Yields:
+            Tuples of (member path, member bytes or HTTPException)
+        """
+        limit = CSVService.MAX_FILE_SIZE
+        try:
+            if file.filename.lower().endswith(ZIP_SUFFIXES):
+                with zipfile.ZipFile(file.file) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir() or not BatchService._wanted(info.filename):
+                            continue
+                        if info.file_size > limit:
+                            yield info.filename, BatchService._too_large()
+                            continue
+                        with archive.open(info) as member:
+                            data = member.read(limit + 1)
+                        yield info.filename, data if len(data) <= limit else BatchService._too_large()
+            else:
+                with tarfile.open(fileobj=file.file, mode='r|*') as archive:
+                    for info in archive:
+                        if not info.isfile() or not BatchService._wanted(info.name):
+                            continue
+                        if info.size > limit:
+                            yield info.name, BatchService._too_large()
+                            continue
+                        yield info.name, archive.extractfile(info).read()
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+            yield file.filename, HTTPException(
+                status_code=400,
+                detail=f"Failed to read archive: {str(e)}"
+            )
+
+    @staticmethod
+    def _wanted(path: str) -> bool:
+        """CSV members only, skipping hidden files and macOS resource forks."""
+        name = posixpath.basename(path)
+        return (name.lower().endswith('.csv') and not name.startswith('.')
+                and not path.startswith('__MACOSX/'))
+
+    @staticmethod
+    def _too_large() -> HTTPException:
+        """The error CSVService gives for a file over MAX_FILE_SIZE."""
+        return HTTPException(
+            status_code=400,
+            detail=f"File too large. Maximum size is {CSVService.MAX_FILE_SIZE / 1024 / 1024}MB"
+        )
@@ -1,14 +1,138 @@
 import pandas as pd
+import numpy as np
+import asyncio
+import csv
+import hashlib
 import io
-from typing import Tuple, Dict, Any
+import os
+import tempfile
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import Awaitable, Callable, Tuple, Dict, Any, Optional
 from fastapi import UploadFile, HTTPException
 
+from app.core.config import settings
+from app.core.executors import run_cpu_bound, parse_parallelism
+from app.core.metrics import count_upload_bytes, count_upload_rows, observe_stage
+from app.db.readings import ReadingWriter
+from app.services.recommendation_service import RecommendationService
+from app.services.rule_table import RuleTable, get_rule_table
+from app.services.statistics import StatsAccumulator
+from app.services.timeseries import NAT, TimeSeriesAccumulator
+
+try:
+    import pyarrow as pa
+    from pyarrow import compute as pa_compute
+    from pyarrow import csv as pa_csv
+except ImportError:  # pyarrow is optional; pandas' C engine is the fallback
+    pa = None
+    pa_compute = None
+    pa_csv = None
+
+
+class CSVBlockError(Exception):
+    """
+    Picklable stand-in for an HTTPException raised inside a parse worker.
+    
+    HTTPException cannot be unpickled, so workers raise this with
+    (status_code, detail) and the caller turns it back into HTTPException.
+    """
+
 
 class CSVService:
     """Service for CSV file processing."""
     
     REQUIRED_COLUMNS = ['pH', 'TDS']
-    MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+    MAX_FILE_SIZE = settings.MAX_FILE_SIZE
+    CHUNK_SIZE = settings.CSV_CHUNK_SIZE
+    CSV_ENGINE = 'pyarrow' if pa_csv is not None else 'c'
+    
+    @staticmethod
+    def _check_size(size: int) -> None:
+        """Reject uploads as soon as they pass MAX_FILE_SIZE."""
+        if size > CSVService.MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File too large. Maximum size is {CSVService.MAX_FILE_SIZE / 1024 / 1024}MB"
+            )
+    
+    @staticmethod
+    async def hash_upload(file: UploadFile) -> str:
+        """
+        Hash the raw upload without parsing it.
+        
+        The file is read in CHUNK_SIZE steps and rewound afterwards, so it
+        can still be analyzed. Identical bytes give the same hash, which is
+        how retried uploads are recognised.
+        
+        Returns:
+            Hex SHA-256 digest of the file
+            
+        Raises:
+            HTTPException: If the file is larger than MAX_FILE_SIZE
+        """
+        digest = hashlib.sha256()
+        total_size = 0
+        while True:
+            chunk = await file.read(CSVService.CHUNK_SIZE)
+            if not chunk:
+                break
+            total_size += len(chunk)
+            CSVService._check_size(total_size)
+            digest.update(chunk)
+        await file.seek(0)
+        return digest.hexdigest()
+    
+    @staticmethod
+    async def spool_upload(file: UploadFile, directory: Optional[str] = None) -> Tuple[str, int]:
+        """
+        Copy an upload to a file of its own on disk.
+        
+        The request's upload is gone once the response is sent, so uploads
+        analyzed later are spooled first. The copy runs in a worker thread
+        in CHUNK_SIZE steps and stops as soon as the file is too large.
+        
+        Args:
+            file: Uploaded CSV file
+            directory: Where to create the copy; the system temp dir if omitted
+            
+        Returns:
+            Tuple of (path of the copy, size in bytes); the caller removes it
+            
+        Raises:
+            HTTPException: If the file is larger than MAX_FILE_SIZE
+        """
+        descriptor, path = tempfile.mkstemp(suffix='.csv', prefix='upload-', dir=directory)
+        
+        def copy() -> int:
+            size = 0
+            with os.fdopen(descriptor, 'wb') as target:
+                while True:
+                    chunk = file.file.read(CSVService.CHUNK_SIZE)
+                    if not chunk:
+                        return size
+                    size += len(chunk)
+                    CSVService._check_size(size)
+                    target.write(chunk)
+        
+        try:
+            return path, await asyncio.to_thread(copy)
+        except BaseException:
+            os.unlink(path)
+            raise
+    
+    @staticmethod
+    async def _read_limited(file: UploadFile) -> bytes:
+        """Read the whole upload in chunks, stopping early if it is too large."""
+        buffer = bytearray()
+        while True:
+            chunk = await file.read(CSVService.CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+            CSVService._check_size(len(buffer))
+        return bytes(buffer)
     
     @staticmethod
     async def validate_and_parse_csv(file: UploadFile) -> pd.DataFrame:
@@ -24,42 +148,226 @@ class CSVService:
         Raises:
             HTTPException: If validation fails
         """
-        # Check file size
-        contents = await file.read()
-        if len(contents) > CSVService.MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large. Maximum size is {CSVService.MAX_FILE_SIZE / 1024 / 1024}MB"
-            )
+        # Read file, rejecting it as soon as it is too large
+        contents = await CSVService._read_limited(file)
         
         # Reset file pointer
         await file.seek(0)
         
-        # Try to parse CSV
-        try:
-            df = pd.read_csv(io.BytesIO(contents))
-        except Exception as e:
+        # Split off the header so only pH and TDS are parsed
+        newline = contents.find(b"\n")
+        if newline == -1:
+            header, body = contents, b""
+        else:
+            header, body = contents[:newline + 1], contents[newline + 1:]
+        
+        if not header.strip():
             raise HTTPException(
                 status_code=400,
-                detail=f"Failed to parse CSV file: {str(e)}"
+                detail="Failed to parse CSV file: No columns to parse from file"
             )
         
+        # Check if there are no data rows, before checking the columns
+        if not body.strip():
+            raise HTTPException(
+                status_code=400,
+                detail="CSV file is empty"
+            )
+        
+        columns = CSVService._resolve_columns(header)
+        values = CSVService._parse_columns(body, columns)
+        
         # Check if DataFrame is empty
-        if df.empty:
+        if values.shape[1] == 0:
+            raise HTTPException(
+                status_code=400,
+                detail="CSV file is empty"
+            )
+        
+        df = pd.DataFrame({'ph': values[0], 'tds': values[1]}, copy=False)
+        
+        return df
+    
+    @staticmethod
+    async def analyze_csv_stream(file: UploadFile, table: Optional[RuleTable] = None,
+                                 readings: Optional[ReadingWriter] = None,
+                                 progress: Optional[Callable[[int], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """
+        Validate and analyze CSV file without holding it in memory.
+        
+        The upload is read in CHUNK_SIZE blocks. Complete lines are parsed as
+        soon as they arrive and folded into running pH/TDS statistics, so peak
+        memory depends on the chunk size rather than on the file size. Quoted
+        fields spanning several lines are not supported in this mode.
+        
+        Parsing runs in the parse pool (see app.core.executors), with up to
+        PARSE_WORKERS blocks in flight, so the event loop stays free to serve
+        other requests while a large file is processed.
+        
+        If the file has a Timestamp column, it is parsed in the same pass and
+        readings are also folded into per-minute buckets, giving hourly and
+        daily windows and rolling excursions under 'timeseries' (see
+        TimeSeriesAccumulator.summary). Files may be in any time order.
+        
+        With a reading writer, the parsed readings of each block are also
+        stored, in file order, as soon as the block is collected.
+        
+        With a progress callback, the number of rows parsed so far is
+        reported after every collected block.
+        
+        Args:
+            file: Uploaded CSV file
+            table: Rule table profile for the categories and rule counts;
+                the active default profile if omitted
+            readings: Where to store the raw readings; not stored if omitted
+            progress: Awaited with the running row count; not reported if omitted
+            
+        Returns:
+            Dictionary with calculated statistics (see calculate_statistics)
+            
+        Raises:
+            HTTPException: If validation fails
+        """
+        rows_seen = 0
+        table = table or get_rule_table()
+        totals = StatsAccumulator(table)
+        series = None
+        in_flight = deque()
+        # Seconds the parse workers spent on blocks, and spent here merging them
+        parse_seconds = merge_seconds = 0.0
+        
+        async def collect() -> None:
+            nonlocal rows_seen, series, parse_seconds, merge_seconds
+            try:
+                rows, block_totals, block_series, block_readings, seconds = await in_flight.popleft()
+            except CSVBlockError as e:
+                raise HTTPException(status_code=e.args[0], detail=e.args[1])
+            rows_seen += rows
+            parse_seconds += seconds
+            start = time.perf_counter()
+            totals.merge(block_totals)
+            # Blocks are collected in file order, as the series merge expects
+            if block_series is not None:
+                series = block_series if series is None else series.merge(block_series)
+            merge_seconds += time.perf_counter() - start
+            if readings is not None:
+                await readings.write(*block_readings)
+            if progress is not None:
+                await progress(rows_seen)
+        
+        try:
+            async with aclosing(CSVService._iter_blocks(file)) as blocks:
+                async for block, columns in blocks:
+                    in_flight.append(asyncio.ensure_future(
+                        run_cpu_bound(CSVService._summarize_block, block, columns, table,
+                                      readings is not None)
+                    ))
+                    # Bound the blocks held in memory to the pool's parallelism
+                    if len(in_flight) >= parse_parallelism():
+                        await collect()
+            while in_flight:
+                await collect()
+        finally:
+            for future in in_flight:
+                future.cancel()
+        
+        if rows_seen == 0:
             raise HTTPException(
                 status_code=400,
                 detail="CSV file is empty"
             )
         
-        # Normalize column names (case-insensitive)
-        df.columns = df.columns.str.strip().str.lower()
+        observe_stage('parse', parse_seconds)
+        stats = CSVService._build_statistics(totals, series, merge_seconds)
+        count_upload_rows(rows_seen)
+        return stats
+    
+    @staticmethod
+    async def _iter_blocks(file: UploadFile):
+        """
+        Read the upload in chunks and yield blocks of complete data lines.
+        
+        The header is validated before the first block is yielded, once a
+        data line follows it; a file with no data lines yields no blocks
+        whatever its columns, so it is reported as empty. The upload is
+        rejected as soon as it passes MAX_FILE_SIZE. The time spent
+        waiting for the upload body is recorded as its read stage.
+        
+        Yields:
+            Tuples of (block bytes, columns as returned by _resolve_columns)
+        """
+        header = columns = None
+        pending = b""
+        total_size = 0
+        read_seconds = 0.0
+        
+        while True:
+            start = time.perf_counter()
+            chunk = await file.read(CSVService.CHUNK_SIZE)
+            read_seconds += time.perf_counter() - start
+            if not chunk:
+                break
+            count_upload_bytes(len(chunk))
+            total_size += len(chunk)
+            CSVService._check_size(total_size)
+            pending += chunk
+            
+            # Validate the header before parsing any data
+            if columns is None:
+                if header is None:
+                    newline = pending.find(b"\n")
+                    if newline == -1:
+                        continue
+                    header, pending = pending[:newline + 1], pending[newline + 1:]
+                if not pending.strip():
+                    continue
+                columns = CSVService._resolve_columns(header)
+            
+            # Parse every complete line, keep the partial tail for later
+            cut = pending.rfind(b"\n")
+            if cut == -1:
+                continue
+            block, pending = pending[:cut + 1], pending[cut + 1:]
+            yield block, columns
+        
+        observe_stage('read', read_seconds)
+        if header is None:
+            if not pending.strip():
+                raise HTTPException(
+                    status_code=400,
+                    detail="Failed to parse CSV file: No columns to parse from file"
+                )
+            header, pending = pending, b""
+        
+        if pending.strip():
+            if columns is None:
+                columns = CSVService._resolve_columns(header)
+            yield pending, columns
+    
+    @staticmethod
+    def _resolve_columns(header: bytes) -> Tuple[int, int, int, Optional[int]]:
+        """
+        Locate the pH, TDS and optional Timestamp columns in a raw header line.
+        
+        Returns:
+            Tuple of (field_count, ph_index, tds_index, timestamp_index);
+            timestamp_index is None when there is no Timestamp column
+        """
+        try:
+            line = header.decode('utf-8-sig').rstrip('\r\n')
+            names = next(csv.reader([line]))
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Failed to parse CSV file: {str(e)}"
+            )
         
-        # Check for required columns
-        missing_columns = []
-        for col in CSVService.REQUIRED_COLUMNS:
-            if col.lower() not in df.columns:
-                missing_columns.append(col)
+        normalized = [name.strip().lower() for name in names]
         
+        missing_columns = [
+            col for col in CSVService.REQUIRED_COLUMNS
+            if col.lower() not in normalized
+        ]
         if missing_columns:
             raise HTTPException(
                 status_code=400,
@@ -70,78 +378,255 @@ class CSVService:
                 }
             )
         
-        return df
+        timestamp_index = normalized.index('timestamp') if 'timestamp' in normalized else None
+        return len(names), normalized.index('ph'), normalized.index('tds'), timestamp_index
+    
+    @staticmethod
+    def _summarize_block(block: bytes, columns: Tuple[int, ...], table: RuleTable,
+                         keep_readings: bool = False) -> Tuple[int, StatsAccumulator,
+                                                               Optional[TimeSeriesAccumulator],
+                                                               Optional[Tuple[np.ndarray, Optional[np.ndarray]]]]:
+        """
+        Parse a block of complete data lines into a fresh accumulator.
+        
+        Runs inside a parse worker, so it only takes and returns picklable
+        values. The compiled rule table is passed in rather than loaded in
+        the worker, so every block of an upload uses the same table.
+        
+        Args:
+            keep_readings: Also return the parsed readings, for storage
+        
+        Returns:
+            Tuple of (rows parsed, accumulated statistics, per-minute
+            aggregates or None when the file has no Timestamp column,
+            (values, timestamps) if keep_readings else None, seconds spent)
+        """
+        start = time.perf_counter()
+        try:
+            values, timestamps = CSVService._parse_block(block, columns)
+        except HTTPException as e:
+            raise CSVBlockError(e.status_code, e.detail) from None
+        series = None
+        if timestamps is not None:
+            series = TimeSeriesAccumulator.from_values(values, timestamps)
+        kept = (values, timestamps) if keep_readings else None
+        totals = StatsAccumulator.from_values(values, table)
+        return values.shape[1], totals, series, kept, time.perf_counter() - start
+    
+    @staticmethod
+    def analyze_readings(values: np.ndarray, timestamps: Optional[np.ndarray],
+                         table: RuleTable) -> Dict[str, Any]:
+        """
+        Recompute the statistics of stored readings, as an upload would.
+        
+        Picklable, so re-analysis can run it in the parse pool.
+        
+        Args:
+            values: (2, n) pH and TDS readings as parsed from the upload
+            timestamps: n int64 nanosecond timestamps, or None for untimed files
+            table: Rule table profile to classify with
+            
+        Returns:
+            Dictionary with calculated statistics (see analyze_csv_stream)
+        """
+        series = None
+        if timestamps is not None:
+            series = TimeSeriesAccumulator.from_values(values, timestamps)
+        return CSVService._build_statistics(StatsAccumulator.from_values(values, table), series)
+    
+    @staticmethod
+    def _parse_columns(data: bytes, columns: Tuple[int, ...]) -> np.ndarray:
+        """
+        Parse only the pH and TDS fields of headerless CSV rows.
+        
+        Args:
+            data: Raw CSV rows without the header line
+            columns: Tuple starting (field_count, ph_index, tds_index)
+            
+        Returns:
+            (2, n) float64 array with pH in row 0 and TDS in row 1
+        """
+        return CSVService._parse_block(data, columns[:3])[0]
     
     @staticmethod
-    def calculate_statistics(df: pd.DataFrame) -> Dict[str, Any]:
+    def _parse_block(data: bytes, columns: Tuple[int, ...]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Parse the pH, TDS and (if present) Timestamp fields of headerless CSV rows.
+        
+        pH and TDS are read as float64, and timestamps as nanoseconds, with
+        the pyarrow CSV reader when it is installed, otherwise with pandas' C
+        engine. If a cell is not numeric, or a timestamp is not plain
+        ISO 8601 without a zone offset, the typed read fails and the block
+        is parsed again as text and coerced, so a bad number becomes NaN and
+        a bad timestamp NaT. Timestamps with an offset are converted to UTC;
+        naive ones are taken as UTC.
+        
+        Args:
+            data: Raw CSV rows without the header line
+            columns: Tuple of (field_count, ph_index, tds_index), optionally
+                followed by timestamp_index
+            
+        Returns:
+            Tuple of a (2, n) float64 array with pH in row 0 and TDS in row 1,
+            and n int64 nanosecond timestamps (NAT when missing) or None when
+            no timestamp column was requested
+        """
+        field_count, ph_index, tds_index, *rest = columns
+        timestamp_index = rest[0] if rest else None
+        
+        if not data.strip():
+            empty = np.empty(0, dtype=np.int64) if timestamp_index is not None else None
+            return np.empty((2, 0), dtype=np.float64), empty
+        
+        names = [f"f{i}" for i in range(field_count)]
+        wanted = [names[ph_index], names[tds_index]]
+        stamp = names[timestamp_index] if timestamp_index is not None else None
+        
+        try:
+            if CSVService.CSV_ENGINE == 'pyarrow':
+                return CSVService._read_with_pyarrow(data, names, wanted, stamp)
+            return CSVService._read_with_pandas(data, names, wanted, np.float64, stamp)
+        except ValueError:
+            pass
+        
+        try:
+            return CSVService._read_with_pandas(data, names, wanted, str, stamp)
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Failed to parse CSV file: {str(e)}"
+            )
+    
+    @staticmethod
+    def _read_with_pyarrow(data: bytes, names: list, wanted: list,
+                           stamp: Optional[str] = None) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Typed, column-projected read with pyarrow.csv."""
+        column_types = {name: pa.float64() for name in wanted}
+        if stamp is not None:
+            column_types[stamp] = pa.timestamp('ns')
+        table = pa_csv.read_csv(
+            io.BytesIO(data),
+            read_options=pa_csv.ReadOptions(column_names=names),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=list(column_types),
+                column_types=column_types
+            )
+        )
+        values = np.empty((2, table.num_rows), dtype=np.float64)
+        for row, name in enumerate(wanted):
+            values[row] = table.column(name).to_numpy(zero_copy_only=False)
+        timestamps = None
+        if stamp is not None:
+            timestamps = pa_compute.fill_null(table.column(stamp).cast(pa.int64()), NAT).to_numpy()
+        return values, timestamps
+    
+    @staticmethod
+    def _read_with_pandas(data: bytes, names: list, wanted: list, dtype,
+                          stamp: Optional[str] = None) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Column-projected read with pandas' C engine."""
+        dtypes = {name: dtype for name in wanted}
+        if stamp is not None:
+            dtypes[stamp] = str
+        df = pd.read_csv(
+            io.BytesIO(data),
+            header=None,
+            names=names,
+            usecols=list(dtypes),
+            dtype=dtypes,
+            engine='c'
+        )
+        timestamps = None
+        if stamp is not None:
+            timestamps = CSVService._to_timestamps(df[stamp])
+        return CSVService._to_buffer(df[wanted[0]], df[wanted[1]]), timestamps
+    
+    @staticmethod
+    def _to_timestamps(column: pd.Series) -> np.ndarray:
+        """Parse ISO 8601 text into int64 UTC nanoseconds; unparseable cells become NAT."""
+        parsed = pd.to_datetime(column, errors='coerce', utc=True, format='ISO8601')
+        return parsed.dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    
+    @staticmethod
+    def calculate_statistics(df: pd.DataFrame, table: Optional[RuleTable] = None) -> Dict[str, Any]:
         """
         Calculate water quality statistics from DataFrame.
         
         Args:
             df: DataFrame with pH and TDS columns
+            table: Rule table profile; the active default profile if omitted
             
         Returns:
             Dictionary with calculated statistics
         """
-        # Get pH and TDS columns
-        ph_col = 'ph'
-        tds_col = 'tds'
-        
-        # Convert to numeric, coercing errors to NaN
-        df[ph_col] = pd.to_numeric(df[ph_col], errors='coerce')
-        df[tds_col] = pd.to_numeric(df[tds_col], errors='coerce')
+        values = CSVService._to_buffer(df['ph'], df['tds'])
+        return CSVService._build_statistics(StatsAccumulator.from_values(values, table))
+    
+    @staticmethod
+    def _to_buffer(ph: pd.Series, tds: pd.Series) -> np.ndarray:
+        """Copy pH and TDS columns into one contiguous (2, n) float64 buffer."""
+        values = np.empty((2, len(ph)), dtype=np.float64)
+        for row, column in enumerate((ph, tds)):
+            if not pd.api.types.is_numeric_dtype(column):
+                column = pd.to_numeric(column, errors='coerce')
+            values[row] = column.to_numpy(dtype=np.float64, na_value=np.nan)
+        return values
+    
+    @staticmethod
+    def _build_statistics(totals: StatsAccumulator,
+                          series: Optional[TimeSeriesAccumulator] = None,
+                          merge_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Turn accumulated readings into the statistics dictionary.
         
-        # Drop rows with NaN values
-        df_clean = df[[ph_col, tds_col]].dropna()
+        The time-series summary is added under 'timeseries' when per-minute
+        aggregates are given. For an upload, merge_seconds is the time spent
+        merging block summaries; the 'statistics' and 'recommendation'
+        upload stages are then observed.
         
-        if df_clean.empty:
+        Raises:
+            HTTPException: If no row had both a numeric pH and TDS value
+        """
+        if totals.count == 0:
             raise HTTPException(
                 status_code=400,
                 detail="No valid numeric data found in pH or TDS columns"
             )
         
-        # Calculate averages
-        avg_ph = float(df_clean[ph_col].mean())
-        avg_tds = float(df_clean[tds_col].mean())
-        
-        # Determine categories
-        ph_category = CSVService._get_ph_category(avg_ph)
-        tds_category = CSVService._get_tds_category(avg_tds)
+        start = time.perf_counter()
+        avg_ph, avg_tds = (float(v) for v in totals.mean)
+        var_ph, var_tds = (float(v) for v in totals.variance)
+        ph_percentiles, tds_percentiles = totals.percentiles()
+        recommend_start = time.perf_counter()
+        recommendation = RecommendationService.recommend(avg_ph, avg_tds, totals.table)
+        recommend_seconds = time.perf_counter() - recommend_start
         
-        # Optional: Calculate min/max
-        min_ph = float(df_clean[ph_col].min())
-        max_ph = float(df_clean[ph_col].max())
-        min_tds = float(df_clean[tds_col].min())
-        max_tds = float(df_clean[tds_col].max())
-        
-        return {
+        stats = {
             'avg_ph': avg_ph,
-            'ph_category': ph_category,
+            'ph_category': recommendation.ph_category,
             'avg_tds': avg_tds,
-            'tds_category': tds_category,
-            'row_count': len(df_clean),
-            'min_ph': min_ph,
-            'max_ph': max_ph,
-            'min_tds': min_tds,
-            'max_tds': max_tds
+            'tds_category': recommendation.tds_category,
+            'treatment_train': recommendation.treatment_train,
+            'explanation': recommendation.explanation,
+            'row_count': totals.count,
+            'min_ph': float(totals.min[0]),
+            'max_ph': float(totals.max[0]),
+            'min_tds': float(totals.min[1]),
+            'max_tds': float(totals.max[1]),
+            'var_ph': var_ph,
+            'var_tds': var_tds,
+            'ph_percentiles': ph_percentiles,
+            'tds_percentiles': tds_percentiles,
+            'rule_counts': totals.rule_distribution(),
+            'out_of_range_fraction': totals.out_of_range_fraction,
+            'dominant_rule': totals.dominant_rule
         }
-    
-    @staticmethod
-    def _get_ph_category(ph: float) -> str:
-        """Determine pH category."""
-        if ph <= 7.5:
-            return "Low pH"
-        elif ph < 8.3:
-            return "In target range"
-        else:
-            return "High pH"
-    
-    @staticmethod
-    def _get_tds_category(tds: float) -> str:
-        """Determine TDS category."""
-        if tds < 100:
-            return "Low"
-        elif tds < 300:
-            return "Moderate"
-        else:
-            return "High"
+        if series is not None:
+            stats['timeseries'] = series.summary(
+                totals.table,
+                settings.TIMESERIES_ROLLING_WINDOW,
+                settings.TIMESERIES_MAX_EXCURSIONS
+            )
+        if merge_seconds is not None:
+            observe_stage('recommendation', recommend_seconds)
+            observe_stage('statistics', merge_seconds + time.perf_counter() - start - recommend_seconds)
+        return stats
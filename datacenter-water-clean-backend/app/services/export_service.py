@@ -0,0 +1,185 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; only Parquet export needs it
+    pa = None
+    pq = None
+
+
+# Exported columns in output order, with their type: the stored '_id' is
+# exported as 'id', everything else under its WaterAnalysis field name
+EXPORT_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ('id', 'string'),
+    ('upload_timestamp', 'timestamp'),
+    ('original_filename', 'string'),
+    ('site_name', 'string'),
+    ('avg_ph', 'float'),
+    ('ph_category', 'string'),
+    ('avg_tds', 'float'),
+    ('tds_category', 'string'),
+    ('treatment_train', 'string'),
+    ('explanation', 'string'),
+    ('user_notes', 'string'),
+    ('row_count', 'int'),
+    ('min_ph', 'float'),
+    ('max_ph', 'float'),
+    ('min_tds', 'float'),
+    ('max_tds', 'float'),
+    ('var_ph', 'float'),
+    ('var_tds', 'float'),
+    ('out_of_range_fraction', 'float'),
+    ('dominant_rule', 'string'),
+    ('created_at', 'timestamp'),
+)
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+class _ParquetSink:
+    """
+    Write-only file object that hands written bytes back to the caller.
+
+    ParquetWriter records absolute offsets in the file footer, so tell()
+    keeps counting across drains even though the bytes have been sent.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        """Return and forget everything written since the last drain."""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ExportService:
+    """Service for streaming analysis history out in bulk formats."""
+
+    @staticmethod
+    def stored_fields() -> Tuple[str, ...]:
+        """Stored document fields to read for an export."""
+        return tuple(name for name, _ in EXPORT_COLUMNS if name != 'id')
+
+    @staticmethod
+    def parquet_available() -> bool:
+        """Whether pyarrow is installed for Parquet export."""
+        return pq is not None
+
+    @staticmethod
+    def export_row(doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Flatten a stored document into export columns; missing fields are None."""
+        row = {name: doc.get(name) for name, _ in EXPORT_COLUMNS}
+        row['id'] = str(doc['_id'])
+        return row
+
+    @staticmethod
+    def _rows(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Export rows for one batch of stored documents."""
+        return [ExportService.export_row(doc) for doc in batch]
+
+    @staticmethod
+    def stream(export_format: str, batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+        """
+        Encode batches of stored documents as a byte stream.
+
+        Args:
+            export_format: One of EXPORT_FORMATS
+            batches: Stored documents, as yielded by AnalysisRepository.iter_batches
+
+        Returns:
+            Async iterator of encoded chunks, one or more per batch
+        """
+        if export_format == 'ndjson':
+            return ExportService._ndjson_stream(batches)
+        if export_format == 'csv':
+            return ExportService._csv_stream(batches)
+        if export_format == 'parquet':
+            return ExportService._parquet_stream(batches)
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    @staticmethod
+    def _text(value: Any) -> Any:
+        """Render timestamps as ISO 8601 for the text formats."""
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    @staticmethod
+    async def _ndjson_stream(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+        async for batch in batches:
+            lines = []
+            for doc in ExportService._rows(batch):
+                row = {name: ExportService._text(value) for name, value in doc.items()}
+                lines.append(json.dumps(row, ensure_ascii=False))
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+    @staticmethod
+    async def _csv_stream(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([name for name, _ in EXPORT_COLUMNS])
+        yield buffer.getvalue().encode('utf-8')
+        async for batch in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            for doc in ExportService._rows(batch):
+                writer.writerow([
+                    '' if value is None else ExportService._text(value)
+                    for value in doc.values()
+                ])
+            yield buffer.getvalue().encode('utf-8')
+
+    @staticmethod
+    def _arrow_schema():
+        """Arrow schema for EXPORT_COLUMNS; explicit so all-null batches keep their types."""
+        types = {
+            'string': pa.string(),
+            'timestamp': pa.timestamp('ms'),
+            'float': pa.float64(),
+            'int': pa.int64(),
+        }
+        return pa.schema([(name, types[kind]) for name, kind in EXPORT_COLUMNS])
+
+    @staticmethod
+    async def _parquet_stream(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+        schema = ExportService._arrow_schema()
+        sink = _ParquetSink()
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            # One row group per batch, sent as soon as it is written
+            async for batch in batches:
+                writer.write_table(pa.Table.from_pylist(ExportService._rows(batch), schema=schema))
+                yield sink.drain()
+            # Closing writes the footer that makes the file readable
+            writer.close()
+            yield sink.drain()
+        finally:
+            if writer.is_open:
+                writer.close()
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, UTC
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional
+from uuid import uuid4
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted to a queue that is already full."""
+
+
+class Job:
+    """
+    A spooled upload waiting for, or going through, analysis.
+
+    Holds everything a worker needs to analyze the file without the request
+    that submitted it, and the progress the status endpoint reports.
+    """
+
+    def __init__(self, path: str, filename: str, file_size: int, site_name: Optional[str],
+                 store_readings: bool, idempotency_key: Optional[str], context: Any = None):
+        self.id = uuid4().hex
+        self.path = path
+        self.filename = filename
+        self.file_size = file_size
+        self.site_name = site_name
+        self.store_readings = store_readings
+        self.idempotency_key = idempotency_key
+        # Whatever the handler needs from the submitting request, such as
+        # the repositories it resolved
+        self.context = context
+        self.status: JobStatus = "queued"
+        self.submitted_at = datetime.now(UTC)
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.rows_processed = 0
+        self.analysis_id: Optional[str] = None
+        self.replayed = False
+        self.error_status: Optional[int] = None
+        self.error: Any = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def start(self) -> None:
+        self.status = "running"
+        self.started_at = datetime.now(UTC)
+
+    def succeed(self, analysis_id: str, replayed: bool = False) -> None:
+        self.status = "succeeded"
+        self.analysis_id = analysis_id
+        self.replayed = replayed
+        self.finished_at = datetime.now(UTC)
+
+    def fail(self, status_code: int, error: Any) -> None:
+        self.status = "failed"
+        self.error_status = status_code
+        self.error = error
+        self.finished_at = datetime.now(UTC)
+
+    def remove_spool(self) -> None:
+        """Delete the spooled upload; the job no longer needs it."""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class JobQueue(ABC):
+    """
+    Bounded queue of upload jobs and the status of recent ones.
+
+    JobWorkers take jobs from it and report progress back through update,
+    so a backend keeping jobs outside the process only has to persist what
+    update hands it.
+    """
+
+    @abstractmethod
+    async def full(self) -> bool:
+        """Whether submit would be refused right now."""
+
+    @abstractmethod
+    async def submit(self, job: Job) -> None:
+        """
+        Queue a job for the workers.
+
+        Raises:
+            JobQueueFull: If the queue already holds its maximum of jobs
+        """
+
+    @abstractmethod
+    async def next(self) -> Job:
+        """Wait for the next queued job."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        """Fetch a job by id, if it is known."""
+
+    @abstractmethod
+    async def update(self, job: Job) -> None:
+        """Record a change to a job's status or progress."""
+
+    @abstractmethod
+    async def drain(self) -> List[Job]:
+        """Remove and return the jobs still waiting to run."""
+
+
+class InMemoryJobQueue(JobQueue):
+    """
+    Job queue held by the worker process.
+
+    Jobs live in a dict and wait in an asyncio.Queue of at most maxsize
+    entries. Finished jobs are forgotten retention seconds after they
+    finish, checked whenever a job is submitted.
+    """
+
+    def __init__(self, maxsize: int, retention: float):
+        self.maxsize = maxsize
+        self.retention = retention
+        self.jobs: Dict[str, Job] = {}
+        self.pending: asyncio.Queue = asyncio.Queue(maxsize)
+        # job id -> monotonic time it finished
+        self._finished: Dict[str, float] = {}
+
+    async def full(self) -> bool:
+        return self.pending.full()
+
+    async def submit(self, job: Job) -> None:
+        self._prune()
+        try:
+            self.pending.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"{self.maxsize} jobs are already queued")
+        self.jobs[job.id] = job
+
+    async def next(self) -> Job:
+        return await self.pending.get()
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def update(self, job: Job) -> None:
+        # Jobs are shared with the workers, so only finishing needs noting
+        if job.finished:
+            self._finished.setdefault(job.id, time.monotonic())
+
+    async def drain(self) -> List[Job]:
+        drained = []
+        while not self.pending.empty():
+            drained.append(self.pending.get_nowait())
+        return drained
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.retention
+        for job_id, finished in list(self._finished.items()):
+            if finished <= cutoff:
+                del self._finished[job_id]
+                self.jobs.pop(job_id, None)
+
+
+# Analyzes one job and records its outcome on it
+JobHandler = Callable[[Job, JobQueue], Awaitable[None]]
+
+
+class JobWorkers:
+    """
+    Fixed pool of asyncio tasks running queued jobs one at a time each.
+
+    The heavy lifting of a job happens in the parse pool, so a worker task
+    mostly waits; the number of workers bounds how many jobs are analyzed
+    at once.
+    """
+
+    def __init__(self, queue: JobQueue, handler: JobHandler, count: int):
+        self.queue = queue
+        self.handler = handler
+        self.count = count
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the worker tasks on the running event loop."""
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.count)]
+
+    async def stop(self) -> None:
+        """
+        Cancel the workers and fail every job that has not finished.
+
+        Jobs only live as long as the process, so queued and interrupted
+        jobs are marked failed and their spooled uploads removed.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for job in await self.queue.drain():
+            job.fail(503, "Server shut down before the job ran")
+            job.remove_spool()
+            await self.queue.update(job)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self.queue.next()
+            job.start()
+            await self.queue.update(job)
+            try:
+                await self.handler(job, self.queue)
+            except asyncio.CancelledError:
+                job.fail(503, "Server shut down before the job finished")
+                raise
+            except Exception:
+                logger.exception(f"Job {job.id} failed")
+                job.fail(500, "Internal error while processing the upload")
+            finally:
+                job.remove_spool()
+                await self.queue.update(job)
+
+
+_queue: Optional[JobQueue] = None
+_workers: Optional[JobWorkers] = None
+
+
+def start_job_workers(handler: JobHandler, queue: Optional[JobQueue] = None) -> JobQueue:
+    """
+    Install the job queue for the routes and start JOB_WORKERS workers on it.
+
+    Args:
+        handler: Runs one job
+        queue: Queue backend to use; an InMemoryJobQueue of JOB_QUEUE_SIZE
+            jobs if omitted
+
+    Returns:
+        The installed queue
+    """
+    global _queue, _workers
+
+    if queue is None:
+        queue = InMemoryJobQueue(settings.JOB_QUEUE_SIZE, settings.JOB_RETENTION)
+    _queue = queue
+    _workers = JobWorkers(queue, handler, settings.JOB_WORKERS)
+    _workers.start()
+    logger.info(f"Started {settings.JOB_WORKERS} upload job workers")
+    return queue
+
+
+async def stop_job_workers() -> None:
+    """Stop the workers and uninstall the job queue."""
+    global _queue, _workers
+    if _workers is not None:
+        await _workers.stop()
+        logger.info("Upload job workers stopped")
+    _queue = None
+    _workers = None
+
+
+def get_job_queue() -> JobQueue:
+    """
+    FastAPI dependency returning the active JobQueue.
+
+    Tests can replace it with app.dependency_overrides.
+    """
+    if _queue is None:
+        raise RuntimeError("Job queue has not been started")
+    return _queue
@@ -1,98 +1,197 @@
-from typing import Tuple
+import sys
+import numpy as np
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.rule_table import RuleTable, get_rule_table, on_rule_change
+
+# Rule tables memoized before the memo resets; bounds a worker of the parse
+# pool, which is never told of rule table changes
+MEMO_TABLES = 64
+
+
+class Recommendation(NamedTuple):
+    """Rule and band names of one rule table cell; all shared, interned strings."""
+    rule_code: str
+    treatment_train: str
+    explanation: str
+    ph_category: Optional[str]  # None for the fallback cell of missing values
+    tds_category: Optional[str]
+
+
+class RecommendationMemo:
+    """
+    Recommendation of each rule table cell, built the first time it is asked for.
+
+    The cell, i.e. the pair of pH and TDS bands, decides the whole result,
+    so averages that differ only within their bands share one entry, and a
+    hit hands out the stored tuple without allocating. Entries are keyed by
+    RuleTable.key, so the copies of a table each parse pool task receives
+    share them, and are dropped whenever the active rule table changes.
+    """
+
+    def __init__(self):
+        # RuleTable.key -> the table's cells' recommendations, fallback cell last
+        self.cells: Dict[Tuple[str, Optional[str], str], List[Optional[Recommendation]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, table: RuleTable, cell: int) -> Recommendation:
+        """Recommendation of a cell of table (see RuleTable.cell)."""
+        cells = self.cells.get(table.key)
+        if cells is None:
+            if len(self.cells) >= MEMO_TABLES:
+                self.cells.clear()
+            cells = self.cells[table.key] = [None] * len(table.codes)
+        recommendation = cells[cell]
+        if recommendation is None:
+            self.misses += 1
+            recommendation = cells[cell] = self._build(table, cell)
+        else:
+            self.hits += 1
+        return recommendation
+
+    @staticmethod
+    def _build(table: RuleTable, cell: int) -> Recommendation:
+        code = sys.intern(str(table.codes[cell]))
+        treatment_train, explanation = table.recommendation(code)
+        if cell == table.fallback_index:
+            return Recommendation(code, treatment_train, explanation, None, None)
+        ph_band, tds_band = divmod(cell, len(table.tds_bands))
+        return Recommendation(code, treatment_train, explanation,
+                              table.ph_bands[ph_band], table.tds_bands[tds_band])
+
+    def clear(self) -> None:
+        """Forget every entry; the hit and miss counts carry on."""
+        self.cells = {}
+
+    def info(self) -> Dict[str, Any]:
+        """Hits, misses and hit ratio since the process started, and cells held."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "cells": sum(cell is not None for cells in self.cells.values() for cell in cells)
+        }
+
+
+_memo = RecommendationMemo()
+on_rule_change(_memo.clear)
 
 
 class RecommendationService:
-    """Service for generating water treatment recommendations."""
-    
+    """
+    Service for generating water treatment recommendations.
+
+    Thresholds, rules and their text come from the rule table (see
+    app.services.rule_table). Every method takes an optional compiled table,
+    e.g. a site's profile; without one the active default profile is used.
+    """
+
     @staticmethod
-    def get_recommendation(avg_ph: float, avg_tds: float) -> Tuple[str, str]:
+    def get_rule_code(avg_ph: float, avg_tds: float, table: Optional[RuleTable] = None) -> str:
+        """
+        Classify one pH/TDS pair into a rule code.
+
+        Args:
+            avg_ph: Average pH value
+            avg_tds: Average TDS value in mg/L or ppm
+            table: Rule table profile to classify with
+
+        Returns:
+            Rule code, or the fallback code if either value is missing (NaN)
+        """
+        table = table or get_rule_table()
+        return _memo.lookup(table, table.cell(avg_ph, avg_tds)).rule_code
+
+    @staticmethod
+    def recommend(avg_ph: float, avg_tds: float, table: Optional[RuleTable] = None) -> Recommendation:
+        """
+        Rule, treatment and band names of one pH/TDS pair, memoized per cell.
+
+        Args:
+            avg_ph: Average pH value
+            avg_tds: Average TDS value in mg/L or ppm
+            table: Rule table profile to classify with
+
+        Returns:
+            The Recommendation shared by every pair in the same pH and TDS bands
+        """
+        table = table or get_rule_table()
+        return _memo.lookup(table, table.cell(avg_ph, avg_tds))
+
+    @staticmethod
+    def get_recommendation(avg_ph: float, avg_tds: float,
+                           table: Optional[RuleTable] = None) -> Tuple[str, str]:
         """
         Generate treatment recommendation based on pH and TDS values.
-        
+
         Args:
             avg_ph: Average pH value
             avg_tds: Average TDS value in mg/L or ppm
-            
+            table: Rule table profile to classify with
+
         Returns:
             Tuple of (treatment_train, explanation)
         """
-        # Determine pH range
-        ph_low = avg_ph <= 7.5
-        ph_target = 7.5 < avg_ph < 8.3
-        ph_high = avg_ph >= 8.3
-        
-        # Determine TDS range
-        tds_low = avg_tds < 100
-        tds_moderate = 100 <= avg_tds < 300
-        tds_high = avg_tds >= 300
-        
-        # Apply rules
-        
-        # Rule A - Clean Water (No Treatment Required)
-        if ph_target and tds_low:
-            return (
-                "No treatment required",
-                "Water is within the target pH range and has low TDS, so it is considered clean and unlikely to cause corrosion."
-            )
-        
-        # Rule B - High pH, Low TDS
-        if ph_high and tds_low:
-            return (
-                "pH adjustment with sulfuric acid (H₂SO₄)",
-                "pH is above the target range; acid dosing is recommended to bring pH into the safe operating range."
-            )
-        
-        # Rule C - Low pH, Low TDS
-        if ph_low and tds_low:
-            return (
-                "pH adjustment with sodium hydroxide (NaOH)",
-                "pH is below the target range; caustic dosing is recommended to bring pH into the safe operating range."
-            )
-        
-        # Rule D - Moderate TDS, Target pH
-        if ph_target and tds_moderate:
-            return (
-                "Reverse osmosis (RO)",
-                "TDS is elevated; RO is recommended to reduce dissolved solids while pH is already in range."
-            )
-        
-        # Rule E - High TDS, Target pH
-        if ph_target and tds_high:
-            return (
-                "Ion exchange",
-                "TDS is high; ion exchange is recommended to remove dissolved ions effectively while pH is in range."
-            )
-        
-        # Rule F - Moderate TDS, High pH
-        if ph_high and tds_moderate:
-            return (
-                "pH adjustment with H₂SO₄ → Reverse osmosis (RO)",
-                "pH is above target range and TDS is elevated. First adjust pH with acid dosing, then use RO to reduce dissolved solids."
-            )
-        
-        # Rule G - Moderate TDS, Low pH
-        if ph_low and tds_moderate:
-            return (
-                "pH adjustment with NaOH → Reverse osmosis (RO)",
-                "pH is below target range and TDS is elevated. First adjust pH with caustic dosing, then use RO to reduce dissolved solids."
-            )
-        
-        # Rule H - High TDS, High pH
-        if ph_high and tds_high:
-            return (
-                "pH adjustment with H₂SO₄ → Ion exchange",
-                "pH is above target range and TDS is high. First adjust pH with acid dosing, then use ion exchange to remove dissolved ions."
-            )
-        
-        # Rule I - High TDS, Low pH
-        if ph_low and tds_high:
-            return (
-                "pH adjustment with NaOH → Ion exchange",
-                "pH is below target range and TDS is high. First adjust pH with caustic dosing, then use ion exchange to remove dissolved ions."
-            )
-        
-        # Fallback (should not reach here with proper logic)
-        return (
-            "Contact water treatment specialist",
-            "Water parameters are outside typical ranges. Professional consultation recommended."
-        )
+        table = table or get_rule_table()
+        # The rules tuple itself, shared by every caller
+        return table.rules[_memo.lookup(table, table.cell(avg_ph, avg_tds)).rule_code]
+
+    @staticmethod
+    def cache_info() -> Dict[str, Any]:
+        """Counters of the per-cell memo behind recommend() (see RecommendationMemo.info)."""
+        return _memo.info()
+
+    @staticmethod
+    def get_rule_indices(ph: np.ndarray, tds: np.ndarray, table: Optional[RuleTable] = None) -> np.ndarray:
+        """
+        Classify whole arrays of pH/TDS pairs into rule table cells.
+
+        The pH and TDS bands of every pair select a cell of the table's lookup
+        matrix with a few vectorised passes instead of a Python rule walk per
+        pair.
+
+        Args:
+            ph: pH values; NaN marks a missing reading
+            tds: TDS values in mg/L or ppm, same length as ph
+            table: Rule table profile to classify with
+
+        Returns:
+            int8 array indexing the table's codes, treatments and explanations
+
+        Raises:
+            ValueError: If the arrays differ in shape
+        """
+        table = table or get_rule_table()
+        ph = np.asarray(ph, dtype=np.float64)
+        tds = np.asarray(tds, dtype=np.float64)
+        if ph.shape != tds.shape:
+            raise ValueError("pH and TDS arrays must have the same length")
+
+        index = np.empty(ph.shape, dtype=np.uint8)
+        table.classify_into(ph, tds, index, np.empty(ph.shape, dtype=bool))
+        index[np.isnan(ph) | np.isnan(tds)] = table.fallback_index
+        return index.view(np.int8)
+
+    @staticmethod
+    def get_recommendations_batch(ph: np.ndarray, tds: np.ndarray,
+                                  table: Optional[RuleTable] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Vectorised get_recommendation; results match it pair for pair.
+
+        Args:
+            ph: pH values; NaN marks a missing reading
+            tds: TDS values in mg/L or ppm, same length as ph
+            table: Rule table profile to classify with
+
+        Returns:
+            Tuple of (rule_codes, treatment_trains, explanations) arrays. The
+            string arrays are object arrays referencing the shared rule text.
+
+        Raises:
+            ValueError: If the arrays differ in shape
+        """
+        table = table or get_rule_table()
+        index = RecommendationService.get_rule_indices(ph, tds, table)
+        return table.codes[index], table.treatments[index], table.explanations[index]
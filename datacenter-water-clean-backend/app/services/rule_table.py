@@ -0,0 +1,413 @@
+import bisect
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULE_TABLE_PATH = Path(__file__).resolve().parent.parent / "core" / "rule_table.json"
+
+# Up to this many edges per axis, arrays are banded with one comparison pass
+# per edge, which beats np.searchsorted by several times for small tables
+COMPARE_EDGES_MAX = 8
+
+# Cell positions are returned as int8, so a table has at most this many cells
+MAX_CELLS = 127
+
+
+class RuleTableError(ValueError):
+    """Raised when a rule table configuration is invalid."""
+
+
+class RuleTable:
+    """
+    One compiled threshold profile of the treatment rule table.
+
+    Each axis (pH, TDS) is compiled into ascending band edges in np.digitize
+    form: a value's band is the number of edges at or below it, found by
+    bisection for a single value. A threshold that belongs to the band below
+    it is stored as the next float above its value, so boundary handling is
+    decided once, in the config, instead of in every comparison.
+
+    The rule for a pair is the cell ph_band * len(tds_bands) + tds_band of a
+    dense lookup matrix, with the fallback rule in an extra last cell. The
+    codes, treatments and explanations arrays are indexed by cell, so scalar
+    and vectorised classification read the same tables.
+    """
+
+    def __init__(self, version: str, profile: Optional[str],
+                 ph_bands: Tuple[str, ...], ph_edges: List[float],
+                 tds_bands: Tuple[str, ...], tds_edges: List[float],
+                 cell_codes: List[str], rules: Dict[str, Tuple[str, str]],
+                 fallback: str, no_treatment: str):
+        self.version = version
+        self.profile = profile
+        self.ph_bands = ph_bands
+        self.tds_bands = tds_bands
+        self.ph_edges = np.array(ph_edges, dtype=np.float64)
+        self.tds_edges = np.array(tds_edges, dtype=np.float64)
+        self._ph_edges = list(ph_edges)
+        self._tds_edges = list(tds_edges)
+        self.rules = rules
+        self.fallback = fallback
+        self.no_treatment = no_treatment
+
+        # Per-cell lookup arrays. The string arrays reference the rule text
+        # objects, so result rows share one object per rule.
+        self.codes = np.array(cell_codes + [fallback])
+        self.treatments = np.array([rules[code][0] for code in self.codes], dtype=object)
+        self.explanations = np.array([rules[code][1] for code in self.codes], dtype=object)
+        self.fallback_index = len(self.codes) - 1
+
+        # Codes that some cell maps to, in code order
+        self.grid_codes = tuple(sorted(set(cell_codes)))
+
+        # Identifies the compiled content across processes: copies sent to
+        # the parse pool are new objects with the same key
+        content = (ph_bands, list(ph_edges), tds_bands, list(tds_edges), cell_codes,
+                   sorted(rules.items()), fallback, no_treatment)
+        digest = hashlib.blake2b(repr(content).encode(), digest_size=12).hexdigest()
+        self.key: Tuple[str, Optional[str], str] = (version, profile, digest)
+
+    @property
+    def cell_count(self) -> int:
+        """Number of (pH band, TDS band) cells, excluding the fallback."""
+        return len(self.ph_bands) * len(self.tds_bands)
+
+    def ph_category(self, ph: float) -> str:
+        """pH band name of a value."""
+        return self.ph_bands[bisect.bisect_right(self._ph_edges, ph)]
+
+    def tds_category(self, tds: float) -> str:
+        """TDS band name of a value."""
+        return self.tds_bands[bisect.bisect_right(self._tds_edges, tds)]
+
+    def cell(self, ph: float, tds: float) -> int:
+        """Lookup position of one pH/TDS pair; NaN in either gives the fallback."""
+        if ph != ph or tds != tds:
+            return self.fallback_index
+        return (bisect.bisect_right(self._ph_edges, ph) * len(self.tds_bands)
+                + bisect.bisect_right(self._tds_edges, tds))
+
+    def rule_code(self, ph: float, tds: float) -> str:
+        """Rule code of one pH/TDS pair."""
+        return str(self.codes[self.cell(ph, tds)])
+
+    def recommendation(self, code: str) -> Tuple[str, str]:
+        """(treatment_train, explanation) of a rule; unknown codes get the fallback."""
+        return self.rules.get(code, self.rules[self.fallback])
+
+    def classify_into(self, ph: np.ndarray, tds: np.ndarray, out: np.ndarray,
+                      flags: np.ndarray) -> np.ndarray:
+        """
+        Write the cell position of each pH/TDS pair into out.
+
+        Works in the caller's buffers, so hot loops classify without
+        allocating. NaN is not detected; callers that may see it must mask it.
+
+        Args:
+            ph: pH values
+            tds: TDS values, same length as ph
+            out: uint8 buffer of the same length, receives the positions
+            flags: bool scratch buffer of the same length
+
+        Returns:
+            out
+        """
+        out.fill(0)
+        self._add_bands(ph, self.ph_edges, out, flags)
+        np.multiply(out, len(self.tds_bands), out=out, casting='unsafe')
+        self._add_bands(tds, self.tds_edges, out, flags)
+        return out
+
+    @staticmethod
+    def _add_bands(values: np.ndarray, edges: np.ndarray, out: np.ndarray, flags: np.ndarray) -> None:
+        """Add each value's band number to out."""
+        if len(edges) > COMPARE_EDGES_MAX:
+            np.add(out, np.searchsorted(edges, values, side='right'), out=out, casting='unsafe')
+            return
+        for edge in edges:
+            np.greater_equal(values, edge, out=flags)
+            np.add(out, flags, out=out, casting='unsafe')
+
+    def target_bands(self) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        """
+        pH and TDS ranges of the no-treatment rule, as (low, high) edges.
+
+        A value is in range when low <= value < high. If no cell maps to the
+        no-treatment rule, both ranges are unbounded.
+        """
+        cells = np.flatnonzero(self.codes[:-1] == self.no_treatment)
+        if len(cells) == 0:
+            return (-np.inf, np.inf), (-np.inf, np.inf)
+        ph_band, tds_band = divmod(int(cells[0]), len(self.tds_bands))
+        bands = []
+        for band, edges in ((ph_band, self._ph_edges), (tds_band, self._tds_edges)):
+            bounds = [-np.inf] + edges + [np.inf]
+            bands.append((bounds[band], bounds[band + 1]))
+        return tuple(bands)
+
+    def count_by_code(self, cell_counts: np.ndarray) -> Dict[str, int]:
+        """Fold per-cell counts (fallback cell ignored) into counts per rule code."""
+        counts = dict.fromkeys(self.grid_codes, 0)
+        for code, count in zip(self.codes[:-1].tolist(), cell_counts[:self.cell_count].tolist()):
+            counts[code] += count
+        return counts
+
+
+class RuleConfig:
+    """
+    A loaded rule table file: the default profile plus per-site profiles.
+
+    Sites may override the pH and/or TDS thresholds; band names, the rule
+    matrix and the rule text are shared, so rule codes mean the same thing
+    everywhere.
+    """
+
+    def __init__(self, version: str, default: RuleTable, sites: Dict[str, RuleTable],
+                 path: Optional[Path] = None, mtime_ns: Optional[int] = None):
+        self.version = version
+        self.default = default
+        self.sites = sites
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.loaded_at = datetime.now(UTC)
+
+    def for_site(self, site_name: Optional[str]) -> RuleTable:
+        """Profile for a site, or the default profile."""
+        if site_name is None:
+            return self.default
+        return self.sites.get(site_name, self.default)
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any], path: Optional[Path] = None,
+                  mtime_ns: Optional[int] = None) -> "RuleConfig":
+        """
+        Validate and compile a rule table configuration.
+
+        Raises:
+            RuleTableError: If the configuration is incomplete or inconsistent
+        """
+        if not isinstance(config, dict):
+            raise RuleTableError("Rule table must be a JSON object")
+        version = str(config.get('version', ''))
+        ph_bands, ph_edges = _compile_axis('ph', config.get('ph'))
+        tds_bands, tds_edges = _compile_axis('tds', config.get('tds'))
+
+        if len(ph_bands) * len(tds_bands) > MAX_CELLS:
+            raise RuleTableError(f"Rule table has more than {MAX_CELLS} band combinations")
+
+        rules = _compile_rules(config.get('treatments'))
+        fallback = config.get('fallback')
+        no_treatment = config.get('no_treatment', 'A')
+        for key, code in (('fallback', fallback), ('no_treatment', no_treatment)):
+            if code not in rules:
+                raise RuleTableError(f"'{key}' must name a rule in 'treatments', got {code!r}")
+
+        matrix = config.get('rules')
+        cell_codes = []
+        for ph_band in ph_bands:
+            row = matrix.get(ph_band) if isinstance(matrix, dict) else None
+            for tds_band in tds_bands:
+                code = row.get(tds_band) if isinstance(row, dict) else None
+                if code is None:
+                    raise RuleTableError(f"No rule for pH band '{ph_band}' and TDS band '{tds_band}'")
+                if code not in rules:
+                    raise RuleTableError(f"Rule '{code}' has no entry in 'treatments'")
+                cell_codes.append(sys.intern(code))
+
+        def profile(name: Optional[str], ph: List[float], tds: List[float]) -> RuleTable:
+            return RuleTable(version, name, ph_bands, ph, tds_bands, tds,
+                             cell_codes, rules, fallback, no_treatment)
+
+        sites = {}
+        for site_name, overrides in (config.get('sites') or {}).items():
+            if not isinstance(overrides, dict):
+                raise RuleTableError(f"Site profile '{site_name}' must be an object")
+            _, site_ph = _compile_axis('ph', overrides['ph'], ph_bands) if 'ph' in overrides else (ph_bands, ph_edges)
+            _, site_tds = _compile_axis('tds', overrides['tds'], tds_bands) if 'tds' in overrides else (tds_bands, tds_edges)
+            sites[site_name] = profile(site_name, site_ph, site_tds)
+
+        return cls(version, profile(None, ph_edges, tds_edges), sites, path, mtime_ns)
+
+    @classmethod
+    def load(cls, path: Path) -> "RuleConfig":
+        """
+        Read and compile a rule table file.
+
+        Raises:
+            RuleTableError: If the file cannot be read or is invalid
+        """
+        path = Path(path)
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+            config = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            raise RuleTableError(f"Cannot read rule table {path}: {e}") from None
+        return cls.from_dict(config, path, mtime_ns)
+
+
+def _compile_axis(name: str, spec: Any, bands: Optional[Tuple[str, ...]] = None) -> Tuple[Tuple[str, ...], List[float]]:
+    """
+    Compile one axis of the config into band names and digitize edges.
+
+    Thresholds are numbers or {"value": v, "belongs_to": "lower" | "upper"};
+    a bare number, like "upper", starts the band above it. A site override
+    passes the default bands and only supplies thresholds.
+    """
+    if not isinstance(spec, dict):
+        raise RuleTableError(f"'{name}' must be an object")
+    if bands is None:
+        bands = spec.get('bands')
+        if not isinstance(bands, list) or len(bands) < 2 or len(set(bands)) != len(bands):
+            raise RuleTableError(f"'{name}.bands' must list at least two distinct band names")
+        bands = tuple(sys.intern(str(band)) for band in bands)
+
+    thresholds = spec.get('thresholds')
+    if not isinstance(thresholds, list) or len(thresholds) != len(bands) - 1:
+        raise RuleTableError(f"'{name}.thresholds' must have {len(bands) - 1} entries, one between each band")
+
+    edges = []
+    for threshold in thresholds:
+        if not isinstance(threshold, dict):
+            threshold = {'value': threshold}
+        value = threshold.get('value')
+        belongs_to = threshold.get('belongs_to', 'upper')
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise RuleTableError(f"'{name}' threshold {value!r} is not a finite number")
+        if belongs_to not in ('lower', 'upper'):
+            raise RuleTableError(f"'{name}' threshold belongs_to must be 'lower' or 'upper'")
+        edge = float(value)
+        edges.append(math.nextafter(edge, math.inf) if belongs_to == 'lower' else edge)
+
+    if any(low >= high for low, high in zip(edges, edges[1:])):
+        raise RuleTableError(f"'{name}.thresholds' must be in increasing order")
+    return bands, edges
+
+
+def _compile_rules(treatments: Any) -> Dict[str, Tuple[str, str]]:
+    """
+    Map rule codes to (treatment_train, explanation).
+
+    Codes and text are interned, so every profile, and every reload of
+    unchanged text, hands out the same string objects.
+    """
+    if not isinstance(treatments, dict) or not treatments:
+        raise RuleTableError("'treatments' must map rule codes to their text")
+    rules = {}
+    for code, text in treatments.items():
+        try:
+            rules[sys.intern(code)] = (sys.intern(str(text['treatment_train'])),
+                                       sys.intern(str(text['explanation'])))
+        except (KeyError, TypeError):
+            raise RuleTableError(f"Rule '{code}' needs a treatment_train and an explanation") from None
+    return rules
+
+
+_config: Optional[RuleConfig] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+# Called with no arguments whenever the active rule table is replaced
+_listeners: List[Callable[[], None]] = []
+
+
+def rule_table_path() -> Path:
+    """Rule table file in use: RULE_TABLE_PATH, or the bundled default."""
+    return Path(settings.RULE_TABLE_PATH) if settings.RULE_TABLE_PATH else DEFAULT_RULE_TABLE_PATH
+
+
+def get_rule_config() -> RuleConfig:
+    """
+    Return the active rule table, loading it on first use.
+
+    At most every RULE_TABLE_RELOAD_INTERVAL seconds the file's modification
+    time is checked, and a changed file is compiled and swapped in. Each
+    server process polls on its own, so an edit reaches every worker without
+    a restart. A file that fails to compile is logged and the previous table
+    stays active.
+
+    Raises:
+        RuleTableError: If no table is loaded yet and the file is invalid
+    """
+    global _checked_at
+    config = _config
+    if config is None:
+        with _lock:
+            if _config is None:
+                set_rule_config(RuleConfig.load(rule_table_path()))
+            return _config
+
+    interval = settings.RULE_TABLE_RELOAD_INTERVAL
+    if config.path is None or interval <= 0:
+        return config
+    now = time.monotonic()
+    if now - _checked_at < interval:
+        return config
+
+    with _lock:
+        _checked_at = now
+        try:
+            mtime_ns = os.stat(config.path).st_mtime_ns
+        except OSError as e:
+            logger.error(f"Cannot check rule table {config.path}: {e}")
+            return _config
+        if mtime_ns != _config.mtime_ns:
+            try:
+                set_rule_config(RuleConfig.load(config.path))
+                logger.info(f"Reloaded rule table {config.path} (version {_config.version})")
+            except RuleTableError as e:
+                # Remember the broken file so it is not re-parsed on every check
+                _config.mtime_ns = mtime_ns
+                logger.error(f"Keeping rule table version {_config.version}: {e}")
+        return _config
+
+
+def get_rule_table(site_name: Optional[str] = None) -> RuleTable:
+    """Active threshold profile for a site, or the default profile."""
+    return get_rule_config().for_site(site_name)
+
+
+def reload_rule_config() -> RuleConfig:
+    """
+    Compile the rule table file now and make it active.
+
+    Raises:
+        RuleTableError: If the file is invalid; the previous table stays active
+    """
+    config = RuleConfig.load(rule_table_path())
+    with _lock:
+        set_rule_config(config)
+    logger.info(f"Reloaded rule table {config.path} (version {config.version})")
+    return config
+
+
+def on_rule_change(listener: Callable[[], None]) -> None:
+    """
+    Call listener whenever the active rule table is replaced.
+
+    For results derived from a table, such as memoized recommendations,
+    to be dropped along with it. Listeners run in the replacing thread,
+    with the new table already active.
+    """
+    _listeners.append(listener)
+
+
+def set_rule_config(config: Optional[RuleConfig]) -> None:
+    """Replace the active rule table; None reloads from the file on next use."""
+    global _config, _checked_at
+    _config = config
+    _checked_at = time.monotonic()
+    for listener in _listeners:
+        listener()
@@ -0,0 +1,238 @@
+import numpy as np
+from typing import Dict, List, Optional
+
+from app.services.rule_table import RuleTable, get_rule_table
+
+
+# Fixed histogram layout per column: (lower edge, upper edge, number of bins).
+# Fixed edges keep histograms from different chunks or workers addable.
+HISTOGRAM_LAYOUT = {
+    'ph': (0.0, 14.0, 1400),      # 0.01 pH resolution
+    'tds': (0.0, 10000.0, 10000)  # 1 mg/L resolution
+}
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Readings processed per inner step; two float64 rows of this size fit in L2
+BLOCK_SIZE = 32768
+
+
+class StatsAccumulator:
+    """
+    Mergeable pH/TDS statistics state.
+
+    Readings are supplied as a (2, n) float64 array, pH in row 0 and TDS in
+    row 1, so every reduction walks one contiguous buffer per column and
+    handles both columns in the same call. Large inputs are consumed in
+    cache-sized blocks, so the moment, extremum and histogram reductions all
+    run over data that is already in cache and the work is effectively a
+    single pass over memory. Rows where either value is missing
+    are ignored, matching the dropna() behaviour of the original service.
+
+    Every row is also classified against a rule table profile in the same
+    block pass, giving a count of readings per rule table cell. The profile
+    travels with the accumulator, so parse workers classify with the table
+    the upload was started with even if it is reloaded meanwhile.
+
+    Count, mean and variance are combined with Chan's parallel update, min and
+    max element-wise, rule counts by addition, and percentiles come from
+    fixed-edge histograms. Two
+    accumulators built from different chunks or processes can therefore be
+    merged into exactly the state a single pass over all rows would produce.
+    """
+
+    COLUMNS = ('ph', 'tds')
+
+    def __init__(self, table: Optional[RuleTable] = None):
+        self.table = table or get_rule_table()
+        self.count = 0
+        self.mean = np.zeros(2)
+        self.m2 = np.zeros(2)
+        self.min = np.full(2, np.inf)
+        self.max = np.full(2, -np.inf)
+        self.histograms = [
+            np.zeros(HISTOGRAM_LAYOUT[col][2], dtype=np.int64)
+            for col in self.COLUMNS
+        ]
+        self.rule_counts = np.zeros(len(self.table.codes), dtype=np.int64)
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, table: Optional[RuleTable] = None) -> "StatsAccumulator":
+        """Build an accumulator from a (2, n) array of readings."""
+        accumulator = cls(table)
+        accumulator.update(values)
+        return accumulator
+
+    def update(self, values: np.ndarray) -> "StatsAccumulator":
+        """
+        Fold a (2, n) block of readings into the state.
+
+        Args:
+            values: pH and TDS readings; NaN marks a missing value
+
+        Returns:
+            The accumulator itself, for chaining
+        """
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        if values.ndim != 2 or values.shape[0] != 2:
+            raise ValueError("Expected a (2, n) array of pH and TDS readings")
+
+        # Work through cache-sized blocks so every reduction over a block hits
+        # data the previous one just loaded, reusing the same scratch buffers
+        block_size = min(BLOCK_SIZE, values.shape[1])
+        scratch = np.empty((2, block_size), dtype=np.float64)
+        indices = np.empty(block_size, dtype=np.intp)
+        masks = np.empty((len(self.table.ph_edges) + len(self.table.tds_edges) + 1, block_size), dtype=bool)
+        for start in range(0, values.shape[1], BLOCK_SIZE):
+            self._update_block(values[:, start:start + BLOCK_SIZE], scratch, indices, masks)
+        return self
+
+    def _update_block(self, block: np.ndarray, scratch: np.ndarray, indices: np.ndarray,
+                      masks: np.ndarray) -> None:
+        """Fold one block into the state using preallocated scratch space."""
+        # The sums double as a NaN check: only compact when something is missing
+        sums = block.sum(axis=1)
+        if not np.isfinite(sums).all():
+            block = np.compress(np.isfinite(block).all(axis=0), block, axis=1)
+            sums = block.sum(axis=1)
+
+        n = block.shape[1]
+        if n == 0:
+            return
+
+        # Classify while the block is still in cache
+        self.rule_counts[:-1] += self._count_rules(self.table, block, masks[:, :n]).ravel()
+
+        mean = sums / n
+        centred = scratch[:, :n]
+        np.subtract(block, mean[:, None], out=centred)
+        m2 = np.einsum('ij,ij->i', centred, centred)
+
+        for row, col in enumerate(self.COLUMNS):
+            low, high, bins = HISTOGRAM_LAYOUT[col]
+            scaled = centred[row]
+            np.subtract(block[row], low, out=scaled)
+            np.multiply(scaled, bins / (high - low), out=scaled)
+            np.clip(scaled, 0, bins - 1, out=scaled)
+            np.copyto(indices[:n], scaled, casting='unsafe')
+            self.histograms[row] += np.bincount(indices[:n], minlength=bins)
+
+        self._merge_moments(n, mean, m2, block.min(axis=1), block.max(axis=1))
+
+    @staticmethod
+    def _count_rules(table: RuleTable, block: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        """
+        Count a NaN-free block's readings per rule table cell.
+
+        Rather than materialising a cell index per row, count how many rows
+        reach each pair of (pH band, TDS band) lower edges and difference the
+        counts: one comparison per edge and a few count_nonzero calls per
+        block.
+
+        Args:
+            table: Rule table profile to classify with
+            block: NaN-free (2, n) readings
+            masks: Scratch of one row per pH and TDS edge, plus one
+
+        Returns:
+            (pH bands, TDS bands) int64 counts laid out like the table's cells
+        """
+        n = block.shape[1]
+        ph_edges, tds_edges = len(table.ph_edges), len(table.tds_edges)
+        ph_masks, tds_masks, both = masks[:ph_edges], masks[ph_edges:-1], masks[-1]
+        for mask, edge in zip(ph_masks, table.ph_edges):
+            np.greater_equal(block[0], edge, out=mask)
+        for mask, edge in zip(tds_masks, table.tds_edges):
+            np.greater_equal(block[1], edge, out=mask)
+
+        # at_least[p, t]: rows whose pH band >= p and TDS band >= t
+        at_least = np.zeros((ph_edges + 2, tds_edges + 2), dtype=np.int64)
+        at_least[0, 0] = n
+        for ph_band, ph_mask in enumerate(ph_masks, 1):
+            at_least[ph_band, 0] = np.count_nonzero(ph_mask)
+        for tds_band, tds_mask in enumerate(tds_masks, 1):
+            at_least[0, tds_band] = np.count_nonzero(tds_mask)
+            for ph_band, ph_mask in enumerate(ph_masks, 1):
+                np.logical_and(ph_mask, tds_mask, out=both)
+                at_least[ph_band, tds_band] = np.count_nonzero(both)
+        return at_least[:-1, :-1] - at_least[1:, :-1] - at_least[:-1, 1:] + at_least[1:, 1:]
+
+    def merge(self, other: "StatsAccumulator") -> "StatsAccumulator":
+        """
+        Combine another accumulator into this one.
+
+        Returns:
+            The accumulator itself, for chaining
+        """
+        if other.count == 0:
+            return self
+        for mine, theirs in zip(self.histograms, other.histograms):
+            mine += theirs
+        self.rule_counts += other.rule_counts
+        self._merge_moments(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def _merge_moments(self, count: int, mean: np.ndarray, m2: np.ndarray,
+                       minimum: np.ndarray, maximum: np.ndarray) -> None:
+        """Chan's parallel update of count, mean and M2, plus min/max."""
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta * delta * (self.count * count / total)
+        self.count = total
+        self.min = np.minimum(self.min, minimum)
+        self.max = np.maximum(self.max, maximum)
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Sample variance (ddof=1) of pH and TDS."""
+        if self.count < 2:
+            return np.zeros(2)
+        return self.m2 / (self.count - 1)
+
+    def percentiles(self, qs=PERCENTILES) -> List[Dict[str, float]]:
+        """
+        Estimate percentiles from the histograms.
+
+        Values are interpolated within a bin, so they are accurate to the bin
+        width of HISTOGRAM_LAYOUT and always lie within [min, max].
+
+        Returns:
+            One {'p<q>': value} dictionary per column
+        """
+        results = []
+        for row, col in enumerate(self.COLUMNS):
+            low, high, bins = HISTOGRAM_LAYOUT[col]
+            width = (high - low) / bins
+            hist = self.histograms[row]
+            cumulative = np.cumsum(hist)
+            column = {}
+            for q in qs:
+                rank = q / 100 * self.count
+                index = min(int(np.searchsorted(cumulative, rank)), bins - 1)
+                before = cumulative[index - 1] if index > 0 else 0
+                fraction = (rank - before) / hist[index] if hist[index] else 0.0
+                value = low + (index + fraction) * width
+                column[f"p{q}"] = float(min(max(value, self.min[row]), self.max[row]))
+            results.append(column)
+        return results
+
+    def rule_distribution(self) -> Dict[str, int]:
+        """Number of readings falling under each treatment rule of the table."""
+        return self.table.count_by_code(self.rule_counts)
+
+    @property
+    def out_of_range_fraction(self) -> float:
+        """Fraction of readings that would individually need treatment."""
+        if self.count == 0:
+            return 0.0
+        in_range = self.rule_distribution().get(self.table.no_treatment, 0)
+        return float(1 - in_range / self.count)
+
+    @property
+    def dominant_rule(self) -> Optional[str]:
+        """Rule covering the most readings; ties go to the earliest rule code."""
+        if self.count == 0:
+            return None
+        counts = self.rule_distribution()
+        return max(sorted(counts), key=counts.get)
@@ -0,0 +1,275 @@
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.rule_table import RuleTable
+
+
+# Timestamps are int64 nanoseconds since the epoch (UTC); NaT marks a
+# missing or unparseable one, as in NumPy and pandas
+NAT = np.iinfo(np.int64).min
+NS_PER_MINUTE = 60 * 10**9
+
+EPOCH = datetime(1970, 1, 1)
+
+# Windows reported per analysis: name -> width in minutes
+WINDOWS = {'hourly': 60, 'daily': 1440}
+
+
+class TimeSeriesAccumulator:
+    """
+    Mergeable per-minute pH/TDS aggregates of a timestamped upload.
+
+    Readings are folded into one bucket per minute holding the count, sum,
+    min and max of each column, kept as parallel arrays sorted by minute.
+    Hourly and daily windows are reductions of those buckets, and the
+    rolling excursion check runs over them as well, so a month of per-second
+    readings is summarised from about 44,000 buckets instead of millions of
+    rows. Every step is a vectorised sort, reduceat or cumulative sum.
+
+    Like StatsAccumulator, rows missing pH, TDS or the timestamp are ignored,
+    and accumulators built from consecutive blocks merge into exactly the
+    state one pass over the whole file would produce. Merging in file order
+    also counts rows that go back in time across block boundaries.
+    """
+
+    def __init__(self):
+        self.minutes = np.empty(0, dtype=np.int64)
+        self.count = np.empty(0, dtype=np.int64)
+        self.sum = np.empty((2, 0), dtype=np.float64)
+        self.min = np.empty((2, 0), dtype=np.float64)
+        self.max = np.empty((2, 0), dtype=np.float64)
+        self.rows = 0
+        self.unparsed = 0
+        self.out_of_order = 0
+        # First and last timestamps in file order, and the overall range
+        self.first: Optional[int] = None
+        self.last: Optional[int] = None
+        self.earliest: Optional[int] = None
+        self.latest: Optional[int] = None
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, timestamps: np.ndarray) -> "TimeSeriesAccumulator":
+        """Build an accumulator from a (2, n) array of readings and their timestamps."""
+        accumulator = cls()
+        accumulator.update(values, timestamps)
+        return accumulator
+
+    def update(self, values: np.ndarray, timestamps: np.ndarray) -> "TimeSeriesAccumulator":
+        """
+        Fold readings taken at the given times into the state.
+
+        Args:
+            values: (2, n) pH and TDS readings; NaN marks a missing value
+            timestamps: n int64 nanosecond timestamps; NAT marks a missing one
+
+        Returns:
+            The accumulator itself, for chaining
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if values.shape != (2, len(timestamps)):
+            raise ValueError("Expected a (2, n) array of readings and n timestamps")
+
+        stamped = timestamps != NAT
+        self.unparsed += int(len(timestamps) - np.count_nonzero(stamped))
+        keep = stamped & np.isfinite(values).all(axis=0)
+        if not keep.all():
+            values = np.compress(keep, values, axis=1)
+            timestamps = timestamps[keep]
+        if len(timestamps) == 0:
+            return self
+
+        block = TimeSeriesAccumulator()
+        block.rows = len(timestamps)
+        block.first, block.last = int(timestamps[0]), int(timestamps[-1])
+        block.earliest, block.latest = int(timestamps.min()), int(timestamps.max())
+        block.out_of_order = int(np.count_nonzero(timestamps[1:] < timestamps[:-1]))
+
+        minutes = timestamps // NS_PER_MINUTE
+        if block.out_of_order:
+            order = np.argsort(minutes, kind='stable')
+            minutes = minutes[order]
+            values = values[:, order]
+        block._set_buckets(minutes, np.ones(len(minutes), dtype=np.int64), values, values, values)
+        return self.merge(block)
+
+    def _set_buckets(self, minutes: np.ndarray, count: np.ndarray, sums: np.ndarray,
+                     mins: np.ndarray, maxs: np.ndarray) -> None:
+        """Reduce sorted, possibly repeated minute rows into one bucket per minute."""
+        starts = np.flatnonzero(np.concatenate(([True], minutes[1:] != minutes[:-1])))
+        self.minutes = minutes[starts]
+        self.count = np.add.reduceat(count, starts)
+        self.sum = np.add.reduceat(sums, starts, axis=1)
+        self.min = np.minimum.reduceat(mins, starts, axis=1)
+        self.max = np.maximum.reduceat(maxs, starts, axis=1)
+
+    def merge(self, other: "TimeSeriesAccumulator") -> "TimeSeriesAccumulator":
+        """
+        Combine the accumulator of the following block into this one.
+
+        Returns:
+            The accumulator itself, for chaining
+        """
+        self.unparsed += other.unparsed
+        if other.rows == 0:
+            return self
+        if self.rows == 0:
+            self.minutes, self.count = other.minutes, other.count
+            self.sum, self.min, self.max = other.sum, other.min, other.max
+            self.rows, self.out_of_order = other.rows, other.out_of_order
+            self.first, self.last = other.first, other.last
+            self.earliest, self.latest = other.earliest, other.latest
+            return self
+
+        self.out_of_order += other.out_of_order + int(other.first < self.last)
+        self.rows += other.rows
+        self.last = other.last
+        self.earliest = min(self.earliest, other.earliest)
+        self.latest = max(self.latest, other.latest)
+
+        minutes = np.concatenate((self.minutes, other.minutes))
+        parts = [
+            np.concatenate((mine, theirs), axis=-1)
+            for mine, theirs in ((self.count, other.count), (self.sum, other.sum),
+                                 (self.min, other.min), (self.max, other.max))
+        ]
+        # Sorted logs only ever touch the last bucket, so skip the sort then
+        if other.minutes[0] < self.minutes[-1]:
+            order = np.argsort(minutes, kind='stable')
+            minutes = minutes[order]
+            parts = [part[..., order] for part in parts]
+        self._set_buckets(minutes, *parts)
+        return self
+
+    def windows(self, width: int) -> Dict[str, Any]:
+        """
+        Mean, min and max per fixed window, for windows that have readings.
+
+        Args:
+            width: Window width in minutes; windows are aligned to the epoch,
+                so hourly windows start on the hour and daily ones at 00:00 UTC
+
+        Returns:
+            Columnar window statistics; see summary()
+        """
+        keys = self.minutes // width
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        count = np.add.reduceat(self.count, starts)
+        mean = np.add.reduceat(self.sum, starts, axis=1) / count
+        low = np.minimum.reduceat(self.min, starts, axis=1)
+        high = np.maximum.reduceat(self.max, starts, axis=1)
+        origin = int(keys[0])
+        return {
+            'origin': EPOCH + timedelta(minutes=origin * width),
+            'step_minutes': width,
+            'offset': (keys[starts] - origin).tolist(),
+            'count': count.tolist(),
+            'ph_mean': mean[0].tolist(),
+            'ph_min': low[0].tolist(),
+            'ph_max': high[0].tolist(),
+            'tds_mean': mean[1].tolist(),
+            'tds_min': low[1].tolist(),
+            'tds_max': high[1].tolist(),
+        }
+
+    def rolling_means(self, window: int) -> np.ndarray:
+        """
+        Trailing time-based rolling mean at each bucket.
+
+        The window ending at minute t covers buckets in (t - window, t], so
+        gaps in the log shrink the number of readings rather than stretching
+        the window over older data.
+
+        Returns:
+            (2, buckets) rolling means of pH and TDS
+        """
+        first = np.searchsorted(self.minutes, self.minutes - window, side='right')
+        count = np.concatenate(([0], np.cumsum(self.count)))
+        sums = np.concatenate((np.zeros((2, 1)), np.cumsum(self.sum, axis=1)), axis=1)
+        end = np.arange(1, len(self.minutes) + 1)
+        return (sums[:, end] - sums[:, first]) / (count[end] - count[first])
+
+    def excursions(self, table: RuleTable, window: int, limit: int) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Periods where the rolling mean of pH or TDS leaves its target band.
+
+        The target bands are those of the table's no-treatment rule. A run of
+        consecutive buckets outside the band on the same side is one
+        excursion. A gap in the log ends a run when it is longer than both
+        the window and twice the median sampling interval, so hourly logs
+        still form runs while an outage in a per-second log splits them.
+
+        Args:
+            table: Rule table profile supplying the target bands
+            window: Rolling window width in minutes
+            limit: Most excursions to return; the longest are kept
+
+        Returns:
+            Tuple of (total excursions found, up to limit excursions in time order)
+        """
+        means = self.rolling_means(window)
+        spacing = np.diff(self.minutes)
+        max_gap = max(window, 2 * float(np.median(spacing))) if len(spacing) else window
+        gap = np.concatenate(([True], spacing > max_gap))
+        runs = []
+        for row, (low, high) in enumerate(table.target_bands()):
+            # -1 below the band, +1 at or above its upper edge, 0 inside
+            side = (means[row] >= high).astype(np.int8) - (means[row] < low)
+            starts = np.flatnonzero(gap | np.concatenate(([True], side[1:] != side[:-1])))
+            # Runs partition the buckets, so reduceat yields each run's extremes
+            peak = np.where(
+                side[starts] > 0,
+                np.maximum.reduceat(means[row], starts),
+                np.minimum.reduceat(means[row], starts)
+            )
+            ends = np.concatenate((starts[1:], [len(side)])) - 1
+            out = side[starts] != 0
+            runs.append((np.full(np.count_nonzero(out), row), starts[out], ends[out],
+                         side[starts][out], peak[out]))
+
+        row, starts, ends, side, peak = (np.concatenate(column) for column in zip(*runs))
+        first, last = self.minutes[starts], self.minutes[ends]
+        duration = last - first + 1
+        # Longest first, earliest first among equals; then back to time order
+        keep = np.lexsort((first, -duration))[:limit]
+        keep = keep[np.lexsort((row[keep], first[keep]))]
+        return len(starts), [
+            {
+                'parameter': ('ph', 'tds')[row[i]],
+                'direction': 'high' if side[i] > 0 else 'low',
+                'start': EPOCH + timedelta(minutes=int(first[i])),
+                'end': EPOCH + timedelta(minutes=int(last[i]) + 1),
+                'duration_minutes': int(duration[i]),
+                'peak_rolling_mean': float(peak[i]),
+            }
+            for i in keep.tolist()
+        ]
+
+    def summary(self, table: RuleTable, window: int, limit: int) -> Optional[Dict[str, Any]]:
+        """
+        Compact time-series summary to store with the analysis.
+
+        Args:
+            table: Rule table profile supplying the excursion target bands
+            window: Rolling window for excursion detection, in minutes
+            limit: Most excursions to keep
+
+        Returns:
+            None if no row had a usable timestamp, otherwise a dictionary
+            with the time range, order checks, columnar hourly and daily
+            windows and the detected excursions
+        """
+        if self.rows == 0:
+            return None
+        total, excursions = self.excursions(table, window, limit)
+        return {
+            'start': EPOCH + timedelta(microseconds=self.earliest // 1000),
+            'end': EPOCH + timedelta(microseconds=self.latest // 1000),
+            'rows': self.rows,
+            'unparsed_timestamps': self.unparsed,
+            'out_of_order_rows': self.out_of_order,
+            **{name: self.windows(width) for name, width in WINDOWS.items()},
+            'rolling_window_minutes': window,
+            'excursion_count': total,
+            'excursions': excursions,
+        }
@@ -0,0 +1,92 @@
+"""
+Benchmark analysis lookups by id with and without the analysis cache.
+
+Seeds a scratch collection and replays lookups skewed towards recent
+analyses, as a reporting dashboard re-fetching what it shows, timing:
+
+  get        every lookup read from the repository
+  cached     lookups through cached_get with the in-process LRU, sized to
+             hold a fraction of the analyses
+
+Run from the backend directory against a disposable database:
+    python -m benchmarks.bench_analysis_cache --mongo-url mongodb://localhost:27017 --rows 100000
+
+Without --mongo-url the in-memory repository stands in for MongoDB; a hit
+then only saves the dict copy, so the cached timing shows what decoding an
+entry costs rather than what it saves.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+from pymongo import AsyncMongoClient
+
+from app.db.cache import DocumentCache, LRUCacheBackend
+from app.db.repository import InMemoryAnalysisRepository, MongoAnalysisRepository
+from benchmarks.bench_history import make_documents, seed
+
+
+async def replay(repository, lookups, cached: bool) -> float:
+    """Look every id up in turn; seconds per lookup."""
+    start = time.perf_counter()
+    for analysis_id in lookups:
+        if cached:
+            await repository.cached_get(analysis_id, ttl=60)
+        else:
+            await repository.get(analysis_id)
+    return (time.perf_counter() - start) / len(lookups)
+
+
+async def run(args) -> None:
+    client = None
+    cache = DocumentCache(LRUCacheBackend(args.cache_size, args.cache_bytes), ttl=300)
+    if args.mongo_url:
+        client = AsyncMongoClient(args.mongo_url)
+        database = client[args.database]
+        await client.drop_database(args.database)
+        repository = MongoAnalysisRepository(database['water_analyses'], cache=cache)
+    else:
+        repository = InMemoryAnalysisRepository(cache=cache)
+
+    try:
+        print(f"Seeding {args.rows:,} analyses...")
+        await seed(repository, args.rows)
+        # Ids in history order, most recent first
+        ids = [str(doc['_id']) async for batch in repository.iter_batches(10_000, fields=()) for doc in batch]
+        rng = random.Random(0)
+        # The dashboard mostly revisits the newest analyses
+        lookups = [ids[min(int(rng.expovariate(1 / args.recent)), len(ids) - 1)] for _ in range(args.lookups)]
+        size = len(make_documents(0, 1)[0]['explanation'])
+
+        plain = await replay(repository, lookups, cached=False)
+        cached = await replay(repository, lookups, cached=True)
+        stats = cache.stats()
+        print(f"{args.lookups:,} lookups, mean rank {args.recent}, ~{size} byte explanations, "
+              f"cache of {args.cache_size:,} analyses")
+        print(f"{'get (us)':>10} {'cached (us)':>12} {'hit ratio':>10} {'evictions':>10} {'cache MB':>9}")
+        print(f"{plain * 1e6:>10.1f} {cached * 1e6:>12.1f} {stats['hit_ratio']:>10.2f} "
+              f"{stats['evictions']:>10,} {stats['bytes'] / 2**20:>9.1f}")
+    finally:
+        if client is not None:
+            await client.drop_database(args.database)
+            await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-url', help="MongoDB to benchmark against; a scratch database is created and dropped")
+    parser.add_argument('--database', default='bench_analysis_cache')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--lookups', type=int, default=20_000)
+    parser.add_argument('--recent', type=int, default=200, help="mean history rank of a looked up analysis")
+    parser.add_argument('--cache-size', type=int, default=1024)
+    parser.add_argument('--cache-bytes', type=int, default=64 * 1024 * 1024)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
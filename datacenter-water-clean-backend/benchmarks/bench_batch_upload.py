@@ -0,0 +1,125 @@
+"""
+Benchmark a nightly site drop: one /upload per file vs one batch request.
+
+Each run gets fresh in-memory repositories, so duplicate detection never
+short-circuits a file. The batch is sent as plain multipart files, as a
+zip and as a tar.gz. Parsing uses the configured PARSE_WORKERS pool.
+
+Run from the backend directory:
+    python -m benchmarks.bench_batch_upload --files 48 --rows 5000
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import tarfile
+import time
+import zipfile
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import httpx
+import numpy as np
+
+from app.core.executors import shutdown_executors
+from app.db.readings import InMemoryReadingRepository, get_reading_repository
+from app.db.repository import InMemoryAnalysisRepository, get_analysis_repository
+from app.main import app
+
+
+def make_files(count: int, rows: int) -> dict:
+    """Distinct CSVs of per-second readings, one per collector."""
+    rng = np.random.default_rng(0)
+    files = {}
+    for i in range(count):
+        ph = rng.normal(7.9, 0.3, rows).round(2)
+        tds = rng.normal(150, 40, rows).round(1)
+        lines = "".join(f"{p},{t},2024-01-01T{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}\n"
+                        for s, (p, t) in enumerate(zip(ph, tds)))
+        files[f"collector-{i:03d}.csv"] = ("pH,TDS,Timestamp\n" + lines).encode()
+    return files
+
+
+def zip_bytes(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_bytes(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def fresh_repositories() -> InMemoryAnalysisRepository:
+    repository = InMemoryAnalysisRepository()
+    app.dependency_overrides[get_analysis_repository] = lambda: repository
+    app.dependency_overrides[get_reading_repository] = InMemoryReadingRepository
+    return repository
+
+
+async def timed(fn, repeat: int, expected: int) -> float:
+    """Fastest of several runs, each against empty repositories, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        repository = fresh_repositories()
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+        assert len(repository.documents) == expected, len(repository.documents)
+    return min(timings)
+
+
+async def run(args) -> None:
+    files = make_files(args.files, args.rows)
+    archives = {'night.zip': zip_bytes(files), 'night.tar.gz': tar_bytes(files)}
+    logging.disable(logging.INFO)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        async def one_per_file():
+            for name, data in files.items():
+                response = await http.post("/api/v1/analysis/upload", files={"file": (name, data, "text/csv")})
+                response.raise_for_status()
+
+        async def batch(parts):
+            response = await http.post("/api/v1/analysis/upload/batch", files=[("files", part) for part in parts])
+            response.raise_for_status()
+            assert response.json()["created"] == len(files), response.json()
+
+        plain = [(name, data, "text/csv") for name, data in files.items()]
+        # Warm the parse pool
+        await timed(lambda: batch(plain), 1, len(files))
+
+        size = sum(map(len, files.values()))
+        print(f"{len(files)} files x {args.rows:,} rows, {size / 2**20:.1f} MB")
+        baseline = await timed(one_per_file, args.repeat, len(files))
+        print(f"  {'one /upload per file':<24} {baseline * 1e3:>9.1f} ms")
+        for label, parts in (("batch, plain files", plain),
+                             *((f"batch, {name}", [(name, data, "application/octet-stream")])
+                               for name, data in archives.items())):
+            elapsed = await timed(lambda: batch(parts), args.repeat, len(files))
+            print(f"  {label:<24} {elapsed * 1e3:>9.1f} ms  ({baseline / elapsed:.1f}x)")
+
+    app.dependency_overrides.clear()
+    shutdown_executors()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=48)
+    parser.add_argument('--rows', type=int, default=5_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark offset against cursor pagination of the analysis history.
+
+Seeds a scratch collection and times fetching one page at increasing depths.
+Offset pages get slower as MongoDB walks past every skipped entry; cursor
+pages stay flat because they seek straight to their position in the
+(upload_timestamp, _id) index.
+
+Run from the backend directory against a disposable database:
+    python -m benchmarks.bench_history --mongo-url mongodb://localhost:27017 --rows 1000000
+
+Without --mongo-url the in-memory repository is used, which only checks the
+two modes agree.
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+from bson import ObjectId
+from pymongo import AsyncMongoClient
+
+from app.db.repository import (
+    InMemoryAnalysisRepository,
+    MongoAnalysisRepository,
+    history_key
+)
+
+BATCH_SIZE = 10_000
+
+EXPLANATION = ("TDS is elevated relative to the target band, so reverse osmosis is "
+               "recommended ahead of the cooling loop. ") * 12
+
+
+def make_documents(start: int, count: int) -> list:
+    """Synthetic analyses, one per minute, with duplicate timestamps in pairs."""
+    base = datetime(2020, 1, 1)
+    return [{
+        '_id': ObjectId(),
+        'upload_timestamp': base + timedelta(minutes=(start + i) // 2),
+        'original_filename': f"bench-{start + i}.csv",
+        'site_name': f"Site {(start + i) % 50}",
+        'avg_ph': 7.9,
+        'ph_category': "In target range",
+        'avg_tds': 250.0,
+        'tds_category': "Moderate",
+        'treatment_train': "Basic filtration only",
+        'explanation': EXPLANATION,
+        'row_count': 100,
+        'created_at': base,
+        'min_ph': 7.1,
+        'max_ph': 8.4,
+        'min_tds': 120.0,
+        'max_tds': 410.0
+    } for i in range(count)]
+
+
+async def seed(repository, rows: int) -> None:
+    """Insert rows analyses into the repository."""
+    for start in range(0, rows, BATCH_SIZE):
+        documents = make_documents(start, min(BATCH_SIZE, rows - start))
+        if isinstance(repository, MongoAnalysisRepository):
+            await repository.collection.insert_many(documents, ordered=False)
+        else:
+            for document in documents:
+                await repository.insert(document)
+
+
+async def best_of(fn, repeat: int) -> float:
+    """Return the fastest wall time of several awaited runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+async def run(args) -> None:
+    client = None
+    if args.mongo_url:
+        client = AsyncMongoClient(args.mongo_url)
+        collection = client[args.database]['water_analyses']
+        await collection.drop()
+        repository = MongoAnalysisRepository(collection)
+        await repository.ensure_indexes()
+    else:
+        repository = InMemoryAnalysisRepository()
+
+    try:
+        print(f"Seeding {args.rows:,} analyses...")
+        await seed(repository, args.rows)
+
+        print(f"{'depth':>12} {'offset (ms)':>12} {'cursor (ms)':>12}")
+        for depth in args.depths:
+            if depth >= args.rows:
+                continue
+            # Key of the record just before the page, as a client would hold it
+            previous = await repository.list(limit=1, offset=depth - 1) if depth else []
+            after = history_key(previous[0]) if previous else None
+
+            by_offset = await best_of(lambda: repository.list(limit=args.limit, offset=depth), args.repeat)
+            by_cursor = await best_of(lambda: repository.list(limit=args.limit, after=after), args.repeat)
+
+            page_offset = await repository.list(limit=args.limit, offset=depth)
+            page_cursor = await repository.list(limit=args.limit, after=after)
+            assert [d['_id'] for d in page_offset] == [d['_id'] for d in page_cursor]
+
+            print(f"{depth:>12,} {by_offset * 1e3:>12.2f} {by_cursor * 1e3:>12.2f}")
+    finally:
+        if client is not None:
+            await client.drop_database(args.database)
+            await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-url', help="MongoDB to benchmark against; a scratch database is created and dropped")
+    parser.add_argument('--database', default='bench_history')
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--depths', type=int, nargs='+', default=[0, 1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
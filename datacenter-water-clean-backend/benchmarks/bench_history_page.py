@@ -0,0 +1,99 @@
+"""
+Benchmark building a 100-item history page.
+
+Compares the previous listing path (whole documents, one validated model per
+item, then the response model) with the projected path the route now uses
+(only the returned fields, plain dicts validated once by the response model),
+and times the full request through the app with and without fields=.
+
+Run from the backend directory:
+    python -m benchmarks.bench_history_page
+    python -m benchmarks.bench_history_page --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import logging
+import os
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import httpx
+from pymongo import AsyncMongoClient
+
+from app.db.repository import (
+    InMemoryAnalysisRepository,
+    MongoAnalysisRepository,
+    get_analysis_repository
+)
+from app.main import app
+from app.models.analysis_result import AnalysisHistoryItem, AnalysisHistoryResponse
+from benchmarks.bench_history import best_of, seed
+
+
+async def legacy_page(repository, limit: int) -> bytes:
+    """Previous listing: whole documents and a validated model per item."""
+    documents = await repository.list(limit=limit)
+    items = [AnalysisHistoryItem.from_document(doc) for doc in documents]
+    response = AnalysisHistoryResponse(analyses=items, total=None, limit=limit, offset=0)
+    return response.model_dump_json().encode()
+
+
+async def projected_page(repository, limit: int) -> bytes:
+    """Current listing: projected fields and plain dicts validated once."""
+    documents = await repository.list(limit=limit, fields=AnalysisHistoryItem.stored_fields())
+    items = [AnalysisHistoryItem.fields_from_document(doc) for doc in documents]
+    response = AnalysisHistoryResponse.model_validate(
+        {'analyses': items, 'total': None, 'limit': limit, 'offset': 0}
+    )
+    return response.model_dump_json().encode()
+
+
+async def run(args) -> None:
+    client = None
+    if args.mongo_url:
+        client = AsyncMongoClient(args.mongo_url)
+        collection = client[args.database]['water_analyses']
+        await collection.drop()
+        repository = MongoAnalysisRepository(collection)
+        await repository.ensure_indexes()
+    else:
+        repository = InMemoryAnalysisRepository()
+
+    try:
+        await seed(repository, args.rows)
+
+        legacy = await best_of(lambda: legacy_page(repository, args.limit), args.repeat)
+        projected = await best_of(lambda: projected_page(repository, args.limit), args.repeat)
+        print(f"page build, {args.limit} items")
+        print(f"  {'full documents + models':<28} {legacy * 1e3:>8.2f} ms")
+        print(f"  {'projected dicts':<28} {projected * 1e3:>8.2f} ms  ({legacy / projected:.1f}x)")
+
+        logging.disable(logging.INFO)
+        app.dependency_overrides[get_analysis_repository] = lambda: repository
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            print(f"GET /history, {args.limit} items")
+            for label, query in (("all fields", ""), ("fields=site_name", "&fields=site_name")):
+                url = f"/api/v1/analysis/history?limit={args.limit}&count_mode=none{query}"
+                elapsed = await best_of(lambda: http.get(url), args.repeat)
+                size = len((await http.get(url)).content)
+                print(f"  {label:<28} {elapsed * 1e3:>8.2f} ms  {size:>8,} bytes")
+        app.dependency_overrides.pop(get_analysis_repository, None)
+    finally:
+        if client is not None:
+            await client.drop_database(args.database)
+            await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-url', help="MongoDB to benchmark against; a scratch database is created and dropped")
+    parser.add_argument('--database', default='bench_history_page')
+    parser.add_argument('--rows', type=int, default=1_000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
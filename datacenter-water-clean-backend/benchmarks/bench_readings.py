@@ -0,0 +1,124 @@
+"""
+Benchmark raw reading storage: columnar chunks vs one document per reading.
+
+Both layouts are written to an in-memory stand-in, and every document is
+BSON-encoded on the way in, as insert_many would do before sending it, so
+the timings cover the client-side cost of a write without a server:
+
+- per-reading: {timestamp, meta, ph, tds} documents in unordered batches of
+  --batch documents, the natural time-series collection layout
+- chunked: encode_readings chunks of READINGS_CHUNK_SIZE readings, the
+  layout the upload path stores
+
+Reading back decodes the stored BSON into the (2, n) value array and the
+timestamp array a re-analysis needs.
+
+Run from the backend directory:
+    python -m benchmarks.bench_readings --readings 1000000
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import asyncio
+from datetime import datetime, timedelta
+import bson
+import numpy as np
+from bson import ObjectId
+
+from app.core.config import settings
+from app.db.readings import InMemoryReadingRepository, decode_readings, encode_readings
+from app.services.timeseries import EPOCH
+
+UPLOADED = datetime(2024, 2, 1)
+
+
+def best_of(fn, repeat: int):
+    """Return the fastest wall time of several runs, in seconds, and the last result."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def make_readings(n: int):
+    """n per-second readings with two-decimal pH and one-decimal TDS."""
+    rng = np.random.default_rng(0)
+    values = np.array([rng.normal(7.9, 0.3, n).round(2), rng.normal(80, 8, n).round(1)])
+    timestamps = np.datetime64('2024-01-01T00:00:00', 'ns').astype(np.int64) + np.arange(n, dtype=np.int64) * 10**9
+    return values, timestamps
+
+
+def write_per_reading(values, timestamps, analysis_id, batch: int) -> list:
+    """One document per reading, encoded in insert_many-sized batches."""
+    meta = {'site_name': 'Site A', 'analysis_id': analysis_id}
+    stored = []
+    for start in range(0, len(timestamps), batch):
+        stop = start + batch
+        stamps = timestamps[start:stop] // 1000
+        documents = [
+            {'timestamp': EPOCH + timedelta(microseconds=stamp), 'meta': meta, 'ph': ph, 'tds': tds}
+            for stamp, ph, tds in zip(stamps.tolist(), values[0, start:stop].tolist(),
+                                      values[1, start:stop].tolist())
+        ]
+        stored.extend(bson.encode(document) for document in documents)
+    return stored
+
+
+def read_per_reading(stored: list):
+    """Decode per-reading documents back into arrays."""
+    documents = [bson.decode(data) for data in stored]
+    values = np.array([[d['ph'] for d in documents], [d['tds'] for d in documents]])
+    timestamps = np.array([d['timestamp'] for d in documents], dtype='datetime64[ns]').view(np.int64)
+    return values, timestamps
+
+
+def write_chunked(values, timestamps, analysis_id) -> list:
+    """Columnar chunks stored through the in-memory reading repository."""
+    repository = InMemoryReadingRepository()
+    chunks = encode_readings(values, timestamps, analysis_id, 'Site A', UPLOADED, 0,
+                             settings.READINGS_CHUNK_SIZE)
+    encoded = [bson.encode(chunk) for chunk in chunks]
+    asyncio.run(repository.insert_chunks(chunks))
+    return encoded
+
+
+def read_chunked(stored: list):
+    """Decode stored chunks back into arrays."""
+    return decode_readings([bson.decode(data) for data in stored])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--batch', type=int, default=10_000, help="documents per insert_many batch")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'readings':>10} {'layout':>12} {'docs':>9} {'BSON MB':>8} {'write (ms)':>11} "
+          f"{'readings/s':>12} {'read (ms)':>10}")
+    for n in args.readings:
+        values, timestamps = make_readings(n)
+        analysis_id = ObjectId()
+
+        write, stored = best_of(lambda: write_per_reading(values, timestamps, analysis_id, args.batch), args.repeat)
+        read, (decoded, _) = best_of(lambda: read_per_reading(stored), args.repeat)
+        assert np.array_equal(decoded, values)
+        size = sum(map(len, stored))
+        print(f"{n:>10,} {'per-reading':>12} {len(stored):>9,} {size / 2**20:>8.1f} {write * 1e3:>11.1f} "
+              f"{n / write:>12,.0f} {read * 1e3:>10.1f}")
+
+        write, stored = best_of(lambda: write_chunked(values, timestamps, analysis_id), args.repeat)
+        read, (decoded, _) = best_of(lambda: read_chunked(stored), args.repeat)
+        assert np.array_equal(decoded, values)
+        size = sum(map(len, stored))
+        print(f"{n:>10,} {'chunked':>12} {len(stored):>9,} {size / 2**20:>8.1f} {write * 1e3:>11.1f} "
+              f"{n / write:>12,.0f} {read * 1e3:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
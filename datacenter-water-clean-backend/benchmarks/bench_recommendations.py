@@ -0,0 +1,64 @@
+"""
+Benchmark batch rule classification against the per-pair rule walk.
+
+The per-pair walk is timed twice: through get_recommendation, whose results
+are memoized per rule table cell, and classifying and looking up the rule
+text on every call as it did before the memo.
+
+Run from the backend directory:
+    python -m benchmarks.bench_recommendations --pairs 1000000
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import numpy as np
+
+from app.services.recommendation_service import RecommendationService
+from app.services.rule_table import get_rule_table
+
+
+def best_of(fn, repeat: int) -> float:
+    """Return the fastest wall time of several runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def make_pairs(pairs: int):
+    """Site averages spread across every pH and TDS band."""
+    rng = np.random.default_rng(0)
+    return rng.uniform(6.5, 9.5, pairs), rng.uniform(0, 600, pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pairs', type=int, nargs='+', default=[1_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    table = get_rule_table()
+    print(f"{'pairs':>12} {'unmemoized (ms)':>16} {'scalar (ms)':>12} {'indices (ms)':>13} "
+          f"{'batch (ms)':>11} {'speedup':>8}")
+    for pairs in args.pairs:
+        ph, tds = make_pairs(pairs)
+        ph_list, tds_list = ph.tolist(), tds.tolist()
+
+        unmemoized = best_of(lambda: [table.recommendation(table.rule_code(p, t))
+                                      for p, t in zip(ph_list, tds_list)], args.repeat)
+        scalar = best_of(lambda: [RecommendationService.get_recommendation(p, t, table)
+                                  for p, t in zip(ph_list, tds_list)], args.repeat)
+        indices = best_of(lambda: RecommendationService.get_rule_indices(ph, tds), args.repeat)
+        batch = best_of(lambda: RecommendationService.get_recommendations_batch(ph, tds), args.repeat)
+
+        print(f"{pairs:>12,} {unmemoized * 1e3:>16.2f} {scalar * 1e3:>12.2f} {indices * 1e3:>13.2f} "
+              f"{batch * 1e3:>11.2f} {scalar / batch:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark response serialization latency of the history and by-id routes.
+
+A few CSVs with a Timestamp column (so analyses carry hourly/daily window
+statistics) are uploaded through the API, then their documents are copied
+until the in-memory repository holds --analyses analyses. Requests go
+through the full ASGI app over httpx, one at a time, so each timing is
+routing, repository read, response building and JSON serialization.
+The history page is also timed gzip- and brotli-encoded, and revalidated
+with the ETag of the previous response (a 304 while nothing is written).
+
+Run from the backend directory:
+    python -m benchmarks.bench_responses --requests 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import httpx
+import numpy as np
+from bson import ObjectId
+
+from app.core.executors import shutdown_executors
+from app.db.readings import InMemoryReadingRepository, set_reading_repository
+from app.db.repository import InMemoryAnalysisRepository, set_analysis_repository
+from app.main import app
+
+
+def make_csv(seed: int, hours: int) -> bytes:
+    """Per-minute readings over several hours, drifting out of range."""
+    rng = np.random.default_rng(seed)
+    minutes = hours * 60
+    ph = (7.5 + np.linspace(0, 1.5, minutes) + rng.normal(0, 0.2, minutes)).round(2)
+    tds = rng.normal(400, 150, minutes).round(1)
+    lines = "".join(f"{p},{t},2024-01-{1 + m // 1440:02d}T{m // 60 % 24:02d}:{m % 60:02d}:00\n"
+                    for m, (p, t) in enumerate(zip(ph, tds)))
+    return ("pH,TDS,Timestamp\n" + lines).encode()
+
+
+def percentiles(timings: list) -> str:
+    p50, p99 = np.percentile(np.array(timings) * 1e3, [50, 99])
+    return f"p50 {p50:7.3f} ms  p99 {p99:7.3f} ms"
+
+
+async def run(args) -> None:
+    # Installed as the app would be, not as dependency_overrides, which
+    # FastAPI re-inspects on every request
+    repository = InMemoryAnalysisRepository()
+    set_analysis_repository(repository)
+    set_reading_repository(InMemoryReadingRepository())
+    logging.disable(logging.INFO)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        for seed in range(4):
+            response = await http.post("/api/v1/analysis/upload", data={"site_name": f"Site {seed}"},
+                                       files={"file": (f"log-{seed}.csv", make_csv(seed, 48), "text/csv")})
+            response.raise_for_status()
+        templates = list(repository.documents.values())
+        for i in range(args.analyses - len(templates)):
+            copy = {key: value for key, value in templates[i % len(templates)].items()
+                    if key not in ('content_hash', 'idempotency_key')}
+            copy['_id'] = ObjectId()
+            copy['user_notes'] = "Dosed acid and ran the softener overnight; " * 4
+            await repository.insert(copy)
+        ids = [str(key) for key in repository.documents]
+
+        history = "/api/v1/analysis/history?limit=100"
+        identity = {"Accept-Encoding": "identity"}
+        etag = (await http.get(history, headers=identity)).headers["ETag"]
+        routes = {
+            "/history?limit=100": (lambda i: history, identity),
+            "/history?limit=100 gzip": (lambda i: history, {"Accept-Encoding": "gzip"}),
+            "/history?limit=100 br": (lambda i: history, {"Accept-Encoding": "br"}),
+            "/history?limit=100 If-None-Match": (lambda i: history, {**identity, "If-None-Match": etag}),
+            "/history?limit=100&count_mode=none": (lambda i: f"{history}&count_mode=none", identity),
+            "/{analysis_id}": (lambda i: f"/api/v1/analysis/{ids[i % len(ids)]}", identity),
+        }
+        for label, (path, headers) in routes.items():
+            sizes = set()
+            for i in range(args.warmup):
+                assert (await http.get(path(i), headers=headers)).status_code in (200, 304)
+            timings = []
+            for i in range(args.requests):
+                start = time.perf_counter()
+                response = await http.get(path(i), headers=headers)
+                timings.append(time.perf_counter() - start)
+                assert response.status_code in (200, 304)
+                # Bytes on the wire, before httpx decodes the content coding
+                sizes.add(int(response.headers.get("Content-Length", 0)))
+            print(f"  {label:<36} {percentiles(timings)}  ({max(sizes) / 1024:.1f} KB)")
+
+    set_analysis_repository(None)
+    set_reading_repository(None)
+    shutdown_executors()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--analyses', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark the statistics kernel against the original pandas implementation.
+
+Run from the backend directory:
+    python -m benchmarks.bench_statistics --rows 10000 1000000 10000000
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import numpy as np
+import pandas as pd
+
+from app.services.csv_service import CSVService
+from app.services.statistics import StatsAccumulator
+
+
+def legacy_statistics(df: pd.DataFrame) -> dict:
+    """The pre-kernel calculate_statistics: convert, copy, six reductions."""
+    df['ph'] = pd.to_numeric(df['ph'], errors='coerce')
+    df['tds'] = pd.to_numeric(df['tds'], errors='coerce')
+    df_clean = df[['ph', 'tds']].dropna()
+    return {
+        'avg_ph': float(df_clean['ph'].mean()),
+        'avg_tds': float(df_clean['tds'].mean()),
+        'min_ph': float(df_clean['ph'].min()),
+        'max_ph': float(df_clean['ph'].max()),
+        'min_tds': float(df_clean['tds'].min()),
+        'max_tds': float(df_clean['tds'].max()),
+        'row_count': len(df_clean)
+    }
+
+
+def best_of(fn, repeat: int) -> float:
+    """Return the fastest wall time of several runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def make_frame(rows: int) -> pd.DataFrame:
+    """Synthetic logger export with a few missing readings."""
+    rng = np.random.default_rng(0)
+    ph = rng.normal(7.9, 0.3, rows)
+    tds = rng.normal(250, 40, rows)
+    ph[::997] = np.nan
+    return pd.DataFrame({
+        'ph': ph,
+        'tds': tds,
+        'location': 'Site A',
+        'timestamp': '2024-01-01 00:00:00'
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'legacy (ms)':>12} {'service (ms)':>13} {'kernel (ms)':>12} {'speedup':>8}")
+    for rows in args.rows:
+        df = make_frame(rows)
+        values = CSVService._to_buffer(df['ph'], df['tds'])
+
+        legacy = best_of(lambda: legacy_statistics(df.copy(deep=False)), args.repeat)
+        service = best_of(lambda: CSVService.calculate_statistics(df), args.repeat)
+        kernel = best_of(lambda: StatsAccumulator.from_values(values), args.repeat)
+
+        print(f"{rows:>12,} {legacy * 1e3:>12.2f} {service * 1e3:>13.2f} "
+              f"{kernel * 1e3:>12.2f} {legacy / service:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark the /stats report against pulling the history into Python.
+
+Seeds a scratch collection and times four ways of building the same
+report of every analysis, and of one site's:
+
+  python     stream the analyses out in export batches (only the fields the
+             report needs) and group them in the API worker, as dashboards
+             did before /stats existed
+  unhinted   the stats aggregation, left to the query planner
+  covered    the stats aggregation hinted to the covering stats index, as
+             the repository runs it
+  rollups    the report composed from the site_daily_rollups cells
+
+Run from the backend directory against a disposable database:
+    python -m benchmarks.bench_stats --mongo-url mongodb://localhost:27017 --rows 1000000
+
+Without --mongo-url the in-memory repository stands in for MongoDB, so only
+the python and in-memory timings are printed and they only check that the
+reports agree.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+from pymongo import AsyncMongoClient
+
+from app.db.repository import InMemoryAnalysisRepository, MongoAnalysisRepository, stats_pipeline
+from app.db.rollups import ROLLUPS_COLLECTION, stats_of_documents
+from app.models.analysis_result import HistoryFilters
+from app.models.water_sample import STATS_FIELDS
+from benchmarks.bench_history import best_of, make_documents
+
+BATCH_SIZE = 10_000
+
+
+async def seed(repository, rows: int) -> None:
+    """Insert rows analyses with varied figures and rule classifications."""
+    for start in range(0, rows, BATCH_SIZE):
+        documents = make_documents(start, min(BATCH_SIZE, rows - start))
+        for i, document in enumerate(documents, start):
+            document['avg_ph'] = 7.0 + (i % 17) / 10
+            document['avg_tds'] = 80.0 + (i % 400)
+            document['out_of_range_fraction'] = (i % 10) / 10
+            document['dominant_rule'] = "ABCDEFGHI"[i % 9]
+        if isinstance(repository, MongoAnalysisRepository):
+            await repository.collection.insert_many(documents, ordered=False)
+        else:
+            for document in documents:
+                await repository.insert(document)
+
+
+async def python_report(repository, filters) -> dict:
+    """Pull every matching analysis into the worker and group it there."""
+    documents = []
+    async for batch in repository.iter_batches(1000, filters=filters, fields=STATS_FIELDS):
+        documents.extend(batch)
+    return stats_of_documents(documents, 'day')
+
+
+async def unhinted_report(repository, filters) -> None:
+    cursor = await repository.collection.aggregate(stats_pipeline('day', filters), allowDiskUse=True)
+    await cursor.to_list()
+
+
+async def run(args) -> None:
+    client = None
+    if args.mongo_url:
+        client = AsyncMongoClient(args.mongo_url)
+        database = client[args.database]
+        await client.drop_database(args.database)
+        repository = MongoAnalysisRepository(database['water_analyses'], rollups=database[ROLLUPS_COLLECTION],
+                                             use_rollups=True)
+        await repository.ensure_indexes()
+    else:
+        repository = InMemoryAnalysisRepository()
+
+    try:
+        print(f"Seeding {args.rows:,} analyses...")
+        await seed(repository, args.rows)
+        # Seeding bypasses the per-insert upserts, as a backfill would
+        start = time.perf_counter()
+        cells = await repository.rebuild_rollups()
+        print(f"Rebuilt {cells:,} rollup cells in {(time.perf_counter() - start) * 1e3:.0f} ms")
+
+        print(f"{'selection':>12} {'python (ms)':>12} {'unhinted (ms)':>14} {'covered (ms)':>13} {'rollups (ms)':>13}")
+        for label, filters in (("all", None), ("one site", HistoryFilters(site_name="Site 7"))):
+            by_python = await best_of(lambda: python_report(repository, filters), args.repeat)
+            by_pipeline = await best_of(lambda: repository.aggregate_stats('day', filters), args.repeat)
+            by_rollups = await best_of(lambda: repository.stats('day', filters), args.repeat)
+            unhinted = "-"
+            if client is not None:
+                unhinted = f"{await best_of(lambda: unhinted_report(repository, filters), args.repeat) * 1e3:.0f}"
+
+            expected = await python_report(repository, filters)
+            for report in (await repository.aggregate_stats('day', filters), await repository.stats('day', filters)):
+                assert report['overall']['analyses'] == expected['overall']['analyses']
+                assert len(report['buckets']) == len(expected['buckets'])
+
+            print(f"{label:>12} {by_python * 1e3:>12.0f} {unhinted:>14} {by_pipeline * 1e3:>13.0f} "
+                  f"{by_rollups * 1e3:>13.1f}")
+    finally:
+        if client is not None:
+            await client.drop_database(args.database)
+            await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-url', help="MongoDB to benchmark against; a scratch database is created and dropped")
+    parser.add_argument('--database', default='bench_stats')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark time-series ingestion of a month-long per-second log.
+
+Parses the CSV in upload-sized blocks through the same path as an upload
+(pH, TDS and Timestamp in one typed read, then the per-minute accumulator)
+and compares it with the plain pandas approach: read_csv with parse_dates,
+resample and a time-based rolling mean over the raw rows.
+
+Run from the backend directory:
+    python -m benchmarks.bench_timeseries --days 31
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import io
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services.csv_service import CSVService
+from app.services.rule_table import get_rule_table
+from app.services.statistics import StatsAccumulator
+from app.services.timeseries import TimeSeriesAccumulator
+
+
+def best_of(fn, repeat: int) -> float:
+    """Return the fastest wall time of several runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def make_log(days: int) -> bytes:
+    """One reading per second with a slow pH drift and a few spikes."""
+    rows = days * 86400
+    rng = np.random.default_rng(0)
+    stamps = pd.date_range('2024-01-01', periods=rows, freq='s').strftime('%Y-%m-%d %H:%M:%S')
+    ph = 7.9 + 0.5 * np.sin(np.arange(rows) / 40000) + rng.normal(0, 0.05, rows)
+    tds = rng.normal(80, 8, rows)
+    frame = pd.DataFrame({'pH': ph.round(2), 'TDS': tds.round(1), 'Location': 'Site A', 'Timestamp': stamps})
+    return frame.to_csv(index=False).encode()
+
+
+def split_blocks(data: bytes, size: int) -> list:
+    """Cut the body into blocks of whole lines, as _iter_blocks does."""
+    blocks = []
+    start = data.index(b"\n") + 1
+    while start < len(data):
+        end = data.rfind(b"\n", start, start + size) + 1 or len(data)
+        if end <= start:
+            end = len(data)
+        blocks.append(data[start:end])
+        start = end
+    return blocks
+
+
+def service(header: bytes, blocks: list) -> dict:
+    """Upload path: typed block reads, then merged accumulators."""
+    table = get_rule_table()
+    columns = CSVService._resolve_columns(header)
+    totals, series = StatsAccumulator(table), TimeSeriesAccumulator()
+    for block in blocks:
+        _, block_totals, block_series, _, _ = CSVService._summarize_block(block, columns, table)
+        totals.merge(block_totals)
+        series.merge(block_series)
+    return series.summary(table, settings.TIMESERIES_ROLLING_WINDOW, settings.TIMESERIES_MAX_EXCURSIONS)
+
+
+def pandas_reference(data: bytes) -> tuple:
+    """Straightforward pandas: parse dates, resample, rolling mean over rows."""
+    frame = pd.read_csv(io.BytesIO(data), usecols=['pH', 'TDS', 'Timestamp'], parse_dates=['Timestamp'])
+    frame = frame.set_index('Timestamp').sort_index()
+    hourly = frame.resample('h').agg(['mean', 'min', 'max', 'count'])
+    daily = frame.resample('D').agg(['mean', 'min', 'max', 'count'])
+    rolling = frame.rolling(f"{settings.TIMESERIES_ROLLING_WINDOW}min").mean()
+    return hourly, daily, rolling
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 31])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'days':>6} {'rows':>12} {'MB':>7} {'pandas (ms)':>12} {'service (ms)':>13} {'speedup':>8}")
+    for days in args.days:
+        data = make_log(days)
+        header = data[:data.index(b"\n") + 1]
+        blocks = split_blocks(data, settings.CSV_CHUNK_SIZE)
+
+        summary = service(header, blocks)
+        assert summary['rows'] == days * 86400
+
+        reference = best_of(lambda: pandas_reference(data), args.repeat)
+        ours = best_of(lambda: service(header, blocks), args.repeat)
+        print(f"{days:>6} {days * 86400:>12,} {len(data) / 2**20:>7.1f} "
+              f"{reference * 1e3:>12.1f} {ours * 1e3:>13.1f} {reference / ours:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import pytest
+
+from app.main import app
+from app.db.readings import InMemoryReadingRepository, get_reading_repository
+from app.db.repository import InMemoryAnalysisRepository, get_analysis_repository
+
+
+@pytest.fixture(autouse=True)
+def memory_repository():
+    """Serve every route from a fresh in-memory analysis repository."""
+    repository = InMemoryAnalysisRepository()
+    app.dependency_overrides[get_analysis_repository] = lambda: repository
+    yield repository
+    app.dependency_overrides.pop(get_analysis_repository, None)
+
+
+@pytest.fixture(autouse=True)
+def reading_repository():
+    """Store raw readings in a fresh in-memory repository."""
+    repository = InMemoryReadingRepository()
+    app.dependency_overrides[get_reading_repository] = lambda: repository
+    yield repository
+    app.dependency_overrides.pop(get_reading_repository, None)
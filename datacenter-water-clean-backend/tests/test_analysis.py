@@ -6,8 +6,10 @@ from fastapi.testclient import TestClient
 from unittest.mock import Mock, patch, MagicMock, AsyncMock
 from io import BytesIO
 from datetime import datetime
+from bson import ObjectId
 
 from app.main import app
+from app.api.analysis import analysis_response
 
 client = TestClient(app)
 
@@ -16,37 +18,23 @@ class TestAnalysisEndpoints:
     """Test analysis upload and retrieval endpoints"""
     
     @patch('app.api.analysis.CSVService')
-    @patch('app.api.analysis.RecommendationService')
-    @patch('app.api.analysis.WaterAnalysis')
-    def test_upload_csv_success(self, mock_water_analysis, mock_recommendation, mock_csv_service):
+    def test_upload_csv_success(self, mock_csv_service, memory_repository):
         """Test successful CSV upload and analysis"""
         # Mock CSV service - need to handle async method
-        mock_csv_service.validate_and_parse_csv = AsyncMock(return_value=Mock())
-        mock_csv_service.calculate_statistics.return_value = {
-            'avg_ph': 7.5,
-            'ph_category': 'Target',
+        mock_csv_service.hash_upload = AsyncMock(return_value="0" * 64)
+        mock_csv_service.analyze_csv_stream = AsyncMock(return_value={
+            'avg_ph': 7.8,
+            'ph_category': 'In target range',
             'avg_tds': 150,
             'tds_category': 'Moderate',
+            'treatment_train': "No treatment required",
+            'explanation': "Water is clean",
             'row_count': 10,
             'min_ph': 7.2,
             'max_ph': 7.8,
             'min_tds': 140,
             'max_tds': 160
-        }
-        
-        # Mock recommendation service
-        mock_recommendation.get_recommendation.return_value = (
-            "No treatment required",
-            "Water is clean"
-        )
-        
-        # Mock database save
-        mock_analysis_instance = Mock()
-        mock_analysis_instance.id = "507f1f77bcf86cd799439011"
-        mock_analysis_instance.upload_timestamp = datetime(2026, 2, 5, 12, 0, 0)
-        mock_analysis_instance.original_filename = "test.csv"
-        mock_analysis_instance.site_name = "Test Site"
-        mock_water_analysis.return_value = mock_analysis_instance
+        })
         
         # Create test CSV file
         csv_content = b"pH,TDS\n7.5,150\n7.6,155\n7.4,145"
@@ -65,7 +53,13 @@ class TestAnalysisEndpoints:
         assert data["original_filename"] == "test.csv"
         assert data["site_name"] == "Test Site"
         assert "summary" in data
-        assert "recommendation" in data
+        assert data["recommendation"]["treatment_train"] == "No treatment required"
+        
+        # Analysis is stored through the repository
+        stored = list(memory_repository.documents.values())
+        assert len(stored) == 1
+        assert str(stored[0]['_id']) == data["analysis_id"]
+        assert stored[0]['site_name'] == "Test Site"
     
     def test_upload_invalid_file_type(self):
         """Test upload with non-CSV file"""
@@ -78,3 +72,303 @@ class TestAnalysisEndpoints:
         
         assert response.status_code == 400
         assert "Invalid file type" in response.json()["detail"]
+
+
+class TestUploadConcurrency:
+    """Test uploads do not block the event loop and are bounded"""
+    
+    def test_upload_rejected_when_saturated(self, memory_repository):
+        """Test a 503 is returned when all upload slots are taken"""
+        from app.core.executors import upload_limiter
+        
+        taken = upload_limiter.limit
+        upload_limiter.in_flight += taken
+        try:
+            response = client.post(
+                "/api/v1/analysis/upload",
+                files={"file": ("test.csv", BytesIO(b"pH,TDS\n7.5,150\n"), "text/csv")}
+            )
+        finally:
+            upload_limiter.in_flight -= taken
+        
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert memory_repository.documents == {}
+    
+    def test_upload_reports_rule_distribution(self, memory_repository):
+        """Test uploads classify every reading, not just the average"""
+        rows = "".join(f"{7.0 if i % 2 else 8.8},50\n" for i in range(100))
+        
+        with patch('app.core.executors.settings.PARSE_WORKERS', 0):
+            response = client.post(
+                "/api/v1/analysis/upload",
+                files={"file": ("bimodal.csv", "pH,TDS\n" + rows, "text/csv")}
+            )
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["summary"]["ph_category"] == "In target range"
+        assert data["recommendation"]["treatment_train"] == "No treatment required"
+        distribution = data["rule_distribution"]
+        assert distribution["rule_counts"]["B"] == 50
+        assert distribution["rule_counts"]["C"] == 50
+        assert distribution["out_of_range_fraction"] == 1.0
+        assert distribution["dominant_rule"] == "B"
+        assert "H₂SO₄" in distribution["dominant_treatment_train"]
+        stored = next(iter(memory_repository.documents.values()))
+        assert stored["dominant_rule"] == "B"
+    
+    def test_upload_reports_spread(self, memory_repository):
+        """Test the variance and percentiles of the readings are stored and returned"""
+        rows = "".join(f"{7.0 + i / 100},{100 + i}\n" for i in range(101))
+        
+        with patch('app.core.executors.settings.PARSE_WORKERS', 0):
+            response = client.post(
+                "/api/v1/analysis/upload",
+                files={"file": ("spread.csv", "pH,TDS\n" + rows, "text/csv")}
+            )
+        
+        assert response.status_code == 200
+        summary = response.json()["summary"]
+        assert summary["var_ph"] == pytest.approx(0.08585)
+        assert summary["var_tds"] == pytest.approx(858.5)
+        assert summary["ph_percentiles"]["p50"] == pytest.approx(7.5, abs=0.02)
+        assert summary["tds_percentiles"]["p95"] == pytest.approx(195, abs=2)
+        stored = next(iter(memory_repository.documents.values()))
+        assert stored["ph_percentiles"] == summary["ph_percentiles"]
+    
+    def test_dominant_treatment_from_site_profile(self):
+        """Test the dominant rule's treatment is read from the analysis's site profile"""
+        document = {
+            '_id': ObjectId(), 'upload_timestamp': datetime(2026, 2, 5), 'original_filename': "a.csv",
+            'site_name': "Site A", 'avg_ph': 7.8, 'ph_category': "In target range", 'avg_tds': 150,
+            'tds_category': "Moderate", 'row_count': 10, 'treatment_train': "RO", 'explanation': "TDS",
+            'rule_counts': {"D": 10}, 'out_of_range_fraction': 1.0, 'dominant_rule': "D"
+        }
+        table = Mock()
+        table.recommendation.return_value = ("Site A RO", "explanation")
+        
+        with patch('app.api.analysis.get_rule_table', return_value=table) as get_rule_table:
+            response = analysis_response(document)
+        
+        get_rule_table.assert_called_once_with("Site A")
+        assert response.rule_distribution.dominant_treatment_train == "Site A RO"
+    
+    def test_upload_reports_timeseries(self, memory_repository):
+        """Test timestamped uploads get windowed statistics and excursions"""
+        rows = "".join(
+            f"{9.0 if 30 <= i < 60 else 8.0},50,2024-01-01T{i // 60:02d}:{i % 60:02d}:00\n"
+            for i in range(120)
+        )
+        
+        with patch('app.core.executors.settings.PARSE_WORKERS', 0):
+            response = client.post(
+                "/api/v1/analysis/upload",
+                files={"file": ("log.csv", "pH,TDS,Timestamp\n" + rows, "text/csv")}
+            )
+        
+        assert response.status_code == 200
+        series = response.json()["timeseries"]
+        assert series["hourly"]["count"] == [60, 60]
+        assert series["daily"]["ph_mean"] == [pytest.approx(8.25)]
+        [excursion] = series["excursions"]
+        assert excursion["parameter"] == "ph"
+        assert excursion["direction"] == "high"
+        # The trailing 15-minute mean crosses 8.3 a few minutes into the spike
+        assert "2024-01-01T00:30:00" <= excursion["start"] <= "2024-01-01T00:35:00"
+        stored = next(iter(memory_repository.documents.values()))
+        assert stored["timeseries"]["excursion_count"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_health_answers_during_upload(self, memory_repository):
+        """Test /health is served while an upload's parse is still running"""
+        import asyncio
+        import threading
+        import httpx
+        from app.services.csv_service import CSVService
+        
+        summarize_block = CSVService._summarize_block
+        parsing = threading.Event()
+        release = threading.Event()
+        
+        def blocked_summarize(*args):
+            # Hold the parse worker until the health checks are done
+            parsing.set()
+            release.wait(10)
+            return summarize_block(*args)
+        
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            with patch('app.core.executors.settings.PARSE_WORKERS', 0), \
+                    patch.object(CSVService, '_summarize_block', staticmethod(blocked_summarize)):
+                upload = asyncio.create_task(ac.post(
+                    "/api/v1/analysis/upload",
+                    files={"file": ("log.csv", b"pH,TDS\n7.5,150\n7.6,155\n", "text/csv")}
+                ))
+                try:
+                    assert await asyncio.to_thread(parsing.wait, 10)
+                    for _ in range(3):
+                        health = await ac.get("/health")
+                        assert health.status_code == 200
+                    assert not upload.done()
+                finally:
+                    release.set()
+                response = await upload
+        
+        assert response.status_code == 200
+        assert response.json()["summary"]["row_count"] == 2
+
+
+class TestRawReadings:
+    """Test raw readings are kept on request and re-analyzed from storage"""
+    
+    ROWS = "pH,TDS,Timestamp\n" + "".join(
+        f"{8.0 + i % 3 / 10},{50 + i},2024-01-01T00:{i:02d}:00\n" for i in range(60)
+    )
+    
+    def upload(self, **data):
+        with patch('app.core.executors.settings.PARSE_WORKERS', 0):
+            return client.post(
+                "/api/v1/analysis/upload",
+                files={"file": ("log.csv", self.ROWS, "text/csv")},
+                data=data
+            )
+    
+    def test_readings_not_stored_by_default(self, reading_repository):
+        """Test uploads keep no raw readings unless asked to"""
+        response = self.upload()
+        
+        assert response.status_code == 200
+        assert response.json()["readings_stored"] is False
+        assert reading_repository.chunks == {}
+        
+        reanalysis = client.post(f"/api/v1/analysis/{response.json()['analysis_id']}/reanalyze")
+        assert reanalysis.status_code == 409
+    
+    def test_stored_readings_reanalyzed_with_current_rules(self, reading_repository):
+        """Test re-analysis reads the readings back and applies rule changes"""
+        import json
+        from app.services import rule_table
+        
+        response = self.upload(site_name="Site A", store_readings="true")
+        assert response.status_code == 200
+        original = response.json()
+        assert original["readings_stored"] is True
+        assert original["summary"]["ph_category"] == "In target range"
+        [chunks] = reading_repository.chunks.values()
+        assert sum(chunk['count'] for chunk in chunks) == 60
+        assert all(chunk['meta']['site_name'] == "Site A" for chunk in chunks)
+        
+        # Narrow the target band so the same readings now count as high pH
+        config = json.loads(rule_table.DEFAULT_RULE_TABLE_PATH.read_text(encoding='utf-8'))
+        config['ph']['thresholds'][1]['value'] = 7.9
+        strict = rule_table.RuleConfig.from_dict(config)
+        saved = rule_table._config
+        rule_table.set_rule_config(strict)
+        try:
+            reanalysis = client.post(f"/api/v1/analysis/{original['analysis_id']}/reanalyze")
+        finally:
+            rule_table.set_rule_config(saved)
+        
+        assert reanalysis.status_code == 200
+        updated = reanalysis.json()
+        assert updated["summary"]["row_count"] == 60
+        assert updated["summary"]["avg_ph"] == pytest.approx(original["summary"]["avg_ph"])
+        assert updated["summary"]["ph_category"] == "High pH"
+        assert updated["timeseries"]["hourly"]["count"] == [60]
+        assert updated["reanalyzed_at"] is not None
+        assert updated["upload_timestamp"] == original["upload_timestamp"]
+    
+    def test_failed_upload_discards_readings(self, reading_repository, memory_repository):
+        """Test readings written before an upload fails are removed again"""
+        with patch('app.core.executors.settings.PARSE_WORKERS', 0):
+            response = client.post(
+                "/api/v1/analysis/upload",
+                files={"file": ("bad.csv", "pH,TDS\nabc,def\n", "text/csv")},
+                data={"store_readings": "true"}
+            )
+        
+        assert response.status_code == 400
+        assert reading_repository.chunks == {}
+        assert memory_repository.documents == {}
+    
+    def test_reanalyze_unknown_analysis(self):
+        """Test re-analysis of a missing or malformed id"""
+        from bson import ObjectId
+        
+        assert client.post(f"/api/v1/analysis/{ObjectId()}/reanalyze").status_code == 404
+        assert client.post("/api/v1/analysis/not-an-id/reanalyze").status_code == 400
+
+
+class TestRetriedUploads:
+    """Test retried uploads return the stored analysis instead of a new one"""
+    
+    BODY = "pH,TDS\n7.9,150\n8.0,160\n"
+    
+    def upload(self, body=BODY, site_name="Site A", key=None):
+        return client.post(
+            "/api/v1/analysis/upload",
+            files={"file": ("log.csv", body, "text/csv")},
+            data={"site_name": site_name} if site_name else {},
+            headers={"Idempotency-Key": key} if key else {}
+        )
+    
+    def test_identical_file_is_not_parsed_again(self, memory_repository):
+        """Test the same bytes for the same site short-circuit to the first analysis"""
+        from app.services.csv_service import CSVService
+        
+        first = self.upload()
+        with patch.object(CSVService, 'analyze_csv_stream', AsyncMock()) as analyze:
+            retry = self.upload()
+        
+        assert retry.status_code == 200
+        assert retry.json() == first.json()
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert "idempotent-replayed" not in first.headers
+        analyze.assert_not_called()
+        assert len(memory_repository.documents) == 1
+    
+    def test_same_file_for_other_site_is_new_analysis(self, memory_repository):
+        """Test deduplication is per site, with no site as its own site"""
+        ids = {self.upload(site_name=site).json()["analysis_id"] for site in ("Site A", "Site B", None)}
+        
+        assert len(ids) == 3
+        assert self.upload(site_name=None).json()["analysis_id"] in ids
+        assert len(memory_repository.documents) == 3
+    
+    def test_idempotency_key_replays_and_rejects_reuse(self, memory_repository):
+        """Test a key returns its analysis and cannot be reused for another file"""
+        first = self.upload(key="collector-7:42")
+        
+        retry = self.upload(key="collector-7:42")
+        reused = self.upload(body="pH,TDS\n6.5,900\n", key="collector-7:42")
+        
+        assert retry.json()["analysis_id"] == first.json()["analysis_id"]
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert reused.status_code == 422
+        stored = next(iter(memory_repository.documents.values()))
+        assert stored["idempotency_key"] == "collector-7:42"
+        assert len(stored["content_hash"]) == 64
+    
+    def test_concurrent_duplicate_returns_winner(self, memory_repository, reading_repository):
+        """Test losing the insert race to an identical upload replays the winner"""
+        from app.db.repository import DuplicateAnalysisError
+        
+        winner = {'_id': ObjectId(), 'upload_timestamp': datetime(2026, 1, 1), 'original_filename': "log.csv",
+                  'site_name': "Site A", 'avg_ph': 7.95, 'ph_category': "In target range", 'avg_tds': 155.0,
+                  'tds_category': "Moderate", 'treatment_train': "No treatment required",
+                  'explanation': "Water is clean", 'row_count': 2}
+        lookups = AsyncMock(side_effect=[None, winner])
+        
+        with patch.object(memory_repository, 'get_by_content', lookups), \
+             patch.object(memory_repository, 'insert', AsyncMock(side_effect=DuplicateAnalysisError())):
+            response = client.post(
+                "/api/v1/analysis/upload",
+                files={"file": ("log.csv", self.BODY, "text/csv")},
+                data={"site_name": "Site A", "store_readings": "true"}
+            )
+        
+        assert response.status_code == 200
+        assert response.json()["analysis_id"] == str(winner['_id'])
+        assert response.headers["idempotent-replayed"] == "true"
+        assert reading_repository.chunks == {}
@@ -0,0 +1,197 @@
+"""
+Test the batch upload endpoint with plain files and archives
+"""
+import io
+import tarfile
+import zipfile
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, patch
+
+from app.main import app
+from app.services.batch_service import BatchService
+from app.services.csv_service import CSVService
+
+client = TestClient(app)
+
+
+def csv_body(ph: float, rows: int = 3) -> bytes:
+    return b"pH,TDS\n" + b"".join(b"%.1f,%d\n" % (ph, 100 + i) for i in range(rows))
+
+
+def zip_archive(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_archive(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def thread_parsing():
+    """Parse in the thread pool; the process pool path is covered by /upload tests."""
+    with patch('app.core.executors.settings.PARSE_WORKERS', 0):
+        yield
+
+
+def upload_batch(files, **data):
+    return client.post("/api/v1/analysis/upload/batch", files=[("files", f) for f in files], data=data)
+
+
+def test_plain_files_stored_with_one_bulk_write(memory_repository):
+    """Test several CSVs become analyses in a single insert_many"""
+    insert_many = AsyncMock(wraps=memory_repository.insert_many)
+
+    with patch.object(memory_repository, 'insert_many', insert_many):
+        response = upload_batch([
+            ("a.csv", csv_body(7.0), "text/csv"),
+            ("notes.txt", b"hello", "text/plain"),
+            ("b.csv", csv_body(8.8), "text/csv"),
+            ("bad.csv", b"pH,TDS\nx,y\n", "text/csv"),
+        ], site_name="Site A")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["created"], data["duplicates"], data["failed"]) == (2, 0, 2)
+    assert [r["filename"] for r in data["results"]] == ["a.csv", "notes.txt", "b.csv", "bad.csv"]
+    assert [r["status"] for r in data["results"]] == ["created", "failed", "created", "failed"]
+    assert data["results"][1]["status_code"] == 400
+    assert "numeric" in data["results"][3]["error"]
+    assert data["results"][2]["analysis"]["summary"]["ph_category"] == "High pH"
+    insert_many.assert_awaited_once()
+    assert len(insert_many.await_args.args[0]) == 2
+    assert {doc['site_name'] for doc in memory_repository.documents.values()} == {"Site A"}
+
+
+@pytest.mark.parametrize('build, filename', [(zip_archive, "night.zip"), (tar_archive, "night.tar.gz")])
+def test_archive_members_analyzed_in_order(memory_repository, build, filename):
+    """Test CSV members are analyzed and junk members skipped"""
+    archive = build({
+        "site/a.csv": csv_body(7.0),
+        "site/readme.md": b"not data",
+        "__MACOSX/site/._a.csv": b"\x00\x05",
+        "site/b.csv": csv_body(8.8),
+        "site/a-copy.csv": csv_body(7.0),
+    })
+
+    response = upload_batch([(filename, archive, "application/octet-stream")])
+
+    data = response.json()
+    assert [r["filename"] for r in data["results"]] == ["site/a.csv", "site/b.csv", "site/a-copy.csv"]
+    assert [r["status"] for r in data["results"]] == ["created", "created", "duplicate"]
+    assert data["results"][2]["analysis"]["analysis_id"] == data["results"][0]["analysis"]["analysis_id"]
+    assert len(memory_repository.documents) == 2
+    assert {doc['original_filename'] for doc in memory_repository.documents.values()} == {"site/a.csv", "site/b.csv"}
+
+
+def test_previously_uploaded_file_not_parsed(memory_repository):
+    """Test a file already stored for the site is a duplicate and skips parsing"""
+    first = client.post(
+        "/api/v1/analysis/upload",
+        files={"file": ("a.csv", csv_body(7.0), "text/csv")},
+        data={"site_name": "Site A"}
+    ).json()
+
+    with patch.object(CSVService, 'analyze_csv_stream', AsyncMock()) as analyze:
+        response = upload_batch([("a.csv", csv_body(7.0), "text/csv")], site_name="Site A")
+
+    [result] = response.json()["results"]
+    assert result["status"] == "duplicate"
+    assert result["analysis"]["analysis_id"] == first["analysis_id"]
+    analyze.assert_not_called()
+    assert len(memory_repository.documents) == 1
+
+
+def test_failed_copy_repeats_error():
+    """Test a copy of a failing file inside the batch reports the same error"""
+    response = upload_batch([
+        ("bad.csv", b"pH,TDS\nx,y\n", "text/csv"),
+        ("bad-again.csv", b"pH,TDS\nx,y\n", "text/csv"),
+    ])
+
+    first, second = response.json()["results"]
+    assert second["status"] == "failed"
+    assert second["filename"] == "bad-again.csv"
+    assert second["error"] == first["error"]
+
+
+def test_oversized_and_corrupt_archives_reported(memory_repository):
+    """Test members over MAX_FILE_SIZE and unreadable archives fail on their own"""
+    archive = zip_archive({"big.csv": csv_body(7.0, rows=200), "small.csv": csv_body(7.5)})
+
+    with patch.object(CSVService, 'MAX_FILE_SIZE', 1000):
+        response = upload_batch([
+            ("night.zip", archive, "application/zip"),
+            ("broken.zip", b"PK\x03\x04 not really", "application/zip"),
+        ])
+
+    results = response.json()["results"]
+    assert [(r["filename"], r["status"]) for r in results] == [
+        ("big.csv", "failed"), ("small.csv", "created"), ("broken.zip", "failed")
+    ]
+    assert "too large" in results[0]["error"]
+    assert "archive" in results[2]["error"]
+    assert len(memory_repository.documents) == 1
+
+
+def test_batch_over_file_limit_stores_nothing(memory_repository, reading_repository):
+    """Test a batch with too many CSVs is rejected and leaves no readings behind"""
+    archive = zip_archive({f"{i}.csv": csv_body(7.0 + i / 10) for i in range(3)})
+
+    with patch('app.services.batch_service.settings.MAX_BATCH_FILES', 2):
+        response = upload_batch([("night.zip", archive, "application/zip")], store_readings="true")
+
+    assert response.status_code == 413
+    assert memory_repository.documents == {}
+    assert reading_repository.chunks == {}
+
+
+def test_batch_over_size_limit_stops_reading_archive(memory_repository):
+    """Test a batch whose members decompress past MAX_BATCH_SIZE is rejected before reading them all"""
+    members = {f"{i}.csv": csv_body(7.0, rows=1000) for i in range(5)}
+    archive = tar_archive(members)
+    read = []
+    as_upload = BatchService._as_upload
+
+    def track(name, data):
+        read.append(name)
+        return as_upload(name, data)
+
+    with patch('app.services.batch_service.settings.MAX_BATCH_SIZE', len(members["0.csv"]) * 2), \
+            patch.object(BatchService, '_as_upload', staticmethod(track)):
+        response = upload_batch([("night.tar.gz", archive, "application/gzip")])
+
+    assert response.status_code == 413
+    assert "larger than" in response.json()["detail"]
+    assert read == ["0.csv", "1.csv", "2.csv"]
+    assert memory_repository.documents == {}
+
+
+def test_lost_race_reported_as_duplicate(memory_repository, reading_repository):
+    """Test a file stored concurrently by another request becomes a duplicate"""
+    winner = {}
+
+    async def insert_many(documents):
+        # Another request stores the same file just before the bulk write
+        winner.update(documents[0], _id=ObjectId())
+        await memory_repository.insert(dict(winner))
+        return []
+
+    with patch.object(memory_repository, 'insert_many', insert_many):
+        response = upload_batch([("a.csv", csv_body(7.0), "text/csv")], store_readings="true")
+
+    [result] = response.json()["results"]
+    assert result["status"] == "duplicate"
+    assert result["analysis"]["analysis_id"] == str(winner['_id'])
+    assert reading_repository.chunks == {}
@@ -0,0 +1,241 @@
+"""
+Test the cache of analyses by id
+"""
+import bson
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.db import cache as cache_module
+from app.db.cache import DocumentCache, LRUCacheBackend, RedisCacheBackend
+from app.db.repository import InMemoryAnalysisRepository, MongoAnalysisRepository, get_analysis_repository
+from app.main import app
+from tests.test_history import make_analysis
+
+client = TestClient(app)
+
+
+def memory_cache(max_entries=100, max_bytes=1 << 20, ttl=60.0):
+    return DocumentCache(LRUCacheBackend(max_entries, max_bytes), ttl)
+
+
+@pytest.fixture
+def cached_repository():
+    """Serve the routes from an in-memory repository with an analysis cache."""
+    repository = InMemoryAnalysisRepository(cache=memory_cache())
+    app.dependency_overrides[get_analysis_repository] = lambda: repository
+    yield repository
+    app.dependency_overrides.pop(get_analysis_repository, None)
+
+
+@pytest.mark.asyncio
+async def test_lru_evicts_least_recently_used():
+    """Test the entry not read for longest goes first once the count is exceeded"""
+    backend = LRUCacheBackend(max_entries=2, max_bytes=1000)
+    await backend.set('a', b'1', 60)
+    await backend.set('b', b'2', 60)
+    await backend.get('a')
+    await backend.set('c', b'3', 60)
+
+    assert list(backend.entries) == ['a', 'c']
+    assert backend.evictions == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_bounded_by_bytes():
+    """Test entries are evicted to stay within the byte budget, and oversize ones never stored"""
+    backend = LRUCacheBackend(max_entries=100, max_bytes=10)
+    await backend.set('a', b'x' * 6, 60)
+    await backend.set('b', b'y' * 4, 60)
+    await backend.set('c', b'z' * 5, 60)
+    await backend.set('huge', b'!' * 11, 60)
+
+    assert list(backend.entries) == ['b', 'c']
+    assert backend.size == 9
+    assert await backend.get('huge') is None
+
+
+@pytest.mark.asyncio
+async def test_lru_expires_entries():
+    """Test an entry past its TTL is a miss and frees its bytes"""
+    backend = LRUCacheBackend(max_entries=10, max_bytes=100)
+    await backend.set('a', b'1234', ttl=0)
+
+    assert await backend.get('a') is None
+    assert backend.stats() == {"entries": 0, "bytes": 0, "evictions": 0, "expirations": 1}
+
+
+@pytest.mark.asyncio
+async def test_document_cache_hands_out_copies():
+    """Test each hit decodes a fresh document, so callers cannot change the cached one"""
+    cache = memory_cache()
+    document = make_analysis()
+    await cache.put('a', document)
+
+    first = await cache.get('a')
+    first['user_notes'] = "changed"
+    second = await cache.get('a')
+
+    assert second == document
+    assert await cache.get('b') is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hit_ratio"] == pytest.approx(2 / 3)
+
+
+@pytest.mark.asyncio
+async def test_document_cache_skips_unencodable_documents():
+    """Test a document BSON cannot encode is served uncached rather than failing"""
+    cache = memory_cache()
+
+    await cache.put('a', {'_id': ObjectId(), 'value': object()})
+
+    assert cache.backend.entries == {}
+
+
+@pytest.mark.asyncio
+async def test_cached_get_reads_each_analysis_once():
+    """Test repeated lookups are served from the cache, and missing analyses are not cached"""
+    repository = InMemoryAnalysisRepository(cache=memory_cache())
+    document = await repository.insert(make_analysis())
+    analysis_id = str(document['_id'])
+
+    with patch.object(repository, 'get', wraps=repository.get) as get:
+        first = await repository.cached_get(analysis_id, ttl=60)
+        second = await repository.cached_get(analysis_id, ttl=60)
+        missing = await repository.cached_get(str(ObjectId()), ttl=60)
+        await repository.cached_get(str(ObjectId()), ttl=60)
+
+    assert first == second == document
+    assert missing is None
+    assert get.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_updates_invalidate_cached_analyses():
+    """Test notes changes and other updates are never hidden by a cached copy"""
+    repository = InMemoryAnalysisRepository(cache=memory_cache())
+    document = await repository.insert(make_analysis())
+    analysis_id = str(document['_id'])
+    await repository.cached_get(analysis_id, ttl=60)
+
+    await repository.update_notes(analysis_id, "Dosed acid")
+    noted = await repository.cached_get(analysis_id, ttl=60)
+    await repository.update(analysis_id, {'reanalyzed_at': datetime(2026, 3, 1)})
+    reanalyzed = await repository.cached_get(analysis_id, ttl=60)
+
+    assert noted['user_notes'] == "Dosed acid"
+    assert reanalyzed['reanalyzed_at'] == datetime(2026, 3, 1)
+    assert repository.cache.backend.stats()["entries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_inserts_keep_cached_analyses():
+    """Test new uploads do not drop the cached analyses"""
+    repository = InMemoryAnalysisRepository(cache=memory_cache())
+    document = await repository.insert(make_analysis())
+    await repository.cached_get(str(document['_id']), ttl=60)
+
+    await repository.insert(make_analysis(_id=ObjectId(), content_hash="other"))
+    await repository.cached_get(str(document['_id']), ttl=60)
+
+    assert repository.cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_updates_by_other_workers_drop_shared_entries():
+    """Test an update through one worker is seen by another sharing the cache backend"""
+    document = make_analysis()
+    noted = {**document, 'user_notes': "Dosed acid"}
+    collection = MagicMock()
+    collection.name = 'water_analyses'
+    collection.find_one = AsyncMock(side_effect=[document, noted])
+    collection.find_one_and_update = AsyncMock(return_value=noted)
+    versions = MagicMock()
+    versions.find_one_and_update = AsyncMock(return_value={'version': 2})
+    shared = LRUCacheBackend(100, 1 << 20)
+    reader = MongoAnalysisRepository(collection, versions=versions, cache=DocumentCache(shared, 60))
+    writer = MongoAnalysisRepository(collection, versions=versions, cache=DocumentCache(shared, 60))
+    analysis_id = str(document['_id'])
+
+    assert await reader.cached_get(analysis_id, ttl=60) == document
+    assert await writer.cached_get(analysis_id, ttl=60) == document
+    await writer.update_notes(analysis_id, "Dosed acid")
+
+    assert (await reader.cached_get(analysis_id, ttl=60))['user_notes'] == "Dosed acid"
+    assert collection.find_one.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_updates_keep_other_cached_analyses():
+    """Test an update drops only the changed analysis from the cache"""
+    repository = InMemoryAnalysisRepository(cache=memory_cache())
+    first = await repository.insert(make_analysis())
+    second = await repository.insert(make_analysis(_id=ObjectId(), content_hash="other"))
+    await repository.cached_get(str(first['_id']), ttl=60)
+    await repository.cached_get(str(second['_id']), ttl=60)
+
+    await repository.update_notes(str(first['_id']), "RO")
+    await repository.cached_get(str(second['_id']), ttl=60)
+
+    assert set(repository.cache.backend.entries) == {str(second['_id'])}
+    assert repository.cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_analysis_route_serves_notes_changes(cached_repository):
+    """Test the by-id route reads through the cache and reads again after a notes change"""
+    document = await cached_repository.insert(make_analysis())
+    url = f"/api/v1/analysis/{document['_id']}"
+    first = client.get(url)
+    assert client.get(url).json() == first.json()
+
+    client.patch(f"{url}/notes", json={"user_notes": "Switched to RO"})
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != first.headers["ETag"]
+    stats = client.get("/health/cache").json()
+    assert stats["enabled"] is True
+    assert stats["backend"] == "LRUCacheBackend"
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_cache_stats_when_disabled():
+    """Test the stats endpoint reports a repository without a cache"""
+    assert client.get("/health/cache").json() == {"enabled": False}
+
+
+@pytest.mark.skipif(cache_module.redis is None, reason="redis not installed")
+@pytest.mark.asyncio
+async def test_redis_errors_are_misses():
+    """Test an unreachable Redis makes lookups misses instead of failing reads"""
+    from redis.exceptions import ConnectionError
+
+    redis_client = MagicMock()
+    redis_client.get = AsyncMock(side_effect=ConnectionError("refused"))
+    redis_client.set = AsyncMock(side_effect=ConnectionError("refused"))
+    cache = DocumentCache(RedisCacheBackend(redis_client), ttl=30)
+
+    await cache.put('a', make_analysis())
+
+    assert await cache.get('a') is None
+    assert cache.stats()["errors"] == 2
+
+
+@pytest.mark.skipif(cache_module.redis is None, reason="redis not installed")
+@pytest.mark.asyncio
+async def test_redis_entries_expire_with_ttl():
+    """Test entries are stored under the key prefix with a millisecond expiry"""
+    redis_client = MagicMock()
+    redis_client.set = AsyncMock()
+    cache = DocumentCache(RedisCacheBackend(redis_client), ttl=2.5)
+
+    await cache.put('a', {'_id': 1})
+
+    key, value = redis_client.set.call_args.args
+    assert key == "analysis:a"
+    assert redis_client.set.call_args.kwargs == {'px': 2500}
+    assert value == bson.encode({'_id': 1})
@@ -0,0 +1,107 @@
+"""
+Test response compression and encoded ETags
+"""
+import pytest
+import pytest_asyncio
+from datetime import datetime
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+import app.core.compression as compression
+from app.core.compression import choose_encoding
+from app.main import app
+
+client = TestClient(app)
+
+
+@pytest_asyncio.fixture
+async def long_history(memory_repository):
+    """Enough analyses with long explanations for a page well over the threshold."""
+    for day in range(1, 21):
+        await memory_repository.insert({
+            '_id': ObjectId(),
+            'upload_timestamp': datetime(2026, 2, day),
+            'original_filename': f"day{day}.csv",
+            'site_name': "Site A",
+            'avg_ph': 8.6,
+            'ph_category': "High pH",
+            'avg_tds': 620.0,
+            'tds_category': "High",
+            'treatment_train': "Acid dosing + Reverse osmosis (RO)",
+            'explanation': "pH is above the target band and TDS is high; " * 6,
+            'row_count': 10
+        })
+
+
+@pytest.mark.parametrize('header, expected', [
+    ("gzip, deflate, br", "br"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("*", "br"),
+    ("identity", None),
+    ("", None),
+    ("gzip;q=bogus", None),
+])
+def test_choose_encoding(header, expected):
+    """Test Accept-Encoding quality values pick the coding"""
+    with patch.object(compression, 'brotli', object()):
+        assert choose_encoding(header) == expected
+
+
+def test_choose_encoding_without_brotli():
+    """Test gzip is offered when brotli is not installed"""
+    with patch.object(compression, 'brotli', None):
+        assert choose_encoding("br, gzip") == "gzip"
+        assert choose_encoding("br") is None
+
+
+def test_large_page_gzipped_with_encoded_etag(long_history):
+    """Test a page over the threshold is gzipped and its ETag marked"""
+    plain = client.get("/api/v1/analysis/history", headers={"Accept-Encoding": "identity"})
+    response = client.get("/api/v1/analysis/history", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.content == plain.content
+    assert int(response.headers["Content-Length"]) < len(plain.content) / 4
+    assert "Content-Encoding" not in plain.headers
+    assert response.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+
+
+def test_brotli_used_when_installed(long_history):
+    """Test brotli is preferred when the client accepts it"""
+    pytest.importorskip("brotli")
+
+    response = client.get("/api/v1/analysis/history", headers={"Accept-Encoding": "gzip, br"})
+
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.json()["total"] == 20
+
+
+def test_small_response_not_compressed():
+    """Test responses under COMPRESSION_MIN_SIZE are sent as they are"""
+    response = client.get("/health", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+
+
+def test_not_modified_echoes_encoded_etag(long_history):
+    """Test a 304 repeats the encoded ETag the client revalidated"""
+    etag = client.get("/api/v1/analysis/history", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+
+    response = client.get("/api/v1/analysis/history",
+                          headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_streamed_export_compressed(long_history):
+    """Test streamed exports are compressed chunk by chunk and decode intact"""
+    plain = client.get("/api/v1/analysis/export?format=ndjson", headers={"Accept-Encoding": "identity"})
+    response = client.get("/api/v1/analysis/export?format=ndjson", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.content == plain.content
+    assert len(response.text.splitlines()) == 20
@@ -1,7 +1,10 @@
 import pytest
 import io
+import os
 from fastapi import UploadFile, HTTPException
 from app.services.csv_service import CSVService
+from app.services.statistics import StatsAccumulator
+from app.services.timeseries import NAT
 
 
 @pytest.fixture
@@ -60,6 +63,18 @@ async def test_validate_csv_empty_file(empty_csv_file):
     assert "empty" in str(exc_info.value.detail).lower()
 
 
+@pytest.mark.asyncio
+async def test_validate_csv_empty_file_checked_before_columns():
+    """Test a header-only CSV is reported as empty even if its columns are wrong."""
+    file = UploadFile(filename="empty.csv", file=io.BytesIO(b"pH,Temperature\n"))
+    
+    with pytest.raises(HTTPException) as exc_info:
+        await CSVService.validate_and_parse_csv(file)
+    
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "CSV file is empty"
+
+
 @pytest.mark.asyncio
 async def test_validate_csv_missing_columns(missing_columns_csv):
     """Test validation fails for missing required columns."""
@@ -115,3 +130,222 @@ def test_calculate_statistics_with_nulls():
     assert 'avg_ph' in stats
     assert 'avg_tds' in stats
     assert stats['row_count'] == 1  # Only one row has both pH and TDS values
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_success(valid_csv_file):
+    """Test streaming analysis matches the in-memory statistics."""
+    stats = await CSVService.analyze_csv_stream(valid_csv_file)
+    
+    assert stats['row_count'] == 3
+    assert stats['avg_ph'] == pytest.approx(7.5)
+    assert stats['avg_tds'] == pytest.approx(383.3333, rel=1e-4)
+    assert stats['min_ph'] == 7.2
+    assert stats['max_tds'] == 420
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_small_chunks(monkeypatch):
+    """Test lines split across chunk boundaries are parsed correctly."""
+    monkeypatch.setattr(CSVService, 'CHUNK_SIZE', 7)
+    rows = "".join(f"{7 + (i % 10) / 10},{100 + i},Site {i}\r\n" for i in range(200))
+    content = ("pH,TDS,Location\r\n" + rows).encode()
+    file = UploadFile(filename="chunks.csv", file=io.BytesIO(content))
+    
+    stats = await CSVService.analyze_csv_stream(file)
+    
+    assert stats['row_count'] == 200
+    assert stats['avg_tds'] == pytest.approx(199.5)
+    assert stats['min_ph'] == 7.0
+    assert stats['max_ph'] == 7.9
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_reports_progress(monkeypatch):
+    """Test the running row count is reported block by block."""
+    monkeypatch.setattr(CSVService, 'CHUNK_SIZE', 64)
+    content = b"pH,TDS\n" + b"".join(b"7.%d,%d\n" % (i % 10, 100 + i) for i in range(50))
+    file = UploadFile(filename="progress.csv", file=io.BytesIO(content))
+    reported = []
+    
+    async def progress(rows):
+        reported.append(rows)
+    
+    stats = await CSVService.analyze_csv_stream(file, progress=progress)
+    
+    assert len(reported) > 1
+    assert reported == sorted(reported)
+    assert reported[-1] == stats['row_count'] == 50
+
+
+@pytest.mark.asyncio
+async def test_spool_upload_copies_to_disk(tmp_path):
+    """Test an upload is copied to its own file in the spool directory."""
+    content = b"pH,TDS\n7.5,150\n"
+    file = UploadFile(filename="spool.csv", file=io.BytesIO(content))
+    
+    path, size = await CSVService.spool_upload(file, str(tmp_path))
+    
+    assert size == len(content)
+    assert os.path.dirname(path) == str(tmp_path)
+    with open(path, 'rb') as spooled:
+        assert spooled.read() == content
+
+
+@pytest.mark.asyncio
+async def test_spool_upload_rejects_oversize(monkeypatch, tmp_path):
+    """Test an oversize upload is refused and leaves no spool file behind."""
+    monkeypatch.setattr(CSVService, 'MAX_FILE_SIZE', 1024)
+    monkeypatch.setattr(CSVService, 'CHUNK_SIZE', 256)
+    file = UploadFile(filename="big.csv", file=io.BytesIO(b"pH,TDS\n" + b"7.5,150\n" * 1000))
+    
+    with pytest.raises(HTTPException) as exc_info:
+        await CSVService.spool_upload(file, str(tmp_path))
+    
+    assert "too large" in exc_info.value.detail
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_rejects_oversize_early(monkeypatch):
+    """Test oversize uploads are rejected before the whole body is read."""
+    monkeypatch.setattr(CSVService, 'MAX_FILE_SIZE', 1024)
+    monkeypatch.setattr(CSVService, 'CHUNK_SIZE', 256)
+    body = io.BytesIO(b"pH,TDS\n" + b"7.5,150\n" * 10000)
+    file = UploadFile(filename="big.csv", file=body)
+    
+    with pytest.raises(HTTPException) as exc_info:
+        await CSVService.analyze_csv_stream(file)
+    
+    assert exc_info.value.status_code == 400
+    assert "too large" in exc_info.value.detail
+    assert body.tell() <= 1024 + 256
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_empty_file(empty_csv_file):
+    """Test streaming analysis fails for a header-only CSV."""
+    with pytest.raises(HTTPException) as exc_info:
+        await CSVService.analyze_csv_stream(empty_csv_file)
+    
+    assert exc_info.value.status_code == 400
+    assert "empty" in str(exc_info.value.detail).lower()
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_empty_file_checked_before_columns():
+    """Test streaming analysis reports a header-only CSV as empty even if its columns are wrong."""
+    file = UploadFile(filename="empty.csv", file=io.BytesIO(b"pH,Temperature\n\n"))
+    
+    with pytest.raises(HTTPException) as exc_info:
+        await CSVService.analyze_csv_stream(file)
+    
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "CSV file is empty"
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_missing_columns(missing_columns_csv):
+    """Test streaming analysis reports missing columns."""
+    with pytest.raises(HTTPException) as exc_info:
+        await CSVService.analyze_csv_stream(missing_columns_csv)
+    
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail["missing_columns"] == ["TDS"]
+
+
+@pytest.fixture(params=['c', 'pyarrow'])
+def csv_engine(request, monkeypatch):
+    """Run a test with each available CSV engine."""
+    if request.param == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    monkeypatch.setattr(CSVService, 'CSV_ENGINE', request.param)
+    return request.param
+
+
+def test_parse_columns_projects_ph_and_tds(csv_engine):
+    """Test only the pH and TDS fields are parsed, as float64."""
+    rows = b'2024-01-01,"Site, A",7.2,350\n2024-01-02,Site B,7.5,\n\n2024-01-03,Site C,7.8,380\n'
+    
+    values = CSVService._parse_columns(rows, (4, 2, 3))
+    
+    assert values.dtype == 'float64'
+    assert values.shape == (2, 3)
+    assert values[0].tolist() == [7.2, 7.5, 7.8]
+    assert values[1][0] == 350 and values[1][2] == 380
+    assert values[1][1] != values[1][1]  # NaN
+
+
+def test_parse_columns_coerces_non_numeric(csv_engine):
+    """Test non-numeric cells become NaN instead of failing the upload."""
+    values = CSVService._parse_columns(b"7.2,abc\n7.4,120\n", (2, 0, 1))
+    
+    stats = CSVService._build_statistics(StatsAccumulator.from_values(values))
+    
+    assert stats['row_count'] == 1
+    assert stats['avg_tds'] == 120
+
+
+def test_parse_columns_malformed_rows(csv_engine):
+    """Test malformed rows are reported as a parse failure."""
+    with pytest.raises(HTTPException) as exc_info:
+        CSVService._parse_columns(b'7.2,100\n7.4,"120\n', (2, 0, 1))
+    
+    assert exc_info.value.status_code == 400
+    assert "Failed to parse CSV file" in exc_info.value.detail
+
+
+@pytest.mark.asyncio
+async def test_validate_csv_returns_projected_columns(valid_csv_file, csv_engine):
+    """Test unused columns such as Timestamp are not parsed."""
+    df = await CSVService.validate_and_parse_csv(valid_csv_file)
+    
+    assert list(df.columns) == ['ph', 'tds']
+    assert df['tds'].dtype == 'float64'
+
+
+def test_parse_block_reads_timestamps(csv_engine):
+    """Test the Timestamp column is parsed to UTC nanoseconds in the same pass."""
+    rows = b"7.2,350,2024-01-01 10:00\n7.5,,2024-01-01T11:00:30\n7.8,380,\n"
+    
+    values, timestamps = CSVService._parse_block(rows, (3, 0, 1, 2))
+    
+    assert values.shape == (2, 3)
+    assert timestamps.dtype == 'int64'
+    assert timestamps[0] == 1704103200 * 10**9
+    assert str(timestamps[1].astype('datetime64[ns]')) == "2024-01-01T11:00:30.000000000"
+    assert timestamps[2] == NAT
+
+
+def test_parse_block_converts_offsets_and_bad_timestamps(csv_engine):
+    """Test zone offsets are converted to UTC and unreadable stamps become NaT."""
+    rows = b"7.2,350,2024-01-01T10:00:00+02:00\n7.5,400,yesterday\n"
+    
+    values, timestamps = CSVService._parse_block(rows, (3, 0, 1, 2))
+    
+    assert values[0].tolist() == [7.2, 7.5]
+    assert str(timestamps[0].astype('datetime64[ns]')) == "2024-01-01T08:00:00.000000000"
+    assert timestamps[1] == NAT
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_timeseries(valid_csv_file, csv_engine):
+    """Test files with a Timestamp column get hourly and daily windows."""
+    stats = await CSVService.analyze_csv_stream(valid_csv_file)
+    
+    series = stats['timeseries']
+    assert series['rows'] == 3
+    assert series['hourly']['offset'] == [0, 1, 2]
+    assert series['hourly']['ph_mean'] == [7.2, 7.5, 7.8]
+    assert series['daily']['count'] == [3]
+    assert series['excursion_count'] >= 1
+
+
+@pytest.mark.asyncio
+async def test_analyze_csv_stream_without_timestamps():
+    """Test files without a Timestamp column have no time-series summary."""
+    file = UploadFile(filename="plain.csv", file=io.BytesIO(b"pH,TDS\n7.2,350\n7.5,420\n"))
+    
+    stats = await CSVService.analyze_csv_stream(file)
+    
+    assert 'timeseries' not in stats
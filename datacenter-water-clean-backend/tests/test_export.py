@@ -0,0 +1,98 @@
+"""
+Test history export endpoint
+"""
+import csv
+import io
+import json
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from datetime import datetime
+
+from app.main import app
+from tests.test_history import make_analysis
+
+client = TestClient(app)
+
+
+async def seed(repository, count=5):
+    """Insert one analysis per day, alternating between two sites."""
+    for day in range(1, count + 1):
+        await repository.insert(make_analysis(
+            upload_timestamp=datetime(2026, 2, day),
+            site_name="Site A" if day % 2 else "Site B",
+            original_filename=f"day{day}.csv"
+        ))
+
+
+@pytest.mark.asyncio
+async def test_export_ndjson(memory_repository):
+    """Test NDJSON export streams one JSON object per analysis, newest first"""
+    await seed(memory_repository)
+    
+    response = client.get("/api/v1/analysis/export")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert 'water_analyses.ndjson' in response.headers["content-disposition"]
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["original_filename"] for row in rows] == [f"day{d}.csv" for d in (5, 4, 3, 2, 1)]
+    assert rows[0]["upload_timestamp"] == "2026-02-05T00:00:00"
+    assert rows[0]["min_ph"] is None
+
+
+@pytest.mark.asyncio
+async def test_export_csv_with_filters(memory_repository):
+    """Test CSV export honours the history filters"""
+    await seed(memory_repository)
+    
+    response = client.get("/api/v1/analysis/export?format=csv&site_name=Site A&from=2026-02-02")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["original_filename"] for row in rows] == ["day5.csv", "day3.csv"]
+    assert rows[0]["avg_ph"] == "7.8"
+    assert rows[0]["user_notes"] == ""
+
+
+@pytest.mark.asyncio
+async def test_export_parquet(memory_repository):
+    """Test Parquet export produces a readable file with one row group per batch"""
+    pq = pytest.importorskip("pyarrow.parquet")
+    await seed(memory_repository)
+    
+    with patch('app.api.export.settings') as mock_settings:
+        mock_settings.EXPORT_BATCH_SIZE = 2
+        response = client.get("/api/v1/analysis/export?format=parquet")
+    
+    assert response.status_code == 200
+    parquet_file = pq.ParquetFile(io.BytesIO(response.content))
+    assert parquet_file.metadata.num_rows == 5
+    assert parquet_file.metadata.num_row_groups == 3
+    table = parquet_file.read()
+    assert table.column("original_filename").to_pylist()[0] == "day5.csv"
+    assert str(table.schema.field("upload_timestamp").type) == "timestamp[ms]"
+
+
+def test_export_empty_csv_has_header():
+    """Test an export with no matches still returns the CSV header"""
+    response = client.get("/api/v1/analysis/export?format=csv")
+    
+    assert response.status_code == 200
+    assert response.text.startswith("id,upload_timestamp,")
+
+
+@patch('app.services.export_service.pq', None)
+def test_export_parquet_without_pyarrow():
+    """Test Parquet export is refused when pyarrow is missing"""
+    response = client.get("/api/v1/analysis/export?format=parquet")
+    
+    assert response.status_code == 501
+
+
+def test_export_unknown_format():
+    """Test unknown formats are rejected"""
+    response = client.get("/api/v1/analysis/export?format=xlsx")
+    
+    assert response.status_code == 422
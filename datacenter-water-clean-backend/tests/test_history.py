@@ -1,57 +1,60 @@
 """
 Test history API endpoints
 """
+import json
+from io import BytesIO
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import patch
 from datetime import datetime
+from bson import ObjectId
 
 from app.main import app
+from app.models.analysis_result import AnalysisHistoryResponse
+from app.services import rule_table
+from app.services.rule_table import DEFAULT_RULE_TABLE_PATH, RuleConfig, set_rule_config
 
 client = TestClient(app)
 
 
+def make_analysis(**overrides):
+    """Stored WaterAnalysis document with sensible defaults."""
+    document = {
+        '_id': ObjectId(),
+        'upload_timestamp': datetime(2026, 2, 5, 12, 0, 0),
+        'original_filename': "test.csv",
+        'site_name': "Test Site",
+        'avg_ph': 7.8,
+        'ph_category': "In target range",
+        'avg_tds': 150,
+        'tds_category': "Moderate",
+        'treatment_train': "Reverse osmosis (RO)",
+        'explanation': "TDS is elevated",
+        'row_count': 10
+    }
+    document.update(overrides)
+    return document
+
+
 class TestHistoryEndpoints:
     """Test history retrieval endpoints"""
     
-    @patch('app.api.history.WaterAnalysis')
-    def test_get_history_success(self, mock_water_analysis):
+    @pytest.mark.asyncio
+    async def test_get_history_success(self, memory_repository):
         """Test successful retrieval of analysis history"""
-        # Mock database query
-        mock_objects = Mock()
-        mock_objects.count.return_value = 2
-        
-        # Create mock analysis records
-        mock_analysis_1 = Mock()
-        mock_analysis_1.id = "507f1f77bcf86cd799439011"
-        mock_analysis_1.upload_timestamp = datetime(2026, 2, 5, 12, 0, 0)
-        mock_analysis_1.original_filename = "test1.csv"
-        mock_analysis_1.site_name = "Site A"
-        mock_analysis_1.avg_ph = 7.5
-        mock_analysis_1.ph_category = "Target"
-        mock_analysis_1.avg_tds = 150
-        mock_analysis_1.tds_category = "Moderate"
-        mock_analysis_1.treatment_train = "No treatment required"
-        mock_analysis_1.explanation = "Water is clean"
-        mock_analysis_1.user_notes = "Applied basic filtration"
-        
-        mock_analysis_2 = Mock()
-        mock_analysis_2.id = "507f1f77bcf86cd799439012"
-        mock_analysis_2.upload_timestamp = datetime(2026, 2, 4, 10, 0, 0)
-        mock_analysis_2.original_filename = "test2.csv"
-        mock_analysis_2.site_name = "Site B"
-        mock_analysis_2.avg_ph = 8.0
-        mock_analysis_2.ph_category = "High"
-        mock_analysis_2.avg_tds = 200
-        mock_analysis_2.tds_category = "Moderate"
-        mock_analysis_2.treatment_train = "H₂SO₄ acid dosing + RO"
-        mock_analysis_2.explanation = "High pH requires acid treatment"
-        mock_analysis_2.user_notes = None
-        
-        mock_skip = Mock()
-        mock_skip.limit.return_value = [mock_analysis_1, mock_analysis_2]
-        mock_objects.skip.return_value = mock_skip
-        mock_water_analysis.objects = mock_objects
+        await memory_repository.insert(make_analysis(
+            original_filename="test1.csv",
+            site_name="Site A",
+            user_notes="Applied basic filtration"
+        ))
+        await memory_repository.insert(make_analysis(
+            upload_timestamp=datetime(2026, 2, 4, 10, 0, 0),
+            original_filename="test2.csv",
+            site_name="Site B",
+            avg_ph=8.5,
+            ph_category="High pH",
+            avg_tds=200
+        ))
         
         # Make request
         response = client.get("/api/v1/analysis/history")
@@ -63,42 +66,271 @@ class TestHistoryEndpoints:
         assert "total" in data
         assert data["total"] == 2
         assert len(data["analyses"]) == 2
+        # Most recent first
+        assert data["analyses"][0]["original_filename"] == "test1.csv"
+        assert data["analyses"][0]["user_notes"] == "Applied basic filtration"
     
-    @patch('app.api.history.WaterAnalysis')
-    @patch('app.api.history.ObjectId')
-    def test_get_analysis_by_id_success(self, mock_objectid, mock_water_analysis):
+    @pytest.mark.asyncio
+    async def test_history_page_encoded_as_response_model(self, memory_repository):
+        """Test the page built from stored rows matches the response model's JSON"""
+        await memory_repository.insert(make_analysis(
+            upload_timestamp=datetime(2026, 2, 5, 12, 0, 0, 250000),
+            avg_tds=150,
+            site_name=None,
+            explanation="Café loop – TDS elevated"
+        ))
+        await memory_repository.insert(make_analysis(upload_timestamp=datetime(2026, 2, 4)))
+        
+        response = client.get("/api/v1/analysis/history?limit=1")
+        
+        assert response.headers["content-type"] == "application/json"
+        expected = AnalysisHistoryResponse.model_validate(response.json()).model_dump_json()
+        assert response.content == expected.encode()
+        assert response.json()["analyses"][0]["avg_tds"] == 150.0
+    
+    @pytest.mark.asyncio
+    async def test_get_history_pagination(self, memory_repository):
+        """Test limit and offset select the expected page"""
+        for day in range(1, 6):
+            await memory_repository.insert(make_analysis(
+                upload_timestamp=datetime(2026, 2, day),
+                original_filename=f"day{day}.csv"
+            ))
+        
+        response = client.get("/api/v1/analysis/history?limit=2&offset=1")
+        
+        data = response.json()
+        assert data["total"] == 5
+        assert [a["original_filename"] for a in data["analyses"]] == ["day4.csv", "day3.csv"]
+
+    @pytest.mark.asyncio
+    async def test_get_history_cursor_walks_all_pages(self, memory_repository):
+        """Test following next_cursor visits every record once, ties included"""
+        for day in (1, 2, 2, 2, 3):
+            await memory_repository.insert(make_analysis(upload_timestamp=datetime(2026, 2, day)))
+
+        seen = []
+        url = "/api/v1/analysis/history?limit=2"
+        while url:
+            data = client.get(url).json()
+            seen.extend(a["id"] for a in data["analyses"])
+            cursor = data["next_cursor"]
+            url = f"/api/v1/analysis/history?limit=2&cursor={cursor}" if cursor else None
+
+        assert len(seen) == 5
+        assert len(set(seen)) == 5
+        timestamps = [memory_repository.documents[ObjectId(i)]['upload_timestamp'] for i in seen]
+        assert timestamps == sorted(timestamps, reverse=True)
+
+    @pytest.mark.asyncio
+    async def test_get_history_last_page_has_no_cursor(self, memory_repository):
+        """Test next_cursor is null once no records remain"""
+        await memory_repository.insert(make_analysis())
+
+        data = client.get("/api/v1/analysis/history?limit=1").json()
+
+        assert len(data["analyses"]) == 1
+        assert data["next_cursor"] is None
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('mode, expected', [
+        ("exact", 3), ("cached", 3), ("estimated", 3), ("none", None)
+    ])
+    async def test_get_history_count_modes(self, memory_repository, mode, expected):
+        """Test each count_mode reports the total it promises"""
+        for day in (1, 2, 3):
+            await memory_repository.insert(make_analysis(upload_timestamp=datetime(2026, 2, day)))
+
+        data = client.get(f"/api/v1/analysis/history?count_mode={mode}").json()
+
+        assert data["total"] == expected
+        assert len(data["analyses"]) == 3
+
+    @pytest.mark.asyncio
+    async def test_get_history_cached_count_refreshed_by_upload(self, memory_repository):
+        """Test the cached total is reused between polls but not across inserts"""
+        await memory_repository.insert(make_analysis())
+        assert client.get("/api/v1/analysis/history").json()["total"] == 1
+
+        with patch.object(memory_repository, 'count', wraps=memory_repository.count) as count:
+            client.get("/api/v1/analysis/history")
+            count.assert_not_called()
+
+            await memory_repository.insert(make_analysis())
+            assert client.get("/api/v1/analysis/history").json()["total"] == 2
+            count.assert_called_once()
+
+    def test_get_history_invalid_count_mode(self):
+        """Test unknown count modes are rejected"""
+        response = client.get("/api/v1/analysis/history?count_mode=sometimes")
+
+        assert response.status_code == 422
+
+    @pytest.mark.asyncio
+    async def test_get_history_fields_drops_unrequested(self, memory_repository):
+        """Test fields= limits the optional fields returned"""
+        await memory_repository.insert(make_analysis(user_notes="Checked RO membrane"))
+
+        data = client.get("/api/v1/analysis/history?fields=site_name,user_notes").json()
+
+        item = data["analyses"][0]
+        assert item["site_name"] == "Test Site"
+        assert item["user_notes"] == "Checked RO membrane"
+        assert item["explanation"] is None
+        assert item["treatment_train"] is None
+        assert item["avg_ph"] == 7.8
+
+    @pytest.mark.asyncio
+    async def test_get_history_reads_only_returned_fields(self, memory_repository):
+        """Test the listing asks storage for response fields only"""
+        await memory_repository.insert(make_analysis())
+
+        with patch.object(memory_repository, 'list', wraps=memory_repository.list) as listing:
+            client.get("/api/v1/analysis/history?fields=")
+
+        fields = listing.call_args.kwargs['fields']
+        assert 'explanation' not in fields
+        assert 'row_count' not in fields
+        assert 'upload_timestamp' in fields
+
+    def test_get_history_unknown_field(self):
+        """Test unknown fields are rejected"""
+        response = client.get("/api/v1/analysis/history?fields=explanation,min_ph")
+
+        assert response.status_code == 400
+        assert response.json()["detail"]["unknown_fields"] == ["min_ph"]
+
+    @pytest.mark.asyncio
+    async def test_get_history_filters(self, memory_repository):
+        """Test site, category, treatment and time window filters combine"""
+        await memory_repository.insert(make_analysis(
+            upload_timestamp=datetime(2026, 1, 10), site_name="Site A", original_filename="jan-a.csv"))
+        await memory_repository.insert(make_analysis(
+            upload_timestamp=datetime(2026, 2, 10), site_name="Site A", original_filename="feb-a.csv"))
+        await memory_repository.insert(make_analysis(
+            upload_timestamp=datetime(2026, 2, 11), site_name="Site B", original_filename="feb-b.csv"))
+        await memory_repository.insert(make_analysis(
+            upload_timestamp=datetime(2026, 2, 12), site_name="Site A", original_filename="feb-a-high.csv",
+            ph_category="High pH", treatment_train="pH adjustment with sulfuric acid (H₂SO₄)"))
+
+        def filenames(query):
+            data = client.get(f"/api/v1/analysis/history?{query}").json()
+            return [a["original_filename"] for a in data["analyses"]], data["total"]
+
+        assert filenames("site_name=Site A") == (["feb-a-high.csv", "feb-a.csv", "jan-a.csv"], 3)
+        assert filenames("site_name=Site A&from=2026-02-01T00:00:00Z") == (["feb-a-high.csv", "feb-a.csv"], 2)
+        assert filenames("from=2026-02-01&to=2026-02-11") == (["feb-a.csv"], 1)
+        assert filenames("ph_category=High pH") == (["feb-a-high.csv"], 1)
+        assert filenames("tds_category=Moderate&site_name=Site B") == (["feb-b.csv"], 1)
+        assert filenames("treatment_train=Reverse osmosis (RO)&site_name=Site A") == (
+            ["feb-a.csv", "jan-a.csv"], 2)
+
+    @pytest.mark.asyncio
+    async def test_get_history_filtered_cursor(self, memory_repository):
+        """Test cursor pages stay within the filter"""
+        for day in range(1, 7):
+            await memory_repository.insert(make_analysis(
+                upload_timestamp=datetime(2026, 2, day),
+                site_name="Site A" if day % 2 else "Site B",
+                original_filename=f"day{day}.csv"
+            ))
+
+        first = client.get("/api/v1/analysis/history?site_name=Site A&limit=2").json()
+        second = client.get(
+            f"/api/v1/analysis/history?site_name=Site A&limit=2&cursor={first['next_cursor']}"
+        ).json()
+
+        assert [a["original_filename"] for a in first["analyses"]] == ["day5.csv", "day3.csv"]
+        assert [a["original_filename"] for a in second["analyses"]] == ["day1.csv"]
+        assert second["next_cursor"] is None
+
+    def test_time_window_filters_uploaded_analyses(self, memory_repository):
+        """Test uploads, stamped with an aware time, are filtered like seeded analyses"""
+        response = client.post(
+            "/api/v1/analysis/upload",
+            files={"file": ("uploaded.csv", BytesIO(b"pH,TDS\n7.5,150\n"), "text/csv")}
+        )
+        assert response.status_code == 200
+        window = "from=2000-01-01T00:00:00Z&to=2100-01-01"
+
+        history = client.get(f"/api/v1/analysis/history?{window}")
+        stats = client.get(f"/api/v1/analysis/stats?{window}")
+        export = client.get(f"/api/v1/analysis/export?format=csv&{window}")
+
+        assert [a["original_filename"] for a in history.json()["analyses"]] == ["uploaded.csv"]
+        assert stats.json()["overall"]["analyses"] == 1
+        assert export.status_code == 200 and "uploaded.csv" in export.text
+        stored = next(iter(memory_repository.documents.values()))
+        assert stored["upload_timestamp"].tzinfo is None
+
+    def test_get_history_empty_time_window(self):
+        """Test from must come before to"""
+        response = client.get("/api/v1/analysis/history?from=2026-02-02&to=2026-02-01")
+
+        assert response.status_code == 400
+
+    def test_get_history_unknown_category(self):
+        """Test category filters only accept known categories"""
+        response = client.get("/api/v1/analysis/history?ph_category=Neutral")
+
+        assert response.status_code == 422
+
+    @pytest.mark.asyncio
+    async def test_category_filters_follow_rule_table(self, memory_repository):
+        """Test category filters accept the band names of the loaded rule table"""
+        config = json.loads(DEFAULT_RULE_TABLE_PATH.read_text(encoding='utf-8'))
+        config['ph']['bands'] = ["Acidic", "In target range", "Alkaline"]
+        config['rules']['Acidic'] = config['rules'].pop("Low pH")
+        config['rules']['Alkaline'] = config['rules'].pop("High pH")
+        await memory_repository.insert(make_analysis(ph_category="Alkaline"))
+        saved = rule_table._config
+        try:
+            set_rule_config(RuleConfig.from_dict(config))
+            renamed = client.get("/api/v1/analysis/history?ph_category=Alkaline")
+            retired = client.get("/api/v1/analysis/stats?ph_category=High pH")
+        finally:
+            set_rule_config(saved)
+        
+        assert renamed.status_code == 200
+        assert renamed.json()["total"] == 1
+        assert retired.status_code == 422
+        assert retired.json()["detail"]["allowed_values"] == ["Acidic", "In target range", "Alkaline"]
+
+    def test_get_history_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = client.get("/api/v1/analysis/history?cursor=not-a-cursor")
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid pagination cursor"
+
+    def test_get_history_cursor_with_offset(self):
+        """Test cursor and offset cannot be combined"""
+        response = client.get("/api/v1/analysis/history?cursor=abc&offset=5")
+
+        assert response.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_get_analysis_by_id_success(self, memory_repository):
         """Test successful retrieval of specific analysis by ID"""
-        # Mock ObjectId validation
-        mock_objectid.is_valid.return_value = True
-        
-        # Create mock analysis
-        mock_analysis = Mock()
-        mock_analysis.id = "507f1f77bcf86cd799439011"
-        mock_analysis.upload_timestamp = datetime(2026, 2, 5, 12, 0, 0)
-        mock_analysis.original_filename = "test.csv"
-        mock_analysis.site_name = "Test Site"
-        mock_analysis.avg_ph = 7.5
-        mock_analysis.ph_category = "Target"
-        mock_analysis.avg_tds = 150
-        mock_analysis.tds_category = "Moderate"
-        mock_analysis.row_count = 10
-        mock_analysis.treatment_train = "No treatment required"
-        mock_analysis.explanation = "Water is clean"
-        
-        mock_objects = Mock()
-        mock_objects.get.return_value = mock_analysis
-        mock_water_analysis.objects = mock_objects
+        analysis = await memory_repository.insert(make_analysis())
         
         # Make request
-        response = client.get("/api/v1/analysis/507f1f77bcf86cd799439011")
+        response = client.get(f"/api/v1/analysis/{analysis['_id']}")
         
         # Assertions
         assert response.status_code == 200
         data = response.json()
-        assert data["analysis_id"] == "507f1f77bcf86cd799439011"
+        assert data["analysis_id"] == str(analysis['_id'])
         assert "summary" in data
         assert "recommendation" in data
     
+    def test_get_analysis_by_id_not_found(self):
+        """Test retrieval of an unknown analysis ID"""
+        response = client.get("/api/v1/analysis/507f1f77bcf86cd799439011")
+        
+        assert response.status_code == 404
+        assert response.json()["detail"]["error"] == "Analysis not found"
+    
     @patch('app.api.history.ObjectId')
     def test_get_analysis_by_invalid_id(self, mock_objectid):
         """Test retrieval with invalid ID format"""
@@ -109,30 +341,18 @@ class TestHistoryEndpoints:
         assert response.status_code == 400
         assert "Invalid analysis ID format" in response.json()["detail"]
     
-    @patch('app.api.history.WaterAnalysis')
-    def test_get_history_with_old_records(self, mock_water_analysis):
+    @pytest.mark.asyncio
+    async def test_get_history_with_old_records(self, memory_repository):
         """Test history retrieval handles old records without treatment fields"""
-        # Mock database query
-        mock_objects = Mock()
-        mock_objects.count.return_value = 1
-        
-        # Create mock analysis record WITHOUT treatment fields (old record)
-        mock_analysis = Mock(spec=['id', 'upload_timestamp', 'original_filename', 'site_name',
-                                     'avg_ph', 'ph_category', 'avg_tds', 'tds_category'])
-        mock_analysis.id = "507f1f77bcf86cd799439011"
-        mock_analysis.upload_timestamp = datetime(2026, 1, 1, 12, 0, 0)
-        mock_analysis.original_filename = "old_test.csv"
-        mock_analysis.site_name = "Old Site"
-        mock_analysis.avg_ph = 7.5
-        mock_analysis.ph_category = "Target"
-        mock_analysis.avg_tds = 150
-        mock_analysis.tds_category = "Moderate"
-        # No treatment_train or explanation attributes (spec prevents auto-generation)
-        
-        mock_skip = Mock()
-        mock_skip.limit.return_value = [mock_analysis]
-        mock_objects.skip.return_value = mock_skip
-        mock_water_analysis.objects = mock_objects
+        # Old record stored before treatment fields existed
+        old_record = make_analysis(
+            upload_timestamp=datetime(2026, 1, 1, 12, 0, 0),
+            original_filename="old_test.csv",
+            site_name="Old Site"
+        )
+        del old_record['treatment_train']
+        del old_record['explanation']
+        await memory_repository.insert(old_record)
         
         # Make request
         response = client.get("/api/v1/analysis/history")
@@ -145,25 +365,14 @@ class TestHistoryEndpoints:
         assert data["analyses"][0]["treatment_train"] is None
         assert data["analyses"][0]["explanation"] is None
     
-    @patch('app.api.history.WaterAnalysis')
-    @patch('app.api.history.ObjectId')
-    def test_update_analysis_notes_success(self, mock_objectid, mock_water_analysis):
+    @pytest.mark.asyncio
+    async def test_update_analysis_notes_success(self, memory_repository):
         """Test successful update of analysis notes"""
-        # Mock ObjectId validation
-        mock_objectid.is_valid.return_value = True
-        
-        # Create mock analysis
-        mock_analysis = Mock()
-        mock_analysis.id = "507f1f77bcf86cd799439011"
-        mock_analysis.user_notes = None
-        
-        mock_objects = Mock()
-        mock_objects.get.return_value = mock_analysis
-        mock_water_analysis.objects = mock_objects
+        analysis = await memory_repository.insert(make_analysis())
         
         # Make request
         response = client.patch(
-            "/api/v1/analysis/507f1f77bcf86cd799439011/notes",
+            f"/api/v1/analysis/{analysis['_id']}/notes",
             json={"user_notes": "Used RO system with pre-filtration"}
         )
         
@@ -171,9 +380,19 @@ class TestHistoryEndpoints:
         assert response.status_code == 200
         data = response.json()
         assert data["success"] is True
-        assert data["analysis_id"] == "507f1f77bcf86cd799439011"
-        assert "user_notes" in data
-        mock_analysis.save.assert_called_once()
+        assert data["analysis_id"] == str(analysis['_id'])
+        assert data["user_notes"] == "Used RO system with pre-filtration"
+        stored = await memory_repository.get(str(analysis['_id']))
+        assert stored['user_notes'] == "Used RO system with pre-filtration"
+    
+    def test_update_analysis_notes_not_found(self):
+        """Test update notes for an unknown analysis ID"""
+        response = client.patch(
+            "/api/v1/analysis/507f1f77bcf86cd799439011/notes",
+            json={"user_notes": "Test notes"}
+        )
+        
+        assert response.status_code == 404
     
     @patch('app.api.history.ObjectId')
     def test_update_analysis_notes_invalid_id(self, mock_objectid):
@@ -187,3 +406,96 @@ class TestHistoryEndpoints:
         
         assert response.status_code == 400
         assert "Invalid analysis ID format" in response.json()["detail"]
+
+
+class TestConditionalGet:
+    """Test ETags and 304 Not Modified on the polled read endpoints"""
+    
+    @pytest.mark.asyncio
+    async def test_unchanged_history_not_read_again(self, memory_repository):
+        """Test a poll with the page's ETag gets 304 without listing analyses"""
+        await memory_repository.insert(make_analysis())
+        first = client.get("/api/v1/analysis/history")
+        etag = first.headers["ETag"]
+        
+        with patch.object(memory_repository, 'list') as listing:
+            response = client.get("/api/v1/analysis/history", headers={"If-None-Match": etag})
+        
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+        assert first.headers["Cache-Control"] == "no-cache"
+        listing.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_history_etag_changes_with_new_analysis(self, memory_repository):
+        """Test an upload or notes change makes the old ETag stale"""
+        document = await memory_repository.insert(make_analysis())
+        etag = client.get("/api/v1/analysis/history").headers["ETag"]
+        
+        client.patch(f"/api/v1/analysis/{document['_id']}/notes", json={"user_notes": "RO"})
+        response = client.get("/api/v1/analysis/history", headers={"If-None-Match": etag})
+        
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert response.json()["analyses"][0]["user_notes"] == "RO"
+    
+    @pytest.mark.asyncio
+    async def test_history_etag_depends_on_query(self, memory_repository):
+        """Test another page, filter or field set is not answered with a different page's ETag"""
+        await memory_repository.insert(make_analysis())
+        etag = client.get("/api/v1/analysis/history").headers["ETag"]
+        
+        queries = ["limit=5", "site_name=Other", "fields=user_notes", "count_mode=none", "offset=1"]
+        responses = [
+            client.get(f"/api/v1/analysis/history?{query}", headers={"If-None-Match": etag})
+            for query in queries
+        ]
+        
+        assert [response.status_code for response in responses] == [200] * len(queries)
+        assert len({etag, *(response.headers["ETag"] for response in responses)}) == len(queries) + 1
+    
+    @pytest.mark.asyncio
+    async def test_analysis_etag_not_shared_between_ids(self, memory_repository):
+        """Test one analysis's ETag gets neither a 304 for another nor hides a missing id"""
+        first = await memory_repository.insert(make_analysis())
+        second = await memory_repository.insert(make_analysis())
+        etag = client.get(f"/api/v1/analysis/{first['_id']}").headers["ETag"]
+        
+        other = client.get(f"/api/v1/analysis/{second['_id']}", headers={"If-None-Match": etag})
+        missing = client.get(f"/api/v1/analysis/{ObjectId()}", headers={"If-None-Match": etag})
+        
+        assert other.status_code == 200
+        assert other.headers["ETag"] != etag
+        assert missing.status_code == 404
+    
+    @pytest.mark.asyncio
+    async def test_unchanged_analysis_not_read_again(self, memory_repository):
+        """Test a poll of one analysis with its ETag gets 304 without a fetch"""
+        document = await memory_repository.insert(make_analysis())
+        url = f"/api/v1/analysis/{document['_id']}"
+        etag = client.get(url).headers["ETag"]
+        
+        with patch.object(memory_repository, 'get') as get:
+            response = client.get(url, headers={"If-None-Match": f'"other", W/{etag}'})
+        
+        assert response.status_code == 304
+        get.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_analysis_etag_changes_with_rule_table(self, memory_repository):
+        """Test a rule table reload makes analysis ETags stale"""
+        document = await memory_repository.insert(make_analysis())
+        url = f"/api/v1/analysis/{document['_id']}"
+        etag = client.get(url).headers["ETag"]
+        
+        config = json.loads(DEFAULT_RULE_TABLE_PATH.read_text(encoding='utf-8'))
+        config['version'] = "next"
+        saved = rule_table._config
+        try:
+            set_rule_config(RuleConfig.from_dict(config))
+            response = client.get(url, headers={"If-None-Match": etag})
+        finally:
+            set_rule_config(saved)
+        
+        assert response.status_code == 200
@@ -0,0 +1,177 @@
+"""
+Check every history filter is served by an index rather than a collection scan,
+and the stats aggregation by its covering index alone.
+
+The static tests read the index declarations on WaterAnalysis. The explain
+tests run the real queries against MongoDB and only execute when
+MONGODB_TEST_URL points at a disposable server, e.g.
+
+    MONGODB_TEST_URL=mongodb://localhost:27017 pytest tests/test_history_indexes.py
+"""
+import os
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+from app.db.repository import (
+    HISTORY_SORT,
+    STATS_COVERED_FILTERS,
+    InMemoryAnalysisRepository,
+    MongoAnalysisRepository,
+    filter_query,
+    stats_pipeline
+)
+from app.models.analysis_result import HistoryFilters
+from app.models.water_sample import STATS_FIELDS, STATS_INDEX, WaterAnalysis
+
+MONGODB_TEST_URL = os.environ.get("MONGODB_TEST_URL")
+
+WINDOW = {'start': datetime(2026, 2, 1), 'end': datetime(2026, 3, 1)}
+
+# Every filter combination the dashboards use, each with and without a time window
+SUPPORTED_FILTERS = [
+    {},
+    {'site_name': "Site 1"},
+    {'ph_category': "High pH"},
+    {'tds_category': "High"},
+    {'treatment_train': "Reverse osmosis (RO)"},
+    {'site_name': "Site 1", 'ph_category': "High pH"},
+    {'site_name': "Site 1", 'tds_category': "High"},
+]
+
+
+def declared_indexes():
+    """Key lists of the indexes declared on WaterAnalysis."""
+    return [list(spec['fields']) for spec in WaterAnalysis._meta['index_specs']]
+
+
+def plan_stages(plan):
+    """All stage names in an explain plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+@pytest.mark.parametrize('field', HistoryFilters.EQUALITY_FIELDS)
+def test_equality_filters_have_esr_index(field):
+    """Test each equality filter leads an index that continues with the history sort."""
+    assert [(field, 1), *HISTORY_SORT] in declared_indexes()
+
+
+def test_time_window_uses_history_sort_index():
+    """Test a bare time window is a range on the leading key of the sort index."""
+    assert list(HISTORY_SORT) in declared_indexes()
+    assert HISTORY_SORT[0][0] == 'upload_timestamp'
+
+
+@pytest_asyncio.fixture
+async def seeded_collection():
+    """A scratch collection with the declared indexes and some analyses."""
+    from pymongo import AsyncMongoClient
+
+    client = AsyncMongoClient(MONGODB_TEST_URL)
+    database = client[f"test_history_indexes_{ObjectId()}"]
+    collection = database['water_analyses']
+    await MongoAnalysisRepository(collection).ensure_indexes()
+    base = datetime(2026, 1, 1)
+    await collection.insert_many([{
+        'upload_timestamp': base + timedelta(hours=i),
+        'original_filename': f"{i}.csv",
+        'site_name': f"Site {i % 20}",
+        'ph_category': ("Low pH", "In target range", "High pH")[i % 3],
+        'tds_category': ("Low", "Moderate", "High")[i % 3],
+        'treatment_train': ("No treatment required", "Reverse osmosis (RO)")[i % 2],
+        'avg_ph': 7.0 + (i % 7) / 5,
+        'avg_tds': 250.0 + i % 11,
+        'row_count': 10 + i % 5,
+        **({'min_ph': 6.5, 'max_ph': 9.2, 'out_of_range_fraction': (i % 4) / 4, 'dominant_rule': "D"}
+           if i % 2 else {})
+    } for i in range(2000)])
+    try:
+        yield collection
+    finally:
+        await client.drop_database(database.name)
+        await client.close()
+
+
+@pytest.mark.skipif(not MONGODB_TEST_URL, reason="MONGODB_TEST_URL not set")
+@pytest.mark.asyncio
+@pytest.mark.parametrize('windowed', [False, True])
+@pytest.mark.parametrize('fields', SUPPORTED_FILTERS)
+async def test_history_filters_avoid_collection_scan(seeded_collection, fields, windowed):
+    """Test the winning plan for each filter is an index scan with no blocking sort."""
+    filters = HistoryFilters(**fields, **(WINDOW if windowed else {}))
+    cursor = seeded_collection.find(filter_query(filters)).sort(HISTORY_SORT).limit(20)
+
+    explain = await cursor.explain()
+
+    stages = plan_stages(explain['queryPlanner']['winningPlan'])
+    assert 'COLLSCAN' not in stages
+    assert 'IXSCAN' in stages
+    assert 'SORT' not in stages
+
+
+@pytest.mark.parametrize('fields', [
+    [('content_hash', 1), ('site_name', 1)],
+    [('idempotency_key', 1)],
+])
+def test_upload_identity_indexes_are_unique_and_partial(fields):
+    """Test retried uploads hit a unique index that skips analyses stored before it."""
+    [spec] = [spec for spec in WaterAnalysis._meta['index_specs'] if spec['fields'] == fields]
+
+    assert spec['unique'] is True
+    assert spec['partialFilterExpression'] == {fields[0][0]: {'$exists': True}}
+
+
+def test_stats_index_covers_aggregated_fields():
+    """Test the stats index starts with the filters it is hinted for and holds every field read."""
+    [spec] = [spec for spec in WaterAnalysis._meta['index_specs'] if spec.get('name') == STATS_INDEX]
+    fields = [field for field, _ in spec['fields']]
+
+    assert set(fields[:len(STATS_COVERED_FILTERS)]) == STATS_COVERED_FILTERS
+    assert fields == list(STATS_FIELDS)
+    assert set(stats_pipeline('day')[1]['$project']) == {'_id', *STATS_FIELDS}
+
+
+def rounded(value):
+    """Floats rounded throughout a nested report, to compare sums taken in a different order."""
+    if isinstance(value, float):
+        return round(value, 9)
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rounded(item) for item in value]
+    return value
+
+
+@pytest.mark.skipif(not MONGODB_TEST_URL, reason="MONGODB_TEST_URL not set")
+@pytest.mark.asyncio
+@pytest.mark.parametrize('fields', [{}, {'site_name': "Site 1"}, WINDOW])
+async def test_stats_aggregation_is_covered(seeded_collection, fields):
+    """Test the hinted stats aggregation reads index keys only, and agrees with the in-memory report."""
+    filters = HistoryFilters(**fields)
+    repository = MongoAnalysisRepository(seeded_collection)
+
+    explain = await seeded_collection.database.command(
+        'aggregate', seeded_collection.name, pipeline=stats_pipeline('day', filters),
+        hint=STATS_INDEX, explain=True
+    )
+
+    # The query stage is reported under $cursor when the rest runs in the pipeline
+    plan = explain['stages'][0]['$cursor'] if 'stages' in explain else explain
+    stages = plan_stages(plan['queryPlanner']['winningPlan'])
+    assert 'IXSCAN' in stages
+    assert 'FETCH' not in stages
+    assert 'COLLSCAN' not in stages
+
+    memory = InMemoryAnalysisRepository()
+    await memory.insert_many(await seeded_collection.find().to_list())
+    assert rounded(await repository.stats('day', filters)) == rounded(await memory.stats('day', filters))
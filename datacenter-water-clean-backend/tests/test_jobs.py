@@ -0,0 +1,150 @@
+"""
+Test queued upload jobs and their status endpoint
+"""
+import os
+import time
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+from app.main import app
+from app.services.job_queue import InMemoryJobQueue, Job, JobWorkers, get_job_queue
+
+CSV = b"pH,TDS\n7.0,100\n7.2,120\n7.4,140\n"
+
+
+@pytest.fixture
+def client(tmp_path):
+    """Client whose lifespan runs the job workers on in-memory storage."""
+    with patch('app.db.mongo.settings.ANALYSIS_REPOSITORY_BACKEND', 'memory'), \
+            patch('app.core.executors.settings.PARSE_WORKERS', 0), \
+            patch('app.api.jobs.settings.JOB_SPOOL_DIR', str(tmp_path)):
+        with TestClient(app) as client:
+            yield client
+
+
+def submit(client, content=CSV, filename="log.csv", **data):
+    return client.post("/api/v1/jobs/upload", files={"file": (filename, content, "text/csv")}, data=data)
+
+
+def wait_for(client, job_id):
+    """Poll a job until it finishes."""
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/v1/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_job_analyzes_upload_in_background(client, memory_repository, tmp_path):
+    """Test a job returns 202 at once and links to the stored analysis when done"""
+    response = submit(client, site_name="Site A")
+
+    assert response.status_code == 202
+    queued = response.json()
+    assert queued["status"] in ("queued", "running")
+    assert response.headers["Location"] == queued["status_url"] == f"/api/v1/jobs/{queued['job_id']}"
+    assert queued["file_size"] == len(CSV)
+
+    job = wait_for(client, queued["job_id"])
+    assert job["status"] == "succeeded"
+    assert job["rows_processed"] == 3
+    assert job["replayed"] is False
+    analysis = client.get(job["result_url"]).json()
+    assert analysis["analysis_id"] == job["analysis_id"]
+    assert analysis["site_name"] == "Site A"
+    assert len(memory_repository.documents) == 1
+    # The spooled copy is removed once the job is done
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_invalid_csv_fails_job_with_upload_error(client, memory_repository):
+    """Test a job fails with the status and error /upload would have returned"""
+    job = wait_for(client, submit(client, content=b"pH,TDS\nx,y\n").json()["job_id"])
+
+    assert job["status"] == "failed"
+    assert job["status_code"] == 400
+    assert "numeric" in job["error"]
+    assert job["result_url"] is None
+    assert memory_repository.documents == {}
+
+
+def test_job_for_uploaded_file_replays_analysis(client):
+    """Test a job for a file already uploaded succeeds with the stored analysis"""
+    first = client.post("/api/v1/analysis/upload", files={"file": ("log.csv", CSV, "text/csv")}).json()
+
+    job = wait_for(client, submit(client).json()["job_id"])
+
+    assert job["status"] == "succeeded"
+    assert job["replayed"] is True
+    assert job["analysis_id"] == first["analysis_id"]
+
+
+def test_job_rejects_non_csv(client):
+    """Test non-CSV files are refused before anything is queued"""
+    response = submit(client, filename="log.txt")
+
+    assert response.status_code == 400
+
+
+def test_unknown_job_not_found(client):
+    """Test polling an unknown job returns 404"""
+    response = client.get("/api/v1/jobs/does-not-exist")
+
+    assert response.status_code == 404
+    assert response.json()["detail"]["job_id"] == "does-not-exist"
+
+
+def test_full_queue_returns_503(tmp_path):
+    """Test submissions beyond the queue bound are refused and leave no spool file"""
+    queue = InMemoryJobQueue(maxsize=1, retention=60)
+    app.dependency_overrides[get_job_queue] = lambda: queue
+    try:
+        with patch('app.api.jobs.settings.JOB_SPOOL_DIR', str(tmp_path)):
+            client = TestClient(app)
+            accepted = submit(client)
+            refused = submit(client, content=CSV + b"7.6,160\n")
+    finally:
+        app.dependency_overrides.pop(get_job_queue, None)
+
+    assert accepted.status_code == 202
+    assert refused.status_code == 503
+    assert "Retry-After" in refused.headers
+    # Only the queued job's upload is spooled
+    assert len(list(tmp_path.iterdir())) == 1
+    assert queue.pending.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_queue_forgets_finished_jobs_after_retention(tmp_path):
+    """Test finished jobs are dropped once their retention has passed"""
+    queue = InMemoryJobQueue(maxsize=4, retention=0)
+    done = Job(str(tmp_path / "a.csv"), "a.csv", 1, None, None, None)
+    await queue.submit(done)
+    await queue.next()
+    done.succeed("0" * 24)
+    await queue.update(done)
+
+    await queue.submit(Job(str(tmp_path / "b.csv"), "b.csv", 1, None, None, None))
+
+    assert await queue.get(done.id) is None
+
+
+@pytest.mark.asyncio
+async def test_stopping_workers_fails_waiting_jobs(tmp_path):
+    """Test jobs still queued at shutdown are failed and their spool removed"""
+    queue = InMemoryJobQueue(maxsize=4, retention=60)
+    path = tmp_path / "queued.csv"
+    path.write_bytes(CSV)
+    job = Job(str(path), "queued.csv", len(CSV), None, None, None)
+    await queue.submit(job)
+    # No workers, so the job is still waiting when the pool stops
+    workers = JobWorkers(queue, handler=None, count=0)
+
+    await workers.stop()
+
+    assert job.status == "failed"
+    assert job.error_status == 503
+    assert not os.path.exists(path)
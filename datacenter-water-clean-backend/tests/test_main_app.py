@@ -3,18 +3,19 @@ from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 
 
-@patch('app.db.mongo.connect')
-@patch('app.db.mongo.disconnect')
-def test_app_lifespan(mock_disconnect, mock_connect):
+@patch('app.db.mongo.settings.ANALYSIS_REPOSITORY_BACKEND', 'memory')
+def test_app_lifespan():
     """Test application startup and shutdown."""
     from app.main import app
+    from app.db.repository import get_analysis_repository
     
     with TestClient(app):
-        # Startup should call connect
-        assert mock_connect.called
+        # Startup should install the analysis repository
+        assert get_analysis_repository() is not None
     
-    # Shutdown should call disconnect
-    assert mock_disconnect.called
+    # Shutdown should remove it
+    with pytest.raises(RuntimeError):
+        get_analysis_repository()
 
 
 def test_routers_included():
@@ -0,0 +1,130 @@
+"""
+Test the Prometheus metrics endpoint and upload instrumentation
+"""
+import os
+import subprocess
+import sys
+import pytest
+from io import BytesIO
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from pymongo.monitoring import (
+    ConnectionCheckedInEvent,
+    ConnectionCheckedOutEvent,
+    ConnectionCreatedEvent
+)
+
+from app.core import metrics
+from app.main import app
+
+pytestmark = pytest.mark.skipif(metrics.prometheus_client is None, reason="prometheus_client not installed")
+
+client = TestClient(app)
+
+REGISTRY = metrics.prometheus_client.REGISTRY if metrics.prometheus_client is not None else None
+
+
+def sample(name, **labels):
+    """Current value of one sample in this process, 0 if not recorded yet."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_exposition():
+    """Test /metrics serves the Prometheus text format"""
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+
+
+def test_request_latency_labelled_by_route_template(memory_repository):
+    """Test requests for different ids share their route's series"""
+    route = "/api/v1/analysis/{analysis_id}"
+    before = sample("http_request_duration_seconds_count", method="GET", route=route, status="404")
+
+    client.get("/api/v1/analysis/65f000000000000000000001")
+    client.get("/api/v1/analysis/65f000000000000000000002")
+
+    assert sample("http_request_duration_seconds_count", method="GET", route=route, status="404") == before + 2
+
+
+def test_unmatched_paths_share_one_series():
+    """Test unknown paths do not create a series each"""
+    before = sample("http_request_duration_seconds_count", method="GET", route="unmatched", status="404")
+
+    client.get("/no/such/path")
+
+    assert sample("http_request_duration_seconds_count", method="GET", route="unmatched", status="404") == before + 1
+    assert sample("http_requests_in_progress", method="GET") == 0
+
+
+def test_upload_records_stages_rows_and_bytes(memory_repository):
+    """Test an upload times every stage and counts its readings and bytes"""
+    content = b"pH,TDS\n7.5,150\n7.6,155\n7.4,145\n"
+    stages = {stage: sample("upload_stage_duration_seconds_count", stage=stage) for stage in metrics.UPLOAD_STAGES}
+    rows, size = sample("upload_rows_total"), sample("upload_bytes_total")
+
+    response = client.post(
+        "/api/v1/analysis/upload",
+        files={"file": ("test.csv", BytesIO(content), "text/csv")}
+    )
+
+    assert response.status_code == 200
+    for stage, count in stages.items():
+        assert sample("upload_stage_duration_seconds_count", stage=stage) == count + 1, stage
+    assert sample("upload_rows_total") == rows + 3
+    assert sample("upload_bytes_total") == size + len(content)
+
+
+def test_failed_save_not_timed(memory_repository):
+    """Test a stage that raises is not recorded"""
+    before = sample("upload_stage_duration_seconds_count", stage="save")
+
+    with patch.object(memory_repository, 'insert', side_effect=RuntimeError("down")):
+        with pytest.raises(RuntimeError):
+            client.post(
+                "/api/v1/analysis/upload",
+                files={"file": ("test.csv", BytesIO(b"pH,TDS\n7.5,150\n"), "text/csv")}
+            )
+
+    assert sample("upload_stage_duration_seconds_count", stage="save") == before
+
+
+def test_mongo_pool_metrics():
+    """Test pool events move the connection gauges and time checkouts"""
+    listener = metrics.MongoPoolMetrics()
+    address = ("localhost", 27017)
+    opened = sample("mongodb_pool_connections", state="open")
+    waits = sample("mongodb_pool_checkout_duration_seconds_count")
+
+    listener.connection_created(ConnectionCreatedEvent(address, 1))
+    listener.connection_checked_out(ConnectionCheckedOutEvent(address, 1, 0.002))
+    checked_out = sample("mongodb_pool_connections", state="checked_out")
+    listener.connection_checked_in(ConnectionCheckedInEvent(address, 1))
+
+    assert sample("mongodb_pool_connections", state="open") == opened + 1
+    assert sample("mongodb_pool_connections", state="checked_out") == checked_out - 1
+    assert sample("mongodb_pool_checkout_duration_seconds_count") == waits + 1
+
+
+def test_metrics_unavailable_without_prometheus_client():
+    """Test /metrics explains what is missing rather than failing"""
+    with patch.object(metrics, 'prometheus_client', None):
+        response = client.get("/metrics")
+
+    assert response.status_code == 501
+
+
+def test_worker_counts_add_up_in_multiprocess_mode(tmp_path):
+    """Test counts written by separate processes are summed by /metrics"""
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path), MONGODB_URL="mongodb://localhost:27017")
+    record = "from app.core import metrics; metrics.count_upload_rows(5)"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", record], env=env, check=True)
+
+    render = "from app.core import metrics; print(metrics.render_metrics()[0].decode())"
+    output = subprocess.run([sys.executable, "-c", render], env=env, check=True,
+                            capture_output=True, text=True).stdout
+
+    assert "upload_rows_total 10.0" in output
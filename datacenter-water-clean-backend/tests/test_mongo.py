@@ -1,41 +1,50 @@
 import pytest
-from unittest.mock import patch, MagicMock
-from app.db.mongo import connect_to_mongo, close_mongo_connection
+from unittest.mock import ANY, patch
 
 
-@patch('app.db.mongo.connect')
+@patch('app.db.mongo.AsyncMongoClient')
 @patch('app.db.mongo.settings')
-def test_connect_to_mongo_success(mock_settings, mock_connect):
-    """Test successful MongoDB connection."""
-    mock_settings.MONGODB_DB_NAME = "test_db"
+def test_create_async_client_applies_pool_settings(mock_settings, mock_client):
+    """Test pool size and timeouts are passed to the async client."""
+    from app.db.mongo import create_async_client
+    
     mock_settings.MONGODB_URL = "mongodb://localhost:27017"
+    mock_settings.MONGODB_MAX_POOL_SIZE = 50
+    mock_settings.MONGODB_MIN_POOL_SIZE = 5
+    mock_settings.MONGODB_CONNECT_TIMEOUT_MS = 1000
+    mock_settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS = 2000
+    mock_settings.MONGODB_SOCKET_TIMEOUT_MS = 3000
     
-    connect_to_mongo()
+    create_async_client()
     
-    mock_connect.assert_called_once_with(
-        db="test_db",
-        host="mongodb://localhost:27017",
-        alias='default'
+    mock_client.assert_called_once_with(
+        "mongodb://localhost:27017",
+        maxPoolSize=50,
+        minPoolSize=5,
+        connectTimeoutMS=1000,
+        serverSelectionTimeoutMS=2000,
+        socketTimeoutMS=3000,
+        event_listeners=ANY
     )
 
 
-@patch('app.db.mongo.connect')
+@pytest.mark.asyncio
 @patch('app.db.mongo.settings')
-def test_connect_to_mongo_failure(mock_settings, mock_connect):
-    """Test MongoDB connection failure raises exception."""
-    mock_settings.MONGODB_DB_NAME = "test_db"
-    mock_settings.MONGODB_URL = "mongodb://invalid:27017"
-    mock_connect.side_effect = Exception("Connection failed")
+async def test_open_memory_repository(mock_settings):
+    """Test the in-memory backend is installed for the routes."""
+    from app.db.mongo import open_analysis_repository, close_analysis_repository
+    from app.db.readings import InMemoryReadingRepository, get_reading_repository
+    from app.db.repository import InMemoryAnalysisRepository, get_analysis_repository
     
-    with pytest.raises(Exception) as exc_info:
-        connect_to_mongo()
+    mock_settings.ANALYSIS_REPOSITORY_BACKEND = "memory"
     
-    assert "Connection failed" in str(exc_info.value)
-
-
-@patch('app.db.mongo.disconnect')
-def test_close_mongo_connection_success(mock_disconnect):
-    """Test successful MongoDB disconnection."""
-    close_mongo_connection()
+    repository = await open_analysis_repository()
+    try:
+        assert isinstance(repository, InMemoryAnalysisRepository)
+        assert get_analysis_repository() is repository
+        assert isinstance(get_reading_repository(), InMemoryReadingRepository)
+    finally:
+        await close_analysis_repository()
     
-    mock_disconnect.assert_called_once_with(alias='default')
+    with pytest.raises(RuntimeError):
+        get_reading_repository()
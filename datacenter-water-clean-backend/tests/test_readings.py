@@ -0,0 +1,159 @@
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from app.db.readings import (
+    READINGS_TIMESERIES,
+    InMemoryReadingRepository,
+    MongoReadingRepository,
+    ReadingWriter,
+    decode_readings,
+    encode_readings
+)
+from app.services.timeseries import NAT
+
+UPLOADED = datetime(2026, 3, 1, 12, 0)
+
+
+def readings(n: int, timed: bool = True):
+    """Readings with a gap in each column and, if timed, one missing timestamp."""
+    values = np.array([np.linspace(6.5, 9.0, n), np.linspace(20, 400, n)])
+    values[0, 1] = np.nan
+    values[1, 2] = np.nan
+    if not timed:
+        return values, None
+    timestamps = np.datetime64('2024-01-01T00:00:00', 'ns').astype(np.int64) + np.arange(n) * 10**9
+    timestamps[0] = NAT
+    return values, timestamps
+
+
+def test_encode_decode_round_trip():
+    """Test chunks reassemble to the exact rows, NaN and NAT included."""
+    values, timestamps = readings(10)
+
+    chunks = encode_readings(values, timestamps, ObjectId(), "Site A", UPLOADED, 0, 4)
+    decoded_values, decoded_timestamps = decode_readings(chunks[::-1])
+
+    assert [chunk['seq'] for chunk in chunks] == [0, 1, 2]
+    assert [chunk['count'] for chunk in chunks] == [4, 4, 2]
+    np.testing.assert_array_equal(decoded_values, values)
+    np.testing.assert_array_equal(decoded_timestamps, timestamps)
+
+
+def test_chunk_time_is_first_valid_timestamp():
+    """Test the time field skips NAT and falls back to the upload time."""
+    values, timestamps = readings(4)
+    timestamps[:2] = NAT
+
+    first, = encode_readings(values[:, :2], timestamps[:2], ObjectId(), None, UPLOADED, 0, 4)
+    second, = encode_readings(values, timestamps, ObjectId(), None, UPLOADED, 0, 4)
+
+    assert first['timestamp'] == UPLOADED
+    assert second['timestamp'] == datetime(2024, 1, 1, 0, 0, 2)
+
+
+def test_untimed_readings_have_no_timestamp_column():
+    """Test files without a Timestamp column decode with timestamps None."""
+    values, _ = readings(6, timed=False)
+
+    chunks = encode_readings(values, None, ObjectId(), "Site A", UPLOADED, 0, 4)
+
+    assert all('timestamps' not in chunk and chunk['timestamp'] == UPLOADED for chunk in chunks)
+    decoded_values, decoded_timestamps = decode_readings(chunks)
+    np.testing.assert_array_equal(decoded_values, values)
+    assert decoded_timestamps is None
+
+
+@pytest.mark.asyncio
+async def test_writer_continues_sequence_and_discards():
+    """Test blocks written one after another keep one sequence per analysis."""
+    repository = InMemoryReadingRepository()
+    analysis_id = ObjectId()
+    writer = ReadingWriter(repository, analysis_id, "Site A", UPLOADED, 4)
+    values, timestamps = readings(10)
+
+    await writer.write(values[:, :6], timestamps[:6])
+    await writer.write(values[:, 6:], timestamps[6:])
+
+    assert [chunk['seq'] for chunk in repository.chunks[analysis_id]] == [0, 1, 2]
+    decoded_values, _ = await repository.load(str(analysis_id))
+    np.testing.assert_array_equal(decoded_values, values)
+
+    await writer.discard()
+    assert await repository.load(str(analysis_id)) is None
+
+
+def mongo_repository():
+    database = MagicMock()
+    database.create_collection = AsyncMock()
+    collection = database.get_collection.return_value
+    collection.name = 'water_readings'
+    collection.create_indexes = AsyncMock()
+    collection.insert_many = AsyncMock()
+    return MongoReadingRepository(database), database, collection
+
+
+@pytest.mark.asyncio
+async def test_mongo_creates_timeseries_collection_once():
+    """Test the first writes create the time-series collection, later ones do not."""
+    repository, database, collection = mongo_repository()
+    chunks = encode_readings(*readings(10), ObjectId(), "Site A", UPLOADED, 0, 4)
+
+    await repository.insert_chunks(chunks)
+    await repository.insert_chunks(chunks)
+
+    database.create_collection.assert_awaited_once_with('water_readings', timeseries=READINGS_TIMESERIES)
+    collection.create_indexes.assert_awaited_once()
+    collection.insert_many.assert_awaited_with(chunks, ordered=False)
+    assert collection.insert_many.await_count == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('error', [
+    CollectionInvalid("collection water_readings already exists"),
+    OperationFailure("Collection already exists", code=48)
+])
+async def test_mongo_existing_collection_is_reused(error):
+    """Test a collection created earlier or by another worker is not an error."""
+    repository, database, collection = mongo_repository()
+    database.create_collection.side_effect = error
+
+    await repository.insert_chunks(encode_readings(*readings(4), ObjectId(), None, UPLOADED, 0, 4))
+
+    collection.insert_many.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_mongo_failed_creation_is_retried():
+    """Test a failed collection setup does not stick for the process."""
+    repository, database, collection = mongo_repository()
+    database.create_collection.side_effect = [OperationFailure("not primary", code=10107), None]
+    chunks = encode_readings(*readings(4), ObjectId(), None, UPLOADED, 0, 4)
+
+    with pytest.raises(OperationFailure):
+        await repository.insert_chunks(chunks)
+    await repository.insert_chunks(chunks)
+
+    assert database.create_collection.await_count == 2
+    collection.insert_many.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_mongo_load_reads_by_analysis_id():
+    """Test readings are fetched by meta.analysis_id and put back in order."""
+    repository, _, collection = mongo_repository()
+    analysis_id = ObjectId()
+    values, timestamps = readings(10)
+    chunks = encode_readings(values, timestamps, analysis_id, "Site A", UPLOADED, 0, 4)
+    cursor = MagicMock()
+    cursor.to_list = AsyncMock(return_value=chunks[::-1])
+    collection.find.return_value = cursor
+
+    decoded_values, decoded_timestamps = await repository.load(str(analysis_id))
+
+    assert collection.find.call_args.args[0] == {'meta.analysis_id': analysis_id}
+    np.testing.assert_array_equal(decoded_values, values)
+    np.testing.assert_array_equal(decoded_timestamps, timestamps)
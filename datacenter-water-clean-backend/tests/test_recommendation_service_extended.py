@@ -1,5 +1,8 @@
+import pickle
 import pytest
+import numpy as np
 from app.services.recommendation_service import RecommendationService
+from app.services.rule_table import get_rule_table
 
 
 def test_recommendation_moderate_tds_high_ph():
@@ -147,3 +150,72 @@ def test_recommendation_boundary_tds_high():
     
     # Should be high TDS
     assert "Ion exchange" in treatment
+
+
+def test_batch_matches_scalar_rules():
+    """Test the vectorised classifier agrees with get_recommendation, boundaries included."""
+    rng = np.random.default_rng(0)
+    ph = np.concatenate([rng.uniform(5, 11, 5000), [7.5, np.nextafter(7.5, 8), 8.3, np.nextafter(8.3, 0), np.nan, 8.0]])
+    tds = np.concatenate([rng.uniform(0, 800, 5000), [100, 99.999, 300, 299.999, 50, np.nan]])
+    
+    codes, treatments, explanations = RecommendationService.get_recommendations_batch(ph, tds)
+    
+    for i in range(len(ph)):
+        assert (treatments[i], explanations[i]) == RecommendationService.get_recommendation(ph[i], tds[i])
+        assert codes[i] == RecommendationService.get_rule_code(ph[i], tds[i])
+
+
+def test_batch_shares_rule_strings():
+    """Test batch results reference the rule text rather than copying it."""
+    _, treatments, _ = RecommendationService.get_recommendations_batch(np.array([8.0, 8.0]), np.array([50.0, 60.0]))
+    
+    assert treatments[0] is treatments[1]
+
+
+def test_batch_length_mismatch():
+    """Test mismatched arrays are rejected."""
+    with pytest.raises(ValueError):
+        RecommendationService.get_recommendations_batch(np.zeros(2), np.zeros(3))
+
+
+def test_recommendation_missing_value_falls_back():
+    """Test NaN readings get the specialist fallback."""
+    treatment, _ = RecommendationService.get_recommendation(float('nan'), 50)
+    
+    assert treatment == "Contact water treatment specialist"
+
+
+def test_recommend_shares_one_result_per_cell():
+    """Test averages in the same pH and TDS bands get the same memoized result."""
+    first = RecommendationService.recommend(8.5, 200)
+    before = RecommendationService.cache_info()
+    second = RecommendationService.recommend(8.9, 250)
+    
+    assert RecommendationService.cache_info()["hits"] == before["hits"] + 1
+    assert second is first
+    assert first.rule_code == RecommendationService.get_rule_code(8.5, 200)
+    assert first.treatment_train is RecommendationService.get_recommendation(8.7, 220)[0]
+    assert (first.ph_category, first.tds_category) == ("High pH", "Moderate")
+
+
+def test_recommend_memo_shared_by_table_copies():
+    """Test a pickled copy of a table, as the parse pool receives, hits the original's entries."""
+    table = get_rule_table()
+    first = RecommendationService.recommend(8.5, 200, table)
+    before = RecommendationService.cache_info()
+    copy = pickle.loads(pickle.dumps(table))
+    
+    second = RecommendationService.recommend(8.5, 200, copy)
+    
+    assert copy is not table and copy.key == table.key
+    assert second is first
+    assert RecommendationService.cache_info()["hits"] == before["hits"] + 1
+    assert RecommendationService.cache_info()["cells"] == before["cells"]
+
+
+def test_recommend_missing_value_has_no_categories():
+    """Test the fallback cell names no bands."""
+    recommendation = RecommendationService.recommend(float('nan'), 50)
+    
+    assert recommendation.treatment_train == "Contact water treatment specialist"
+    assert recommendation.ph_category is None
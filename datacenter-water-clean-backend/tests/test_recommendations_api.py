@@ -0,0 +1,166 @@
+"""
+Test batch recommendation endpoint
+"""
+import io
+import json
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+from app.main import app
+from app.services import rule_table
+from app.services.recommendation_service import RecommendationService
+from app.services.rule_table import DEFAULT_RULE_TABLE_PATH, RuleConfig, set_rule_config
+
+client = TestClient(app)
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+def test_batch_json():
+    """Test JSON batches return one rule code per pair and each rule once"""
+    response = client.post(
+        "/api/v1/recommendations/batch",
+        json={"ph": [7.5, 8.0, 8.3, None], "tds": [50, 200, 300, 10]}
+    )
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] == 4
+    assert data["rule_codes"] == ["C", "D", "H", "X"]
+    assert set(data["rules"]) == {"C", "D", "H", "X"}
+    assert data["rules"]["D"]["treatment_train"] == "Reverse osmosis (RO)"
+
+
+def test_batch_json_length_mismatch():
+    """Test ph and tds must line up"""
+    response = client.post("/api/v1/recommendations/batch", json={"ph": [7.5], "tds": [50, 60]})
+    
+    assert response.status_code == 400
+
+
+def test_batch_json_invalid():
+    """Test malformed JSON bodies are rejected"""
+    response = client.post("/api/v1/recommendations/batch", json={"ph": ["acidic"], "tds": [50]})
+    
+    assert response.status_code == 422
+
+
+@patch('app.api.recommendations.settings')
+def test_batch_too_large(mock_settings):
+    """Test batches over MAX_BATCH_RECOMMENDATIONS are refused"""
+    mock_settings.MAX_BATCH_RECOMMENDATIONS = 2
+    
+    response = client.post("/api/v1/recommendations/batch", json={"ph": [7, 8, 9], "tds": [1, 2, 3]})
+    
+    assert response.status_code == 413
+
+
+def test_batch_unsupported_content_type():
+    """Test only JSON and Arrow bodies are accepted"""
+    response = client.post(
+        "/api/v1/recommendations/batch",
+        content=b"ph,tds\n7,50\n",
+        headers={"Content-Type": "text/csv"}
+    )
+    
+    assert response.status_code == 415
+
+
+def test_batch_arrow_round_trip():
+    """Test Arrow batches return dictionary-encoded rule columns"""
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({"ph": [7.0, 8.0, None], "tds": [500.0, 50.0, 50.0]})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    
+    response = client.post(
+        "/api/v1/recommendations/batch",
+        content=sink.getvalue(),
+        headers={"Content-Type": ARROW_STREAM}
+    )
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"] == ARROW_STREAM
+    result = pa.ipc.open_stream(response.content).read_all()
+    assert result.column("rule_code").to_pylist() == ["I", "A", "X"]
+    assert pa.types.is_dictionary(result.schema.field("treatment_train").type)
+    assert result.column("treatment_train").to_pylist()[1] == "No treatment required"
+
+
+def test_batch_arrow_missing_column():
+    """Test Arrow batches need ph and tds columns"""
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({"ph": [7.0]})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    
+    response = client.post(
+        "/api/v1/recommendations/batch",
+        content=sink.getvalue(),
+        headers={"Content-Type": ARROW_STREAM}
+    )
+    
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def site_rules():
+    """Activate a rule table with a lower pH target band for Site 7."""
+    previous = rule_table._config
+    config = json.loads(DEFAULT_RULE_TABLE_PATH.read_text(encoding='utf-8'))
+    config['sites'] = {"Site 7": {"ph": {"thresholds": [7.0, 8.0]}}}
+    set_rule_config(RuleConfig.from_dict(config))
+    yield
+    set_rule_config(previous)
+
+
+def test_batch_uses_site_profile(site_rules):
+    """Test site_name selects that site's thresholds"""
+    body = {"ph": [7.2, 8.1], "tds": [50, 50]}
+    
+    default = client.post("/api/v1/recommendations/batch", json=body)
+    site = client.post("/api/v1/recommendations/batch", params={"site_name": "Site 7"}, json=body)
+    
+    assert default.json()["rule_codes"] == ["C", "A"]
+    assert site.json()["rule_codes"] == ["A", "B"]
+
+
+def test_rules_info(site_rules):
+    """Test the active rule table is described"""
+    response = client.get("/api/v1/recommendations/rules")
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["version"] == "2026.1"
+    assert data["ph_bands"] == ["Low pH", "In target range", "High pH"]
+    assert data["sites"] == ["Site 7"]
+
+
+def test_cache_info():
+    """Test the memo counters show the scalar lookups of this worker"""
+    before = client.get("/api/v1/recommendations/cache").json()
+    RecommendationService.recommend(8.0, 200)
+    RecommendationService.recommend(8.0, 210)
+    
+    after = client.get("/api/v1/recommendations/cache").json()
+    
+    assert after["hits"] + after["misses"] == before["hits"] + before["misses"] + 2
+    assert after["hits"] > before["hits"]
+    assert 0 < after["hit_ratio"] <= 1
+    assert after["cells"] >= 1
+
+
+@patch('app.services.rule_table.settings')
+def test_rules_reload_rejects_invalid_file(mock_settings, tmp_path, site_rules):
+    """Test a broken rule table file is refused and the active table kept"""
+    path = tmp_path / "rules.json"
+    path.write_text('{"version": "broken"}', encoding='utf-8')
+    mock_settings.RULE_TABLE_PATH = str(path)
+    
+    response = client.post("/api/v1/recommendations/rules/reload")
+    
+    assert response.status_code == 422
+    assert client.get("/api/v1/recommendations/rules").json()["version"] == "2026.1"
@@ -0,0 +1,572 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from app.db.repository import (
+    DuplicateAnalysisError,
+    InMemoryAnalysisRepository,
+    MongoAnalysisRepository,
+    decode_cursor,
+    encode_cursor,
+    filter_query,
+    stats_pipeline
+)
+from app.models.analysis_result import HistoryFilters
+
+
+def analysis(day: int, **fields):
+    """Minimal stored analysis document."""
+    return {'upload_timestamp': datetime(2026, 2, day), 'original_filename': f"day{day}.csv", **fields}
+
+
+@pytest.mark.asyncio
+async def test_in_memory_insert_assigns_id_and_copies():
+    """Test inserts get an ObjectId and later edits do not leak into storage."""
+    repository = InMemoryAnalysisRepository()
+    document = await repository.insert(analysis(1))
+    document['original_filename'] = "changed.csv"
+    
+    stored = await repository.get(str(document['_id']))
+    
+    assert isinstance(document['_id'], ObjectId)
+    assert stored['original_filename'] == "day1.csv"
+
+
+@pytest.mark.asyncio
+async def test_in_memory_list_most_recent_first():
+    """Test listing is ordered by upload_timestamp descending."""
+    repository = InMemoryAnalysisRepository()
+    for day in (2, 5, 1, 4, 3):
+        await repository.insert(analysis(day))
+    
+    page = await repository.list(limit=2, offset=1)
+    
+    assert [doc['original_filename'] for doc in page] == ["day4.csv", "day3.csv"]
+    assert await repository.count() == 5
+
+
+@pytest.mark.asyncio
+async def test_in_memory_update_notes_missing():
+    """Test updating notes on an unknown id returns None."""
+    repository = InMemoryAnalysisRepository()
+    
+    assert await repository.update_notes(str(ObjectId()), "notes") is None
+
+
+@pytest.mark.asyncio
+async def test_mongo_insert_sets_id():
+    """Test the Mongo backend inserts through the async collection."""
+    collection = MagicMock()
+    inserted_id = ObjectId()
+    collection.insert_one = AsyncMock(return_value=MagicMock(inserted_id=inserted_id))
+    repository = MongoAnalysisRepository(collection)
+    
+    document = await repository.insert(analysis(1))
+    
+    assert document['_id'] == inserted_id
+    collection.insert_one.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_mongo_list_sorts_and_pages():
+    """Test list sorts most recent first and applies skip/limit."""
+    cursor = MagicMock()
+    cursor.sort.return_value = cursor
+    cursor.skip.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = AsyncMock(return_value=[analysis(2)])
+    collection = MagicMock()
+    collection.find.return_value = cursor
+    repository = MongoAnalysisRepository(collection)
+    
+    result = await repository.list(limit=10, offset=20)
+    
+    assert result == [analysis(2)]
+    cursor.sort.assert_called_once_with([('upload_timestamp', -1), ('_id', -1)])
+    cursor.skip.assert_called_once_with(20)
+    cursor.limit.assert_called_once_with(10)
+
+
+@pytest.mark.asyncio
+async def test_mongo_list_after_uses_keyset_filter():
+    """Test keyset pages filter on (upload_timestamp, _id) instead of skipping."""
+    cursor = MagicMock()
+    cursor.sort.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = AsyncMock(return_value=[])
+    collection = MagicMock()
+    collection.find.return_value = cursor
+    repository = MongoAnalysisRepository(collection)
+    timestamp, analysis_id = datetime(2026, 2, 3), ObjectId()
+    
+    await repository.list(limit=10, after=(timestamp, analysis_id))
+    
+    collection.find.assert_called_once_with({'$or': [
+        {'upload_timestamp': {'$lt': timestamp}},
+        {'upload_timestamp': timestamp, '_id': {'$lt': analysis_id}}
+    ]}, None)
+    cursor.skip.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_in_memory_list_after_key():
+    """Test keyset listing resumes right after the given position."""
+    repository = InMemoryAnalysisRepository()
+    documents = [await repository.insert(analysis(day)) for day in (1, 2, 3, 4)]
+    third = documents[2]
+    
+    page = await repository.list(limit=5, after=(third['upload_timestamp'], third['_id']))
+    
+    assert [doc['original_filename'] for doc in page] == ["day2.csv", "day1.csv"]
+
+
+@pytest.mark.asyncio
+async def test_mongo_list_projects_fields():
+    """Test requested fields become a find() projection."""
+    cursor = MagicMock()
+    cursor.sort.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = AsyncMock(return_value=[])
+    collection = MagicMock()
+    collection.find.return_value = cursor
+    repository = MongoAnalysisRepository(collection)
+    
+    await repository.list(limit=10, fields=['upload_timestamp', 'avg_ph'])
+    
+    collection.find.assert_called_once_with({}, {'upload_timestamp': 1, 'avg_ph': 1})
+
+
+@pytest.mark.asyncio
+async def test_in_memory_list_projects_fields():
+    """Test projected listings keep only '_id' and the requested fields."""
+    repository = InMemoryAnalysisRepository()
+    document = await repository.insert(analysis(1, explanation="long text"))
+    
+    page = await repository.list(limit=1, fields=['original_filename', 'site_name'])
+    
+    assert page == [{'_id': document['_id'], 'original_filename': "day1.csv"}]
+
+
+def test_cursor_round_trip():
+    """Test cursors decode to the key they were built from."""
+    key = (datetime(2026, 2, 5, 12, 30, 15, 123000), ObjectId())
+    
+    assert decode_cursor(encode_cursor(key)) == key
+
+
+@pytest.mark.parametrize('token', ["", "not-a-cursor", "WyJ4IiwieSJd"])
+def test_decode_cursor_rejects_garbage(token):
+    """Test malformed cursors raise ValueError."""
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+@pytest.mark.asyncio
+async def test_mongo_update_notes_returns_updated_document():
+    """Test notes are set atomically and the new document returned."""
+    collection = MagicMock()
+    collection.find_one_and_update = AsyncMock(return_value={'user_notes': "RO"})
+    repository = MongoAnalysisRepository(collection)
+    analysis_id = ObjectId()
+    
+    result = await repository.update_notes(str(analysis_id), "RO")
+    
+    assert result == {'user_notes': "RO"}
+    collection.find_one_and_update.assert_awaited_once_with(
+        {'_id': analysis_id},
+        {'$set': {'user_notes': "RO"}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+@pytest.mark.asyncio
+async def test_mongo_ensure_indexes_uses_model_specs():
+    """Test indexes declared on WaterAnalysis are created."""
+    collection = MagicMock()
+    collection.create_indexes = AsyncMock()
+    repository = MongoAnalysisRepository(collection)
+    
+    await repository.ensure_indexes()
+    
+    models = collection.create_indexes.await_args.args[0]
+    keys = [list(model.document['key'].items()) for model in models]
+    assert [('upload_timestamp', -1), ('_id', -1)] in keys
+    assert [('site_name', 1), ('upload_timestamp', -1), ('_id', -1)] in keys
+
+
+@pytest.mark.asyncio
+async def test_cached_count_expires():
+    """Test cached counts are reused within the TTL and recounted after."""
+    repository = InMemoryAnalysisRepository()
+    await repository.insert(analysis(1))
+    await repository.cached_count(ttl=60)
+    repository.documents.clear()  # change storage behind the cache's back
+    
+    assert await repository.cached_count(ttl=60) == 1
+    assert await repository.cached_count(ttl=0) == 0
+
+
+@pytest.mark.asyncio
+async def test_mongo_estimated_count_uses_metadata():
+    """Test the estimated count avoids count_documents."""
+    collection = MagicMock()
+    collection.estimated_document_count = AsyncMock(return_value=1_000_000)
+    collection.count_documents = AsyncMock()
+    repository = MongoAnalysisRepository(collection)
+    
+    assert await repository.estimated_count() == 1_000_000
+    collection.count_documents.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_mongo_insert_invalidates_cached_count():
+    """Test a new analysis forces the next cached count to hit the database."""
+    collection = MagicMock()
+    collection.count_documents = AsyncMock(side_effect=[1, 2])
+    collection.insert_one = AsyncMock(return_value=MagicMock(inserted_id=ObjectId()))
+    repository = MongoAnalysisRepository(collection)
+    
+    assert await repository.cached_count(ttl=60) == 1
+    await repository.insert(analysis(2))
+    
+    assert await repository.cached_count(ttl=60) == 2
+
+
+@pytest.mark.asyncio
+async def test_change_version_moves_on_writes():
+    """Test inserts and updates advance the change counter, reads do not."""
+    repository = InMemoryAnalysisRepository()
+    start = await repository.change_version(ttl=60)
+    
+    document = await repository.insert(analysis(1))
+    after_insert = await repository.change_version(ttl=60)
+    await repository.list(limit=10)
+    await repository.update_notes(str(document['_id']), "RO")
+    
+    assert after_insert > start
+    assert await repository.change_version(ttl=60) > after_insert
+    assert await repository.update_notes(str(ObjectId()), "RO") is None
+
+
+@pytest.mark.asyncio
+async def test_mongo_change_version_shared_through_counter_collection():
+    """Test writes increment the shared counter and reads refresh it after the TTL."""
+    collection = MagicMock()
+    collection.name = 'water_analyses'
+    collection.insert_one = AsyncMock(return_value=MagicMock(inserted_id=ObjectId()))
+    versions = MagicMock()
+    versions.find_one = AsyncMock(side_effect=[None, {'version': 9}])
+    versions.find_one_and_update = AsyncMock(return_value={'version': 4})
+    repository = MongoAnalysisRepository(collection, versions=versions)
+    
+    assert await repository.change_version(ttl=60) == 0
+    await repository.insert(analysis(1))
+    # This worker's own write shows at once, without a read
+    assert await repository.change_version(ttl=60) == 4
+    # Another worker's writes show once the TTL has passed
+    assert await repository.change_version(ttl=0) == 9
+    
+    versions.find_one_and_update.assert_awaited_once_with(
+        {'_id': 'water_analyses'},
+        {'$inc': {'version': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    assert versions.find_one.await_count == 2
+
+
+def test_filter_query_builds_equality_and_window():
+    """Test filters become equality matches plus a half-open time range."""
+    filters = HistoryFilters(
+        site_name="Site A",
+        ph_category="High pH",
+        start=datetime(2026, 2, 1),
+        end=datetime(2026, 3, 1)
+    )
+    
+    assert filter_query(filters) == {
+        'site_name': "Site A",
+        'ph_category': "High pH",
+        'upload_timestamp': {'$gte': datetime(2026, 2, 1), '$lt': datetime(2026, 3, 1)}
+    }
+    assert filter_query(HistoryFilters()) == {}
+
+
+@pytest.mark.asyncio
+async def test_mongo_list_combines_filters_and_cursor():
+    """Test the keyset condition is added alongside the filters."""
+    cursor = MagicMock()
+    cursor.sort.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = AsyncMock(return_value=[])
+    collection = MagicMock()
+    collection.find.return_value = cursor
+    repository = MongoAnalysisRepository(collection)
+    timestamp, analysis_id = datetime(2026, 2, 3), ObjectId()
+    
+    await repository.list(limit=10, after=(timestamp, analysis_id),
+                          filters=HistoryFilters(site_name="Site A"))
+    
+    query = collection.find.call_args.args[0]
+    assert query['site_name'] == "Site A"
+    assert len(query['$or']) == 2
+
+
+@pytest.mark.asyncio
+async def test_mongo_filtered_estimated_count_is_exact():
+    """Test filtered counts cannot use collection metadata."""
+    collection = MagicMock()
+    collection.count_documents = AsyncMock(return_value=7)
+    collection.estimated_document_count = AsyncMock()
+    repository = MongoAnalysisRepository(collection)
+    
+    assert await repository.estimated_count(HistoryFilters(site_name="Site A")) == 7
+    collection.count_documents.assert_awaited_once_with({'site_name': "Site A"})
+    collection.estimated_document_count.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_in_memory_filtered_list_offset_and_count():
+    """Test filtered listing skips non-matching analyses before applying offset."""
+    repository = InMemoryAnalysisRepository()
+    for day in range(1, 7):
+        await repository.insert(analysis(day, site_name="Site A" if day % 2 else "Site B"))
+    filters = HistoryFilters(site_name="Site A")
+    
+    page = await repository.list(limit=5, offset=1, filters=filters)
+    
+    assert [doc['original_filename'] for doc in page] == ["day3.csv", "day1.csv"]
+    assert await repository.count(filters) == 3
+    assert await repository.cached_count(60, filters) == 3
+    assert await repository.cached_count(60) == 6
+
+
+@pytest.mark.asyncio
+async def test_in_memory_stores_naive_utc_times():
+    """Test aware timestamps are stored as naive UTC, so naive filter bounds compare."""
+    repository = InMemoryAnalysisRepository()
+    plus_two = timezone(timedelta(hours=2))
+    await repository.insert(analysis(1, upload_timestamp=datetime(2026, 2, 1, 1, tzinfo=plus_two)))
+    await repository.insert_many([analysis(2, upload_timestamp=datetime(2026, 2, 2, tzinfo=timezone.utc))])
+    filters = HistoryFilters(start=datetime(2026, 1, 31, 23), end=datetime(2026, 2, 1, 23))
+
+    page = await repository.list(limit=5, filters=filters)
+
+    assert [doc['upload_timestamp'] for doc in page] == [datetime(2026, 1, 31, 23)]
+    assert await repository.count(filters) == 1
+    assert (await repository.stats('day', filters))['overall']['analyses'] == 1
+
+
+@pytest.mark.asyncio
+async def test_in_memory_iter_batches():
+    """Test batches cover every match in history order."""
+    repository = InMemoryAnalysisRepository()
+    for day in range(1, 6):
+        await repository.insert(analysis(day, site_name="Site A" if day != 3 else "Site B"))
+    
+    batches = [batch async for batch in repository.iter_batches(
+        2, filters=HistoryFilters(site_name="Site A"), fields=['original_filename'])]
+    
+    assert [[doc['original_filename'] for doc in batch] for batch in batches] == [
+        ["day5.csv", "day4.csv"], ["day2.csv", "day1.csv"]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_mongo_iter_batches_uses_batched_cursor():
+    """Test the export cursor is sorted, batched and closed afterwards."""
+    documents = [analysis(day) for day in (3, 2, 1)]
+
+    class FakeCursor:
+        def __init__(self):
+            self.sort = MagicMock(return_value=self)
+            self.batch_size = MagicMock(return_value=self)
+            self.close = AsyncMock()
+
+        async def __aiter__(self):
+            for document in documents:
+                yield document
+
+    cursor = FakeCursor()
+    collection = MagicMock()
+    collection.find.return_value = cursor
+    repository = MongoAnalysisRepository(collection)
+    
+    batches = [batch async for batch in repository.iter_batches(2)]
+    
+    assert [len(batch) for batch in batches] == [2, 1]
+    cursor.batch_size.assert_called_once_with(2)
+    cursor.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_in_memory_update_sets_fields():
+    """Test update changes only the given fields and returns the document."""
+    repository = InMemoryAnalysisRepository()
+    document = await repository.insert(analysis(1, avg_ph=7.0, user_notes="RO"))
+    
+    updated = await repository.update(str(document['_id']), {'avg_ph': 8.1})
+    
+    assert updated['avg_ph'] == 8.1
+    assert updated['user_notes'] == "RO"
+    assert await repository.update(str(ObjectId()), {'avg_ph': 8.1}) is None
+
+
+@pytest.mark.asyncio
+async def test_in_memory_rejects_duplicate_upload():
+    """Test content hash per site and idempotency keys are unique, like the indexes."""
+    repository = InMemoryAnalysisRepository()
+    first = await repository.insert(analysis(1, content_hash="h1", site_name="A", idempotency_key="k1"))
+    await repository.insert(analysis(2, content_hash="h1", site_name="B"))
+    await repository.insert(analysis(3))
+    await repository.insert(analysis(4))
+    
+    for duplicate in (analysis(5, content_hash="h1", site_name="A"), analysis(5, content_hash="h2", idempotency_key="k1")):
+        with pytest.raises(DuplicateAnalysisError):
+            await repository.insert(duplicate)
+    
+    assert (await repository.get_by_content("h1", "A"))['_id'] == first['_id']
+    assert (await repository.get_by_idempotency_key("k1"))['_id'] == first['_id']
+    assert await repository.get_by_content("h1", None) is None
+    assert await repository.count() == 4
+
+
+@pytest.mark.asyncio
+async def test_mongo_duplicate_key_becomes_duplicate_analysis():
+    """Test the unique index violation surfaces as DuplicateAnalysisError."""
+    collection = MagicMock()
+    collection.insert_one = AsyncMock(side_effect=DuplicateKeyError("E11000 duplicate key"))
+    repository = MongoAnalysisRepository(collection)
+    
+    with pytest.raises(DuplicateAnalysisError):
+        await repository.insert(analysis(1, content_hash="h1"))
+
+
+@pytest.mark.asyncio
+async def test_mongo_get_by_content_matches_missing_site():
+    """Test a lookup without a site matches analyses stored without one."""
+    collection = MagicMock()
+    collection.find_one = AsyncMock(return_value=None)
+    repository = MongoAnalysisRepository(collection)
+    
+    await repository.get_by_content("h1", None)
+    
+    collection.find_one.assert_awaited_once_with({'content_hash': "h1", 'site_name': None})
+
+
+@pytest.mark.asyncio
+async def test_mongo_insert_many_skips_duplicates():
+    """Test duplicate key errors drop only the conflicting documents."""
+    collection = MagicMock()
+    collection.insert_many = AsyncMock(side_effect=BulkWriteError({
+        'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': "E11000 duplicate key"}]
+    }))
+    repository = MongoAnalysisRepository(collection)
+    documents = [analysis(day, _id=ObjectId()) for day in (1, 2, 3)]
+    
+    stored = await repository.insert_many(documents)
+    
+    assert stored == [documents[0], documents[2]]
+    collection.insert_many.assert_awaited_once_with(documents, ordered=False)
+
+
+@pytest.mark.asyncio
+async def test_mongo_insert_many_raises_other_errors():
+    """Test write errors other than duplicates are not swallowed."""
+    collection = MagicMock()
+    collection.insert_many = AsyncMock(side_effect=BulkWriteError({
+        'writeErrors': [{'index': 0, 'code': 121, 'errmsg': "Document failed validation"}]
+    }))
+    repository = MongoAnalysisRepository(collection)
+    
+    with pytest.raises(BulkWriteError):
+        await repository.insert_many([analysis(1, _id=ObjectId())])
+
+
+@pytest.mark.asyncio
+async def test_in_memory_insert_many_skips_duplicates():
+    """Test the in-memory bulk insert applies the same uniqueness rules."""
+    repository = InMemoryAnalysisRepository()
+    documents = [analysis(1, content_hash="h1"), analysis(2, content_hash="h1"), analysis(3, content_hash="h2")]
+    
+    stored = await repository.insert_many(documents)
+    
+    assert [doc['original_filename'] for doc in stored] == ["day1.csv", "day3.csv"]
+
+
+def stats_collection(*results):
+    """Collection whose aggregate calls return the given facet documents, or raise them."""
+    def cursor(result):
+        if isinstance(result, Exception):
+            return result
+        cursor = MagicMock()
+        cursor.to_list = AsyncMock(return_value=[result])
+        return cursor
+    collection = MagicMock()
+    collection.aggregate = AsyncMock(side_effect=[cursor(result) for result in results])
+    return collection
+
+
+EMPTY_FACETS = {'overall': [], 'sites': [], 'buckets': [], 'treatments': [], 'dominant_rules': []}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('filters, hinted', [
+    (None, True),
+    (HistoryFilters(site_name="Site A", start=datetime(2026, 2, 1)), True),
+    (HistoryFilters(ph_category="High pH"), False),
+])
+async def test_mongo_stats_hints_covering_index(filters, hinted):
+    """Test the stats index is hinted for the filters it covers, with allowDiskUse passed on."""
+    collection = stats_collection(EMPTY_FACETS)
+    repository = MongoAnalysisRepository(collection)
+    
+    await repository.stats('day', filters, allow_disk_use=False)
+    
+    pipeline, options = collection.aggregate.call_args.args[0], collection.aggregate.call_args.kwargs
+    assert pipeline == stats_pipeline('day', filters)
+    assert options['allowDiskUse'] is False
+    assert ('hint' in options) is hinted
+
+
+@pytest.mark.asyncio
+async def test_mongo_stats_without_covering_index_yet():
+    """Test the aggregation runs unhinted while the stats index is still being built."""
+    collection = stats_collection(OperationFailure("hint provided does not correspond to an existing index", 2),
+                                  EMPTY_FACETS)
+    repository = MongoAnalysisRepository(collection)
+    
+    report = await repository.stats('day')
+    
+    assert 'hint' not in collection.aggregate.call_args.kwargs
+    assert report['overall']['analyses'] == 0
+    assert report['overall']['ph'] == {'mean': None, 'min': None, 'max': None}
+
+
+@pytest.mark.asyncio
+async def test_mongo_stats_maps_counts():
+    """Test count facets become dicts in the order the database sorted them."""
+    collection = stats_collection({
+        **EMPTY_FACETS,
+        'treatments': [{'_id': "Ion exchange", 'count': 5}, {'_id': "Reverse osmosis (RO)", 'count': 2}],
+        'dominant_rules': [{'_id': "E", 'count': 5}]
+    })
+    repository = MongoAnalysisRepository(collection)
+    
+    report = await repository.stats('week')
+    
+    assert list(report['treatments'].items()) == [("Ion exchange", 5), ("Reverse osmosis (RO)", 2)]
+    assert report['dominant_rules'] == {"E": 5}
+
+
+def test_stats_pipeline_projects_covered_fields_first():
+    """Test only the covering index's fields reach the $facet, and weeks start on Monday."""
+    pipeline = stats_pipeline('week', HistoryFilters(site_name="Site A"))
+    
+    assert pipeline[0] == {'$match': {'site_name': "Site A"}}
+    assert pipeline[1]['$project']['_id'] == 0
+    bucket_key = pipeline[2]['$facet']['buckets'][0]['$group']['_id']
+    assert bucket_key == {'$dateTrunc': {'date': '$upload_timestamp', 'unit': 'week', 'startOfWeek': 'monday'}}
@@ -0,0 +1,76 @@
+"""
+Test JSON response encoding
+"""
+import math
+import pytest
+import numpy as np
+from datetime import datetime, UTC
+from bson import ObjectId
+from typing import Optional
+from pydantic import BaseModel
+from unittest.mock import patch
+
+import app.core.responses as responses
+from app.core.responses import FastJSONResponse, ModelResponse, dumps
+
+
+class Reading(BaseModel):
+    taken_at: datetime
+    uploaded_at: datetime
+    ph: float
+    tds: Optional[float]
+    note: str
+
+
+READING = {
+    'taken_at': datetime(2024, 1, 1, 10, 0, 0, 123000),
+    'uploaded_at': datetime(2024, 1, 2, tzinfo=UTC),
+    'ph': 7.1,
+    'tds': math.nan,
+    'note': "pH dosing – check"
+}
+
+
+@pytest.fixture(params=["orjson", "pydantic-core"])
+def encoder(request):
+    """Run with orjson when installed, and with the pydantic-core fallback."""
+    if request.param == "orjson":
+        if responses.orjson is None:
+            pytest.skip("orjson is not installed")
+        yield
+    else:
+        with patch.object(responses, 'orjson', None):
+            yield
+
+
+def test_dumps_matches_model_serialization(encoder):
+    """Test plain data encodes exactly as its pydantic model would"""
+    assert dumps(READING) == Reading(**READING).model_dump_json().encode()
+
+
+def test_dumps_encodes_object_ids_and_numpy(encoder):
+    """Test values outside plain JSON types are converted"""
+    analysis_id = ObjectId()
+
+    assert dumps({'id': analysis_id, 'count': np.int64(3)}) == b'{"id":"%s","count":3}' % str(analysis_id).encode()
+
+
+def test_dumps_rejects_unknown_types(encoder):
+    """Test unsupported values fail instead of being stringified"""
+    with pytest.raises((TypeError, ValueError)):
+        dumps({'value': object()})
+
+
+def test_model_response_headers_and_status():
+    """Test a model response carries its status, headers and JSON content type"""
+    response = ModelResponse(Reading(**READING), status_code=202, headers={"Location": "/here"})
+
+    assert response.status_code == 202
+    assert response.headers["location"] == "/here"
+    assert response.headers["content-type"] == "application/json"
+    assert response.body == Reading(**READING).model_dump_json().encode()
+
+
+def test_fast_json_response_renders_plain_data():
+    """Test the default response class encodes with dumps"""
+    assert FastJSONResponse(READING).body == dumps(READING)
@@ -0,0 +1,300 @@
+"""
+Test the site and day rollups behind /stats
+
+The Mongo round trip at the end only runs when MONGODB_TEST_URL points at a
+disposable server, e.g.
+
+    MONGODB_TEST_URL=mongodb://localhost:27017 pytest tests/test_rollups.py
+"""
+import os
+import random
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import AutoReconnect
+
+from app.db.repository import InMemoryAnalysisRepository, MongoAnalysisRepository
+from app.db.rollups import (
+    ROLLUP_INDEXES,
+    ROLLUPS_COLLECTION,
+    report_from_cells,
+    rollup_cells,
+    rollup_query,
+    rollups_cover,
+    stats_of_documents
+)
+from app.models.analysis_result import HistoryFilters
+from tests.test_history import make_analysis
+
+MONGODB_TEST_URL = os.environ.get("MONGODB_TEST_URL")
+
+
+def random_analyses(count, seed=0):
+    """Analyses spread over three sites and six weeks, some stored before rules were recorded."""
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(count):
+        fields = {}
+        if rng.random() < 0.7:
+            fields = {'min_ph': 6.5, 'max_ph': 9.5, 'out_of_range_fraction': rng.random(),
+                      'dominant_rule': rng.choice("ADEH")}
+        documents.append(make_analysis(
+            upload_timestamp=datetime(2026, 1, 1) + timedelta(minutes=rng.randrange(60 * 24 * 42)),
+            site_name=rng.choice(["Site A", "Site B", None]),
+            avg_ph=round(rng.uniform(6.8, 9.0), 2),
+            avg_tds=round(rng.uniform(50, 700), 1),
+            treatment_train=rng.choice(["Reverse osmosis (RO)", "Ion exchange", "No treatment required"]),
+            row_count=rng.randrange(1, 500),
+            **fields
+        ))
+    return documents
+
+
+def approx_report(report):
+    """Report with floats compared approximately, as cells add them up in another order."""
+    if isinstance(report, float):
+        return pytest.approx(report)
+    if isinstance(report, dict):
+        return {key: approx_report(value) for key, value in report.items()}
+    if isinstance(report, list):
+        return [approx_report(value) for value in report]
+    return report
+
+
+@pytest.mark.parametrize('bucket', ['day', 'week', 'month'])
+def test_report_from_cells_matches_analyses(bucket):
+    """Test a report composed from day cells equals one grouped from the analyses"""
+    documents = random_analyses(500)
+
+    from_cells = report_from_cells(rollup_cells(documents).items(), bucket)
+
+    assert from_cells == approx_report(stats_of_documents(documents, bucket))
+
+
+@pytest.mark.parametrize('bucket, fields, covered', [
+    ('day', {}, True),
+    ('month', {'site_name': "Site A", 'treatment_train': "Ion exchange"}, True),
+    ('week', {'start': datetime(2026, 1, 5), 'end': datetime(2026, 2, 1)}, True),
+    ('hour', {}, False),
+    ('day', {'ph_category': "High pH"}, False),
+    ('day', {'start': datetime(2026, 1, 5, 12)}, False),
+])
+def test_rollups_cover_whole_day_reports(bucket, fields, covered):
+    """Test only reports over whole cells are composed from them"""
+    assert rollups_cover(bucket, HistoryFilters(**fields)) is covered
+
+
+def test_rollup_query_selects_cells():
+    """Test key filters and the day window become the cell query"""
+    filters = HistoryFilters(site_name="Site A", start=datetime(2026, 1, 5), end=datetime(2026, 2, 1))
+
+    assert rollup_query(filters) == {
+        'site_name': "Site A",
+        'day': {'$gte': datetime(2026, 1, 5), '$lt': datetime(2026, 2, 1)}
+    }
+
+
+@pytest.mark.asyncio
+async def test_in_memory_rollups_follow_inserts_and_updates():
+    """Test cells are added to on insert and recomputed when an analysis's figures change"""
+    repository = InMemoryAnalysisRepository()
+    documents = random_analyses(200)
+    for document in documents:
+        await repository.insert(document)
+    assert repository.rollups == approx_report(rollup_cells(documents))
+
+    changed = await repository.update(str(documents[0]['_id']), {
+        'avg_ph': 7.9, 'treatment_train': "Ion exchange", 'dominant_rule': "E"
+    })
+    await repository.update_notes(str(documents[1]['_id']), "Dosed acid")
+
+    assert changed['avg_ph'] == 7.9
+    assert repository.rollups == approx_report(rollup_cells(repository.documents.values()))
+    rebuilt = await repository.rebuild_rollups()
+    assert rebuilt == len(repository.rollups)
+
+
+@pytest.mark.asyncio
+async def test_in_memory_stats_from_rollups_match_aggregation():
+    """Test the report read from cells equals the one aggregated from the analyses"""
+    repository = InMemoryAnalysisRepository()
+    await repository.insert_many(random_analyses(300))
+    filters = HistoryFilters(site_name="Site B", start=datetime(2026, 1, 12))
+
+    report = await repository.stats('week', filters)
+
+    assert report == approx_report(await repository.aggregate_stats('week', filters))
+
+
+def mongo_repository(use_rollups=False):
+    """Repository on mock collections, with a rollup collection."""
+    collection = MagicMock()
+    collection.insert_one = AsyncMock(return_value=MagicMock(inserted_id=ObjectId()))
+    rollups = MagicMock()
+    rollups.name = ROLLUPS_COLLECTION
+    rollups.bulk_write = AsyncMock()
+    return MongoAnalysisRepository(collection, rollups=rollups, use_rollups=use_rollups)
+
+
+@pytest.mark.asyncio
+async def test_mongo_insert_upserts_cell():
+    """Test a stored analysis is added into its cell with one $inc/$min/$max upsert"""
+    repository = mongo_repository()
+    document = make_analysis(min_ph=7.1, max_ph=8.4, dominant_rule="D")
+
+    await repository.insert(document)
+
+    [update] = repository.rollups.bulk_write.call_args.args[0]
+    assert isinstance(update, UpdateOne)
+    assert update._filter == {'site_name': "Test Site", 'day': datetime(2026, 2, 5),
+                              'treatment_train': "Reverse osmosis (RO)", 'dominant_rule': "D"}
+    assert update._doc['$inc']['analyses'] == 1
+    assert update._doc['$inc']['ph_total'] == pytest.approx(78.0)
+    assert update._doc['$min'] == {'ph_min': 7.1, 'tds_min': 150}
+    assert update._doc['$max'] == {'ph_max': 8.4, 'tds_max': 150}
+    assert update._upsert is True
+
+
+@pytest.mark.asyncio
+async def test_mongo_rollup_failure_does_not_fail_insert():
+    """Test the analysis is still stored when its cell cannot be updated"""
+    repository = mongo_repository()
+    repository.rollups.bulk_write = AsyncMock(side_effect=AutoReconnect("primary stepped down"))
+
+    document = await repository.insert(make_analysis())
+
+    assert document['_id'] is not None
+
+
+@pytest.mark.asyncio
+async def test_mongo_changed_figures_move_between_cells():
+    """Test an update to rolled up fields moves the analysis's totals with $inc and refreshes extremes"""
+    repository = mongo_repository()
+    before = make_analysis(treatment_train="Reverse osmosis (RO)", dominant_rule="D")
+    repository.collection.find_one_and_update = AsyncMock(return_value=before)
+    cells = MagicMock()
+    cells.to_list = AsyncMock(return_value=[{
+        'site_name': "Test Site", 'day': datetime(2026, 2, 5), 'treatment_train': "Ion exchange",
+        'dominant_rule': "E", 'analyses': 1, 'readings': 10, 'classified': 0, 'out_of_range': 0,
+        'ph_total': 78.0, 'tds_total': 1500, 'ph_min': 7.8, 'ph_max': 7.8, 'tds_min': 150, 'tds_max': 150
+    }])
+    repository.collection.aggregate = AsyncMock(return_value=cells)
+    repository.rollups.delete_many = AsyncMock()
+
+    updated = await repository.update(str(before['_id']), {'treatment_train': "Ion exchange", 'dominant_rule': "E"})
+
+    assert repository.collection.find_one_and_update.call_args.kwargs['return_document'] == ReturnDocument.BEFORE
+    assert updated['treatment_train'] == "Ion exchange"
+    (removal, addition), extremes = [call.args[0] for call in repository.rollups.bulk_write.call_args_list]
+    assert removal._filter['treatment_train'] == "Reverse osmosis (RO)"
+    assert removal._doc == {'$inc': {'analyses': -1, 'readings': -10, 'classified': 0, 'out_of_range': 0,
+                                     'ph_total': pytest.approx(-78.0), 'tds_total': -1500}}
+    assert addition._filter['treatment_train'] == "Ion exchange"
+    assert addition._doc['$inc']['analyses'] == 1
+    repository.rollups.delete_many.assert_awaited_once_with(
+        {'site_name': "Test Site", 'day': datetime(2026, 2, 5), 'analyses': {'$lte': 0}})
+    pipeline = repository.collection.aggregate.call_args.args[0]
+    assert pipeline[0] == {'$match': {
+        'site_name': "Test Site",
+        'upload_timestamp': {'$gte': datetime(2026, 2, 5), '$lt': datetime(2026, 2, 6)}
+    }}
+    [refresh] = extremes
+    assert refresh._filter['analyses'] == 1
+    assert refresh._doc == {'$set': {'ph_min': 7.8, 'ph_max': 7.8, 'tds_min': 150, 'tds_max': 150}}
+
+
+@pytest.mark.asyncio
+async def test_mongo_rollup_failure_does_not_fail_update():
+    """Test the update still succeeds when its cells cannot be moved"""
+    repository = mongo_repository()
+    document = make_analysis()
+    repository.collection.find_one_and_update = AsyncMock(return_value=document)
+    repository.rollups.bulk_write = AsyncMock(side_effect=AutoReconnect("primary stepped down"))
+
+    updated = await repository.update(str(document['_id']), {'dominant_rule': "E"})
+
+    assert updated['dominant_rule'] == "E"
+
+
+@pytest.mark.asyncio
+async def test_mongo_stats_read_cells_when_enabled():
+    """Test whole-day reports read the rollup collection instead of aggregating analyses"""
+    repository = mongo_repository(use_rollups=True)
+    cursor = MagicMock()
+    cursor.to_list = AsyncMock(return_value=[{
+        'site_name': "Site A", 'day': datetime(2026, 2, 5), 'treatment_train': "Ion exchange",
+        'dominant_rule': None, 'analyses': 2, 'readings': 20, 'classified': 0, 'out_of_range': 0,
+        'ph_total': 160.0, 'tds_total': 4000.0, 'ph_min': 7.5, 'ph_max': 8.5, 'tds_min': 150, 'tds_max': 250
+    }])
+    repository.rollups.find = MagicMock(return_value=cursor)
+    repository.collection.aggregate = AsyncMock()
+
+    report = await repository.stats('month', HistoryFilters(site_name="Site A"))
+
+    repository.rollups.find.assert_called_once_with({'site_name': "Site A"}, {'_id': 0})
+    repository.collection.aggregate.assert_not_called()
+    assert report['overall']['ph'] == {'mean': 8.0, 'min': 7.5, 'max': 8.5}
+    assert report['buckets'][0]['start'] == datetime(2026, 2, 1)
+    assert report['treatments'] == {"Ion exchange": 2}
+
+
+@pytest.mark.asyncio
+async def test_mongo_rebuild_replaces_collection_with_out():
+    """Test a rebuild regroups the analyses on the covering index straight into the rollups"""
+    repository = mongo_repository()
+    cursor = MagicMock()
+    cursor.to_list = AsyncMock(return_value=[])
+    repository.collection.aggregate = AsyncMock(return_value=cursor)
+    repository.rollups.count_documents = AsyncMock(return_value=42)
+
+    assert await repository.rebuild_rollups() == 42
+
+    pipeline, options = repository.collection.aggregate.call_args.args[0], repository.collection.aggregate.call_args.kwargs
+    assert pipeline[-1] == {'$out': ROLLUPS_COLLECTION}
+    assert options['allowDiskUse'] is True
+    assert 'hint' in options
+
+
+@pytest.mark.asyncio
+async def test_mongo_ensure_indexes_creates_rollup_key():
+    """Test the rollup key gets the unique index upserts and $out rely on"""
+    repository = mongo_repository()
+    repository.collection.create_indexes = AsyncMock()
+    repository.rollups.create_indexes = AsyncMock()
+
+    await repository.ensure_indexes()
+
+    repository.rollups.create_indexes.assert_awaited_once_with(ROLLUP_INDEXES)
+    assert ROLLUP_INDEXES[0].document['unique'] is True
+
+
+@pytest.mark.skipif(not MONGODB_TEST_URL, reason="MONGODB_TEST_URL not set")
+@pytest.mark.asyncio
+async def test_mongo_rollups_match_rebuild_and_aggregation():
+    """Test upserted cells, rebuilt cells and the aggregated report all agree"""
+    from pymongo import AsyncMongoClient
+
+    client = AsyncMongoClient(MONGODB_TEST_URL)
+    database = client[f"test_rollups_{ObjectId()}"]
+    repository = MongoAnalysisRepository(database['water_analyses'], rollups=database[ROLLUPS_COLLECTION],
+                                         use_rollups=True)
+    try:
+        await repository.ensure_indexes()
+        documents = random_analyses(300)
+        await repository.insert_many(documents[:200])
+        for document in documents[200:]:
+            await repository.insert(document)
+        await repository.update(str(documents[0]['_id']), {'avg_ph': 7.0})
+
+        upserted = await repository.stats('week')
+        await repository.rebuild_rollups()
+        rebuilt = await repository.stats('week')
+        aggregated = await repository.aggregate_stats('week')
+
+        assert upserted == approx_report(aggregated)
+        assert rebuilt == approx_report(aggregated)
+    finally:
+        await client.drop_database(database.name)
+        await client.close()
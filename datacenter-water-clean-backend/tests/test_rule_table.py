@@ -0,0 +1,204 @@
+"""
+Test the rule table: compilation, boundaries, site profiles and hot reload
+"""
+import json
+import os
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+from app.services import rule_table
+from app.services.recommendation_service import RecommendationService
+from app.services.rule_table import (
+    DEFAULT_RULE_TABLE_PATH,
+    RuleConfig,
+    RuleTableError,
+    get_rule_config,
+    get_rule_table,
+    set_rule_config
+)
+from app.services.statistics import StatsAccumulator
+
+
+def default_config():
+    """The bundled rule table as a dict."""
+    return json.loads(DEFAULT_RULE_TABLE_PATH.read_text(encoding='utf-8'))
+
+
+@pytest.fixture(autouse=True)
+def restore_rule_config():
+    """Put the process-wide rule table back after each test."""
+    previous = rule_table._config
+    yield
+    set_rule_config(previous)
+
+
+@pytest.fixture
+def rule_file(tmp_path):
+    """A writable copy of the bundled rule table, made active."""
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(default_config()), encoding='utf-8')
+    set_rule_config(RuleConfig.load(path))
+    return path
+
+
+def rewrite(path, config, mtime_ns):
+    """Write a new table and give it a distinct modification time."""
+    path.write_text(json.dumps(config), encoding='utf-8')
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.mark.parametrize('ph, category', [
+    (7.5, "Low pH"),
+    (np.nextafter(7.5, 8), "In target range"),
+    (np.nextafter(8.3, 0), "In target range"),
+    (8.3, "High pH"),
+])
+def test_ph_boundaries(ph, category):
+    """Test pH 7.5 belongs to the low band and 8.3 to the high band."""
+    assert get_rule_table().ph_category(ph) == category
+
+
+@pytest.mark.parametrize('tds, category', [
+    (99.999, "Low"),
+    (100, "Moderate"),
+    (299.999, "Moderate"),
+    (300, "High"),
+])
+def test_tds_boundaries(tds, category):
+    """Test TDS thresholds start the band above them."""
+    assert get_rule_table().tds_category(tds) == category
+
+
+def test_categories_agree_with_rules():
+    """Test every rule code's cell matches the category names it is filed under."""
+    config = default_config()
+    table = get_rule_table()
+    rng = np.random.default_rng(1)
+
+    for ph, tds in zip(rng.uniform(5, 11, 2000), rng.uniform(0, 800, 2000)):
+        expected = config['rules'][table.ph_category(ph)][table.tds_category(tds)]
+        assert table.rule_code(ph, tds) == expected
+
+
+def test_site_profile_overrides_thresholds():
+    """Test a site profile moves the thresholds but keeps the shared rules."""
+    config = default_config()
+    config['sites'] = {"Site 7": {"ph": {"thresholds": [7.0, 8.0]}}}
+    rules = RuleConfig.from_dict(config)
+
+    assert rules.for_site("Site 7").rule_code(7.2, 50) == 'A'
+    assert rules.for_site("Site 7").rule_code(8.1, 50) == 'B'
+    assert rules.for_site("Site 8").rule_code(7.2, 50) == 'C'
+    assert rules.for_site(None) is rules.default
+    assert rules.for_site("Site 7").recommendation('B') == rules.default.recommendation('B')
+
+
+def test_site_profile_classifies_batches_and_statistics():
+    """Test the vectorised paths honour a site profile too."""
+    config = default_config()
+    config['sites'] = {"Site 7": {"tds": {"thresholds": [50, 150]}}}
+    site = RuleConfig.from_dict(config).for_site("Site 7")
+    ph = np.array([8.0, 8.0, 8.0])
+    tds = np.array([40.0, 120.0, 200.0])
+
+    codes, _, _ = RecommendationService.get_recommendations_batch(ph, tds, site)
+    acc = StatsAccumulator.from_values(np.array([ph, tds]), site)
+
+    assert codes.tolist() == ['A', 'D', 'E']
+    assert acc.rule_distribution() == {**dict.fromkeys("ABCDEFGHI", 0), 'A': 1, 'D': 1, 'E': 1}
+
+
+def test_more_bands_than_default():
+    """Test tables are not tied to three bands per axis."""
+    config = default_config()
+    config['tds']['bands'] = ["Low", "Moderate", "High", "Brine"]
+    config['tds']['thresholds'] = [100, 300, 5000]
+    for band, row in config['rules'].items():
+        row["Brine"] = 'X'
+    table = RuleConfig.from_dict(config).default
+    rng = np.random.default_rng(2)
+    ph = rng.uniform(5, 11, 5000)
+    tds = rng.uniform(0, 8000, 5000)
+
+    codes, _, _ = RecommendationService.get_recommendations_batch(ph, tds, table)
+    acc = StatsAccumulator.from_values(np.array([ph, tds]), table)
+
+    assert codes.tolist() == [table.rule_code(p, t) for p, t in zip(ph, tds)]
+    assert sum(acc.rule_distribution().values()) == acc.count
+    assert acc.rule_distribution()['X'] == int(np.count_nonzero(tds >= 5000))
+
+
+@pytest.mark.parametrize('change, message', [
+    (lambda c: c['ph'].update(thresholds=[8.3, 7.5]), "increasing"),
+    (lambda c: c['ph'].update(thresholds=[7.5]), "entries"),
+    (lambda c: c['tds']['thresholds'].__setitem__(0, "low"), "finite"),
+    (lambda c: c['rules']['High pH'].pop('Low'), "No rule"),
+    (lambda c: c['treatments'].pop('D'), "'D'"),
+    (lambda c: c.update(fallback='Z'), "fallback"),
+    (lambda c: c.update(sites={"Site 1": {"ph": {"thresholds": [7.0]}}}), "entries"),
+])
+def test_invalid_tables_rejected(change, message):
+    """Test inconsistent tables are refused with a pointed message."""
+    config = default_config()
+    change(config)
+
+    with pytest.raises(RuleTableError, match=message):
+        RuleConfig.from_dict(config)
+
+
+def test_rule_change_drops_memoized_recommendations():
+    """Test recommendations memoized for the old table are not served once it is replaced"""
+    config = default_config()
+    set_rule_config(RuleConfig.from_dict(config))
+    RecommendationService.recommend(7.8, 50)
+    assert RecommendationService.cache_info()["cells"] > 0
+    
+    config['treatments']['A']['treatment_train'] = "Monitor only"
+    set_rule_config(RuleConfig.from_dict(config))
+    
+    assert RecommendationService.cache_info()["cells"] == 0
+    assert RecommendationService.recommend(7.8, 50).treatment_train == "Monitor only"
+
+
+def test_rule_text_is_interned():
+    """Test separately compiled tables share the rule text objects"""
+    first, second = RuleConfig.from_dict(default_config()), RuleConfig.from_dict(default_config())
+    
+    assert first.default.recommendation('D')[1] is second.default.recommendation('D')[1]
+
+
+@patch('app.services.rule_table.settings')
+def test_changed_file_is_reloaded(mock_settings, rule_file):
+    """Test an edited rule table takes effect without a restart."""
+    mock_settings.RULE_TABLE_RELOAD_INTERVAL = 1e-9
+    config = default_config()
+    config['version'] = "2026.2"
+    config['ph']['thresholds'] = [7.0, 8.3]
+    rewrite(rule_file, config, get_rule_config().mtime_ns + 10**9)
+
+    assert get_rule_config().version == "2026.2"
+    assert RecommendationService.get_rule_code(7.2, 50) == 'A'
+
+
+@patch('app.services.rule_table.settings')
+def test_broken_file_keeps_previous_table(mock_settings, rule_file):
+    """Test a file that fails to compile leaves the active table in place."""
+    mock_settings.RULE_TABLE_RELOAD_INTERVAL = 1e-9
+    active = get_rule_config()
+    rule_file.write_text("{not json", encoding='utf-8')
+    os.utime(rule_file, ns=(active.mtime_ns + 10**9,) * 2)
+
+    assert get_rule_config() is active
+    assert get_rule_config() is active
+
+
+@patch('app.services.rule_table.settings')
+def test_reload_waits_for_interval(mock_settings, rule_file):
+    """Test the file is not checked again within the reload interval."""
+    mock_settings.RULE_TABLE_RELOAD_INTERVAL = 3600
+    config = default_config()
+    config['version'] = "2026.2"
+    rewrite(rule_file, config, get_rule_config().mtime_ns + 10**9)
+
+    assert get_rule_config().version == "2026.1"
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from app.services.statistics import StatsAccumulator
+
+
+@pytest.fixture
+def readings():
+    """Random pH/TDS readings as a (2, n) array."""
+    rng = np.random.default_rng(42)
+    return np.vstack([
+        rng.normal(7.9, 0.3, 5000),
+        rng.normal(250, 40, 5000)
+    ])
+
+
+def test_single_pass_matches_numpy(readings):
+    """Test count, mean, variance, min and max against NumPy."""
+    acc = StatsAccumulator.from_values(readings)
+    
+    assert acc.count == 5000
+    np.testing.assert_allclose(acc.mean, readings.mean(axis=1))
+    np.testing.assert_allclose(acc.variance, readings.var(axis=1, ddof=1))
+    np.testing.assert_array_equal(acc.min, readings.min(axis=1))
+    np.testing.assert_array_equal(acc.max, readings.max(axis=1))
+
+
+def test_merge_matches_single_pass(readings):
+    """Test merging chunk accumulators gives the single-pass state."""
+    whole = StatsAccumulator.from_values(readings)
+    merged = StatsAccumulator()
+    for chunk in np.array_split(readings, 7, axis=1):
+        merged.merge(StatsAccumulator.from_values(chunk))
+    
+    assert merged.count == whole.count
+    np.testing.assert_allclose(merged.mean, whole.mean)
+    np.testing.assert_allclose(merged.variance, whole.variance)
+    np.testing.assert_array_equal(merged.min, whole.min)
+    for mine, theirs in zip(merged.histograms, whole.histograms):
+        np.testing.assert_array_equal(mine, theirs)
+
+
+def test_missing_values_drop_whole_row():
+    """Test a NaN in either column drops the reading pair."""
+    values = np.array([
+        [7.0, np.nan, 8.0],
+        [200.0, 300.0, np.nan]
+    ])
+    acc = StatsAccumulator.from_values(values)
+    
+    assert acc.count == 1
+    np.testing.assert_array_equal(acc.mean, [7.0, 200.0])
+
+
+def test_percentiles_within_bin_width(readings):
+    """Test histogram percentiles are accurate to the bin width."""
+    ph_percentiles, tds_percentiles = StatsAccumulator.from_values(readings).percentiles()
+    
+    assert ph_percentiles['p50'] == pytest.approx(np.percentile(readings[0], 50), abs=0.02)
+    assert tds_percentiles['p95'] == pytest.approx(np.percentile(readings[1], 95), abs=2)
+
+
+def test_rejects_wrong_shape():
+    """Test update requires a (2, n) array."""
+    with pytest.raises(ValueError):
+        StatsAccumulator().update(np.zeros((3, 4)))
+
+
+def test_rule_counts_match_scalar_rules(readings):
+    """Test per-reading rule counts agree with RecommendationService row by row."""
+    from collections import Counter
+    from app.services.recommendation_service import RecommendationService
+    
+    values = readings.copy()
+    values[:, :6] = [[7.5, 8.3, 7.6, 8.0, 6.0, 9.0], [100, 300, 99.9, 50, 500, 250]]
+    expected = Counter(RecommendationService.get_rule_code(ph, tds) for ph, tds in values.T)
+    
+    acc = StatsAccumulator.from_values(values)
+    
+    assert acc.rule_distribution() == {code: expected.get(code, 0) for code in "CGIADEBFH"}
+
+
+def test_rule_counts_merge_and_skip_missing(readings):
+    """Test rule counts add up across chunks and ignore incomplete rows."""
+    values = readings.copy()
+    values[0, ::10] = np.nan
+    whole = StatsAccumulator.from_values(values)
+    merged = StatsAccumulator()
+    for chunk in np.array_split(values, 5, axis=1):
+        merged.merge(StatsAccumulator.from_values(chunk))
+    
+    np.testing.assert_array_equal(merged.rule_counts, whole.rule_counts)
+    assert sum(whole.rule_distribution().values()) == whole.count
+
+
+def test_bimodal_readings_expose_dominant_rule():
+    """Test a half-acidic, half-alkaline file is flagged despite an in-range average."""
+    values = np.array([[7.0, 8.8] * 500, [50.0] * 1000])
+    acc = StatsAccumulator.from_values(values)
+    
+    assert 7.5 < acc.mean[0] < 8.3  # the average alone says Rule A
+    assert acc.rule_distribution()['A'] == 0
+    assert acc.out_of_range_fraction == 1.0
+    assert acc.dominant_rule in ('B', 'C')
@@ -0,0 +1,139 @@
+"""
+Test the aggregate statistics endpoint
+"""
+import pytest
+from datetime import datetime
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+from app.main import app
+from tests.test_history import make_analysis
+
+client = TestClient(app)
+
+
+async def seed(repository):
+    """Two sites over two days, one analysis stored before readings were classified."""
+    await repository.insert(make_analysis(
+        upload_timestamp=datetime(2026, 2, 2, 9, 30), site_name="Site A",
+        avg_ph=7.8, min_ph=7.2, max_ph=8.4, avg_tds=100, min_tds=60, max_tds=180, row_count=10,
+        out_of_range_fraction=0.2, dominant_rule="D"
+    ))
+    await repository.insert(make_analysis(
+        upload_timestamp=datetime(2026, 2, 2, 17, 0), site_name="Site A",
+        avg_ph=8.6, min_ph=8.1, max_ph=9.0, avg_tds=400, min_tds=350, max_tds=450, row_count=30,
+        ph_category="High pH", treatment_train="Acid dosing", out_of_range_fraction=0.6, dominant_rule="H"
+    ))
+    await repository.insert(make_analysis(
+        upload_timestamp=datetime(2026, 2, 3, 8, 0), site_name="Site B",
+        avg_ph=7.0, avg_tds=50, row_count=20
+    ))
+
+
+@pytest.mark.asyncio
+async def test_stats_overall(memory_repository):
+    """Test means are weighted by readings and ranges fall back to averages"""
+    await seed(memory_repository)
+
+    response = client.get("/api/v1/analysis/stats")
+
+    assert response.status_code == 200
+    overall = response.json()["overall"]
+    assert overall["analyses"] == 3
+    assert overall["readings"] == 60
+    assert overall["ph"]["mean"] == pytest.approx((7.8 * 10 + 8.6 * 30 + 7.0 * 20) / 60)
+    # Site B stored no extremes, so its average stands in for them
+    assert overall["ph"]["min"] == 7.0
+    assert overall["ph"]["max"] == 9.0
+    assert overall["tds"]["min"] == 50
+    # Only the 40 classified readings count towards the ratio
+    assert overall["out_of_range_ratio"] == pytest.approx((0.2 * 10 + 0.6 * 30) / 40)
+
+
+@pytest.mark.asyncio
+async def test_stats_per_site_and_bucket(memory_repository):
+    """Test analyses are grouped by site name and by day"""
+    await seed(memory_repository)
+
+    stats = client.get("/api/v1/analysis/stats").json()
+
+    assert stats["bucket"] == "day"
+    assert [site["site_name"] for site in stats["sites"]] == ["Site A", "Site B"]
+    assert stats["sites"][0]["tds"]["mean"] == pytest.approx((100 * 10 + 400 * 30) / 40)
+    assert stats["sites"][1]["out_of_range_ratio"] is None
+    assert [(bucket["start"], bucket["analyses"]) for bucket in stats["buckets"]] == [
+        ("2026-02-02T00:00:00", 2), ("2026-02-03T00:00:00", 1)
+    ]
+    assert stats["treatments"] == {"Reverse osmosis (RO)": 2, "Acid dosing": 1}
+    assert stats["dominant_rules"] == {"D": 1, "H": 1}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('bucket, starts', [
+    ("hour", ["2026-02-02T09:00:00", "2026-02-02T17:00:00", "2026-02-03T08:00:00"]),
+    ("week", ["2026-02-02T00:00:00"]),
+    ("month", ["2026-02-01T00:00:00"]),
+])
+async def test_stats_bucket_width(memory_repository, bucket, starts):
+    """Test buckets start on the hour, Monday or first of the month"""
+    await seed(memory_repository)
+
+    stats = client.get(f"/api/v1/analysis/stats?bucket={bucket}").json()
+
+    assert [bucket["start"] for bucket in stats["buckets"]] == starts
+
+
+@pytest.mark.asyncio
+async def test_stats_apply_history_filters(memory_repository):
+    """Test only analyses matching the history filters are aggregated"""
+    await seed(memory_repository)
+
+    stats = client.get("/api/v1/analysis/stats?site_name=Site A&from=2026-02-02T12:00:00").json()
+
+    assert stats["overall"]["analyses"] == 1
+    assert stats["overall"]["ph"]["mean"] == 8.6
+    assert [site["site_name"] for site in stats["sites"]] == ["Site A"]
+
+
+def test_stats_of_no_analyses():
+    """Test an empty selection reports zero counts and no figures"""
+    stats = client.get("/api/v1/analysis/stats").json()
+
+    assert stats["overall"]["analyses"] == 0
+    assert stats["overall"]["ph"] == {"mean": None, "min": None, "max": None}
+    assert stats["sites"] == stats["buckets"] == []
+    assert stats["treatments"] == {}
+
+
+def test_stats_rejects_unknown_bucket():
+    """Test bucket widths other than hour, day, week and month are refused"""
+    response = client.get("/api/v1/analysis/stats?bucket=minute")
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_unchanged_stats_not_aggregated_again(memory_repository):
+    """Test a poll with the report's ETag gets 304 without running the aggregation"""
+    await seed(memory_repository)
+    etag = client.get("/api/v1/analysis/stats").headers["ETag"]
+
+    with patch.object(memory_repository, 'stats') as stats:
+        response = client.get("/api/v1/analysis/stats", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    stats.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_stats_etag_depends_on_query(memory_repository):
+    """Test another bucket or filter is not answered with the ETag of a different report"""
+    await seed(memory_repository)
+    etag = client.get("/api/v1/analysis/stats").headers["ETag"]
+
+    weekly = client.get("/api/v1/analysis/stats?bucket=week", headers={"If-None-Match": etag})
+    filtered = client.get("/api/v1/analysis/stats?site_name=Site A", headers={"If-None-Match": etag})
+
+    assert weekly.status_code == 200
+    assert filtered.status_code == 200
+    assert len({etag, weekly.headers["ETag"], filtered.headers["ETag"]}) == 3
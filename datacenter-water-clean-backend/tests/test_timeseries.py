@@ -0,0 +1,144 @@
+"""
+Test the per-minute time-series accumulator against pandas resampling
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.rule_table import get_rule_table
+from app.services.timeseries import NAT, TimeSeriesAccumulator
+
+
+@pytest.fixture
+def readings():
+    """Three days of jittered 10-second readings drifting through the pH bands."""
+    rng = np.random.default_rng(3)
+    n = 3 * 24 * 360
+    timestamps = (np.datetime64('2024-03-01T00:00:00', 'ns').astype(np.int64)
+                  + np.arange(n, dtype=np.int64) * 10**10
+                  + rng.integers(0, 10**9, n))
+    ph = 7.9 + 0.7 * np.sin(np.arange(n) / 3000) + rng.normal(0, 0.05, n)
+    tds = rng.normal(60, 10, n)
+    return np.array([ph, tds]), timestamps
+
+
+def resampled(values, timestamps, rule):
+    """Reference window statistics from pandas."""
+    index = pd.to_datetime(timestamps)
+    frame = pd.DataFrame({'ph': values[0], 'tds': values[1]}, index=index)
+    return frame.resample(rule).agg(['mean', 'min', 'max', 'count']).dropna()
+
+
+@pytest.mark.parametrize('name, rule', [('hourly', 'h'), ('daily', 'D')])
+def test_windows_match_pandas_resample(readings, name, rule):
+    """Test hourly and daily windows equal a pandas resample of the raw rows."""
+    values, timestamps = readings
+    expected = resampled(values, timestamps, rule)
+
+    summary = TimeSeriesAccumulator.from_values(values, timestamps).summary(get_rule_table(), 15, 50)
+    windows = summary[name]
+
+    starts = [windows['origin'] + pd.Timedelta(minutes=o * windows['step_minutes']) for o in windows['offset']]
+    assert starts == list(expected.index)
+    assert windows['count'] == expected[('ph', 'count')].tolist()
+    np.testing.assert_allclose(windows['ph_mean'], expected[('ph', 'mean')])
+    np.testing.assert_allclose(windows['tds_min'], expected[('tds', 'min')])
+    np.testing.assert_allclose(windows['tds_max'], expected[('tds', 'max')])
+
+
+def test_merged_blocks_match_single_pass(readings):
+    """Test block-by-block accumulation gives the single-pass buckets."""
+    values, timestamps = readings
+    whole = TimeSeriesAccumulator.from_values(values, timestamps)
+    merged = TimeSeriesAccumulator()
+    for block in np.array_split(np.arange(len(timestamps)), 7):
+        merged.merge(TimeSeriesAccumulator.from_values(values[:, block], timestamps[block]))
+
+    np.testing.assert_array_equal(merged.minutes, whole.minutes)
+    np.testing.assert_array_equal(merged.count, whole.count)
+    np.testing.assert_allclose(merged.sum, whole.sum)
+    np.testing.assert_array_equal(merged.min, whole.min)
+    assert merged.out_of_order == 0
+
+
+def test_unsorted_rows_are_counted_and_sorted(readings):
+    """Test shuffled logs give the same windows and report their disorder."""
+    values, timestamps = readings
+    order = np.random.default_rng(4).permutation(len(timestamps))
+    shuffled = TimeSeriesAccumulator()
+    for block in np.array_split(order, 5):
+        shuffled.merge(TimeSeriesAccumulator.from_values(values[:, block], timestamps[block]))
+    ordered = TimeSeriesAccumulator.from_values(values, timestamps)
+
+    np.testing.assert_array_equal(shuffled.minutes, ordered.minutes)
+    np.testing.assert_allclose(shuffled.sum, ordered.sum)
+    assert shuffled.out_of_order > 0
+    assert shuffled.earliest == timestamps.min()
+
+
+def test_missing_timestamps_and_values_skipped():
+    """Test rows without a timestamp or reading are left out of the buckets."""
+    base = np.datetime64('2024-03-01T00:00:00', 'ns').astype(np.int64)
+    timestamps = np.array([base, NAT, base + 10**9, base + 2 * 10**9])
+    values = np.array([[7.0, 7.2, np.nan, 8.0], [50.0, 60.0, 70.0, 80.0]])
+
+    acc = TimeSeriesAccumulator.from_values(values, timestamps)
+
+    assert acc.rows == 2
+    assert acc.unparsed == 1
+    assert acc.count.tolist() == [2]
+    assert acc.sum[0].tolist() == [15.0]
+
+
+def test_excursion_found_with_peak(readings):
+    """Test a sustained pH spike is one high excursion with its peak rolling mean."""
+    values, timestamps = readings
+    values = values.copy()
+    values[0] = 8.0
+    spike = slice(1000, 1360)  # one hour
+    values[0, spike] = 9.2
+
+    total, excursions = TimeSeriesAccumulator.from_values(values, timestamps).excursions(get_rule_table(), 15, 50)
+
+    assert total == 1
+    [excursion] = excursions
+    assert excursion['parameter'] == 'ph'
+    assert excursion['direction'] == 'high'
+    assert excursion['peak_rolling_mean'] == pytest.approx(9.2)
+    start = pd.Timestamp(timestamps[1000]).floor('min')
+    assert start <= excursion['start'] <= start + pd.Timedelta(minutes=10)
+    assert 50 <= excursion['duration_minutes'] <= 75
+
+
+def test_excursions_limited_to_longest(readings):
+    """Test only the longest excursions are kept, in time order."""
+    values, timestamps = readings
+
+    acc = TimeSeriesAccumulator.from_values(values, timestamps)
+
+    total, excursions = acc.excursions(get_rule_table(), 15, 3)
+    _, everything = acc.excursions(get_rule_table(), 15, 1000)
+
+    longest = sorted((e['duration_minutes'] for e in everything), reverse=True)[:3]
+    assert total == len(everything) > 3
+    assert sorted((e['duration_minutes'] for e in excursions), reverse=True) == longest
+    assert [e['start'] for e in excursions] == sorted(e['start'] for e in excursions)
+
+
+def test_hourly_samples_form_one_excursion():
+    """Test sparse logs are not split into an excursion per reading."""
+    base = np.datetime64('2024-01-16T08:00:00', 'ns').astype(np.int64)
+    timestamps = base + np.arange(5, dtype=np.int64) * 3600 * 10**9
+    values = np.array([[8.5, 8.6, 8.4, 8.7, 8.5], [50.0] * 5])
+
+    total, excursions = TimeSeriesAccumulator.from_values(values, timestamps).excursions(get_rule_table(), 15, 50)
+
+    assert total == 1
+    assert excursions[0]['duration_minutes'] == 4 * 60 + 1
+
+
+def test_no_timestamps_gives_no_summary():
+    """Test a file whose timestamps are all unreadable has no summary."""
+    acc = TimeSeriesAccumulator.from_values(np.array([[7.0], [50.0]]), np.array([NAT]))
+
+    assert acc.summary(get_rule_table(), 15, 50) is None